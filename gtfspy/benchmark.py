@@ -0,0 +1,305 @@
+"""
+Benchmark suite of the main gtfspy pipelines, run on synthetic feeds (see gtfspy.synthetic_feed) of several scales.
+
+For each scale and benchmark, the wall clock times of the repeated runs and the peak memory usage are recorded.
+The cold start benchmarks measure the time of importing gtfspy modules in a fresh interpreter
+(and are independent of the scale).
+The results are returned (and optionally written) as JSON, so that they can be tracked over time.
+
+Usage:
+    python -m gtfspy.benchmark --scale small medium --repeat 3 --output results.json
+"""
+from __future__ import print_function
+
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+
+from gtfspy import stats
+from gtfspy.gtfs import GTFS
+from gtfspy.import_gtfs import import_gtfs
+from gtfspy.synthetic_feed import generate_synthetic_feed
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+RESULTS_FORMAT_VERSION = 1
+
+# parameters of gtfspy.synthetic_feed.generate_synthetic_feed
+SCALES = OrderedDict([
+    ("small", dict(n_stops=200, n_routes=10, trips_per_day=1000, n_days=7, n_frequency_routes=1)),
+    ("medium", dict(n_stops=2000, n_routes=60, trips_per_day=10000, n_days=14, n_frequency_routes=5)),
+    ("large", dict(n_stops=8000, n_routes=250, trips_per_day=50000, n_days=28, n_frequency_routes=20)),
+])
+
+# time span used by the transit events and routing benchmarks, in seconds after the start of the day
+ROUTING_START_DS = 7 * 3600
+ROUTING_END_DS = 10 * 3600
+
+
+def _prepare_import_gtfs(context):
+    fnames = []
+
+    def run():
+        fname = os.path.join(context["work_dir"], "import_%d.sqlite" % len(fnames))
+        fnames.append(fname)
+        import_gtfs(context["feed"], fname, print_progress=False)
+        os.remove(fname)
+    return run
+
+
+def _prepare_get_transit_events(context):
+    gtfs = GTFS(context["db_fname"])
+    day_start_ut = gtfs.get_suitable_date_for_daily_extract(ut=True)
+
+    def run():
+        gtfs.get_transit_events(day_start_ut + ROUTING_START_DS, day_start_ut + ROUTING_END_DS)
+    return run
+
+
+def _prepare_routing_profiler(context):
+    import networkx
+    from gtfspy.routing.helpers import get_transit_connections
+    from gtfspy.routing.multi_objective_pseudo_connection_scan_profiler import MultiObjectivePseudoCSAProfiler
+
+    gtfs = GTFS(context["db_fname"])
+    day_start_ut = gtfs.get_suitable_date_for_daily_extract(ut=True)
+    start_time_ut = day_start_ut + ROUTING_START_DS
+    end_time_ut = day_start_ut + ROUTING_END_DS
+    connections = get_transit_connections(gtfs, start_time_ut, end_time_ut)
+    connections.sort(key=lambda connection: connection.departure_time, reverse=True)
+    # the stop with the most arrivals
+    target = gtfs.execute_custom_query(
+        "SELECT stop_I FROM stop_times GROUP BY stop_I ORDER BY count(*) DESC, stop_I LIMIT 1").fetchone()[0]
+
+    def run():
+        profiler = MultiObjectivePseudoCSAProfiler(connections,
+                                                   targets=[target],
+                                                   start_time_ut=start_time_ut,
+                                                   end_time_ut=end_time_ut,
+                                                   transfer_margin=120,
+                                                   walk_network=networkx.Graph(),
+                                                   track_vehicle_legs=True,
+                                                   track_time=True)
+        profiler.run()
+    return run
+
+
+def _prepare_get_stats(context):
+    gtfs = GTFS(context["db_fname"])
+
+    def run():
+        stats.get_stats(gtfs)
+    return run
+
+
+def _prepare_cold_start(module):
+    def prepare(context):
+        # import the module in a fresh interpreter (including the start-up time of the interpreter itself)
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+        command = [sys.executable, "-c", "import " + module]
+
+        def run():
+            subprocess.check_call(command, env=env)
+        return run
+    return prepare
+
+
+# name -> function taking the benchmark context, and returning the function to be timed
+BENCHMARKS = OrderedDict([
+    ("import_gtfs", _prepare_import_gtfs),
+    ("get_transit_events", _prepare_get_transit_events),
+    ("routing_profiler", _prepare_routing_profiler),
+    ("get_stats", _prepare_get_stats),
+    ("cold_start_gtfs", _prepare_cold_start("gtfspy.gtfs")),
+    ("cold_start_routing", _prepare_cold_start("gtfspy.routing.multi_objective_pseudo_connection_scan_profiler")),
+])
+
+
+def run_benchmarks(scales=("small",), benchmarks=None, repeat=3, measure_memory=True,
+                   output_fname=None, work_dir=None, print_progress=True):
+    """
+    Run the benchmark suite.
+
+    Parameters
+    ----------
+    scales: list | dict
+        names of the scales in SCALES, or a dict mapping (custom) scale names to parameters
+        of gtfspy.synthetic_feed.generate_synthetic_feed
+    benchmarks: list of str, optional
+        names of the benchmarks in BENCHMARKS, defaults to all benchmarks
+    repeat: int, optional
+        number of timed runs of each benchmark
+    measure_memory: bool, optional
+        whether to make one extra (untimed) run of each benchmark tracing the peak memory allocated by Python
+    output_fname: str, optional
+        path of the JSON file to which the results are written
+    work_dir: str, optional
+        directory for the generated feeds and databases, defaults to a temporary directory which is removed afterwards
+    print_progress: bool, optional
+
+    Returns
+    -------
+    results: dict
+        with keys "format_version", "created", "environment", "scales" and "results",
+        where "results" is a list with one dict per (scale, benchmark) pair
+    """
+    if not isinstance(scales, dict):
+        scales = OrderedDict((name, SCALES[name]) for name in scales)
+    if benchmarks is None:
+        benchmarks = list(BENCHMARKS.keys())
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark " + str(name))
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="gtfspy_benchmark_")
+    elif not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    results = OrderedDict([
+        ("format_version", RESULTS_FORMAT_VERSION),
+        ("created", datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")),
+        ("environment", get_environment_info()),
+        ("scales", scales),
+        ("results", []),
+    ])
+    try:
+        for scale, parameters in scales.items():
+            if print_progress:
+                print("Generating the " + scale + " synthetic feed")
+            context = _create_context(scale, parameters, work_dir)
+            for name in benchmarks:
+                if print_progress:
+                    print("Running benchmark " + name + " (" + scale + ")")
+                result = OrderedDict([("scale", scale), ("benchmark", name)])
+                try:
+                    run = BENCHMARKS[name](context)
+                    result.update(_measure(run, repeat, measure_memory))
+                    result["error"] = None
+                    if print_progress:
+                        print("  min %.3f s, mean %.3f s" % (result["min_s"], result["mean_s"]))
+                except Exception as e:
+                    result["error"] = repr(e)
+                    if print_progress:
+                        print("  failed: " + repr(e))
+                results["results"].append(result)
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir)
+
+    if output_fname is not None:
+        with open(output_fname, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def get_environment_info():
+    """
+    Returns
+    -------
+    info: dict
+        versions of python and the main dependencies, the platform, and the git revision of gtfspy (if available)
+    """
+    import numpy
+    import pandas
+    import sqlite3
+    info = OrderedDict([
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("numpy", numpy.__version__),
+        ("pandas", pandas.__version__),
+        ("sqlite", sqlite3.sqlite_version),
+        ("git_revision", None),
+    ])
+    try:
+        with open(os.devnull, "w") as devnull:
+            revision = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull,
+                                               cwd=os.path.dirname(os.path.abspath(__file__)))
+        info["git_revision"] = revision.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def _create_context(scale, parameters, work_dir):
+    feed = generate_synthetic_feed(**parameters)
+    db_fname = os.path.join(work_dir, scale + ".sqlite")
+    if os.path.exists(db_fname):
+        os.remove(db_fname)
+    import_gtfs(feed, db_fname, print_progress=False)
+    return {"feed": feed, "db_fname": db_fname, "work_dir": work_dir}
+
+
+def _measure(run, repeat, measure_memory):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        time_start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - time_start)
+    measurements = OrderedDict([
+        ("times_s", times),
+        ("min_s", min(times)),
+        ("mean_s", sum(times) / len(times)),
+        ("peak_memory_bytes", None),
+        ("max_rss_bytes", None),
+    ])
+    if measure_memory and tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            measurements["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    if resource is not None:
+        # peak resident set size of the whole process so far (kilobytes on Linux, bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        measurements["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+    return measurements
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the main gtfspy pipelines on synthetic feeds.")
+    parser.add_argument("--scale", nargs="+", default=["small"], choices=list(SCALES.keys()),
+                        help="scales of the synthetic feeds")
+    parser.add_argument("--benchmark", nargs="+", default=None, choices=list(BENCHMARKS.keys()),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs of each benchmark")
+    parser.add_argument("--no_memory", action="store_true", help="do not trace the peak memory usage")
+    parser.add_argument("--output", "-o", default=None, help="JSON file for the results (default: stdout)")
+    parser.add_argument("--work_dir", default=None, help="directory to keep the generated databases in")
+    args = parser.parse_args()
+
+    results = run_benchmarks(scales=args.scale,
+                             benchmarks=args.benchmark,
+                             repeat=args.repeat,
+                             measure_memory=not args.no_memory,
+                             output_fname=args.output,
+                             work_dir=args.work_dir,
+                             print_progress=args.output is not None)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
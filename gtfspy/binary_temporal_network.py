@@ -0,0 +1,202 @@
+"""
+Binary, columnar storage of temporal networks (transit events sorted by departure time).
+
+File layout of the uncompressed format:
+    - HEADER_SIZE bytes of header: MAGIC, followed by the length of a JSON document (uint32, little endian)
+      and the JSON document itself, describing the number of events and the dtype and offset of each column.
+    - the columns, each stored as a contiguous little endian array.
+The columns can thus be memory mapped directly by read_binary_temporal_network.
+
+The compressed format is a (deflated) zip file containing the same JSON header as "header.json",
+and each column as a .npy file.
+"""
+import json
+import os
+import struct
+import zipfile
+
+import numpy
+
+from gtfspy.segments import get_segment_events_from_clause
+
+MAGIC = b"GTFSPYTN"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096
+COLUMN_ALIGNMENT = 64
+
+# (name, dtype) of the stored columns, in the order they appear in the file
+TEMPORAL_NETWORK_COLUMNS = [
+    ("dep_time_ut", "<i8"),
+    ("arr_time_ut", "<i8"),
+    ("from_stop_I", "<i4"),
+    ("to_stop_I", "<i4"),
+    ("trip_I", "<i4"),
+    ("seq", "<i4"),
+    ("route_type", "<i2"),
+    ("route_I", "<i4")
+]
+
+
+def write_binary_temporal_network(gtfs, output_filename, start_time_ut=None, end_time_ut=None, route_type=None,
+                                  compress=False, chunksize=100000):
+    """
+    Write the temporal network (the transit events sorted by departure and arrival time) into a binary file.
+
+    The events are streamed from the database chunksize rows at a time directly into the output columns.
+    An event is included if it overlaps with the given time span.
+
+    Parameters
+    ----------
+    gtfs : gtfspy.GTFS
+    output_filename : str
+    start_time_ut: int, optional
+        start time of the time span (in unix time)
+    end_time_ut: int, optional
+        end time of the time span (in unix time)
+    route_type: int, optional
+        include only events of this route type
+    compress: bool, optional
+        write a compressed zip file instead (which can not be memory mapped when reading)
+    chunksize: int, optional
+
+    Returns
+    -------
+    n_events: int
+    """
+    from_clause, params = get_segment_events_from_clause(gtfs, start_time_ut, end_time_ut, route_type)
+    n_events = gtfs.conn.execute("SELECT count(*) " + from_clause, params).fetchone()[0]
+    header = {
+        "version": FORMAT_VERSION,
+        "n_events": n_events,
+        "sorted_by": ["dep_time_ut", "arr_time_ut"],
+        "start_time_ut": start_time_ut,
+        "end_time_ut": end_time_ut,
+        "route_type": route_type,
+        "columns": []
+    }
+    offset = HEADER_SIZE
+    for name, dtype in TEMPORAL_NETWORK_COLUMNS:
+        header["columns"].append({"name": name, "dtype": dtype, "offset": offset})
+        size = n_events * numpy.dtype(dtype).itemsize
+        offset += size + (-size) % COLUMN_ALIGNMENT
+
+    binary_filename = output_filename + ".tmp" if compress else output_filename
+    with open(binary_filename, "wb") as f:
+        f.write(_encode_header(header))
+        f.truncate(offset)
+    if n_events > 0:
+        columns = _map_columns(binary_filename, header, mode="r+")
+        query = "SELECT " + ", ".join(name for name, _ in TEMPORAL_NETWORK_COLUMNS) + " " + from_clause + \
+                " ORDER BY dep_time_ut, arr_time_ut"
+        cursor = gtfs.conn.execute(query, params)
+        position = 0
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            values = numpy.array(rows, dtype=numpy.int64)
+            for i, (name, _) in enumerate(TEMPORAL_NETWORK_COLUMNS):
+                columns[name][position:position + len(rows)] = values[:, i]
+            position += len(rows)
+        for column in columns.values():
+            column.flush()
+        del columns
+
+    if compress:
+        try:
+            _compress(binary_filename, output_filename, header)
+        finally:
+            os.remove(binary_filename)
+    return n_events
+
+
+def read_binary_temporal_network(filename):
+    """
+    Read a temporal network written by write_binary_temporal_network.
+
+    Parameters
+    ----------
+    filename: str
+
+    Returns
+    -------
+    events: dict
+        maps each column name (see TEMPORAL_NETWORK_COLUMNS) to a numpy.array of equal lengths.
+        For uncompressed files the arrays are read-only memory maps of the file.
+    """
+    if _is_compressed(filename):
+        with zipfile.ZipFile(filename) as zip_file:
+            header = json.loads(zip_file.read("header.json").decode("utf-8"))
+            return {column["name"]: numpy.lib.format.read_array(zip_file.open(column["name"] + ".npy"))
+                    for column in header["columns"]}
+    with open(filename, "rb") as f:
+        header = _decode_header(f.read(HEADER_SIZE))
+    return _map_columns(filename, header, mode="r")
+
+
+def read_binary_temporal_network_header(filename):
+    """
+    Returns
+    -------
+    header: dict
+        with keys "version", "n_events", "sorted_by", "start_time_ut", "end_time_ut", "route_type" and "columns"
+    """
+    if _is_compressed(filename):
+        with zipfile.ZipFile(filename) as zip_file:
+            return json.loads(zip_file.read("header.json").decode("utf-8"))
+    with open(filename, "rb") as f:
+        return _decode_header(f.read(HEADER_SIZE))
+
+
+def _is_compressed(filename):
+    # The uncompressed format is recognized from its first bytes. The zip check (which searches the end of
+    # the file for a zip directory record) is only a fallback, as the column data may contain such bytes.
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return False
+    return zipfile.is_zipfile(filename)
+
+
+def _encode_header(header):
+    header_json = json.dumps(header).encode("utf-8")
+    encoded = MAGIC + struct.pack("<I", len(header_json)) + header_json
+    assert len(encoded) <= HEADER_SIZE, "too large header"
+    return encoded + b"\0" * (HEADER_SIZE - len(encoded))
+
+
+def _decode_header(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary temporal network file")
+    header_length = struct.unpack("<I", data[len(MAGIC):len(MAGIC) + 4])[0]
+    start = len(MAGIC) + 4
+    header = json.loads(data[start:start + header_length].decode("utf-8"))
+    if header["version"] > FORMAT_VERSION:
+        raise ValueError("Unsupported binary temporal network version " + str(header["version"]))
+    return header
+
+
+def _map_columns(filename, header, mode):
+    columns = {}
+    for column in header["columns"]:
+        if header["n_events"] == 0:
+            columns[column["name"]] = numpy.zeros(0, dtype=column["dtype"])
+        else:
+            columns[column["name"]] = numpy.memmap(filename, dtype=column["dtype"], mode=mode,
+                                                   offset=column["offset"], shape=(header["n_events"],))
+    return columns
+
+
+def _compress(binary_filename, output_filename, header):
+    columns = _map_columns(binary_filename, header, mode="r")
+    with zipfile.ZipFile(output_filename, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("header.json", json.dumps(header))
+        # each column is first saved into a temporary .npy file, as ZipFile.open
+        # does not support writing in Python 3.5
+        npy_filename = binary_filename + ".npy"
+        try:
+            for name, _ in TEMPORAL_NETWORK_COLUMNS:
+                numpy.save(npy_filename, columns[name])
+                zip_file.write(npy_filename, name + ".npy")
+        finally:
+            if os.path.exists(npy_filename):
+                os.remove(npy_filename)
@@ -1,13 +1,13 @@
 from __future__ import print_function
 
-import math
 import operator
 
+import numpy
 from geoindex import GeoGridIndex, GeoPoint
 from geoindex.geo_grid_index import GEO_HASH_GRID_SIZE
 
 from gtfspy.gtfs import GTFS
-from gtfspy.util import wgs84_distance, wgs84_height, wgs84_width
+from gtfspy.util import wgs84_distance, wgs84_distances_from_point, wgs84_height, wgs84_width
 
 create_stmt = ('CREATE TABLE IF NOT EXISTS main.stop_distances '
                '(from_stop_I INT, '
@@ -57,18 +57,17 @@ def calc_transfers(conn, threshold_meters=1000):
         from_lat = stop_geopoint.latitude
         from_lon = stop_geopoint.longitude
 
+        nearby_stop_geopoints = [geopoint for geopoint in nearby_stop_geopoints if int(geopoint.ref) != from_stop_I]
+        nearby_distances = numpy.ceil(wgs84_distances_from_point(
+            from_lat, from_lon,
+            [geopoint.latitude for geopoint in nearby_stop_geopoints],
+            [geopoint.longitude for geopoint in nearby_stop_geopoints]))
         to_stop_Is = []
         distances = []
-        for nearby_stop_geopoint in nearby_stop_geopoints:
-            to_stop_I = int(nearby_stop_geopoint.ref)
-            if to_stop_I == from_stop_I:
-                continue
-            to_lat = nearby_stop_geopoint.latitude
-            to_lon = nearby_stop_geopoint.longitude
-            distance = math.ceil(wgs84_distance(from_lat, from_lon, to_lat, to_lon))
+        for nearby_stop_geopoint, distance in zip(nearby_stop_geopoints, nearby_distances.tolist()):
             if distance <= threshold_meters:
-                to_stop_Is.append(to_stop_I)
-                distances.append(distance)
+                to_stop_Is.append(int(nearby_stop_geopoint.ref))
+                distances.append(int(distance))
 
         n_pairs = len(to_stop_Is)
         from_stop_Is = [from_stop_I]*n_pairs
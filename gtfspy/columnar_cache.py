@@ -0,0 +1,240 @@
+"""
+Columnar on-disk cache of the core timetable tables.
+
+For a database stored at <path>, the cache lives in the directory <path>.columns.
+It contains a manifest.json and one .npy file per table column (<table>/<column>.npy),
+so that the columns can be loaded (or memory-mapped) with numpy without converting SQLite rows into Python objects.
+
+The cache is valid only as long as
+    (1) the cache id recorded in the metadata table of the database matches the one in the manifest, and
+    (2) the row counts of the cached tables (and the stop coordinates) have not changed since the cache was written.
+Otherwise the GTFS accessors silently fall back to reading the tables from the database.
+The GTFS methods modifying the timetable remove the cache id from the metadata (see GTFS.invalidate_caches),
+which should also be done after modifying the cached tables directly with SQL.
+"""
+import json
+import os
+import shutil
+import uuid
+
+import numpy
+import pandas as pd
+from six import string_types
+
+CACHED_TABLES = ["stops", "trips", "stop_times", "day_trips2"]
+COLUMNAR_CACHE_SUFFIX = ".columns"
+MANIFEST_FILE = "manifest.json"
+# key of the metadata table, under which the id of the current cache is stored
+COLUMNAR_CACHE_META_KEY = "columnar_cache_id"
+
+NUMERIC = "numeric"
+STRING = "string"
+
+
+def get_columnar_cache_directory(gtfs):
+    """
+    Parameters
+    ----------
+    gtfs: GTFS
+
+    Returns
+    -------
+    directory: str | None
+        None for in-memory databases
+    """
+    path = gtfs.get_main_database_path()
+    if not path:
+        return None
+    return path + COLUMNAR_CACHE_SUFFIX
+
+
+def write_columnar_cache(gtfs, tables=None, print_progress=False):
+    """
+    Write (or rewrite) the columnar cache of a database.
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    tables: list of str, optional
+        names of the tables to cache, defaults to CACHED_TABLES
+    print_progress: bool, optional
+
+    Returns
+    -------
+    directory: str
+        the directory of the cache
+    """
+    directory = get_columnar_cache_directory(gtfs)
+    if directory is None:
+        raise ValueError("A columnar cache can be written only for databases stored on disk")
+    if tables is None:
+        tables = CACHED_TABLES
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    manifest = {"cache_id": uuid.uuid4().hex, "tables": {}}
+    for table in tables:
+        if print_progress:
+            print("Writing columnar cache of table " + table)
+        table_manifest = _write_table(gtfs, table, os.path.join(directory, table))
+        if table_manifest is not None:
+            manifest["tables"][table] = table_manifest
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    gtfs.meta[COLUMNAR_CACHE_META_KEY] = manifest["cache_id"]
+    return directory
+
+
+def invalidate_columnar_cache(gtfs, schema="main"):
+    """
+    Mark the columnar cache of a database outdated (the files are left in place).
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    schema: str, optional
+        name of the (attached) database
+    """
+    gtfs.conn.execute("DELETE FROM " + schema + ".metadata WHERE key=?", (COLUMNAR_CACHE_META_KEY,))
+    gtfs.conn.commit()
+
+
+def load_columnar_cache(gtfs):
+    """
+    Parameters
+    ----------
+    gtfs: GTFS
+
+    Returns
+    -------
+    cache: ColumnarCache | None
+        None, if the database does not have a columnar cache
+    """
+    directory = get_columnar_cache_directory(gtfs)
+    if directory is None or not os.path.isfile(os.path.join(directory, MANIFEST_FILE)):
+        return None
+    return ColumnarCache(directory)
+
+
+class ColumnarCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            self._manifest = json.load(f)
+
+    @property
+    def cache_id(self):
+        return self._manifest["cache_id"]
+
+    @property
+    def tables(self):
+        return list(self._manifest["tables"].keys())
+
+    def is_valid(self, gtfs, table):
+        """
+        Whether the cached version of a table is up to date with the database.
+
+        Parameters
+        ----------
+        gtfs: GTFS
+        table: str
+
+        Returns
+        -------
+        valid: bool
+        """
+        if table not in self._manifest["tables"]:
+            return False
+        if gtfs.meta.get(COLUMNAR_CACHE_META_KEY) != self.cache_id:
+            return False
+        return self._manifest["tables"][table]["fingerprint"] == _get_table_fingerprint(gtfs, table)
+
+    def load_columns(self, table, columns=None, mmap=True):
+        """
+        Parameters
+        ----------
+        table: str
+        columns: list of str, optional
+            defaults to all columns of the table
+        mmap: bool, optional
+            whether to memory-map the numeric columns instead of reading them into memory
+
+        Returns
+        -------
+        columns: dict
+            column name -> numpy.array
+            Text columns are returned as object arrays (with None for NULL values)
+        """
+        table_manifest = self._manifest["tables"][table]
+        if columns is None:
+            columns = table_manifest["columns"]
+        table_directory = os.path.join(self.directory, table)
+        values = {}
+        for column in columns:
+            path = os.path.join(table_directory, column)
+            if table_manifest["kinds"][column] == NUMERIC:
+                values[column] = numpy.load(path + ".npy", mmap_mode="r" if mmap else None)
+            else:
+                strings = numpy.load(path + ".npy").astype(object)
+                strings[numpy.load(path + ".null.npy")] = None
+                values[column] = strings
+        return values
+
+    def read_table(self, table, columns=None):
+        """
+        Parameters
+        ----------
+        table: str
+        columns: list of str, optional
+
+        Returns
+        -------
+        df: pandas.DataFrame
+            the same as reading the (selected columns of the) table with pandas.read_sql
+        """
+        if columns is None:
+            columns = self._manifest["tables"][table]["columns"]
+        values = self.load_columns(table, columns, mmap=False)
+        return pd.DataFrame({column: values[column] for column in columns}, columns=columns)
+
+
+def _write_table(gtfs, table, table_directory):
+    os.makedirs(table_directory)
+    fingerprint = _get_table_fingerprint(gtfs, table)
+    columns = [row[1] for row in gtfs.conn.execute("PRAGMA table_info(" + table + ")")]
+    kinds = {}
+    for column in columns:
+        # one column at a time, so that the whole table is never in memory
+        values = pd.read_sql_query('SELECT "' + column + '" FROM ' + table + ' ORDER BY rowid', gtfs.conn)[column]
+        kind = _save_column(values, os.path.join(table_directory, column))
+        if kind is None:
+            # column with mixed types, the table is not cached
+            shutil.rmtree(table_directory)
+            return None
+        kinds[column] = kind
+    return {"fingerprint": fingerprint, "columns": columns, "kinds": kinds}
+
+
+def _save_column(values, path):
+    if values.dtype.kind in "biuf":
+        numpy.save(path + ".npy", values.values)
+        return NUMERIC
+    nulls = pd.isnull(values).values
+    strings = values.values.astype(object)
+    if not all(isinstance(value, string_types) for value in strings[~nulls]):
+        return None
+    strings[nulls] = ""
+    numpy.save(path + ".npy", numpy.array(strings.tolist(), dtype=str))
+    numpy.save(path + ".null.npy", nulls)
+    return STRING
+
+
+def _get_table_fingerprint(gtfs, table):
+    if table == "stops":
+        # the stops table is small, so a checksum of its coordinates is cheap to compute each time
+        counts = gtfs.conn.execute("SELECT count(*), max(rowid), total(lat), total(lon), "
+                                   "total(stop_I * lat), total(stop_I * lon) FROM stops").fetchone()
+    else:
+        counts = gtfs.conn.execute("SELECT count(*), max(rowid) FROM " + table).fetchone()
+    return ",".join(repr(count) for count in counts)
@@ -1,29 +1,111 @@
+"""
+Compiled versions of the geodesic distance functions of gtfspy.util.
 
-#cimport math
+All computations are done in double precision, using the same formulas as the pure python / numpy versions.
+The array functions take one-dimensional (possibly read-only) arrays of floats of equal length.
+"""
+cimport cython
 from libc.math cimport sin, cos, sqrt, atan2
 
-cdef float TORADIANS = 3.141592653589793 / 180.
-cdef float EARTH_RADIUS = 6378137.
+import numpy
 
-def wgs84_distance(float lat1, float lon1, float lat2, float lon2):
+cdef double TORADIANS = 3.141592653589793 / 180.
+cdef double EARTH_RADIUS = 6378137.
+
+
+cdef inline double _haversine(double lat1, double lon1, double lat2, double lon2) nogil:
+    cdef double sin_dlat_half = sin(TORADIANS * (lat2 - lat1) / 2)
+    cdef double sin_dlon_half = sin(TORADIANS * (lon2 - lon1) / 2)
+    cdef double a = (sin_dlat_half * sin_dlat_half +
+                     cos(TORADIANS * lat1) * cos(TORADIANS * lat2) *
+                     sin_dlon_half * sin_dlon_half)
+    return EARTH_RADIUS * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+cdef inline double _equirectangular(double lat1, double lon1, double lat2, double lon2) nogil:
+    cdef double x = TORADIANS * (lon2 - lon1) * cos(TORADIANS * (lat1 + lat2) / 2)
+    cdef double y = TORADIANS * (lat2 - lat1)
+    return EARTH_RADIUS * sqrt(x * x + y * y)
+
+
+def wgs84_distance(double lat1, double lon1, double lat2, double lon2):
     """Distance (in meters) between two points in WGS84 coord system."""
-    cdef float dLat
-    cdef float dLon
-    cdef float a
-    cdef float c
-    cdef float d
-    dLat = TORADIANS*(lat2 - lat1)
-    dLon = TORADIANS*(lon2 - lon1)
-    a = (sin(dLat / 2) * sin(dLat / 2) +
-            cos(TORADIANS * lat1 ) * cos(TORADIANS * lat2) *
-            sin(dLon / 2) * sin(dLon / 2))
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    d = EARTH_RADIUS * c
-    return d
-
-def wgs84_height(float meters):
-    return meters/(EARTH_RADIUS * TORADIANS)
-
-def wgs84_width(float meters, float lat):
-    cdef float R2 = EARTH_RADIUS * cos(TORADIANS*lat)
-    return meters/(R2 * TORADIANS)
+    return _haversine(lat1, lon1, lat2, lon2)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def wgs84_distances(const double[:] lats1, const double[:] lons1, const double[:] lats2, const double[:] lons2):
+    """Distances (in meters) between the points (lats1[i], lons1[i]) and (lats2[i], lons2[i])."""
+    cdef Py_ssize_t n = lats1.shape[0]
+    if lons1.shape[0] != n or lats2.shape[0] != n or lons2.shape[0] != n:
+        raise ValueError("The coordinate arrays should have equal lengths")
+    distances = numpy.empty(n, dtype=numpy.float64)
+    cdef double[:] distances_view = distances
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(n):
+            distances_view[i] = _haversine(lats1[i], lons1[i], lats2[i], lons2[i])
+    return distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def wgs84_distances_from_point(double lat, double lon, const double[:] lats, const double[:] lons):
+    """Distances (in meters) from the point (lat, lon) to the points (lats[i], lons[i])."""
+    cdef Py_ssize_t n = lats.shape[0]
+    if lons.shape[0] != n:
+        raise ValueError("The coordinate arrays should have equal lengths")
+    distances = numpy.empty(n, dtype=numpy.float64)
+    cdef double[:] distances_view = distances
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(n):
+            distances_view[i] = _haversine(lat, lon, lats[i], lons[i])
+    return distances
+
+
+def equirectangular_distance(double lat1, double lon1, double lat2, double lon2):
+    """Equirectangular approximation of the distance (in meters) between two points in WGS84 coord system."""
+    return _equirectangular(lat1, lon1, lat2, lon2)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def equirectangular_distances(const double[:] lats1, const double[:] lons1, const double[:] lats2, const double[:] lons2):
+    """Equirectangular approximations of the distances between (lats1[i], lons1[i]) and (lats2[i], lons2[i])."""
+    cdef Py_ssize_t n = lats1.shape[0]
+    if lons1.shape[0] != n or lats2.shape[0] != n or lons2.shape[0] != n:
+        raise ValueError("The coordinate arrays should have equal lengths")
+    distances = numpy.empty(n, dtype=numpy.float64)
+    cdef double[:] distances_view = distances
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(n):
+            distances_view[i] = _equirectangular(lats1[i], lons1[i], lats2[i], lons2[i])
+    return distances
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def equirectangular_distances_from_point(double lat, double lon, const double[:] lats, const double[:] lons):
+    """Equirectangular approximations of the distances from the point (lat, lon) to (lats[i], lons[i])."""
+    cdef Py_ssize_t n = lats.shape[0]
+    if lons.shape[0] != n:
+        raise ValueError("The coordinate arrays should have equal lengths")
+    distances = numpy.empty(n, dtype=numpy.float64)
+    cdef double[:] distances_view = distances
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(n):
+            distances_view[i] = _equirectangular(lat, lon, lats[i], lons[i])
+    return distances
+
+
+def wgs84_height(double meters):
+    return meters / (EARTH_RADIUS * TORADIANS)
+
+
+def wgs84_width(double meters, double lat):
+    cdef double R2 = EARTH_RADIUS * cos(TORADIANS * lat)
+    return meters / (R2 * TORADIANS)
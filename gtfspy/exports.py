@@ -1,18 +1,26 @@
+import csv
 import json
 import os
-import shutil
+import tempfile
 import uuid
+import zipfile
+from multiprocessing.pool import ThreadPool
 
 import networkx
-import pandas
 
 from gtfspy import route_types
+from gtfspy.binary_temporal_network import write_binary_temporal_network
 from gtfspy.gtfs import GTFS
 from gtfspy import util
 from gtfspy.networks import stop_to_stop_networks_by_type, temporal_network, \
     combined_stop_to_stop_transit_network
 from gtfspy.route_types import ROUTE_TYPE_TO_ZORDER
 
+# number of rows read from the database and written out at a time by write_gtfs
+WRITE_GTFS_CHUNKSIZE = 100000
+# number of stops read from the database at a time when writing GeoJSON
+GEOJSON_CHUNKSIZE = 10000
+
 
 def write_walk_transfer_edges(gtfs, output_file_name):
     """
@@ -44,58 +52,93 @@ def write_nodes(gtfs, output, fields=None):
         nodes.to_csv(tmpfile, encoding='utf-8', index=False, sep=";")
 
 
-def create_stops_geojson_dict(gtfs, fields=None):
-    nodes = gtfs.get_table("stops")
+def create_stops_geojson_dict(gtfs, fields=None, precision=None):
+    return {
+        "type": "FeatureCollection",
+        "features": list(_generate_stop_features(gtfs, fields, precision))
+    }
+
+
+def _generate_stop_features(gtfs, fields=None, precision=None, chunksize=GEOJSON_CHUNKSIZE):
+    """
+    Generate the GeoJSON features of the stops, reading the stops from the database chunksize rows at a time.
+
+    Parameters
+    ----------
+    fields: dict, optional
+        maps the columns of the stops table to the names of the feature properties
+        (the coordinates are always included as the geometry of the features).
+        By default, the stop_I and name of the stops are included.
+    """
     if fields is None:
-        fields = {'name': 'stop_name', 'stop_I': 'stop_I', 'lat': 'lat', 'lon': 'lon'}
-    assert (fields['lat'] == 'lat' and fields['lon'] == 'lon')
-    nodes = nodes[list(fields.keys())]
-    nodes.replace(list(fields.keys()), [fields[key] for key in fields.keys()], inplace=True)
-    assert ('lat' in nodes.columns)
-    assert ('lon' in nodes.columns)
-
-    features = []
-    for i, node_tuple in enumerate(nodes.itertuples()):
-        feature = {"type": "Feature",
+        fields = {'stop_I': 'stop_I', 'name': 'name'}
+    columns = [column for column in fields if column not in ('lat', 'lon')]
+    stops_columns = [row[1] for row in gtfs.conn.execute("PRAGMA table_info(stops)")]
+    for column in columns:
+        if column not in stops_columns:
+            raise ValueError("No column " + column + " in the stops table")
+    property_names = [fields[column] for column in columns]
+
+    cursor = gtfs.conn.execute("SELECT " + ", ".join(["lat", "lon"] + columns) + " FROM stops ORDER BY rowid")
+    i = 0
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        lats, lons = util.simplify_polyline([row[0] for row in rows], [row[1] for row in rows], precision=precision)
+        for row, lat, lon in zip(rows, lats.tolist(), lons.tolist()):
+            properties = dict(zip(property_names, row[2:]))
+            if "stop_I" in fields:
+                properties[fields["stop_I"]] = str(properties[fields["stop_I"]])
+            yield {"type": "Feature",
                    "id": str(i),
                    "geometry": {
                        "type": "Point",
-                       "coordinates": [
-                           node_tuple.lon,
-                           node_tuple.lat
-                       ]
+                       "coordinates": [lon, lat]
                    },
-                   "properties": {
-                       "stop_I": str(node_tuple.stop_I),
-                       "name": node_tuple.name
+                   "properties": properties
                    }
-                   }
-        features.append(feature)
+            i += 1
 
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-    return geojson
 
-def write_stops_geojson(gtfs, out_file, fields=None):
+def write_stops_geojson(gtfs, out_file, fields=None, precision=None):
     """
     Parameters
     ----------
     gtfs: gtfspy.GTFS
     out_file: file-like or path to file
-    fields: dict
-        simultaneously map each original_name to the new_name
+    fields: dict, optional
+        maps the columns of the stops table to the names of the feature properties,
+        by default {'stop_I': 'stop_I', 'name': 'name'}
+    precision: int, optional
+        number of decimals the coordinates are rounded to
     Returns
     -------
     """
-    geojson = create_stops_geojson_dict(gtfs, fields)
+    features = _generate_stop_features(gtfs, fields, precision)
     if hasattr(out_file, "write"):
-        out_file.write(json.dumps(geojson))
+        _write_geojson_features(features, out_file)
     else:
         with util.create_file(out_file, tmpdir=True, keepext=True) as tmpfile_path:
-            tmpfile = open(tmpfile_path, 'w')
-            tmpfile.write(json.dumps(geojson))
+            with open(tmpfile_path, 'w') as tmpfile:
+                _write_geojson_features(features, tmpfile)
+
+
+def _write_geojson_features(features, output_file):
+    """
+    Write a GeoJSON FeatureCollection one feature at a time.
+
+    Parameters
+    ----------
+    features: iterable of dicts
+    output_file: file-like object
+    """
+    output_file.write('{"type": "FeatureCollection", "features": [')
+    for i, feature in enumerate(features):
+        if i > 0:
+            output_file.write(", ")
+        output_file.write(json.dumps(feature))
+    output_file.write("]}")
 
 
 def write_combined_transit_stop_to_stop_network(gtfs, output_path, fmt=None):
@@ -135,7 +178,7 @@ def write_static_networks(gtfs, output_dir, fmt=None):
             _write_stop_to_stop_network_edges(net, file_name, fmt=fmt)
 
 
-def write_temporal_networks_by_route_type(gtfs, extract_output_dir):
+def write_temporal_networks_by_route_type(gtfs, extract_output_dir, fmt=None):
     """
     Write temporal networks by route type to disk.
 
@@ -143,16 +186,23 @@ def write_temporal_networks_by_route_type(gtfs, extract_output_dir):
     ----------
     gtfs: gtfspy.GTFS
     extract_output_dir: str
+    fmt: str, optional
+        "csv" (default) for writing ".tnet" csv files,
+        "binary" for writing ".tnetb" files (see gtfspy.binary_temporal_network)
     """
     util.makedirs(extract_output_dir)
     for route_type in route_types.TRANSIT_ROUTE_TYPES:
-        pandas_data_frame = temporal_network(gtfs, start_time_ut=None, end_time_ut=None, route_type=route_type)
         tag = route_types.ROUTE_TYPE_TO_LOWERCASE_TAG[route_type]
-        out_file_name = os.path.join(extract_output_dir, tag + ".tnet")
-        pandas_data_frame.to_csv(out_file_name, encoding='utf-8', index=False)
+        if fmt == "binary":
+            out_file_name = os.path.join(extract_output_dir, tag + ".tnetb")
+            write_binary_temporal_network(gtfs, out_file_name, route_type=route_type)
+        else:
+            pandas_data_frame = temporal_network(gtfs, start_time_ut=None, end_time_ut=None, route_type=route_type)
+            out_file_name = os.path.join(extract_output_dir, tag + ".tnet")
+            pandas_data_frame.to_csv(out_file_name, encoding='utf-8', index=False)
 
 
-def write_temporal_network(gtfs, output_filename, start_time_ut=None, end_time_ut=None):
+def write_temporal_network(gtfs, output_filename, start_time_ut=None, end_time_ut=None, fmt=None, compress=False):
     """
     Parameters
     ----------
@@ -163,10 +213,20 @@ def write_temporal_network(gtfs, output_filename, start_time_ut=None, end_time_u
         start time of the extract in unixtime (seconds after epoch)
     end_time_ut: int | None
         end time of the extract in unixtime (seconds after epoch)
+    fmt: str, optional
+        "csv" (default) or "binary".
+        The binary format is streamed from the database, and can be memory mapped when reading
+        (see gtfspy.binary_temporal_network)
+    compress: bool, optional
+        whether to compress the binary format
     """
     util.makedirs(os.path.dirname(os.path.abspath(output_filename)))
-    pandas_data_frame = temporal_network(gtfs, start_time_ut=start_time_ut, end_time_ut=end_time_ut)
-    pandas_data_frame.to_csv(output_filename, encoding='utf-8', index=False)
+    if fmt == "binary":
+        write_binary_temporal_network(gtfs, output_filename, start_time_ut=start_time_ut, end_time_ut=end_time_ut,
+                                      compress=compress)
+    else:
+        pandas_data_frame = temporal_network(gtfs, start_time_ut=start_time_ut, end_time_ut=end_time_ut)
+        pandas_data_frame.to_csv(output_filename, encoding='utf-8', index=False)
 
 
 def _write_stop_to_stop_network_edges(net, file_name, data=True, fmt=None):
@@ -213,13 +273,18 @@ def _write_stop_to_stop_network_edges(net, file_name, data=True, fmt=None):
                 f.write(";".join(all_values))
 
 
-def create_sections_geojson_dict(G, start_time_ut=None, end_time_ut=None):
+def create_sections_geojson_dict(G, start_time_ut=None, end_time_ut=None, precision=None):
+    return {
+        "type": "FeatureCollection",
+        "features": list(_generate_section_features(G, start_time_ut, end_time_ut, precision))
+    }
+
+
+def _generate_section_features(G, start_time_ut=None, end_time_ut=None, precision=None):
     multi_di_graph = combined_stop_to_stop_transit_network(G, start_time_ut=start_time_ut, end_time_ut=end_time_ut)
-    stops = G.get_table("stops")
-    stop_I_to_coords = {row.stop_I: [row.lon, row.lat] for row in stops.itertuples()}
-    gjson = {"type": "FeatureCollection"}
-    features = []
-    gjson["features"] = features
+    stops = G.conn.execute("SELECT stop_I, lat, lon FROM stops").fetchall()
+    lats, lons = util.simplify_polyline([stop[1] for stop in stops], [stop[2] for stop in stops], precision=precision)
+    stop_I_to_coords = {stop[0]: [lon, lat] for stop, lat, lon in zip(stops, lats.tolist(), lons.tolist())}
     data = list(multi_di_graph.edges(data=True))
     data.sort(key=lambda el: ROUTE_TYPE_TO_ZORDER[el[2]['route_type']])
     for from_stop_I, to_stop_I, data in data:
@@ -236,57 +301,84 @@ def create_sections_geojson_dict(G, start_time_ut=None, end_time_ut=None):
         properties['from_stop_I'] = int(from_stop_I)
         properties['to_stop_I'] = int(to_stop_I)
         feature['properties'] = data
-        features.append(feature)
-    return gjson
+        yield feature
+
 
-def write_sections_geojson(G, output_file, start_time_ut=None, end_time_ut=None):
-    gjson = create_sections_geojson_dict(G, start_time_ut=start_time_ut, end_time_ut=end_time_ut)
+def write_sections_geojson(G, output_file, start_time_ut=None, end_time_ut=None, precision=None):
+    features = _generate_section_features(G, start_time_ut=start_time_ut, end_time_ut=end_time_ut,
+                                          precision=precision)
     if hasattr(output_file, "write"):
-        output_file.write(json.dumps(gjson))
+        _write_geojson_features(features, output_file)
     else:
         with open(output_file, 'w') as f:
-            f.write(json.dumps(gjson))
+            _write_geojson_features(features, f)
 
-def create_routes_geojson_dict(G):
+
+def create_routes_geojson_dict(G, precision=None, simplify_tolerance=None):
     assert(isinstance(G, GTFS))
-    gjson = {"type": "FeatureCollection"}
-    features = []
-    for routeShape in G.get_all_route_shapes(use_shapes=False):
+    return {
+        "type": "FeatureCollection",
+        "features": list(_generate_route_features(G, precision, simplify_tolerance))
+    }
+
+
+def _generate_route_features(G, precision=None, simplify_tolerance=None):
+    for routeShape in G.generate_route_shapes(use_shapes=False):
+        lats, lons = util.simplify_polyline(routeShape['lats'], routeShape['lons'],
+                                            tolerance=simplify_tolerance, precision=precision)
         feature = {"type": "Feature"}
         geometry = {
             "type": "LineString",
-            "coordinates": list(zip(routeShape['lons'], routeShape['lats']))
+            "coordinates": list(zip(lons.tolist(), lats.tolist()))
         }
         feature['geometry'] = geometry
         properties = {"route_type": int(routeShape['type']),
                       "route_I": int(routeShape['route_I']),
                       "route_name": str(routeShape['name'])}
         feature['properties'] = properties
-        features.append(feature)
-    gjson['features'] = features
-    return gjson
+        yield feature
 
-def write_routes_geojson(G, output_file):
-    gjson = create_routes_geojson_dict(G)
+
+def write_routes_geojson(G, output_file, precision=None, simplify_tolerance=None):
+    """
+    Parameters
+    ----------
+    G: gtfspy.GTFS
+    output_file: file-like or path to file
+    precision: int, optional
+        number of decimals the coordinates are rounded to
+    simplify_tolerance: float, optional
+        tolerance (in meters) for simplifying the route geometries with the Douglas-Peucker algorithm
+    """
+    features = _generate_route_features(G, precision, simplify_tolerance)
     if hasattr(output_file, "write"):
-        output_file.write(json.dumps(gjson))
+        _write_geojson_features(features, output_file)
     else:
         with open(output_file, 'w') as f:
-            f.write(json.dumps(gjson))
+            _write_geojson_features(features, f)
     return None
 
 
-
-def write_gtfs(gtfs, output):
+def write_gtfs(gtfs, output, n_threads=1, chunksize=WRITE_GTFS_CHUNKSIZE):
     """
     Write out the database according to the GTFS format.
 
+    The tables are read from the database in chunks (with the integer keys replaced by the original ids
+    already in SQL), and written out chunk by chunk, so that memory usage is bounded by the chunk size.
+
     Parameters
     ----------
     gtfs: gtfspy.GTFS
     output: str
         Path where to put the GTFS files
-        if output ends with ".zip" a ZIP-file is created instead.
+        if output ends with ".zip" a ZIP-file is created instead,
+        and the tables are added to it one at a time.
+    n_threads: int, optional
+        Number of tables written in parallel, when writing into a directory.
+        Each thread uses a connection of its own, therefore this requires the database to be stored in a file.
+        Entries of a ZIP-file are always written one at a time.
+    chunksize: int, optional
+        number of rows read and written at a time
 
     Returns
     -------
@@ -294,20 +386,6 @@ def write_gtfs(gtfs, output):
     """
     output = os.path.abspath(output)
     uuid_str = "tmp_" + str(uuid.uuid1())
-    if output[-4:] == '.zip':
-        zip = True
-        out_basepath = os.path.dirname(os.path.abspath(output))
-        if not os.path.exists(out_basepath):
-            raise IOError(out_basepath + " does not exist, cannot write gtfs as a zip")
-        tmp_dir = os.path.join(out_basepath, str(uuid_str))
-        # zip_file_na,e = ../out_basedir + ".zip
-    else:
-        zip = False
-        out_basepath = output
-        tmp_dir = os.path.join(out_basepath + "_" + str(uuid_str))
-
-    os.makedirs(tmp_dir, exist_ok=True)
-
     gtfs_table_to_writer = {
         "agency": _write_gtfs_agencies,
         "calendar": _write_gtfs_calendar,
@@ -324,65 +402,128 @@ def write_gtfs(gtfs, output):
         "trips": _write_gtfs_trips,
     }
 
-    for table, writer in gtfs_table_to_writer.items():
-        fname_to_write = os.path.join(tmp_dir, table + '.txt')
-        print(fname_to_write)
-        writer(gtfs, open(os.path.join(tmp_dir, table + '.txt'), 'w'))
-
-    if zip:
-        shutil.make_archive(output[:-4], 'zip', tmp_dir)
-        shutil.rmtree(tmp_dir)
+    if output[-4:] == '.zip':
+        out_basepath = os.path.dirname(os.path.abspath(output))
+        if not os.path.exists(out_basepath):
+            raise IOError(out_basepath + " does not exist, cannot write gtfs as a zip")
+        # each table is written into a temporary file, which is then added to the zip file
+        # (ZipFile.open does not support writing in Python 3.5)
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_file, \
+                tempfile.TemporaryDirectory(dir=out_basepath) as tmp_dir:
+            for table, writer in gtfs_table_to_writer.items():
+                print(output + ": " + table + '.txt')
+                fname_to_write = os.path.join(tmp_dir, table + '.txt')
+                with open(fname_to_write, 'w', encoding='utf-8') as output_file:
+                    writer(gtfs, output_file, chunksize=chunksize)
+                zip_file.write(fname_to_write, table + '.txt')
+                os.remove(fname_to_write)
     else:
+        out_basepath = output
+        tmp_dir = os.path.join(out_basepath + "_" + str(uuid_str))
+        os.makedirs(tmp_dir, exist_ok=True)
+        db_path = gtfs.get_main_database_path()
+        tasks = [(db_path, os.path.join(tmp_dir, table + '.txt'), writer, chunksize)
+                 for table, writer in gtfs_table_to_writer.items()]
+        if n_threads > 1 and db_path:
+            pool = ThreadPool(n_threads)
+            try:
+                pool.map(_write_gtfs_table_in_thread, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for _, fname_to_write, writer, _ in tasks:
+                print(fname_to_write)
+                with open(fname_to_write, 'w') as output_file:
+                    writer(gtfs, output_file, chunksize=chunksize)
         print("moving " + str(tmp_dir) + " to " + out_basepath)
         os.rename(tmp_dir, out_basepath)
 
 
+def _write_gtfs_table_in_thread(task):
+    db_path, fname_to_write, writer, chunksize = task
+    print(fname_to_write)
+    gtfs = GTFS(db_path)
+    try:
+        with open(fname_to_write, 'w') as output_file:
+            writer(gtfs, output_file, chunksize=chunksize)
+    finally:
+        gtfs.conn.close()
+
 
-def _remove_I_columns(df):
+def _select_columns(gtfs, table, columns_to_change=None, columns_to_drop=(), remove_I_columns=True,
+                    column_expressions=None):
     """
-    Remove columns ending with I from a pandas.DataFrame
+    Build the column list of a SELECT statement for writing out a database table.
 
     Parameters
     ----------
-    df: dataFrame
+    gtfs: gtfspy.GTFS
+    table: str
+        name of the database table
+    columns_to_change: dict, optional
+        maps database column names to GTFS column names
+    columns_to_drop: iterable, optional
+        columns that are not written out
+    remove_I_columns: bool
+        whether to leave out the integer key columns (ending with "_I")
+    column_expressions: dict, optional
+        SQL expressions to use instead of the plain column values
 
     Returns
     -------
-    None
+    columns: list[str]
     """
-    all_columns = list(filter(lambda el: el[-2:] == "_I", df.columns))
-    for column in all_columns:
-        del df[column]
-
+    columns_to_change = columns_to_change or {}
+    column_expressions = column_expressions or {}
+    selected = []
+    for row in gtfs.conn.execute("PRAGMA table_info(" + table + ")"):
+        column = row[1]
+        if column in columns_to_drop or (remove_I_columns and column[-2:] == "_I"):
+            continue
+        expression = column_expressions.get(column, table + '."' + column + '"')
+        selected.append(expression + ' AS "' + columns_to_change.get(column, column) + '"')
+    return selected
+
+
+def _write_query_in_chunks(gtfs, output_file, columns, from_clause, chunksize=WRITE_GTFS_CHUNKSIZE):
+    """
+    Write the result of a query as csv, chunksize rows at a time.
+    The values are written as returned by sqlite (e.g. no integers with NULLs converted to floats),
+    so that the output does not depend on the contents of the chunk.
 
-def __replace_I_with_id(gtfs, current_table, from_table_name, old_column_current, old_column_from, new_column_in_from,
-                        new_column_name=None):
-    if new_column_name is None:
-        new_column_name = new_column_in_from
-    from_table = gtfs.get_table(from_table_name)
-    merged = pandas.merge(current_table, from_table, how="left",
-                          left_on=old_column_current, right_on=old_column_from)
-    series = pandas.Series(merged[new_column_in_from], index=current_table.index)
-    current_table[new_column_name] = series
+    Parameters
+    ----------
+    gtfs: gtfspy.GTFS
+    output_file: file-like object
+    columns: list[str]
+        expressions of the SELECT statement
+    from_clause: str
+        the rest of the query (FROM ... ORDER BY ...)
+    chunksize: int
+    """
+    cursor = gtfs.conn.execute("SELECT " + ", ".join(columns) + " " + from_clause)
+    writer = csv.writer(output_file, lineterminator="\n")
+    writer.writerow([description[0] for description in cursor.description])
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        writer.writerows(rows)
 
 
-def _write_gtfs_agencies(gtfs, output_file):
+def _write_gtfs_agencies(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     # remove agency_I
-    agencies_table = gtfs.get_table("agencies")
-    assert (isinstance(agencies_table, pandas.DataFrame))
     columns_to_change = {'name': 'agency_name',
                          'url': 'agency_url',
                          'timezone': 'agency_timezone',
                          'lang': 'agency_lang',
                          'phone': 'agency_phone'}
-    agencies_table = agencies_table.rename(columns=columns_to_change)
-    _remove_I_columns(agencies_table)
-    agencies_table.to_csv(output_file, index=False)
+    columns = _select_columns(gtfs, "agencies", columns_to_change)
+    _write_query_in_chunks(gtfs, output_file, columns, "FROM agencies ORDER BY agencies.rowid", chunksize)
 
 
-def _write_gtfs_stops(gtfs, output_file):
-    stops_table = gtfs.get_table("stops")
-    assert (isinstance(stops_table, pandas.DataFrame))
+def _write_gtfs_stops(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {'name': 'stop_name',
                          'url': 'stop_url',
                          'lat': 'stop_lat',
@@ -390,24 +531,15 @@ def _write_gtfs_stops(gtfs, output_file):
                          'code': 'stop_code',
                          'desc': 'stop_desc'
                          }
-    stops_table = stops_table.rename(columns=columns_to_change)
-
-    # Remove stop_I
-    stop_I_to_id = {row.stop_I: row.stop_id for row in stops_table.itertuples()}
-    parent_stations = []
-    for stop_row in stops_table.itertuples():
-        try:
-            parent_station = stop_I_to_id[stop_row.parent_I]
-        except KeyError:
-            parent_station = ""
-        parent_stations.append(parent_station)
-    stops_table['parent_station'] = pandas.Series(parent_stations, index=stops_table.index)
-    _remove_I_columns(stops_table)
-    stops_table.to_csv(output_file, index=False)
-
-
-def _write_gtfs_routes(gtfs, output_file):
-    routes_table = gtfs.get_table("routes")
+    # Remove stop_I, and replace parent_I with the stop_id of the parent
+    columns = _select_columns(gtfs, "stops", columns_to_change)
+    columns.append("COALESCE(parents.stop_id, '') AS parent_station")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM stops LEFT JOIN stops AS parents ON (stops.parent_I = parents.stop_I) "
+                           "ORDER BY stops.rowid", chunksize)
+
+
+def _write_gtfs_routes(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {'name': 'route_short_name',
                          'long_name': 'route_long_name',
                          'url': 'route_url',
@@ -416,59 +548,47 @@ def _write_gtfs_routes(gtfs, output_file):
                          'color': 'route_color',
                          'text_color': 'route_text_color'
                          }
-    routes_table = routes_table.rename(columns=columns_to_change)
-
     # replace agency_I
-    agencies_table = gtfs.get_table("agencies")
-    agency_ids = pandas.merge(routes_table, agencies_table, how="left", on='agency_I')['agency_id']
-    routes_table['agency_id'] = pandas.Series(agency_ids, index=routes_table.index)
-    _remove_I_columns(routes_table)
-    routes_table.to_csv(output_file, index=False)
+    columns = _select_columns(gtfs, "routes", columns_to_change)
+    columns.append("agencies.agency_id AS agency_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM routes LEFT JOIN agencies ON (routes.agency_I = agencies.agency_I) "
+                           "ORDER BY routes.rowid", chunksize)
 
 
-def _write_gtfs_trips(gtfs, output_file):
-    trips_table = gtfs.get_table("trips")
+def _write_gtfs_trips(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {
         'headsign': 'trip_headsign',
     }
-    trips_table = trips_table.rename(columns=columns_to_change)
-
-    __replace_I_with_id(gtfs, trips_table, 'routes', 'route_I', 'route_I', 'route_id')
-    __replace_I_with_id(gtfs, trips_table, 'calendar', 'service_I', 'service_I', 'service_id')
-
-    _remove_I_columns(trips_table)
-    del [trips_table['start_time_ds']]
-    del [trips_table['end_time_ds']]
+    columns = _select_columns(gtfs, "trips", columns_to_change, columns_to_drop=('start_time_ds', 'end_time_ds'))
+    columns.append("routes.route_id AS route_id")
+    columns.append("calendar.service_id AS service_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM trips "
+                           "LEFT JOIN routes ON (trips.route_I = routes.route_I) "
+                           "LEFT JOIN calendar ON (trips.service_I = calendar.service_I) "
+                           "ORDER BY trips.rowid", chunksize)
 
-    trips_table.to_csv(output_file, index=False)
-
-
-def _write_gtfs_stop_times(gtfs, output_file):
-    stop_times_table = gtfs.get_table('stop_times')
 
+def _write_gtfs_stop_times(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {
         'seq': 'stop_sequence',
         'arr_time': 'arrival_time',
         'dep_time': 'departure_time'
     }
-    stop_times_table = stop_times_table.rename(columns=columns_to_change)
-
-    # replace trip_I with trip_id
-    __replace_I_with_id(gtfs, stop_times_table, 'trips', 'trip_I', 'trip_I', 'trip_id')
-    __replace_I_with_id(gtfs, stop_times_table, 'stops', 'stop_I', 'stop_I', 'stop_id')
-
-    # delete unneeded columns:
-    del [stop_times_table['arr_time_hour']]
-    del [stop_times_table['arr_time_ds']]
-    del [stop_times_table['dep_time_ds']]
-    del [stop_times_table['shape_break']]
-    _remove_I_columns(stop_times_table)
-
-    stop_times_table.to_csv(output_file, index=False)
-
-
-def _write_gtfs_calendar(gtfs, output_file):
-    calendar_table = gtfs.get_table('calendar')
+    # delete unneeded columns, and replace trip_I and stop_I with trip_id and stop_id
+    columns = _select_columns(gtfs, "stop_times", columns_to_change,
+                              columns_to_drop=('arr_time_hour', 'arr_time_ds', 'dep_time_ds', 'shape_break'))
+    columns.append("trips.trip_id AS trip_id")
+    columns.append("stops.stop_id AS stop_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM stop_times "
+                           "LEFT JOIN trips ON (stop_times.trip_I = trips.trip_I) "
+                           "LEFT JOIN stops ON (stop_times.stop_I = stops.stop_I) "
+                           "ORDER BY stop_times.rowid", chunksize)
+
+
+def _write_gtfs_calendar(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {
         'm': 'monday',
         't': 'tuesday',
@@ -478,56 +598,63 @@ def _write_gtfs_calendar(gtfs, output_file):
         's': 'saturday',
         'su': 'sunday'
     }
-    calendar_table = calendar_table.rename(columns=columns_to_change)
-    calendar_table['start_date'] = [date.replace("-", "") for date in calendar_table['start_date']]
-    calendar_table['end_date'] = [date.replace("-", "") for date in calendar_table['end_date']]
-    _remove_I_columns(calendar_table)
-    calendar_table.to_csv(output_file, index=False)
+    column_expressions = {
+        'start_date': "replace(calendar.start_date, '-', '')",
+        'end_date': "replace(calendar.end_date, '-', '')"
+    }
+    columns = _select_columns(gtfs, "calendar", columns_to_change, column_expressions=column_expressions)
+    _write_query_in_chunks(gtfs, output_file, columns, "FROM calendar ORDER BY calendar.rowid", chunksize)
 
 
-def _write_gtfs_calendar_dates(gtfs, output_file):
-    calendar_dates_table = gtfs.get_table('calendar_dates')
-    __replace_I_with_id(gtfs, calendar_dates_table, 'calendar', 'service_I', 'service_I', 'service_id')
-    _remove_I_columns(calendar_dates_table)
-    calendar_dates_table.to_csv(output_file, index=False)
+def _write_gtfs_calendar_dates(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
+    columns = _select_columns(gtfs, "calendar_dates")
+    columns.append("calendar.service_id AS service_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM calendar_dates "
+                           "LEFT JOIN calendar ON (calendar_dates.service_I = calendar.service_I) "
+                           "ORDER BY calendar_dates.rowid", chunksize)
 
 
-def _write_gtfs_shapes(gtfs, ouput_file):
-    shapes_table = gtfs.get_table('shapes')
+def _write_gtfs_shapes(gtfs, ouput_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     columns_to_change = {
         'lat': 'shape_pt_lat',
         'lon': 'shape_pt_lon',
         'seq': 'shape_pt_sequence',
         'd': 'shape_dist_traveled'
     }
-    shapes_table = shapes_table.rename(columns=columns_to_change)
-    shapes_table.to_csv(ouput_file, index=False)
+    columns = _select_columns(gtfs, "shapes", columns_to_change, remove_I_columns=False)
+    _write_query_in_chunks(gtfs, ouput_file, columns, "FROM shapes ORDER BY shapes.rowid", chunksize)
 
 
-def _write_gtfs_feed_info(gtfs, output_file):
-    gtfs.get_table('feed_info').to_csv(output_file, index=False)
+def _write_gtfs_feed_info(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
+    columns = _select_columns(gtfs, "feed_info", remove_I_columns=False)
+    _write_query_in_chunks(gtfs, output_file, columns, "FROM feed_info ORDER BY feed_info.rowid", chunksize)
 
 
-def _write_gtfs_frequencies(gtfs, output_file):
+def _write_gtfs_frequencies(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
     raise NotImplementedError("Frequencies should not be outputted from GTFS as they are included in other tables.")
 
 
-def _write_gtfs_transfers(gtfs, output_file):
-    transfers_table = gtfs.get_table('transfers')
-    __replace_I_with_id(gtfs, transfers_table, 'stops', 'from_stop_I', 'stop_I', 'stop_id', 'from_stop_id')
-    __replace_I_with_id(gtfs, transfers_table, 'stops', 'to_stop_I', 'stop_I', 'stop_id', 'to_stop_id')
-    _remove_I_columns(transfers_table)
-    transfers_table.to_csv(output_file, index=False)
-
-
-def _write_gtfs_stop_distances(gtfs, output_file):
-    stop_distances = gtfs.get_table('stop_distances')
-    __replace_I_with_id(gtfs, stop_distances, 'stops', 'from_stop_I', 'stop_I', 'stop_id', 'from_stop_id')
-    __replace_I_with_id(gtfs, stop_distances, 'stops', 'to_stop_I', 'stop_I', 'stop_id', 'to_stop_id')
-    _remove_I_columns(stop_distances)
-    del stop_distances['min_transfer_time']
-    del stop_distances['timed_transfer']
-    stop_distances.to_csv(output_file, index=False)
+def _write_gtfs_transfers(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
+    columns = _select_columns(gtfs, "transfers")
+    columns.append("from_stops.stop_id AS from_stop_id")
+    columns.append("to_stops.stop_id AS to_stop_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM transfers "
+                           "LEFT JOIN stops AS from_stops ON (transfers.from_stop_I = from_stops.stop_I) "
+                           "LEFT JOIN stops AS to_stops ON (transfers.to_stop_I = to_stops.stop_I) "
+                           "ORDER BY transfers.rowid", chunksize)
+
+
+def _write_gtfs_stop_distances(gtfs, output_file, chunksize=WRITE_GTFS_CHUNKSIZE):
+    columns = _select_columns(gtfs, "stop_distances", columns_to_drop=('min_transfer_time', 'timed_transfer'))
+    columns.append("from_stops.stop_id AS from_stop_id")
+    columns.append("to_stops.stop_id AS to_stop_id")
+    _write_query_in_chunks(gtfs, output_file, columns,
+                           "FROM stop_distances "
+                           "LEFT JOIN stops AS from_stops ON (stop_distances.from_stop_I = from_stops.stop_I) "
+                           "LEFT JOIN stops AS to_stops ON (stop_distances.to_stop_I = to_stops.stop_I) "
+                           "ORDER BY stop_distances.rowid", chunksize)
 
 
 # for row in stop_times_table.itertuples():
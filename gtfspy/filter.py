@@ -9,6 +9,7 @@ import pandas as pd
 
 from gtfspy import util
 from gtfspy.util import wgs84_distance
+from gtfspy.segments import SEGMENTS_TABLE
 from gtfspy import stats
 from gtfspy import gtfs
 
@@ -109,77 +110,241 @@ class FilterExtract(object):
         # this with statement
         # is used to ensure that no corrupted/uncompleted files get created in case of problems
         with util.create_file(self.copy_db_path) as tempfile:
-            logging.info("copying database")
-            shutil.copy(self.this_db_path, tempfile)
-            self.copy_db_conn = sqlite3.connect(tempfile)
+            if not (self._filter_by_dates() or self._filter_by_agencies() or self._filter_by_buffer()):
+                logging.info("copying database")
+                shutil.copy(self.this_db_path, tempfile)
+                self.copy_db_conn = sqlite3.connect(tempfile)
+            else:
+                self.copy_db_conn = sqlite3.connect(tempfile)
+                self._create_snapshot()
             assert isinstance(self.copy_db_conn, sqlite3.Connection)
-
-            self._delete_rows_by_start_and_end_date()
-            if self.copy_db_conn.execute('SELECT count(*) FROM days').fetchone() == (0,):
-                raise ValueError('No data left after filtering')
-            self._filter_by_calendar()
-            self._filter_by_agency()
-            self._filter_by_area()
             if self.update_metadata:
                 self._update_metadata()
-
         return
 
-    def _delete_rows_by_start_and_end_date(self):
+    def _filter_by_dates(self):
+        return (self.start_date is not None) and (self.end_date is not None)
+
+    def _filter_by_agencies(self):
+        return self.agency_ids_to_preserve is not None
+
+    def _filter_by_buffer(self):
+        return (self.buffer_lat is not None) and (self.buffer_lon is not None) and (self.buffer_distance is not None)
+
+    def _create_snapshot(self):
         """
-        Removes rows from the sqlite database copy that are out of the time span defined by start_date and end_date
-        :param gtfs: GTFS object
-        :param copy_db_conn: sqlite database connection
-        :param start_date:
-        :param end_date:
-        :return:
+        Create the filtered database by copying only the rows to be preserved from the original database.
+
+        The original database is attached to the new (empty) database as "source".
+        The ids of the preserved trips, stops, routes, and agencies are first collected into temporary
+        key tables (following the same cascading rules as the filters), after which each table
+        is filled with a single INSERT ... SELECT.
         """
-        # filter by start_time_ut and end_date_ut:
-        if (self.start_date is not None) and (self.end_date is not None):
-            start_date_ut = self.gtfs.get_day_start_ut(self.start_date)
-            end_date_ut = self.gtfs.get_day_start_ut(self.end_date)
-            if self.copy_db_conn.execute("SELECT count(*) FROM day_trips2 WHERE start_time_ut IS null "
-                                         "OR end_time_ut IS null").fetchone() != (0,):
-                raise ValueError("Missing information in day_trips2 (start_time_ut and/or end_time_ut), "
-                                 "check trips.start_time_ds and trips.end_time_ds.")
-            logging.info("Filtering based on agency_ids")
-            # negated from import_gtfs
-            table_to_remove_map = {
-                "calendar": ("WHERE NOT ("
-                             "date({start_ut}, 'unixepoch', 'localtime') < end_date "
-                             "AND "
-                             "start_date < date({end_ut}, 'unixepoch', 'localtime')"
-                             ");"),
-                "calendar_dates": "WHERE NOT ("
-                                  "date({start_ut}, 'unixepoch', 'localtime') <= date "
-                                  "AND "
-                                  "date < date({end_ut}, 'unixepoch', 'localtime')"
-                                  ")",
-                "day_trips2": 'WHERE NOT ('
-                              '{start_ut} < end_time_ut '
-                              'AND '
-                              'start_time_ut < {end_ut}'
-                              ')',
-                "days": "WHERE NOT ("
-                        "{start_ut} <= day_start_ut "
-                        "AND "
-                        "day_start_ut < {end_ut}"
-                        ")"
-            }
-            # remove the 'source' entries from tables
-            for table, query_template in table_to_remove_map.items():
-                param_dict = {"start_ut": str(start_date_ut),
-                              "end_ut": str(end_date_ut)}
-                if True and table == "days":
-                    query = "SELECT * FROM " + table + " " + \
-                            query_template.format(**param_dict)
-
-                    self.gtfs.execute_custom_query_pandas(query)
-
-                query = "DELETE FROM " + table + " " + \
-                        query_template.format(**param_dict)
-                self.copy_db_conn.execute(query)
-        return
+        conn = self.copy_db_conn
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("ATTACH DATABASE ? AS source", (self.this_db_path,))
+        conn.create_function("find_distance", 4, wgs84_distance)
+        # the cached segments table is not copied, it is recomputed from the filtered tables when needed
+        schema = conn.execute("SELECT type, name, tbl_name, sql FROM source.sqlite_master "
+                              "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' AND tbl_name != ?",
+                              (SEGMENTS_TABLE,)).fetchall()
+        tables = [name for type_, name, _, _ in schema if type_ == "table"]
+
+        for key_table, column, source_table in [("keep_trips", "trip_I", "trips"),
+                                                ("keep_stops", "stop_I", "stops"),
+                                                ("keep_routes", "route_I", "routes"),
+                                                ("keep_agencies", "agency_I", "agencies")]:
+            conn.execute("CREATE TEMP TABLE {key_table} ({column} INTEGER PRIMARY KEY)"
+                         .format(key_table=key_table, column=column))
+            conn.execute("INSERT INTO {key_table} SELECT {column} FROM source.{source_table}"
+                         .format(key_table=key_table, column=column, source_table=source_table))
+
+        # additional WHERE clauses, by table, for the rows to be copied
+        table_to_conditions = {table: [] for table in tables}
+        self._collect_keys_by_start_and_end_date(table_to_conditions)
+        self._collect_keys_by_agency(table_to_conditions)
+        self._collect_keys_by_area(table_to_conditions)
+        table_to_conditions["trips"].append("trip_I IN temp.keep_trips")
+        table_to_conditions["stops"].append("stop_I IN temp.keep_stops")
+        table_to_conditions["routes"].append("route_I IN temp.keep_routes")
+        table_to_conditions["agencies"].append("agency_I IN temp.keep_agencies")
+        table_to_conditions["stop_times"].append("trip_I IN temp.keep_trips")
+        table_to_conditions["shapes"].append("shape_id IN (SELECT shape_id FROM source.trips "
+                                             "WHERE trip_I IN temp.keep_trips)")
+        if conn.execute("SELECT count(*) FROM keep_trips").fetchone() == (0,):
+            raise ValueError('No data left after filtering')
+
+        logging.info("copying the preserved rows")
+        for type_, name, _, sql in schema:
+            if type_ == "table":
+                conn.execute(sql)
+        for table in tables:
+            query = "INSERT INTO main.{table} SELECT * FROM source.{table}".format(table=table)
+            if table_to_conditions[table]:
+                query += " WHERE " + " AND ".join("(" + condition + ")" for condition in table_to_conditions[table])
+            conn.execute(query)
+        for type_, name, _, sql in schema:
+            if type_ != "table":
+                conn.execute(sql)
+
+        if self._filter_by_dates():
+            self._update_calendar_dates()
+        conn.commit()
+        conn.execute("DETACH DATABASE source")
+
+    def _collect_keys_by_start_and_end_date(self, table_to_conditions):
+        """
+        Restrict the key tables and rows to the time span defined by start_date and end_date.
+        """
+        if not self._filter_by_dates():
+            return
+        conn = self.copy_db_conn
+        start_date_ut = self.gtfs.get_day_start_ut(self.start_date)
+        end_date_ut = self.gtfs.get_day_start_ut(self.end_date)
+        if conn.execute("SELECT count(*) FROM source.day_trips2 WHERE start_time_ut IS null "
+                        "OR end_time_ut IS null").fetchone() != (0,):
+            raise ValueError("Missing information in day_trips2 (start_time_ut and/or end_time_ut), "
+                             "check trips.start_time_ds and trips.end_time_ds.")
+        logging.info("Filtering based on start and end dates")
+        params = {"start_ut": str(start_date_ut), "end_ut": str(end_date_ut)}
+        days_condition = "{start_ut} <= day_start_ut AND day_start_ut < {end_ut}".format(**params)
+        table_to_conditions["days"].append(days_condition)
+        table_to_conditions["day_trips2"].append("{start_ut} < end_time_ut AND start_time_ut < {end_ut}"
+                                                 .format(**params))
+        table_to_conditions["calendar"].append("date({start_ut}, 'unixepoch', 'localtime') < end_date "
+                                               "AND start_date < date({end_ut}, 'unixepoch', 'localtime')"
+                                               .format(**params))
+        table_to_conditions["calendar_dates"].append("date({start_ut}, 'unixepoch', 'localtime') <= date "
+                                                     "AND date < date({end_ut}, 'unixepoch', 'localtime')"
+                                                     .format(**params))
+        if conn.execute("SELECT count(*) FROM source.days WHERE " + days_condition).fetchone() == (0,):
+            raise ValueError('No data left after filtering')
+
+        conn.execute("DELETE FROM keep_trips WHERE trip_I NOT IN "
+                     "(SELECT trip_I FROM source.days WHERE " + days_condition + ")")
+        self._replace_keys("keep_stops", "SELECT DISTINCT stop_I FROM source.stop_times "
+                                         "WHERE trip_I IN temp.keep_trips")
+        self._replace_keys("keep_routes", "SELECT DISTINCT route_I FROM source.trips "
+                                          "WHERE trip_I IN temp.keep_trips")
+        self._replace_keys("keep_agencies", "SELECT DISTINCT agency_I FROM source.routes "
+                                            "WHERE route_I IN temp.keep_routes")
+        table_to_conditions["stop_distances"].append("from_stop_I IN temp.keep_stops "
+                                                     "AND to_stop_I IN temp.keep_stops")
+
+    def _update_calendar_dates(self):
+        """
+        Limit the validity of the calendar services to the time span defined by start_date and end_date.
+        """
+        logging.info("Making date extract")
+        self.copy_db_conn.execute("UPDATE calendar "
+                                  "SET start_date='{start_date}' "
+                                  "WHERE start_date<'{start_date}' ".format(start_date=self.start_date))
+        self.copy_db_conn.execute("UPDATE calendar "
+                                  "SET end_date='{end_date_to_include}' "
+                                  "WHERE end_date>'{end_date_to_include}' "
+                                  .format(end_date_to_include=self.end_date_to_include_str))
+
+    def _collect_keys_by_agency(self, table_to_conditions):
+        """
+        Restrict the key tables and rows to the agencies listed in agency_ids_to_preserve.
+        """
+        if not self._filter_by_agencies():
+            return
+        logging.info("Filtering based on agency_ids")
+        conn = self.copy_db_conn
+        conn.execute("CREATE TEMP TABLE agency_ids_to_preserve (agency_id TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO agency_ids_to_preserve VALUES (?)",
+                         [(agency_id,) for agency_id in self.agency_ids_to_preserve])
+        conn.execute("DELETE FROM keep_agencies WHERE agency_I NOT IN "
+                     "(SELECT agency_I FROM source.agencies "
+                     "WHERE agency_id IN temp.agency_ids_to_preserve)")
+        conn.execute("DELETE FROM keep_routes WHERE route_I NOT IN "
+                     "(SELECT route_I FROM source.routes WHERE agency_I IN temp.keep_agencies)")
+        conn.execute("DELETE FROM keep_trips WHERE trip_I NOT IN "
+                     "(SELECT trip_I FROM source.trips WHERE route_I IN temp.keep_routes)")
+        # only the days, day_trips2 and calendar rows of the preserved trips are kept
+        conn.execute("CREATE TEMP TABLE agency_trips AS SELECT trip_I FROM keep_trips")
+        conn.execute("CREATE TEMP TABLE agency_services AS "
+                     "SELECT DISTINCT service_I FROM source.trips WHERE trip_I IN temp.keep_trips")
+        table_to_conditions["days"].append("trip_I IN temp.agency_trips")
+        table_to_conditions["day_trips2"].append("trip_I IN temp.agency_trips")
+        table_to_conditions["calendar"].append("service_I IN temp.agency_services")
+        table_to_conditions["calendar_dates"].append("service_I IN temp.agency_services")
+
+    def _collect_keys_by_area(self, table_to_conditions):
+        """
+        Restrict the key tables and rows to the area defined by buffer_lat, buffer_lon, and buffer_distance.
+
+        For each trip, the smallest (min_seq) and largest (max_seq) stop sequence numbers
+        that are within the buffer_distance from the buffer_lon and buffer_lat are found.
+        Then all stops that are not between the min_seq and max_seq for any trip are removed.
+        Note that if a trip is OUT-IN-OUT-IN-OUT, the process preserves the part IN-OUT-IN of the trip.
+        """
+        print("filtering with lat: " + str(self.buffer_lat) +
+              " lon: " + str(self.buffer_lon) +
+              " buffer distance: " + str(self.buffer_distance))
+        if not self._filter_by_buffer():
+            return
+        logging.info("Making spatial extract")
+        conn = self.copy_db_conn
+        print("stops before filtering: ", conn.execute("SELECT count(*) FROM keep_stops").fetchone()[0])
+        conn.execute("CREATE TEMP TABLE stops_in_buffer (stop_I INTEGER PRIMARY KEY)")
+        conn.execute("INSERT INTO stops_in_buffer " + self._stops_within_distance_query(self.buffer_distance * 1000))
+        conn.execute("CREATE TEMP TABLE trip_seq_ranges AS "
+                     "SELECT trip_I, min(seq) AS min_seq, max(seq) AS max_seq FROM source.stop_times "
+                     "WHERE stop_I IN temp.stops_in_buffer AND trip_I IN temp.keep_trips "
+                     "GROUP BY trip_I")
+        self._replace_keys("keep_stops", "SELECT DISTINCT stop_times.stop_I "
+                                         "FROM source.stop_times JOIN temp.trip_seq_ranges USING (trip_I) "
+                                         "WHERE seq >= min_seq AND seq <= max_seq "
+                                         "AND stop_times.stop_I IN temp.keep_stops")
+        print("stops after first filtering: ", conn.execute("SELECT count(*) FROM keep_stops").fetchone()[0])
+        if self.hard_buffer_distance:
+            print("filtering with hard buffer")
+            conn.execute("DELETE FROM keep_stops WHERE stop_I NOT IN (" +
+                         self._stops_within_distance_query(self.hard_buffer_distance * 1000) + ")")
+        print("stops after second filtering: ", conn.execute("SELECT count(*) FROM keep_stops").fetchone()[0])
+
+        # Trips with only one stop, or only one stop visited several times, are not preserved
+        self._replace_keys("keep_trips", "SELECT trip_I FROM source.stop_times "
+                                         "WHERE trip_I IN temp.keep_trips AND stop_I IN temp.keep_stops "
+                                         "GROUP BY trip_I "
+                                         "HAVING count(*) > 1 AND count(DISTINCT stop_I) > 1")
+        self._replace_keys("keep_routes", "SELECT DISTINCT route_I FROM source.trips "
+                                          "WHERE trip_I IN temp.keep_trips")
+        self._replace_keys("keep_agencies", "SELECT DISTINCT agency_I FROM source.routes "
+                                            "WHERE route_I IN temp.keep_routes")
+        # days, day_trips2 and the calendar are not affected by the spatial filtering:
+        table_to_conditions["stop_times"].append("stop_I IN temp.keep_stops")
+        table_to_conditions["stop_distances"].append("from_stop_I IN temp.keep_stops "
+                                                     "AND to_stop_I IN temp.keep_stops")
+
+    def _stops_within_distance_query(self, distance_m):
+        """
+        Query for the (preserved) stops within distance_m from the buffer center.
+        A cheap bounding box check is done before the exact distance computation.
+        """
+        lat_diff = util.wgs84_height(distance_m)
+        lon_diff = util.wgs84_width(distance_m, min(89.9, abs(self.buffer_lat) + lat_diff))
+        return ("SELECT stop_I FROM source.stops "
+                "WHERE stop_I IN temp.keep_stops "
+                "AND lat BETWEEN {lat_min} AND {lat_max} "
+                "AND lon BETWEEN {lon_min} AND {lon_max} "
+                "AND CAST(find_distance(lat, lon, {lat}, {lon}) AS INT) < {distance}"
+                ).format(lat_min=self.buffer_lat - lat_diff,
+                         lat_max=self.buffer_lat + lat_diff,
+                         lon_min=self.buffer_lon - lon_diff,
+                         lon_max=self.buffer_lon + lon_diff,
+                         lat=self.buffer_lat,
+                         lon=self.buffer_lon,
+                         distance=distance_m)
+
+    def _replace_keys(self, key_table, select_query):
+        """
+        Replace the contents of a temporary key table with the results of select_query.
+        """
+        self.copy_db_conn.execute("DELETE FROM " + key_table + " WHERE rowid NOT IN (" + select_query + ")")
 
     def _soft_filter_by_calendar(self):
         pass
@@ -216,173 +381,6 @@ class FilterExtract(object):
 
         agency_query = 'DELETE FROM agencies WHERE NOT agency_I IN (SELECT agency_I FROM routes WHERE route_I IN (SELECT route_I FROM trips WHERE trip_I IN ())) AND '
         """
-    def _filter_by_calendar(self):
-        """
-        update calendar table's services
-        :param copy_db_conn:
-        :param start_date:
-        :param end_date:
-        :return:
-        """
-
-        if (self.start_date is not None) and (self.end_date is not None):
-
-            logging.info("Making date extract")
-
-            start_date_query = "UPDATE calendar " \
-                               "SET start_date='{start_date}' " \
-                               "WHERE start_date<'{start_date}' ".format(start_date=self.start_date)
-            self.copy_db_conn.execute(start_date_query)
-
-            end_date_query = "UPDATE calendar " \
-                             "SET end_date='{end_date_to_include}' " \
-                             "WHERE end_date>'{end_date_to_include}' " \
-                .format(end_date_to_include=self.end_date_to_include_str)
-            self.copy_db_conn.execute(end_date_query)
-
-            # then recursively delete further data:
-            self.copy_db_conn.execute('DELETE FROM trips WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM days)')
-            self.copy_db_conn.execute('DELETE FROM shapes WHERE '
-                                      'shape_id NOT IN (SELECT shape_id FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM stops WHERE '
-                                      'stop_I NOT IN (SELECT stop_I FROM stop_times)')
-            self.copy_db_conn.execute('DELETE FROM stop_distances WHERE '
-                                      '   from_stop_I NOT IN (SELECT stop_I FROM stops) '
-                                      'OR to_stop_I   NOT IN (SELECT stop_I FROM stops)')
-            self.copy_db_conn.execute('DELETE FROM routes WHERE '
-                                      'route_I NOT IN (SELECT route_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM agencies WHERE '
-                                      'agency_I NOT IN (SELECT agency_I FROM routes)')
-            self.copy_db_conn.commit()
-        return
-
-    def _filter_by_agency(self):
-        """
-        filter by agency ids
-        :param copy_db_conn:
-        :param agency_ids_to_preserve:
-        :return:
-        """
-        if self.agency_ids_to_preserve is not None:
-            logging.info("Filtering based on agency_ids")
-            agency_ids_to_preserve = list(self.agency_ids_to_preserve)
-            agencies = pd.read_sql("SELECT * FROM agencies", self.copy_db_conn)
-            agencies_to_remove = []
-            for idx, row in agencies.iterrows():
-                if row['agency_id'] not in agency_ids_to_preserve:
-                    agencies_to_remove.append(row['agency_id'])
-            for agency_id in agencies_to_remove:
-                self.copy_db_conn.execute('DELETE FROM agencies WHERE agency_id=?', (agency_id,))
-            # and remove recursively related to the agencies:
-            self.copy_db_conn.execute('DELETE FROM routes WHERE '
-                                      'agency_I NOT IN (SELECT agency_I FROM agencies)')
-            self.copy_db_conn.execute('DELETE FROM trips WHERE '
-                                      'route_I NOT IN (SELECT route_I FROM routes)')
-            self.copy_db_conn.execute('DELETE FROM calendar WHERE '
-                                      'service_I NOT IN (SELECT service_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM calendar_dates WHERE '
-                                      'service_I NOT IN (SELECT service_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM days WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM shapes WHERE '
-                                      'shape_id NOT IN (SELECT shape_id FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM day_trips2 WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM trips)')
-            self.copy_db_conn.commit()
-        return
-
-    def _filter_by_area(self):
-        """
-        filter by boundary
-        select the largest and smallest seq value for each trip that is within boundary
-        WITH query that includes all stops that are within area or stops of routes
-        that leaves and then returns to area
-        DELETE from stops where not in WITH query
-        Cascade for other tables
-        :param copy_db_conn:
-        :param buffer_lat:
-        :param buffer_lon:
-        :param buffer_distance: in kilometers
-        :return:
-        """
-        print("filtering with lat: " + str(self.buffer_lat) +
-              " lon: " + str(self.buffer_lon) +
-              " buffer distance: " + str(self.buffer_distance))
-
-        if (self.buffer_lat is not None) and (self.buffer_lon is not None) and (self.buffer_distance is not None):
-            _buffer_distance = self.buffer_distance * 1000
-            logging.info("Making spatial extract")
-            self.copy_db_conn.create_function("find_distance", 4, wgs84_distance)
-            # For each trip_I, find smallest (min_seq) and largest (max_seq) stop sequence numbers
-            # that are within the buffer_distance from the buffer_lon and buffer_lat.
-            # Then delete all stops that are not between the min_seq and max_seq for any trip_I,
-            # Note that if a trip is OUT-IN-OUT-IN-OUT, the process preserves the part IN-OUT-IN of the trip.
-            print("stops before filtering: ", self.copy_db_conn.execute("SELECT count(*) FROM stops").fetchone()[0])
-
-            self.copy_db_conn.execute('DELETE FROM stops '
-                                      'WHERE stop_I NOT IN '
-                                      '(SELECT stops.stop_I FROM stop_times, stops, '
-                                      '(SELECT trip_I, min(seq) AS min_seq, max(seq) AS max_seq FROM stop_times, stops '
-                                      'WHERE stop_times.stop_I = stops.stop_I '
-                                      'AND CAST(find_distance(lat, lon, ?, ?) AS INT) < ? '
-                                      'GROUP BY trip_I) q1 '
-                                      'WHERE stop_times.stop_I = stops.stop_I '
-                                      'AND stop_times.trip_I = q1.trip_I '
-                                      'AND seq >= min_seq '
-                                      'AND seq <= max_seq '
-                                      ')', (self.buffer_lat, self.buffer_lon, _buffer_distance))
-            print("stops after first filtering: ", self.copy_db_conn.execute("SELECT count(*) FROM stops").fetchone()[0])
-
-            if self.hard_buffer_distance:
-                print("filtering with hard buffer")
-                _hard_buffer_distance = self.hard_buffer_distance * 1000
-                self.copy_db_conn.execute('DELETE FROM stops '
-                                          'WHERE stop_I NOT IN '
-                                          '(SELECT stop_I FROM stops '
-                                          'WHERE CAST(find_distance(lat, lon, ?, ?) AS INT) < ?) ',
-                                          (self.buffer_lat, self.buffer_lon, _hard_buffer_distance))
-
-            print("stops after second filtering: ", self.copy_db_conn.execute("SELECT count(*) FROM stops").fetchone()[0])
-
-            # Delete all stop_times for uncovered stops
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'stop_I NOT IN (SELECT stop_I FROM stops)')
-            # Delete trips with only one stop
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'trip_I IN (SELECT trip_I FROM '
-                                      '(SELECT trip_I, count(*) AS N_stops from stop_times '
-                                      'GROUP BY trip_I) q1 '
-                                      'WHERE N_stops = 1)')
-            # Delete trips with only one stop but several instances in stop_times
-            self.copy_db_conn.execute('DELETE FROM stop_times WHERE '
-                                      'trip_I IN (SELECT q1.trip_I AS trip_I FROM '
-                                        '(SELECT trip_I, stop_I, count(*) AS stops_per_stop FROM stop_times '
-                                        'GROUP BY trip_I, stop_I) q1, '
-                                        '(SELECT trip_I, count(*) as n_stops FROM stop_times '
-                                        'GROUP BY trip_I) q2 '
-                                        'WHERE q1.trip_I = q2.trip_I AND n_stops = stops_per_stop)')
-            # Consecutively delete all the rest remaining.
-            self.copy_db_conn.execute('DELETE FROM trips WHERE '
-                                      'trip_I NOT IN (SELECT trip_I FROM stop_times)')
-            self.copy_db_conn.execute('DELETE FROM routes WHERE '
-                                      'route_I NOT IN (SELECT route_I FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM agencies WHERE '
-                                      'agency_I NOT IN (SELECT agency_I FROM routes)')
-            self.copy_db_conn.execute('DELETE FROM shapes WHERE '
-                                      'shape_id NOT IN (SELECT shape_id FROM trips)')
-            self.copy_db_conn.execute('DELETE FROM stop_distances WHERE '
-                                      'from_stop_I NOT IN (SELECT stop_I FROM stops)'
-                                      'OR to_stop_I NOT IN (SELECT stop_I FROM stops)')
-            self.copy_db_conn.commit()
-        return
-
     def _update_metadata(self):
         # Update metadata
         G_orig = self.gtfs
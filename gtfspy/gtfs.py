@@ -4,61 +4,228 @@ import logging
 import os
 import sqlite3
 import sys
+import threading
 import time
-from collections import Counter, defaultdict
+import weakref
 from datetime import timedelta
 
 import numpy
 import pandas as pd
 import pytz
 from six import string_types
+from six.moves.urllib.request import pathname2url
 
+from gtfspy import columnar_cache
+from gtfspy import segments
 from gtfspy import shapes
+from gtfspy.local_calendar import LocalCalendar
+from gtfspy.query_cache import QueryCache, DEFAULT_QUERY_CACHE_SIZE, cached_query
 from gtfspy.route_types import ALL_ROUTE_TYPES
 from gtfspy.route_types import WALK
-from gtfspy.util import wgs84_distance, wgs84_width, wgs84_height
+from gtfspy.util import wgs84_distance, wgs84_distances, wgs84_distances_from_point, wgs84_width, wgs84_height, \
+    find_points_within_distance
+
+
+class _ThreadConnection(object):
+    """The read-only connection of one thread (see GTFS.conn)."""
+
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.pid = pid
+
+
+def _close_thread_connection(conn, pid, connections, connections_lock):
+    # connections inherited from the parent process are left for the parent to close
+    if os.getpid() != pid:
+        return
+    with connections_lock:
+        connections[:] = [(connection_pid, connection) for connection_pid, connection in connections
+                          if connection is not conn]
+    conn.close()
 
 
 class GTFS(object):
 
-    def __init__(self, fname):
+    def __init__(self, fname, read_only=False, immutable=False):
         """Open a GTFS object
 
         Parameters
         ----------
         fname: str | sqlite3.Connection
             path to the preprocessed gtfs database or a connection to a gtfs database
-        """
+        read_only: bool, optional
+            Open the database (given as a path) in read-only mode.
+            Each thread (and process) then lazily opens its own read-only connection,
+            so that the same GTFS object can be queried concurrently from many threads,
+            and passed to (or inherited by) worker processes.
+        immutable: bool, optional
+            Open the database in read-only mode, and additionally tell SQLite that the file
+            does not change while it is open (which skips all locking).
+        """
+        self.read_only = read_only or immutable
+        self.immutable = immutable
+        self._conn = None
+        self._query_cache = None
+        self._init_connection_pool()
         if isinstance(fname, string_types):
             if os.path.isfile(fname):
-                self.conn = sqlite3.connect(fname)
                 self.fname = fname
-                # memory-mapped IO size, in bytes
-                self.conn.execute('PRAGMA mmap_size = 1000000000;')
-                # page cache size, in negative KiB.
-                self.conn.execute('PRAGMA cache_size = -2000000;')
+                if not self.read_only:
+                    self._conn = self._connect()
             else:
                 raise EnvironmentError("File " + fname + " missing")
         elif isinstance(fname, sqlite3.Connection):
-            self.conn = fname
+            if self.read_only:
+                raise ValueError("Read-only mode requires the path to the database")
+            self._conn = fname
             self._dont_close = True
+            # Bind functions
+            self._conn.create_function("find_distance", 4, wgs84_distance)
         else:
             raise NotImplementedError(
                 "Initiating GTFS using an object with type " + str(type(fname)) + " is not supported")
 
         assert self.conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchone() is not None
-        self.meta = GTFSMetadata(self.conn)
-
-        # Bind functions
-        self.conn.create_function("find_distance", 4, wgs84_distance)
 
         # Set timezones
         self._timezone = pytz.timezone(self.get_timezone_name())
+        self._local_calendar = None
+
+    @property
+    def conn(self):
+        """
+        The connection to the database.
+        In read-only mode, each thread and process gets a connection of its own.
+
+        Returns
+        -------
+        conn: sqlite3.Connection
+        """
+        if not self.read_only:
+            return self._conn
+        thread_local = self._thread_local
+        pid = os.getpid()
+        holder = getattr(thread_local, "holder", None)
+        if holder is None or holder.pid != pid:
+            # first use in this thread, or a connection inherited from the parent process
+            holder = _ThreadConnection(self._connect(), pid)
+            # the thread-local holder is released when the thread exits, and then its connection is closed
+            weakref.finalize(holder, _close_thread_connection, holder.conn, pid,
+                             self._connections, self._connections_lock)
+            thread_local.holder = holder
+        return holder.conn
+
+    @conn.setter
+    def conn(self, conn):
+        if self.read_only:
+            raise AttributeError("The connections of a read-only GTFS can not be replaced")
+        self._conn = conn
+
+    @property
+    def meta(self):
+        """
+        Returns
+        -------
+        meta: GTFSMetadata
+            the metadata of the database, accessed through the current connection
+        """
+        return GTFSMetadata(self.conn)
+
+    def _init_connection_pool(self):
+        self._thread_local = threading.local()
+        # (pid, connection) of the open read-only connections
+        self._connections = []
+        # reentrant, as the connections of exited threads may be closed by the garbage collector at any point
+        self._connections_lock = threading.RLock()
+
+    def _connect(self):
+        if self.read_only:
+            uri = "file:" + pathname2url(os.path.abspath(self.fname)) + "?mode=ro"
+            if self.immutable:
+                uri += "&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            with self._connections_lock:
+                self._connections.append((os.getpid(), conn))
+        else:
+            conn = sqlite3.connect(self.fname)
+        # memory-mapped IO size, in bytes
+        conn.execute('PRAGMA mmap_size = 1000000000;')
+        # page cache size, in negative KiB.
+        conn.execute('PRAGMA cache_size = -2000000;')
+        # Bind functions
+        conn.create_function("find_distance", 4, wgs84_distance)
+        return conn
+
+    def close(self):
+        """
+        Close the connection(s) to the database opened by this object (in this process).
+        """
+        if self.read_only:
+            with self._connections_lock:
+                pid = os.getpid()
+                for connection_pid, conn in list(self._connections):
+                    if connection_pid == pid:
+                        conn.close()
+                del self._connections[:]
+            self._thread_local = threading.local()
+        elif self._conn is not None:
+            self._conn.close()
+
+    def __getstate__(self):
+        if not self.read_only:
+            raise TypeError("Only read-only GTFS objects can be pickled")
+        state = self.__dict__.copy()
+        for name in ["_thread_local", "_connections", "_connections_lock"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_connection_pool()
 
     def __del__(self):
-        if not getattr(self, '_dont_close', False):
-            self.conn.close()
+        if not getattr(self, '_dont_close', False) and hasattr(self, "_connections_lock"):
+            self.close()
+
+    def enable_query_cache(self, maxsize=DEFAULT_QUERY_CACHE_SIZE):
+        """
+        Cache the results of the (frequently called) lookup methods of this object, such as
+        stops(), get_stop_coordinates() and get_route_name_and_type_of_tripI().
+
+        The results are cached based on the arguments and the data version of the database,
+        so any modification of the database invalidates the cached results.
+
+        Parameters
+        ----------
+        maxsize: int, optional
+            maximum number of cached results, the least recently used results are discarded first
+        """
+        self._query_cache = QueryCache(maxsize)
 
+    def disable_query_cache(self):
+        self._query_cache = None
+
+    def clear_query_cache(self):
+        if self._query_cache is not None:
+            self._query_cache.clear()
+
+    def get_query_cache_info(self):
+        """
+        Returns
+        -------
+        info: dict | None
+            hits, misses, size and maxsize of the query cache, None if the cache is not enabled
+        """
+        if self._query_cache is None:
+            return None
+        return self._query_cache.info()
+
+    def _get_data_version(self):
+        if self.immutable:
+            return None
+        conn = self.conn
+        # data_version changes when other connections modify the database, total_changes when this one does
+        return id(conn), conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes
 
     @classmethod
     def from_directory_as_inmemory_db(cls, gtfs_directory):
@@ -98,6 +265,7 @@ class GTFS(object):
     def get_location_name(self):
         return self.meta.get('location_name', "location_unknown")
 
+    @cached_query
     def get_shape_distance_between_stops(self, trip_I, from_stop_seq, to_stop_seq):
         """
         Get the distance along a shape between stops
@@ -130,14 +298,97 @@ class GTFS(object):
         distance_query = query_template.format(trip_I=trip_I, from_stop_seq=from_stop_seq, to_stop_seq=to_stop_seq)
         return self.conn.execute(distance_query).fetchone()[0]
 
+    def get_shape_distances_between_stops(self, trip_Is, from_stop_seqs, to_stop_seqs):
+        """
+        Bulk version of get_shape_distance_between_stops.
+
+        The shapes table is read only once, and the shape points between each pair of stops
+        are then located with a binary search.
+
+        Parameters
+        ----------
+        trip_Is : list-like of ints
+        from_stop_seqs : list-like of ints
+        to_stop_seqs : list-like of ints
+
+        Returns
+        -------
+        distances : list
+            for each trip_I, from_stop_seq, to_stop_seq, the distance along the shape
+            (or None, if the trip has no shape or there are no shape points in the interval)
+        """
+        trip_Is = numpy.asarray(trip_Is, dtype=numpy.int64)
+        from_stop_seqs = numpy.asarray(from_stop_seqs, dtype=numpy.int64)
+        to_stop_seqs = numpy.asarray(to_stop_seqs, dtype=numpy.int64)
+        distances = [None] * len(trip_Is)
+        shapes_df = pd.read_sql_query("SELECT shape_id, seq, d FROM shapes "
+                                      "WHERE d IS NOT NULL ORDER BY shape_id, seq", self.conn)
+        if len(trip_Is) == 0 or len(shapes_df) == 0:
+            return distances
+        trips_df = pd.read_sql_query("SELECT trip_I, shape_id FROM trips WHERE shape_id IS NOT NULL", self.conn)
+
+        # shapes are ordered by shape_id, so the codes are non-decreasing
+        shape_codes, shape_ids = pd.factorize(shapes_df['shape_id'])
+        shape_seqs = shapes_df['seq'].values.astype(numpy.int64)
+        min_seq = min(shape_seqs.min(), from_stop_seqs.min(), to_stop_seqs.min())
+        stride = max(shape_seqs.max(), from_stop_seqs.max(), to_stop_seqs.max()) - min_seq + 1
+        keys = shape_codes * stride + (shape_seqs - min_seq)
+
+        trip_shape_codes = pd.Series(shape_ids.get_indexer(trips_df['shape_id']), index=trips_df['trip_I'].values)
+        trip_shape_codes = trip_shape_codes[trip_shape_codes >= 0]
+        codes = pd.Series(trip_Is).map(trip_shape_codes).fillna(-1).values.astype(numpy.int64)
+        starts = numpy.searchsorted(keys, codes * stride + (from_stop_seqs - min_seq), side="left")
+        ends = numpy.searchsorted(keys, codes * stride + (to_stop_seqs - min_seq), side="right")
+        valid = numpy.nonzero((codes >= 0) & (ends > starts))[0]
+        if len(valid) == 0:
+            return distances
+
+        # reduce over [start, end) of each interval; the appended element keeps all indices in bounds
+        d = numpy.append(shapes_df['d'].values, shapes_df['d'].values[-1])
+        bounds = numpy.column_stack((starts[valid], ends[valid])).ravel()
+        shape_distances = (numpy.maximum.reduceat(d, bounds)[::2] - numpy.minimum.reduceat(d, bounds)[::2]).tolist()
+        for i, distance in zip(valid.tolist(), shape_distances):
+            distances[i] = distance
+        return distances
+
+    @cached_query
     def get_stop_distance(self, from_stop_I, to_stop_I):
         query_template = "SELECT d_walk FROM stop_distances WHERE from_stop_I={from_stop_I} AND to_stop_I={to_stop_I} "
         q = query_template.format(from_stop_I=int(from_stop_I), to_stop_I=int(to_stop_I))
-        if self.conn.execute(q).fetchone():
-            return self.conn.execute(q).fetchone()[0]
+        row = self.conn.execute(q).fetchone()
+        if row:
+            return row[0]
         else:
             return None
 
+    def get_stop_distances(self, from_stop_Is, to_stop_Is):
+        """
+        Bulk version of get_stop_distance.
+
+        Parameters
+        ----------
+        from_stop_Is: list-like of ints
+        to_stop_Is: list-like of ints
+
+        Returns
+        -------
+        d_walks: list
+            the walking distance for each (from_stop_I, to_stop_I) pair, None if the pair is not in stop_distances
+        """
+        pairs = list(zip(numpy.asarray(from_stop_Is, dtype=numpy.int64).tolist(),
+                         numpy.asarray(to_stop_Is, dtype=numpy.int64).tolist()))
+        unique_from_stop_Is = sorted(set(from_stop_I for from_stop_I, _ in pairs))
+        pair_to_d_walk = {}
+        # keep the number of query parameters below the SQLite limit
+        chunk_size = 500
+        for i in range(0, len(unique_from_stop_Is), chunk_size):
+            chunk = unique_from_stop_Is[i:i + chunk_size]
+            rows = self.conn.execute("SELECT from_stop_I, to_stop_I, d_walk FROM stop_distances "
+                                     "WHERE from_stop_I IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+            for from_stop_I, to_stop_I, d_walk in rows:
+                pair_to_d_walk.setdefault((from_stop_I, to_stop_I), d_walk)
+        return [pair_to_d_walk.get(pair) for pair in pairs]
+
     def get_cursor(self):
         """
         Return a cursor to the underlying sqlite3 object
@@ -157,8 +408,27 @@ class GTFS(object):
         -------
         df : pandas.DataFrame
         """
+        if table_name in columnar_cache.CACHED_TABLES:
+            cache = self.get_columnar_cache()
+            if cache is not None and cache.is_valid(self, table_name):
+                return cache.read_table(table_name)
         return pd.read_sql("SELECT * FROM " + table_name, self.conn)
 
+    def get_columnar_cache(self):
+        """
+        Returns
+        -------
+        cache: gtfspy.columnar_cache.ColumnarCache | None
+            the columnar on-disk cache of the core tables (see gtfspy.columnar_cache), if one has been written
+        """
+        return columnar_cache.load_columnar_cache(self)
+
+    def _get_cached_columns(self, table_name, columns):
+        cache = self.get_columnar_cache()
+        if cache is None or not cache.is_valid(self, table_name):
+            return None
+        return cache.load_columns(table_name, columns)
+
     def get_row_count(self, table):
         """
         Get number of rows in a table
@@ -196,6 +466,23 @@ class GTFS(object):
     def get_timezone_pytz(self):
         return self._timezone
 
+    def get_local_calendar(self):
+        """
+        Get the calendar of the feed's local dates, precomputed for the dates of the feed.
+
+        Returns
+        -------
+        local_calendar: gtfspy.local_calendar.LocalCalendar
+        """
+        if self._local_calendar is None:
+            try:
+                first_date, last_date = self.conn.execute("SELECT min(date), max(date) FROM days").fetchone()
+            except sqlite3.OperationalError:
+                first_date, last_date = None, None
+            self._local_calendar = LocalCalendar(self._timezone, first_date, last_date)
+        return self._local_calendar
+
+    @cached_query
     def get_timezone_name(self):
         """
         Get name of the GTFS timezone
@@ -323,73 +610,183 @@ class GTFS(object):
                 el['name'] -- name of the route
         """
         trips = []
-        trip_df = self.get_tripIs_active_in_range(start, end)
-        print("gtfs_viz.py: fetched " + str(len(trip_df)) + " trip ids")
-        shape_cache = {}
+        for trips_in_slice in self.generate_trip_trajectories(start, end, use_shapes=use_shapes,
+                                                              filter_name=filter_name):
+            trips.extend(trips_in_slice)
+        return {"trips": trips}
 
-        # loop over all trips:
-        for row in trip_df.itertuples():
-            trip_I = row.trip_I
-            day_start_ut = row.day_start_ut
-            shape_id = row.shape_id
+    def generate_trip_trajectories(self, start, end, use_shapes=True, filter_name=None, time_slice_length=None):
+        """
+        Generate the trip trajectories (see get_trip_trajectories_within_timespan) in time slices.
 
-            trip = {}
+        The stop times and shape points of each time slice are fetched with a few queries,
+        and the shape passage times are interpolated for all trips of the slice at once.
 
-            name, route_type = self.get_route_name_and_type_of_tripI(trip_I)
-            trip['route_type'] = int(route_type)
-            trip['name'] = str(name)
+        Parameters
+        ----------
+        start: number
+            Earliest position data to return (in unix time)
+        end: number
+            Latest position data to return (in unix time)
+        use_shapes: bool, optional
+            Whether or not shapes should be included
+        filter_name: str, optional
+            Pick only routes having this name.
+        time_slice_length: int, optional
+            Length of the time slices in seconds.
+            If not given, all trajectories are generated as one slice.
+
+        Yields
+        ------
+        trips: list
+            the trajectories (dicts) of the trips starting within the time slice
+            (trips that started before start are included in the first slice)
+        """
+        trip_df = self.get_tripIs_active_in_range(start, end)
+        logging.debug("generate_trip_trajectories: fetched " + str(len(trip_df)) + " trip ids")
+        if time_slice_length is None:
+            yield self._get_trip_trajectories(trip_df, use_shapes, filter_name)
+            return
+        slice_start = start
+        while slice_start < end:
+            slice_end = slice_start + time_slice_length
+            in_slice = trip_df['start_time_ut'].values < slice_end
+            if slice_start > start:
+                in_slice &= trip_df['start_time_ut'].values >= slice_start
+            yield self._get_trip_trajectories(trip_df[in_slice], use_shapes, filter_name)
+            slice_start = slice_end
 
+    def _get_trip_trajectories(self, trip_df, use_shapes, filter_name):
+        """
+        Compute the trajectories of the trips (day_trips rows) in trip_df in batch.
+
+        Returns
+        -------
+        trips: list of dicts
+        """
+        trip_Is = numpy.unique(trip_df['trip_I'].values)
+        if len(trip_Is) == 0:
+            return []
+        trip_I_list = ",".join(str(trip_I) for trip_I in trip_Is)
+        route_df = pd.read_sql_query("SELECT trip_I, name, type FROM routes JOIN trips USING(route_I) "
+                                     "WHERE trip_I IN (" + trip_I_list + ")", self.conn)
+        trip_to_route = dict(zip(route_df['trip_I'].values, zip(route_df['name'].values, route_df['type'].values)))
+        stop_df = pd.read_sql_query("SELECT trip_I, dep_time_ds, lat, lon, shape_break "
+                                    "FROM stop_times JOIN stops USING(stop_I) "
+                                    "WHERE trip_I IN (" + trip_I_list + ") ORDER BY trip_I, seq", self.conn)
+        stop_trip_Is = stop_df['trip_I'].values
+        stop_lats = stop_df['lat'].values.astype(float)
+        stop_lons = stop_df['lon'].values.astype(float)
+        stop_dep_times_ds = stop_df['dep_time_ds'].values.astype(float)
+
+        rows = []
+        for row in trip_df.itertuples():
+            name, route_type = trip_to_route[row.trip_I]
+            name = u"%s" % str(name)
             if filter_name and (name != filter_name):
                 continue
+            stops_start = numpy.searchsorted(stop_trip_Is, row.trip_I, side="left")
+            stops_end = numpy.searchsorted(stop_trip_Is, row.trip_I, side="right")
+            rows.append((row.trip_I, row.day_start_ut, row.shape_id, name, int(route_type), stops_start, stops_end))
+        if not rows:
+            return []
+
+        n_trips = len(rows)
+        day_start_uts = numpy.array([row[1] for row in rows], dtype=float)
+        stops_starts = numpy.array([row[5] for row in rows], dtype=numpy.int64)
+        stop_counts = numpy.array([row[6] for row in rows], dtype=numpy.int64) - stops_starts
+        # stop rows of each trip (repeated for trips running on several days)
+        stop_indices = numpy.repeat(stops_starts - numpy.cumsum(stop_counts) + stop_counts, stop_counts) + \
+            numpy.arange(stop_counts.sum())
+        stop_times = stop_dep_times_ds[stop_indices] + numpy.repeat(day_start_uts, stop_counts)
+
+        shape_trips = numpy.zeros(n_trips, dtype=bool)
+        if use_shapes:
+            shape_df = pd.read_sql_query("SELECT shape_id, lat, lon, d FROM shapes "
+                                         "WHERE shape_id IN (SELECT DISTINCT shape_id FROM trips "
+                                         "WHERE trip_I IN (" + trip_I_list + ")) ORDER BY shape_id, seq", self.conn)
+            shape_ids = shape_df['shape_id'].values
+            shape_distances = shape_df['d'].values.astype(float)
+            shape_id_to_range = {}
+            if len(shape_ids) > 0:
+                boundaries = numpy.concatenate(([0], numpy.nonzero(shape_ids[1:] != shape_ids[:-1])[0] + 1,
+                                                [len(shape_ids)]))
+                for shape_start, shape_end in zip(boundaries[:-1], boundaries[1:]):
+                    shape_id_to_range[shape_ids[shape_start]] = (shape_start, shape_end)
+
+            # Trips with regular shape data are interpolated in batch,
+            # the rest are handled trip by trip below (falling back to stop coordinates)
+            breaks = stop_df['shape_break'].values.astype(float)
+            null_distances = numpy.cumsum(numpy.isnan(shape_distances))
+            shape_starts = numpy.zeros(n_trips, dtype=numpy.int64)
+            for i, row in enumerate(rows):
+                shape_range = shape_id_to_range.get(row[2])
+                if shape_range is None or stop_counts[i] == 0:
+                    continue
+                trip_breaks = breaks[row[5]:row[6]]
+                n_shape_points = shape_range[1] - shape_range[0]
+                if (numpy.isnan(trip_breaks).any() or trip_breaks.min() < 0 or
+                        trip_breaks.max() >= n_shape_points or (numpy.diff(trip_breaks) < 0).any() or
+                        null_distances[shape_range[1] - 1] >
+                        (null_distances[shape_range[0] - 1] if shape_range[0] > 0 else 0)):
+                    continue
+                shape_trips[i] = True
+                shape_starts[i] = shape_range[0]
+            all_shape_lats = shape_df['lat'].values.astype(float)
+            all_shape_lons = shape_df['lon'].values.astype(float)
+            if shape_trips.any():
+                stop_in_shape_trip = numpy.repeat(shape_trips, stop_counts)
+                shape_indices, shape_times, point_counts = shapes.interpolate_shape_times_in_batch(
+                    shape_distances, shape_starts[shape_trips], breaks[stop_indices[stop_in_shape_trip]],
+                    stop_times[stop_in_shape_trip], stop_counts[shape_trips])
+                shape_times = shape_times.tolist()
+                shape_lats = all_shape_lats[shape_indices].tolist()
+                shape_lons = all_shape_lons[shape_indices].tolist()
+                point_ends = numpy.cumsum(point_counts).tolist()
+            all_shape_lats = all_shape_lats.tolist()
+            all_shape_lons = all_shape_lons.tolist()
+            all_shape_distances = [None if numpy.isnan(d) else d for d in shape_distances.tolist()]
 
-            stop_lats = []
-            stop_lons = []
-            stop_dep_times = []
-            shape_breaks = []
-            stop_seqs = []
-
-            # get stop_data and store it:
-            stop_time_df = self.get_trip_stop_time_data(trip_I, day_start_ut)
-            for stop_row in stop_time_df.itertuples():
-                stop_lats.append(float(stop_row.lat))
-                stop_lons.append(float(stop_row.lon))
-                stop_dep_times.append(float(stop_row.dep_time_ut))
-                try:
-                    stop_seqs.append(int(stop_row.seq))
-                except TypeError:
-                    stop_seqs.append(None)
-                try:
-                    shape_breaks.append(int(stop_row.shape_break))
-                except TypeError:
-                    shape_breaks.append(None)
-
-            if use_shapes:
-                # get shape data (from cache, if possible)
-                if shape_id not in shape_cache:
-                    shape_cache[shape_id] = shapes.get_shape_points2(self.conn.cursor(), shape_id)
-                shape_data = shape_cache[shape_id]
-                # noinspection PyBroadException
-                try:
-                    trip['times'] = shapes.interpolate_shape_times(shape_data['d'], shape_breaks, stop_dep_times)
-                    trip['lats'] = shape_data['lats']
-                    trip['lons'] = shape_data['lons']
-                    start_break = shape_breaks[0]
-                    end_break = shape_breaks[-1]
-                    trip['times'] = trip['times'][start_break:end_break + 1]
-                    trip['lats'] = trip['lats'][start_break:end_break + 1]
-                    trip['lons'] = trip['lons'][start_break:end_break + 1]
-                except:
-                    # In case interpolation fails:
-                    trip['times'] = stop_dep_times
-                    trip['lats'] = stop_lats
-                    trip['lons'] = stop_lons
+        trips = []
+        stop_ends = numpy.cumsum(stop_counts).tolist()
+        stop_lats = stop_lats[stop_indices].tolist()
+        stop_lons = stop_lons[stop_indices].tolist()
+        stop_times = stop_times.tolist()
+        shape_trip_index = 0
+        for i, row in enumerate(rows):
+            trip = {'route_type': row[4], 'name': str(row[3])}
+            if shape_trips[i]:
+                point_start = point_ends[shape_trip_index - 1] if shape_trip_index > 0 else 0
+                point_end = point_ends[shape_trip_index]
+                trip['times'] = shape_times[point_start:point_end]
+                trip['lats'] = shape_lats[point_start:point_end]
+                trip['lons'] = shape_lons[point_start:point_end]
+                shape_trip_index += 1
             else:
-                trip['times'] = stop_dep_times
-                trip['lats'] = stop_lats
-                trip['lons'] = stop_lons
+                stop_start = stop_ends[i - 1] if i > 0 else 0
+                trip['times'] = stop_times[stop_start:stop_ends[i]]
+                trip['lats'] = stop_lats[stop_start:stop_ends[i]]
+                trip['lons'] = stop_lons[stop_start:stop_ends[i]]
+                if use_shapes:
+                    shape_start, shape_end = shape_id_to_range.get(row[2], (0, 0))
+                    shape_breaks = [None if numpy.isnan(shape_break) else int(shape_break)
+                                    for shape_break in breaks[row[5]:row[6]]]
+                    # noinspection PyBroadException
+                    try:
+                        times = shapes.interpolate_shape_times(all_shape_distances[shape_start:shape_end],
+                                                               shape_breaks, trip['times'])
+                        start_break = shape_breaks[0]
+                        end_break = shape_breaks[-1]
+                        trip['times'] = times[start_break:end_break + 1]
+                        trip['lats'] = all_shape_lats[shape_start:shape_end][start_break:end_break + 1]
+                        trip['lons'] = all_shape_lons[shape_start:shape_end][start_break:end_break + 1]
+                    except:
+                        # In case interpolation fails, use the stop data
+                        pass
             trips.append(trip)
-        return {"trips": trips}
+        return trips
 
+    @cached_query
     def get_stop_count_data(self, start_ut, end_ut):
         """
         Get stop count data.
@@ -409,25 +806,63 @@ class GTFS(object):
             with data types
                 (int, int, float, float, str)
         """
-        # TODO! this function could perhaps be made a single sql query now with the new tables?
-        trips_df = self.get_tripIs_active_in_range(start_ut, end_ut)
-        # stop_I -> count, lat, lon, name
-        stop_counts = Counter()
-
-        # loop over all trips:
-        for row in trips_df.itertuples():
-            # get stop_data and store it:
-            stops_seq = self.get_trip_stop_time_data(row.trip_I, row.day_start_ut)
-            for stop_time_row in stops_seq.itertuples(index=False):
-                if (stop_time_row.dep_time_ut >= start_ut) and (stop_time_row.dep_time_ut <= end_ut):
-                    stop_counts[stop_time_row.stop_I] += 1
-
+        self._materialize_day_trips_for_time_span(start_ut, end_ut)
+        query = "SELECT stop_I, count(*) AS count " \
+                "FROM " + self._get_day_trips_table_name() + " JOIN stop_times USING(trip_I) " \
+                "WHERE end_time_ut > ? AND start_time_ut < ? " \
+                "AND day_start_ut + dep_time_ds >= ? AND day_start_ut + dep_time_ds <= ? " \
+                "GROUP BY stop_I"
+        counts_df = pd.read_sql_query(query, self.conn, params=(start_ut, end_ut, start_ut, end_ut))
+        stop_counts = dict(zip(counts_df['stop_I'].values, counts_df['count'].values))
         all_stop_data = self.stops()
-        counts = [stop_counts[stop_I] for stop_I in all_stop_data["stop_I"].values]
-
+        counts = [int(stop_counts.get(stop_I, 0)) for stop_I in all_stop_data["stop_I"].values]
         all_stop_data.loc[:, "count"] = pd.Series(counts, index=all_stop_data.index)
         return all_stop_data
 
+    def get_stop_count_data_in_time_bins(self, time_bin_edges_ut):
+        """
+        Get stop count data (see get_stop_count_data) for many consecutive time bins at once.
+
+        The stop times are fetched from the database only once for the whole time span.
+
+        Parameters
+        ----------
+        time_bin_edges_ut : list-like of ints
+            increasing edges of the time bins in unixtime,
+            the i:th time bin runs from time_bin_edges_ut[i] to time_bin_edges_ut[i+1]
+
+        Returns
+        -------
+        stop_data_by_bin : list of pandas.DataFrame
+            for each time bin, the result of get_stop_count_data for the bin
+        """
+        edges = numpy.asarray(time_bin_edges_ut, dtype=numpy.int64)
+        assert len(edges) >= 2 and (numpy.diff(edges) > 0).all()
+        self._materialize_day_trips_for_time_span(int(edges[0]), int(edges[-1]))
+        query = "SELECT stop_I, start_time_ut, end_time_ut, day_start_ut + dep_time_ds AS dep_time_ut " \
+                "FROM " + self._get_day_trips_table_name() + " JOIN stop_times USING(trip_I) " \
+                "WHERE end_time_ut > ? AND start_time_ut < ? " \
+                "AND day_start_ut + dep_time_ds >= ? AND day_start_ut + dep_time_ds <= ?"
+        span = (int(edges[0]), int(edges[-1]))
+        stop_times_df = pd.read_sql_query(query, self.conn, params=span + span)
+        dep_times = stop_times_df['dep_time_ut'].values
+        rows, bins = self._get_time_bins(edges, dep_times, dep_times,
+                                         stop_times_df['start_time_ut'].values, stop_times_df['end_time_ut'].values)
+
+        all_stop_data = self.stops()
+        stop_Is = all_stop_data['stop_I'].values
+        order = numpy.argsort(stop_Is)
+        stop_indices = order[numpy.searchsorted(stop_Is, stop_times_df['stop_I'].values[rows], sorter=order)]
+        n_bins = len(edges) - 1
+        counts = numpy.bincount(bins * len(stop_Is) + stop_indices,
+                                minlength=n_bins * len(stop_Is)).reshape(n_bins, len(stop_Is))
+        stop_data_by_bin = []
+        for bin_counts in counts:
+            stop_data = all_stop_data.copy()
+            stop_data.loc[:, "count"] = pd.Series(bin_counts.tolist(), index=stop_data.index)
+            stop_data_by_bin.append(stop_data)
+        return stop_data_by_bin
+
     def get_segment_count_data(self, start, end, use_shapes=True):
         """
         Get segment data including PTN vehicle counts per segment that are
@@ -446,68 +881,172 @@ class GTFS(object):
         -------
         seg_data : list
             each element in the list is a dict containing keys:
-                "trip_I", "lats", "lons", "shape_id", "stop_seqs", "shape_breaks"
+                "lats", "lons", "name", "count"
         """
-        cur = self.conn.cursor()
-        # get all possible trip_ids that take place between start and end
-        trips_df = self.get_tripIs_active_in_range(start, end)
-        # stop_I -> count, lat, lon, name
-        segment_counts = Counter()
-        seg_to_info = {}
-        # tripI_to_seq = "inverted segToShapeData"
-        tripI_to_seq = defaultdict(list)
-
-        # loop over all trips:
-        for row in trips_df.itertuples():
-            # get stop_data and store it:
-            stops_df = self.get_trip_stop_time_data(row.trip_I, row.day_start_ut)
-            for i in range(len(stops_df) - 1):
-                (stop_I, dep_time_ut, s_lat, s_lon, s_seq, shape_break) = stops_df.iloc[i]
-                (stop_I_n, dep_time_ut_n, s_lat_n, s_lon_n, s_seq_n, shape_break_n) = stops_df.iloc[i + 1]
-                # test if _contained_ in the interval
-                # overlap would read:
-                #   (dep_time_ut <= end) and (start <= dep_time_ut_n)
-                if (dep_time_ut >= start) and (dep_time_ut_n <= end):
-                    seg = (stop_I, stop_I_n)
-                    segment_counts[seg] += 1
-                    if seg not in seg_to_info:
-                        seg_to_info[seg] = {
-                            u"trip_I": row.trip_I,
-                            u"lats": [s_lat, s_lat_n],
-                            u"lons": [s_lon, s_lon_n],
-                            u"shape_id": row.shape_id,
-                            u"stop_seqs": [s_seq, s_seq_n],
-                            u"shape_breaks": [shape_break, shape_break_n]
-                        }
-                        tripI_to_seq[row.trip_I].append(seg)
-
-        stop_names = {}
-        for (stop_I, stop_J) in segment_counts.keys():
-            for s in [stop_I, stop_J]:
-                if s not in stop_names:
-                    stop_names[s] = self.stop(s)[u'name'].values[0]
+        segments_df = self._get_consecutive_stop_pairs(start, end)
+        return self._segment_count_data(segments_df, use_shapes)
+
+    def get_segment_count_data_in_time_bins(self, time_bin_edges_ut, use_shapes=True):
+        """
+        Get segment count data (see get_segment_count_data) for many consecutive time bins at once.
+
+        The consecutive stop pairs are fetched from the database only once for the whole time span.
+
+        Parameters
+        ----------
+        time_bin_edges_ut : list-like of ints
+            increasing edges of the time bins in unixtime,
+            the i:th time bin runs from time_bin_edges_ut[i] to time_bin_edges_ut[i+1]
+        use_shapes : bool, optional
+            whether to include shapes (if available)
+
+        Returns
+        -------
+        seg_data_by_bin : list
+            for each time bin, the result of get_segment_count_data for the bin
+        """
+        edges = numpy.asarray(time_bin_edges_ut, dtype=numpy.int64)
+        assert len(edges) >= 2 and (numpy.diff(edges) > 0).all()
+        segments_df = self._get_consecutive_stop_pairs(int(edges[0]), int(edges[-1]))
+        rows, bins = self._get_time_bins(edges, segments_df['dep_time_ut'].values,
+                                         segments_df['next_dep_time_ut'].values,
+                                         segments_df['start_time_ut'].values, segments_df['end_time_ut'].values)
+        order = numpy.lexsort((rows, bins))
+        rows = rows[order]
+        bin_starts = numpy.searchsorted(bins[order], numpy.arange(len(edges)))
+        return [self._segment_count_data(segments_df.iloc[rows[bin_start:bin_end]], use_shapes)
+                for bin_start, bin_end in zip(bin_starts[:-1], bin_starts[1:])]
+
+    def _get_consecutive_stop_pairs(self, start, end):
+        """
+        Consecutive stop pairs of trips, fully contained within the interval (start, end).
+
+        Returns
+        -------
+        segments_df : pandas.DataFrame
+            ordered as the trips of get_tripIs_active_in_range, and by stop sequence within each trip
+        """
+        self._materialize_day_trips_for_time_span(start, end)
+        day_trips_table = self._get_day_trips_table_name()
+        query = "SELECT " + day_trips_table + ".trip_I AS trip_I, day_start_ut, start_time_ut, end_time_ut, " \
+                "first.seq AS seq, first.stop_I AS from_stop_I, second.stop_I AS to_stop_I, " \
+                "day_start_ut + first.dep_time_ds AS dep_time_ut, " \
+                "day_start_ut + second.dep_time_ds AS next_dep_time_ut, " \
+                "first.shape_break AS from_shape_break, second.shape_break AS to_shape_break " \
+                "FROM " + day_trips_table + " " \
+                "JOIN stop_times AS first ON (first.trip_I = " + day_trips_table + ".trip_I) " \
+                "JOIN stop_times AS second ON (second.trip_I = first.trip_I AND second.seq = first.seq + 1) " \
+                "WHERE end_time_ut > ? AND start_time_ut < ? " \
+                "AND day_start_ut + first.dep_time_ds >= ? AND day_start_ut + second.dep_time_ds <= ?"
+        segments_df = pd.read_sql_query(query, self.conn, params=(start, end, start, end))
+        trips_df = self.get_tripIs_active_in_range(start, end)[['trip_I', 'day_start_ut']]
+        trips_df['trip_order'] = numpy.arange(len(trips_df))
+        segments_df = segments_df.merge(trips_df, on=['trip_I', 'day_start_ut'], how='left')
+        return segments_df.sort_values(['trip_order', 'seq'], kind='mergesort').reset_index(drop=True)
+
+    @staticmethod
+    def _get_time_bins(edges, first_times, last_times, trip_start_times, trip_end_times):
+        """
+        Assign events to the time bins that fully contain them, and during which the event's trip is active.
+
+        An event lying exactly on a bin edge belongs to both adjacent bins.
+
+        Returns
+        -------
+        rows : numpy.array
+            indices of the events
+        bins : numpy.array
+            the corresponding time bins
+        """
+        bins = numpy.searchsorted(edges, first_times, side="right") - 1
+        # events starting exactly at an edge also belong to the preceding bin
+        on_edge = numpy.nonzero(numpy.searchsorted(edges, first_times, side="left") - 1 != bins)[0]
+        rows = numpy.concatenate((numpy.arange(len(first_times)), on_edge))
+        bins = numpy.concatenate((bins, bins[on_edge] - 1))
+        valid = (bins >= 0) & (bins < len(edges) - 1)
+        rows, bins = rows[valid], bins[valid]
+        contained = ((edges[bins] <= first_times[rows]) & (last_times[rows] <= edges[bins + 1]) &
+                     (trip_end_times[rows] > edges[bins]) & (trip_start_times[rows] < edges[bins + 1]))
+        return rows[contained], bins[contained]
+
+    def _segment_count_data(self, segments_df, use_shapes):
+        """
+        Count the vehicles of each stop pair in segments_df (see get_segment_count_data).
+        The geometry of each segment is taken from the first trip passing it.
+        """
+        stop_pair_groups = segments_df.groupby(['from_stop_I', 'to_stop_I'], sort=False)
+        counts = stop_pair_groups.size().tolist()
+        first_segments = segments_df.loc[stop_pair_groups.head(1).index]
+        stops_df = self.stops()
+        stop_names = dict(zip(stops_df['stop_I'].values, stops_df['name'].values))
+        stop_lats = dict(zip(stops_df['stop_I'].values, stops_df['lat'].values))
+        stop_lons = dict(zip(stops_df['stop_I'].values, stops_df['lon'].values))
+
+        from_breaks = first_segments['from_shape_break'].values
+        to_breaks = first_segments['to_shape_break'].values
+        # (as before, a shape break of 0 is not taken into account)
+        with_shape = (first_segments['from_shape_break'].fillna(0).values != 0) & \
+                     (first_segments['to_shape_break'].fillna(0).values != 0)
+        shape_points = [None] * len(first_segments)
+        if use_shapes and with_shape.any():
+            points = self._get_shape_points_between_breaks(first_segments['trip_I'].values[with_shape],
+                                                           from_breaks[with_shape], to_breaks[with_shape])
+            for i, segment_points in zip(numpy.nonzero(with_shape)[0], points):
+                shape_points[i] = segment_points
 
         seg_data = []
-        for seg, count in segment_counts.items():
-            segInfo = seg_to_info[seg]
-            shape_breaks = segInfo[u"shape_breaks"]
+        for from_stop_I, to_stop_I, count, points in zip(first_segments['from_stop_I'].values,
+                                                         first_segments['to_stop_I'].values,
+                                                         counts, shape_points):
+            lats = [stop_lats[from_stop_I], stop_lats[to_stop_I]]
+            lons = [stop_lons[from_stop_I], stop_lons[to_stop_I]]
             seg_el = {}
-            if use_shapes and shape_breaks and shape_breaks[0] and shape_breaks[1]:
-                shape = shapes.get_shape_between_stops(
-                    cur,
-                    segInfo[u'trip_I'],
-                    shape_breaks=shape_breaks
-                )
-                seg_el[u'lats'] = segInfo[u'lats'][:1] + shape[u'lat'] + segInfo[u'lats'][1:]
-                seg_el[u'lons'] = segInfo[u'lons'][:1] + shape[u'lon'] + segInfo[u'lons'][1:]
+            if points is not None:
+                seg_el[u'lats'] = lats[:1] + points[0] + lats[1:]
+                seg_el[u'lons'] = lons[:1] + points[1] + lons[1:]
             else:
-                seg_el[u'lats'] = segInfo[u'lats']
-                seg_el[u'lons'] = segInfo[u'lons']
-            seg_el[u'name'] = stop_names[seg[0]] + u"-" + stop_names[seg[1]]
+                seg_el[u'lats'] = lats
+                seg_el[u'lons'] = lons
+            seg_el[u'name'] = stop_names[from_stop_I] + u"-" + stop_names[to_stop_I]
             seg_el[u'count'] = count
             seg_data.append(seg_el)
         return seg_data
 
+    def _get_shape_points_between_breaks(self, trip_Is, from_breaks, to_breaks):
+        """
+        Bulk version of shapes.get_shape_between_stops.
+
+        Returns
+        -------
+        points : list
+            for each trip_I, from_break, to_break, a tuple (lats, lons) of the trip's shape points
+            with seq between from_break and to_break
+        """
+        trip_I_list = ",".join(str(int(trip_I)) for trip_I in numpy.unique(trip_Is))
+        trips_df = pd.read_sql_query("SELECT trip_I, shape_id FROM trips "
+                                     "WHERE trip_I IN (" + trip_I_list + ") AND shape_id IS NOT NULL", self.conn)
+        shapes_df = pd.read_sql_query("SELECT shape_id, seq, lat, lon FROM shapes "
+                                      "WHERE shape_id IN (SELECT shape_id FROM trips "
+                                      "WHERE trip_I IN (" + trip_I_list + ")) ORDER BY shape_id, seq", self.conn)
+        from_breaks = numpy.asarray(from_breaks, dtype=numpy.int64)
+        to_breaks = numpy.asarray(to_breaks, dtype=numpy.int64)
+        if len(shapes_df) == 0:
+            return [([], []) for _ in trip_Is]
+        # shapes are ordered by shape_id, so the codes are non-decreasing
+        shape_codes, shape_ids = pd.factorize(shapes_df['shape_id'])
+        shape_seqs = shapes_df['seq'].values.astype(numpy.int64)
+        min_seq = min(shape_seqs.min(), from_breaks.min(), to_breaks.min())
+        stride = max(shape_seqs.max(), from_breaks.max(), to_breaks.max()) - min_seq + 1
+        keys = shape_codes * stride + (shape_seqs - min_seq)
+        trip_shape_codes = dict(zip(trips_df['trip_I'].values, shape_ids.get_indexer(trips_df['shape_id'])))
+        codes = numpy.array([trip_shape_codes.get(trip_I, -1) for trip_I in trip_Is], dtype=numpy.int64)
+        starts = numpy.searchsorted(keys, codes * stride + (from_breaks - min_seq), side="left")
+        ends = numpy.searchsorted(keys, codes * stride + (to_breaks - min_seq), side="right")
+        ends[codes < 0] = starts[codes < 0]
+        lats = shapes_df['lat'].values.tolist()
+        lons = shapes_df['lon'].values.tolist()
+        return [(lats[start:end], lons[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
+
     def get_all_route_shapes(self, use_shapes=True):
         """
         Get the shapes of all routes.
@@ -525,11 +1064,25 @@ class GTFS(object):
             with types
             list, list, str, list, list
         """
+        return list(self.generate_route_shapes(use_shapes=use_shapes))
+
+    def generate_route_shapes(self, use_shapes=True):
+        """
+        Generate the shapes of all routes one route at a time.
+        Only the points of the route being yielded are fetched from the database.
+
+        Parameters
+        ----------
+        use_shapes : bool, optional
+            by default True (i.e. use shapes as the name of the function indicates)
+            if False (fall back to lats and longitudes)
+
+        Yields
+        ------
+        routeShape: dict
+            see get_all_route_shapes
+        """
         cur = self.conn.cursor()
-        # all shape_id:s corresponding to a route_I:
-        # query = "SELECT DISTINCT name, shape_id, trips.route_I, route_type
-        #          FROM trips LEFT JOIN routes USING(route_I)"
-        # data1 = pd.read_sql_query(query, self.conn)
         # one (arbitrary) shape_id per route_I ("one direction") -> less than half of the routes
         query = "SELECT routes.name as name, shape_id, route_I, trip_I, routes.type, " \
                 "        agency_id, agencies.name as agency_name, max(end_time_ds-start_time_ds) as trip_duration " \
@@ -539,25 +1092,22 @@ class GTFS(object):
                 "LEFT JOIN agencies " \
                 "USING(agency_I) " \
                 "GROUP BY routes.route_I"
-        data = pd.read_sql_query(query, self.conn)
-
-        routeShapes = []
-        for i, row in enumerate(data.itertuples()):
-            datum = {"name": str(row.name), "type": int(row.type), "route_I": row.route_I, "agency": str(row.agency_id), "agency_name": str(row.agency_name)}
+        route_cursor = self.conn.execute(query)
+        for name, shape_id, route_I, trip_I, route_type, agency_id, agency_name, _ in route_cursor:
+            datum = {"name": str(name), "type": int(route_type), "route_I": route_I, "agency": str(agency_id),
+                     "agency_name": str(agency_name)}
             # this function should be made also non-shape friendly (at this point)
-            if use_shapes and row.shape_id:
-                shape = shapes.get_shape_points2(cur, row.shape_id)
-                lats = shape['lats']
-                lons = shape['lons']
+            if use_shapes and shape_id:
+                cur.execute("SELECT lat, lon FROM shapes WHERE shape_id=? ORDER BY seq", (shape_id,))
             else:
-                stop_shape = self.get_trip_stop_coordinates(row.trip_I)
-                lats = list(stop_shape['lat'])
-                lons = list(stop_shape['lon'])
-            datum['lats'] = [float(lat) for lat in lats]
-            datum['lons'] = [float(lon) for lon in lons]
-            routeShapes.append(datum)
-        return routeShapes
-
+                cur.execute("SELECT lat, lon FROM stop_times JOIN stops USING(stop_I) "
+                            "WHERE trip_I=? ORDER BY stop_times.seq", (trip_I,))
+            points = cur.fetchall()
+            datum['lats'] = [float(lat) for lat, _ in points]
+            datum['lons'] = [float(lon) for _, lon in points]
+            yield datum
+
+    @cached_query
     def get_tripIs_active_in_range(self, start, end):
         """
         Obtain from the (standard) GTFS database, list of trip_IDs (and other trip_related info)
@@ -576,6 +1126,7 @@ class GTFS(object):
         active_trips : pandas.DataFrame with columns
             trip_I, day_start_ut, start_time_ut, end_time_ut, shape_id
         """
+        self._materialize_day_trips_for_time_span(start, end)
         to_select = "trip_I, day_start_ut, start_time_ut, end_time_ut, shape_id "
         query = "SELECT " + to_select + \
                 "FROM day_trips " \
@@ -583,6 +1134,7 @@ class GTFS(object):
                 "(end_time_ut > {start_ut} AND start_time_ut < {end_ut})".format(start_ut=start, end_ut=end)
         return pd.read_sql_query(query, self.conn)
 
+    @cached_query
     def get_trip_counts_per_day(self):
         """
         Get trip counts per day between the start and end day of the feed.
@@ -594,7 +1146,7 @@ class GTFS(object):
                 date_str are strings
                 trip_counts are ints
         """
-        query = "SELECT date, count(*) AS number_of_trips FROM day_trips GROUP BY date"
+        query = "SELECT date, count(*) AS number_of_trips FROM days JOIN trips USING(trip_I) GROUP BY date"
         # this yields the actual data
         trip_counts_per_day = pd.read_sql_query(query, self.conn, index_col="date")
         # the rest is simply code for filling out "gaps" in the time span
@@ -784,34 +1336,46 @@ class GTFS(object):
         stop_I: int
             the index of the stop in the database
         """
-        cur = self.conn.cursor()
-        min_dist = float("inf")
-        min_stop_I = None
-        rows = cur.execute("SELECT stop_I, lat, lon FROM stops")
-        for stop_I, lat_s, lon_s in rows:
-            dist_now = wgs84_distance(lat, lon, lat_s, lon_s)
-            if dist_now < min_dist:
-                min_dist = dist_now
-                min_stop_I = stop_I
-        return min_stop_I
+        stops = self._get_stop_coordinates_table()
+        if len(stops) == 0:
+            return None
+        distances = wgs84_distances_from_point(lat, lon, stops['lat'].values, stops['lon'].values)
+        return int(stops.index[int(numpy.argmin(distances))])
 
+    @cached_query
     def get_stop_coordinates(self, stop_I):
         cur = self.conn.cursor()
         results = cur.execute("SELECT lat, lon FROM stops WHERE stop_I={stop_I}".format(stop_I=stop_I))
         lat, lon = results.fetchone()
         return lat, lon
 
+    def get_coordinates_of_stops(self, stop_Is):
+        """
+        Bulk version of get_stop_coordinates.
+
+        Parameters
+        ----------
+        stop_Is: list-like of ints
+
+        Returns
+        -------
+        lats: numpy.array of floats
+        lons: numpy.array of floats
+            nan for stop_Is not in the database
+        """
+        coordinates = self._get_stop_coordinates_table().reindex(numpy.asarray(stop_Is, dtype=numpy.int64))
+        return coordinates['lat'].values, coordinates['lon'].values
+
+    @cached_query
+    def _get_stop_coordinates_table(self):
+        return pd.read_sql_query("SELECT stop_I, lat, lon FROM stops", self.conn, index_col="stop_I")
+
     def get_bounding_box_by_stops(self, stop_Is, buffer_ratio=None):
-        lats = []
-        lons = []
-        for stop_I in stop_Is:
-            lat, lon = self.get_stop_coordinates(stop_I)
-            lats.append(lat)
-            lons.append(lon)
-        min_lat = min(lats)
-        max_lat = max(lats)
-        min_lon = min(lons)
-        max_lon = max(lons)
+        lats, lons = self.get_coordinates_of_stops(list(stop_Is))
+        min_lat = float(lats.min())
+        max_lat = float(lats.max())
+        min_lon = float(lons.min())
+        max_lon = float(lons.max())
         lon_diff = 0
         lat_diff = 0
 
@@ -826,6 +1390,7 @@ class GTFS(object):
                 "lon_max": max_lon+lon_diff}
 
 
+    @cached_query
     def get_route_name_and_type_of_tripI(self, trip_I):
         """
         Get route short name and type
@@ -848,6 +1413,35 @@ class GTFS(object):
         name, rtype = results.fetchone()
         return u"%s" % str(name), int(rtype)
 
+    def get_route_names_and_types_of_tripIs(self, trip_Is):
+        """
+        Bulk version of get_route_name_and_type_of_tripI.
+
+        Parameters
+        ----------
+        trip_Is: list-like of ints
+
+        Returns
+        -------
+        names_and_types: pandas.DataFrame
+            with columns trip_I, name and type, one row for each trip_I (in the given order)
+        """
+        routes_of_trips = self._get_route_names_and_types_of_all_trips()
+        names_and_types = routes_of_trips.reindex(numpy.asarray(trip_Is, dtype=numpy.int64))
+        if names_and_types['type'].isnull().any():
+            missing = names_and_types.index[names_and_types['type'].isnull()].tolist()
+            raise ValueError("Unknown trip_Is: " + str(missing[:10]))
+        names_and_types['type'] = names_and_types['type'].astype(int)
+        return names_and_types.reset_index()
+
+    @cached_query
+    def _get_route_names_and_types_of_all_trips(self):
+        df = pd.read_sql_query("SELECT trip_I, name, type FROM routes JOIN trips USING(route_I)", self.conn,
+                               index_col="trip_I")
+        df['name'] = [u"%s" % str(name) for name in df['name']]
+        return df
+
+    @cached_query
     def get_route_name_and_type(self, route_I):
         """
         Get route short name and type
@@ -869,6 +1463,7 @@ class GTFS(object):
         name, rtype = results.fetchone()
         return name, int(rtype)
 
+    @cached_query
     def get_trip_stop_coordinates(self, trip_I):
         """
         Get coordinates for a given trip_I
@@ -1061,20 +1656,21 @@ class GTFS(object):
         Running it twice on the "move clocks backwards" day will result in
         being one day too early.
 
+        The local date is resolved with the feed's precomputed calendar (see get_local_calendar),
+        so the process-global time zone is not modified.
+
         Parameters
         ----------
-        ut: int
+        ut: int | list-like of ints
             Unixtime
 
         Returns
         -------
-        ut: int
+        ut: float | numpy.array of floats
             Unixtime corresponding to start of day
         """
-        # set timezone to the one of gtfs
-        self.set_current_process_time_zone()
-        # last -1 equals to 'not known' for DST (automatically deduced then)
-        return time.mktime(time.localtime(ut)[:3] + (12, 00, 0, 0, 0, -1)) - 43200
+        day_start_uts = self.get_local_calendar().day_start_uts(ut).astype(float)
+        return float(day_start_uts) if day_start_uts.ndim == 0 else day_start_uts
 
     def increment_day_start_ut(self, day_start_ut, n_days=1):
         """Increment the GTFS-definition of "day start".
@@ -1088,12 +1684,10 @@ class GTFS(object):
         n_days: int
             number of days to increment
         """
-        self.set_current_process_time_zone()
-        day0 = time.localtime(day_start_ut + 43200)  # time of noon
-        dayN = time.mktime(day0[:2] +  # YYYY, MM
-                           (day0[2] + n_days,) +  # DD
-                           (12, 00, 0, 0, 0, -1)) - 43200  # HHMM, etc.  Minus 12 hours.
-        return dayN
+        local_calendar = self.get_local_calendar()
+        day_numbers = local_calendar.local_day_numbers(numpy.asarray(day_start_ut) + 43200)  # day of noon
+        day_start_uts = local_calendar.day_start_uts_of_days(day_numbers + n_days).astype(float)
+        return float(day_start_uts) if day_start_uts.ndim == 0 else day_start_uts
 
     def _get_possible_day_starts(self, start_ut, end_ut, max_time_overnight=None):
         """
@@ -1126,46 +1720,25 @@ class GTFS(object):
             # 7 hours:
             max_time_overnight = 7 * 60 * 60
 
-        # sanity checks for the timezone parameter
-        # assert timezone < 14
-        # assert timezone > -14
-        # tz_seconds = int(timezone*3600)
         assert start_ut < end_ut
-        start_day_ut = self.day_start_ut(start_ut)
-        # start_day_ds = int(start_ut+tz_seconds) % seconds_in_a_day  #??? needed?
-        start_day_ds = start_ut - start_day_ut
-        # assert (start_day_ut+tz_seconds) % seconds_in_a_day == 0
-        end_day_ut = self.day_start_ut(end_ut)
-        # end_day_ds = int(end_ut+tz_seconds) % seconds_in_a_day    #??? needed?
-        # end_day_ds = end_ut - end_day_ut
-        # assert (end_day_ut+tz_seconds) % seconds_in_a_day == 0
-
+        local_calendar = self.get_local_calendar()
+        start_day, end_day = local_calendar.local_day_numbers([start_ut, end_ut])
+        start_day_ds = start_ut - local_calendar.day_start_uts_of_days(start_day)
         # If we are early enough in a day that we might have trips from
         # the previous day still running, decrement the start day.
         if start_day_ds < max_time_overnight:
-            start_day_ut = self.increment_day_start_ut(start_day_ut, n_days=-1)
-
-        # day_start_times_ut = range(start_day_ut, end_day_ut+seconds_in_a_day, seconds_in_a_day)
-
-        # Create a list of all possible day start times.  This is roughly
-        # range(day_start_ut, day_end_ut+1day, 1day).
-        day_start_times_ut = [start_day_ut]
-        while day_start_times_ut[-1] < end_day_ut:
-            day_start_times_ut.append(self.increment_day_start_ut(day_start_times_ut[-1]))
-
-        start_times_ds = []
-        end_times_ds = []
-        # For every possible day start:
-        for dsut in day_start_times_ut:
-            # start day_seconds starts at either zero, or time - daystart
-            day_start_ut = max(0, start_ut - dsut)
-            start_times_ds.append(day_start_ut)
-            # end day_seconds is time-day_start
-            day_end_ut = end_ut - dsut
-            end_times_ds.append(day_end_ut)
+            start_day -= 1
+
+        # All possible day start times, i.e. roughly range(day_start_ut, day_end_ut+1day, 1day).
+        day_start_times_ut = local_calendar.day_start_uts_of_days(numpy.arange(start_day, end_day + 1)).astype(float)
+        # start day_seconds starts at either zero, or time - daystart
+        start_times_ds = numpy.maximum(0, start_ut - day_start_times_ut)
+        # end day_seconds is time-day_start
+        end_times_ds = end_ut - day_start_times_ut
         # Return three tuples which can be zip:ped together.
-        return day_start_times_ut, start_times_ds, end_times_ds
+        return day_start_times_ut.tolist(), start_times_ds.tolist(), end_times_ds.tolist()
 
+    @cached_query
     def get_tripIs_within_range_by_dsut(self,
                                         start_time_ut,
                                         end_time_ut):
@@ -1187,34 +1760,29 @@ class GTFS(object):
         trip_I_dict: dict
             keys: day_start_times to list of integers (trip_Is)
         """
-        cur = self.conn.cursor()
         assert start_time_ut <= end_time_ut
-        dst_ut, st_ds, et_ds = \
-            self._get_possible_day_starts(start_time_ut, end_time_ut, 7)
-        # noinspection PyTypeChecker
-        assert len(dst_ut) >= 0
+        dst_ut, _, _ = self._get_possible_day_starts(start_time_ut, end_time_ut, 7)
+        query = """
+                    SELECT DISTINCT day_start_ut, trip_I
+                    FROM days
+                        JOIN trips
+                        USING(trip_I)
+                    WHERE
+                        (days.day_start_ut >= ?) AND (days.day_start_ut <= ?)
+                        AND (
+                                (trips.start_time_ds <= ? - days.day_start_ut)
+                                AND
+                                (trips.end_time_ds >= max(0, ? - days.day_start_ut))
+                            )
+                    ORDER BY day_start_ut
+                    """
+        params = (dst_ut[0], dst_ut[-1], end_time_ut, start_time_ut)
         trip_I_dict = {}
-        for day_start_ut, start_ds, end_ds in \
-                zip(dst_ut, st_ds, et_ds):
-            query = """
-                        SELECT distinct(trip_I)
-                        FROM days
-                            JOIN trips
-                            USING(trip_I)
-                        WHERE
-                            (days.day_start_ut == ?)
-                            AND (
-                                    (trips.start_time_ds <= ?)
-                                    AND
-                                    (trips.end_time_ds >= ?)
-                                )
-                        """
-            params = (day_start_ut, end_ds, start_ds)
-            trip_Is = [el[0] for el in cur.execute(query, params)]
-            if len(trip_Is) > 0:
-                trip_I_dict[day_start_ut] = trip_Is
+        for day_start_ut, trip_I in self.conn.execute(query, params):
+            trip_I_dict.setdefault(float(day_start_ut), []).append(trip_I)
         return trip_I_dict
 
+    @cached_query
     def stops(self):
         """
         Get all stop data as a pandas DataFrame
@@ -1225,6 +1793,7 @@ class GTFS(object):
         """
         return self.get_table("stops")
 
+    @cached_query
     def stop(self, stop_I):
         """
         Get all stop data as a pandas DataFrame for all stops, or an individual stop'
@@ -1258,6 +1827,7 @@ class GTFS(object):
         modes = list(pd.read_sql_query("SELECT distinct(type) from routes;", self.conn).values.flatten())
         return modes
 
+    @cached_query
     def get_stops_for_route_type(self, route_type):
         """
         Parameters
@@ -1342,33 +1912,10 @@ class GTFS(object):
         --------
         get_transit_events_in_time_span : an older version of the same thing
         """
-        table_name = self._get_day_trips_table_name()
-        event_query = "SELECT stop_I, seq, trip_I, route_I, routes.route_id AS route_id, routes.type AS route_type, " \
-                          "shape_id, day_start_ut+dep_time_ds AS dep_time_ut, day_start_ut+arr_time_ds AS arr_time_ut " \
-                      "FROM " + table_name + " " \
-                      "JOIN trips USING(trip_I) " \
-                      "JOIN routes USING(route_I) " \
-                      "JOIN stop_times USING(trip_I)"
-
-        where_clauses = []
-        if end_time_ut:
-            where_clauses.append(table_name + ".start_time_ut< {end_time_ut}".format(end_time_ut=end_time_ut))
-            where_clauses.append("dep_time_ut  <={end_time_ut}".format(end_time_ut=end_time_ut))
-        if start_time_ut:
-            where_clauses.append(table_name + ".end_time_ut  > {start_time_ut}".format(start_time_ut=start_time_ut))
-            where_clauses.append("arr_time_ut  >={start_time_ut}".format(start_time_ut=start_time_ut))
-        if route_type is not None:
-            assert route_type in ALL_ROUTE_TYPES
-            where_clauses.append("routes.type={route_type}".format(route_type=route_type))
-        if len(where_clauses) > 0:
-            event_query += " WHERE "
-            for i, where_clause in enumerate(where_clauses):
-                if i is not 0:
-                    event_query += " AND "
-                event_query += where_clause
-        # ordering is required for later stages
-        event_query += " ORDER BY trip_I, day_start_ut+dep_time_ds;"
-        events_result = pd.read_sql_query(event_query, self.conn)
+        self._materialize_day_trips_for_time_span(start_time_ut, end_time_ut)
+        events_result = self._get_transit_event_rows_from_columnar_cache(start_time_ut, end_time_ut, route_type)
+        if events_result is None:
+            events_result = self._get_transit_event_rows(start_time_ut, end_time_ut, route_type)
         # 'filter' results so that only real "events" are taken into account
         from_indices = numpy.nonzero(
             (events_result['trip_I'][:-1].values == events_result['trip_I'][1:].values) *
@@ -1399,44 +1946,102 @@ class GTFS(object):
         df = pd.DataFrame.from_records(data_tuples, columns=columns)
         return df
 
+    def _get_transit_event_rows(self, start_time_ut, end_time_ut, route_type):
+        table_name = self._get_day_trips_table_name()
+        event_query = "SELECT stop_I, seq, trip_I, route_I, routes.route_id AS route_id, routes.type AS route_type, " \
+                          "shape_id, day_start_ut+dep_time_ds AS dep_time_ut, day_start_ut+arr_time_ds AS arr_time_ut " \
+                      "FROM " + table_name + " " \
+                      "JOIN trips USING(trip_I) " \
+                      "JOIN routes USING(route_I) " \
+                      "JOIN stop_times USING(trip_I)"
+
+        where_clauses = []
+        if end_time_ut:
+            where_clauses.append(table_name + ".start_time_ut< {end_time_ut}".format(end_time_ut=end_time_ut))
+            where_clauses.append("dep_time_ut  <={end_time_ut}".format(end_time_ut=end_time_ut))
+        if start_time_ut:
+            where_clauses.append(table_name + ".end_time_ut  > {start_time_ut}".format(start_time_ut=start_time_ut))
+            where_clauses.append("arr_time_ut  >={start_time_ut}".format(start_time_ut=start_time_ut))
+        if route_type is not None:
+            assert route_type in ALL_ROUTE_TYPES
+            where_clauses.append("routes.type={route_type}".format(route_type=route_type))
+        if len(where_clauses) > 0:
+            event_query += " WHERE "
+            for i, where_clause in enumerate(where_clauses):
+                if i is not 0:
+                    event_query += " AND "
+                event_query += where_clause
+        # ordering is required for later stages
+        event_query += " ORDER BY trip_I, day_start_ut+dep_time_ds;"
+        events_result = pd.read_sql_query(event_query, self.conn)
+        return events_result
+
+    def _get_transit_event_rows_from_columnar_cache(self, start_time_ut, end_time_ut, route_type):
+        """
+        The same rows as _get_transit_event_rows, computed from the columnar cache (if available).
+        """
+        day_trips = self._get_cached_columns(self._get_day_trips_table_name(),
+                                             ["trip_I", "day_start_ut", "start_time_ut", "end_time_ut"])
+        trips = self._get_cached_columns("trips", ["trip_I", "route_I", "shape_id"])
+        stop_times = self._get_cached_columns("stop_times", ["stop_I", "seq", "trip_I", "dep_time_ds", "arr_time_ds"])
+        if day_trips is None or trips is None or stop_times is None:
+            return None
+        day_trips = pd.DataFrame(day_trips)
+        if end_time_ut:
+            day_trips = day_trips[day_trips['start_time_ut'].values < end_time_ut]
+        if start_time_ut:
+            day_trips = day_trips[day_trips['end_time_ut'].values > start_time_ut]
+        routes = pd.read_sql_query("SELECT route_I, route_id, type AS route_type FROM routes", self.conn)
+        if route_type is not None:
+            assert route_type in ALL_ROUTE_TYPES
+            routes = routes[routes['route_type'] == route_type]
+        trips = pd.DataFrame(trips).merge(routes, on="route_I")
+        day_trips = day_trips[['trip_I', 'day_start_ut']].merge(trips, on="trip_I")
+
+        events_result = pd.DataFrame(stop_times).merge(day_trips, on="trip_I")
+        events_result['dep_time_ut'] = events_result['day_start_ut'].values + events_result['dep_time_ds'].values
+        events_result['arr_time_ut'] = events_result['day_start_ut'].values + events_result['arr_time_ds'].values
+        valid = numpy.ones(len(events_result), dtype=bool)
+        if end_time_ut:
+            valid &= events_result['dep_time_ut'].values <= end_time_ut
+        if start_time_ut:
+            valid &= events_result['arr_time_ut'].values >= start_time_ut
+        events_result = events_result[valid]
+        # ordering is required for later stages
+        events_result = events_result.sort_values(["trip_I", "dep_time_ut", "seq"], kind="mergesort")
+        columns = ["stop_I", "seq", "trip_I", "route_I", "route_id", "route_type", "shape_id",
+                   "dep_time_ut", "arr_time_ut"]
+        rows = {}
+        for column in columns:
+            values = events_result[column].values
+            if values.dtype.kind not in "biuf":
+                # text columns as read from the database: objects, with None for NULL values
+                values = numpy.array(values, dtype=object)
+                values[pd.isnull(values)] = None
+            rows[column] = values
+        return pd.DataFrame(rows, columns=columns)
+
     def get_route_difference_with_other_db(self, other_gtfs, start_time, end_time, uniqueness_threshold=None, uniqueness_ratio=None):
         """
         Compares the routes based on stops in the schedule with the routes in another db and returns the ones without match.
-        Uniqueness thresholds or ratio can be used to allow small differences
-        :param uniqueness_threshold:
-        :param uniqueness_ratio:
+        Uniqueness thresholds or ratio can be used to allow small differences, otherwise the sets of stops should be equal.
+        The routes are compared using hashing and an index from stops to routes, instead of comparing all route pairs.
+        :param uniqueness_threshold: maximum number of stops by which matching routes can differ
+        :param uniqueness_ratio: minimum ratio of common stops (out of all stops of the two routes) for matching routes
         :return:
         """
         from gtfspy.stats import frequencies_by_generated_route
 
         this_df = frequencies_by_generated_route(self, start_time, end_time)
         other_df = frequencies_by_generated_route(other_gtfs, start_time, end_time)
-        this_routes = {x: set(x.split(',')) for x in this_df["route"]}
-        other_routes = {x: set(x.split(',')) for x in other_df["route"]}
-        # this_df["route_set"] = this_df.apply(lambda x: set(x.route.split(',')), axis=1)
-        # other_df["route_set"] = other_df.apply(lambda x: set(x.route.split(',')), axis=1)
-
-        this_uniques = list(this_routes.keys())
-        other_uniques = list(other_routes.keys())
-        print("initial routes A:", len(this_uniques))
-        print("initial routes B:", len(other_uniques))
-        for i_key, i in this_routes.items():
-            for j_key, j in other_routes.items():
-                union = i | j
-                intersection = i & j
-                symmetric_difference = i ^ j
-                if uniqueness_ratio:
-                    if len(intersection)/len(union) >= uniqueness_ratio:
-                        try:
-                            this_uniques.remove(i_key)
-                            this_df = this_df[this_df["route"] != i_key]
-                        except ValueError:
-                            pass
-                        try:
-                            other_uniques.remove(j_key)
-                            other_df = other_df[other_df["route"] != j_key]
-                        except ValueError:
-                            pass
+        this_routes = {x: frozenset(x.split(',')) for x in this_df["route"]}
+        other_routes = {x: frozenset(x.split(',')) for x in other_df["route"]}
+        print("initial routes A:", len(this_routes))
+        print("initial routes B:", len(other_routes))
+        this_matched, other_matched = _match_stop_sets(this_routes, other_routes, uniqueness_threshold,
+                                                       uniqueness_ratio)
+        this_df = this_df[~this_df["route"].isin(this_matched)]
+        other_df = other_df[~other_df["route"].isin(other_matched)]
 
         print("unique routes A", len(this_df))
         print("unique routes B", len(other_df))
@@ -1446,25 +2051,34 @@ class GTFS(object):
 
 
     def get_section_difference_with_other_db(self, other_conn, start_time, end_time):
-        query = """SELECT from_stop_I, to_stop_I, sum(n_trips) AS n_trips, count(*) AS n_routes,
-                    group_concat(route_id) AS all_routes FROM
-                    (SELECT route_id, from_stop_I, to_stop_I, count(*) AS n_trips FROM
-                    (SELECT stop_I AS from_stop_I, seq, trip_I FROM stop_times
-                    WHERE dep_time_ds >= %s) t1,
-                    (SELECT stop_I AS to_stop_I, seq, trip_I  FROM stop_times
-                    WHERE arr_time_ds <= %s) t2,
-                    trips,
-                    routes
-                    WHERE t1.seq +1 = t2.seq AND t1.trip_I = t2.trip_I
-                    AND t1.trip_I = trips.trip_I AND trips.route_I = routes.route_I
-                    GROUP BY from_stop_I, to_stop_I, routes.route_I
-                    ORDER BY route_id) sq1
-                    GROUP BY from_stop_I, to_stop_I""" % (start_time, end_time)
+        """
+        Compare the stop-to-stop sections (and the routes using them) between this and another database.
 
+        Parameters
+        ----------
+        other_conn: GTFS
+            the other (new) database
+        start_time: int
+            earliest departure time (in day seconds) of the considered sections
+        end_time: int
+            latest arrival time (in day seconds) of the considered sections
+
+        Returns
+        -------
+        result: pandas.DataFrame
+        """
         prev_df = None
         result = pd.DataFrame
-        for conn in [self.conn, other_conn]:
-            df = conn.execute_custom_query_pandas(query)
+        for gtfs in [self, other_conn]:
+            query = """SELECT from_stop_I, to_stop_I, sum(n_trips) AS n_trips, count(*) AS n_routes,
+                    group_concat(route_id) AS all_routes FROM
+                    (SELECT route_id, from_stop_I, to_stop_I, count(*) AS n_trips
+                    FROM %s JOIN routes USING (route_I)
+                    WHERE dep_time_ds >= %s AND arr_time_ds <= %s
+                    GROUP BY from_stop_I, to_stop_I, route_I
+                    ORDER BY route_id) sq1
+                    GROUP BY from_stop_I, to_stop_I""" % (segments.ensure_segments_table(gtfs), start_time, end_time)
+            df = gtfs.execute_custom_query_pandas(query)
             df.set_index(["from_stop_I", "to_stop_I"], inplace=True, drop=True)
             if prev_df is not None:
                 result = prev_df.merge(df, how="outer", left_index=True, right_index=True, suffixes=["_old", "_new"])
@@ -1473,7 +2087,7 @@ class GTFS(object):
             prev_df = df
         for suffix in ["_new", "_old"]:
             result["all_routes" + suffix] = result["all_routes" + suffix].fillna(value="")
-            result["all_routes" + suffix] = result["all_routes" + suffix].apply(lambda x: x.split(","))
+            result["all_routes" + suffix] = result["all_routes" + suffix].str.split(",")
         result.reset_index(inplace=True)
         result.fillna(value=0, inplace=True)
         for column in ["n_trips", "n_routes"]:
@@ -1583,28 +2197,105 @@ class GTFS(object):
             table_name = "day_trips"
         return table_name
 
+    def get_materialized_day_trips_date_range(self):
+        """
+        Returns
+        -------
+        date_range: tuple | None
+            None if the day_trips2 table contains all dates of the feed, otherwise
+            (first_date, last_date) of the materialized dates (or an empty tuple if no dates are materialized)
+        """
+        from gtfspy.import_loaders.day_trips_materializer import get_materialized_date_range
+        try:
+            return get_materialized_date_range(self.conn)
+        except sqlite3.OperationalError:
+            # no metadata table
+            return None
+
+    def materialize_day_trips(self, first_date=None, last_date=None):
+        """
+        Make sure that the day_trips2 table covers the given dates,
+        in case it has been materialized only for part of the dates (see import_gtfs, day_trips_date_range).
+        For a read-only GTFS, the missing dates are added to a temporary copy of day_trips2 instead
+        (one per connection), which is discarded when the connection is closed.
+
+        Parameters
+        ----------
+        first_date: str, optional
+            "YYYY-MM-DD", defaults to the first date of the feed
+        last_date: str, optional
+            "YYYY-MM-DD", defaults to the last date of the feed
+
+        Returns
+        -------
+        n_inserted: int
+            number of rows added to day_trips2
+        """
+        from gtfspy.import_loaders.day_trips_materializer import materialize_day_trips
+        return materialize_day_trips(self.conn, first_date, last_date, temporary=self.read_only)
+
+    def _materialize_day_trips_for_time_span(self, start_ut=None, end_ut=None):
+        date_range = self.get_materialized_day_trips_date_range()
+        if date_range is None:
+            return
+        calendar = self.get_local_calendar()
+        first_date, last_date = None, None
+        # one extra day on both sides covers the (daylight saving time) offsets between day starts and midnights
+        if start_ut is not None:
+            # trips of the earlier days may still be running at start_ut
+            max_end_time_ds = self.conn.execute("SELECT max(end_time_ds) FROM trips").fetchone()[0] or 0
+            first_day = calendar.local_day_numbers(int(start_ut) - max_end_time_ds) - 1
+            first_date = str(numpy.datetime64(int(first_day), 'D'))
+        if end_ut is not None:
+            last_day = calendar.local_day_numbers(int(end_ut)) + 1
+            last_date = str(numpy.datetime64(int(last_day), 'D'))
+        if date_range and (first_date is not None and date_range[0] <= first_date) and \
+                (last_date is not None and last_date <= date_range[1]):
+            return
+        self.materialize_day_trips(first_date, last_date)
+
     # TODO: The following methods could be moved to a "edit gtfs" -module
-    def homogenize_stops_table_with_other_db(self, source):
+
+    def invalidate_caches(self, schema="main"):
+        """
+        Drop the data derived from the timetable tables and cached in the database (the segments table),
+        and mark the columnar cache outdated, so that they are recomputed (or not used) when next needed.
+        The methods below modifying the timetable call this, but it should also be called after modifying
+        the stops, stop_times, trips or routes tables directly with SQL.
+
+        Parameters
+        ----------
+        schema: str, optional
+            name of the (attached) database, e.g. "other" after attach_gtfs_database
+        """
+        segments.drop_segments_table(self, schema)
+        columnar_cache.invalidate_columnar_cache(self, schema)
+
+    def homogenize_stops_table_with_other_db(self, source, max_distance=50, match_stop_ids=True):
         """
         This function takes an external database, looks of common stops and adds the missing stops to both databases.
         In addition the stop_pair_I column is added. This id links the stops between these two sources.
+        The common stops are found using a hash join on stop_id, or a spatial join when matching by location only,
+        so that homogenizing scales near-linearly with the number of stops.
+        Note: earlier versions computed the distance between stops with latitude and longitude swapped, so that
+        (away from lat == lon) stops closer than max_distance could be left unpaired, and farther ones paired.
+        The distances are now correct, which changes the results for such stops.
         :param source: directory of external database
+        :param max_distance: maximum distance (in meters) between two stops considered to be the same
+        :param match_stop_ids: whether common stops should also have the same stop_id. If False, each stop is paired
+            with the closest (not yet paired) stop of the other database within max_distance.
         :return:
         """
         cur = self.conn.cursor()
         self.attach_gtfs_database(source)
 
-        query_inner_join = """SELECT t1.*
-                              FROM stops t1
-                              INNER JOIN other.stops t2
-                              ON t1.stop_id=t2.stop_id
-                              AND find_distance(t1.lon, t1.lat, t2.lon, t2.lat) <= 50"""
-        df_inner_join = self.execute_custom_query_pandas(query_inner_join)
-        print("number of common stops: ", len(df_inner_join.index))
-        df_not_in_other = self.execute_custom_query_pandas("SELECT * FROM stops EXCEPT " + query_inner_join)
+        this_stops = self.execute_custom_query_pandas("SELECT * FROM stops ORDER BY stop_I")
+        other_stops = self.execute_custom_query_pandas("SELECT * FROM other.stops ORDER BY stop_I")
+        this_indices, other_indices = _match_stops(this_stops, other_stops, max_distance, match_stop_ids)
+        print("number of common stops: ", len(this_indices))
+        df_not_in_other = this_stops.drop(this_stops.index[this_indices])
         print("number of stops missing in second feed: ", len(df_not_in_other.index))
-        df_not_in_self = self.execute_custom_query_pandas("SELECT * FROM other.stops EXCEPT " +
-                                                          query_inner_join.replace("t1.*", "t2.*"))
+        df_not_in_self = other_stops.drop(other_stops.index[other_indices])
         print("number of stops missing in first feed: ", len(df_not_in_self.index))
         try:
             self.execute_custom_query("""ALTER TABLE stops ADD COLUMN stop_pair_I INT """)
@@ -1618,22 +2309,22 @@ class GTFS(object):
         rows_to_update_other = []
         rows_to_add_to_self = []
         rows_to_add_to_other = []
+        columns = ["stop_id", "code", "name", "desc", "lat", "lon", "location_type", "wheelchair_boarding"]
 
-        for items in df_inner_join.itertuples(index=False):
-            rows_to_update_self.append((counter, items[1]))
-            rows_to_update_other.append((counter, items[1]))
+        for this_stop_id, other_stop_id in zip(this_stops["stop_id"].values[this_indices],
+                                               other_stops["stop_id"].values[other_indices]):
+            rows_to_update_self.append((counter, this_stop_id))
+            rows_to_update_other.append((counter, other_stop_id))
             counter += 1
 
-        for items in df_not_in_other.itertuples(index=False):
-            rows_to_update_self.append((counter, items[1]))
-            rows_to_add_to_other.append((stop_id_stub + str(counter),) + tuple(items[x] for x in [2, 3, 4, 5, 6, 8, 9])
-                                        + (counter,))
+        for items in df_not_in_other[columns].itertuples(index=False):
+            rows_to_update_self.append((counter, items[0]))
+            rows_to_add_to_other.append((stop_id_stub + str(counter),) + tuple(items[1:]) + (counter,))
             counter += 1
 
-        for items in df_not_in_self.itertuples(index=False):
-            rows_to_update_other.append((counter, items[1]))
-            rows_to_add_to_self.append((stop_id_stub + str(counter),) + tuple(items[x] for x in [2, 3, 4, 5, 6, 8, 9])
-                                       + (counter,))
+        for items in df_not_in_self[columns].itertuples(index=False):
+            rows_to_update_other.append((counter, items[0]))
+            rows_to_add_to_self.append((stop_id_stub + str(counter),) + tuple(items[1:]) + (counter,))
             counter += 1
 
         query_add_row = """INSERT INTO stops(
@@ -1654,6 +2345,8 @@ class GTFS(object):
         cur.executemany(query_add_row.replace("stops", "other.stops"), rows_to_add_to_other)
         cur.executemany(query_update_row.replace("stops", "other.stops"), rows_to_update_other)
         self.conn.commit()
+        self.invalidate_caches()
+        self.invalidate_caches("other")
         print("finished")
 
     def replace_stop_i_with_stop_pair_i(self):
@@ -1702,6 +2395,7 @@ class GTFS(object):
         for query in queries:
             cur.execute(query)
         self.conn.commit()
+        self.invalidate_caches()
 
     def add_stops_from_csv(self, csv_dir):
         stops_to_add = pd.read_csv(csv_dir, encoding='utf-8')
@@ -1715,6 +2409,7 @@ class GTFS(object):
                         'VALUES (?, ?, ?, ?, ?, ?)'
         cur.executemany(query_add_row, [[stop_id, code, name, desc, lat, lon]])
         self.conn.commit()
+        self.invalidate_caches()
 
     def recalculate_stop_distances(self, max_distance):
         from gtfspy.calc_transfers import calc_transfers
@@ -1737,6 +2432,7 @@ class GTFS(object):
         stop_values = [(values.lat, values.lon, values.stop_id) for values in stop_updates.itertuples()]
         cur.executemany("""UPDATE stops SET lat = ?, lon = ? WHERE stop_id = ?""", stop_values)
         self.conn.commit()
+        self.invalidate_caches()
 
 
 class GTFSMetadata(object):
@@ -1810,6 +2506,89 @@ class GTFSMetadata(object):
                 self[key] = value
 
 
+def _match_stops(stops1, stops2, max_distance, match_stop_ids):
+    """
+    Pair the stops of two stops tables (DataFrames with columns stop_id, lat and lon).
+    Distances are computed with the coordinates in the (lat, lon) order, unlike in earlier versions
+    of homogenize_stops_table_with_other_db, which had them swapped.
+
+    Returns
+    -------
+    indices1, indices2: numpy.array
+        positions of the paired stops in stops1 and stops2, ordered by indices1
+    """
+    if match_stop_ids:
+        pairs = pd.DataFrame({"stop_id": stops1["stop_id"].values, "index1": numpy.arange(len(stops1))}).merge(
+            pd.DataFrame({"stop_id": stops2["stop_id"].values, "index2": numpy.arange(len(stops2))}), on="stop_id")
+        pairs.sort_values("index1", inplace=True)
+        indices1, indices2 = pairs["index1"].values, pairs["index2"].values
+        distances = wgs84_distances(stops1["lat"].values[indices1], stops1["lon"].values[indices1],
+                                    stops2["lat"].values[indices2], stops2["lon"].values[indices2])
+        within = distances <= max_distance
+        return indices1[within], indices2[within]
+
+    indices1, indices2, distances = find_points_within_distance(stops1["lat"].values, stops1["lon"].values,
+                                                                stops2["lat"].values, stops2["lon"].values,
+                                                                max_distance)
+    # one-to-one pairing, closest candidate pairs first
+    paired1 = numpy.zeros(len(stops1), dtype=bool)
+    paired2 = numpy.zeros(len(stops2), dtype=bool)
+    pairs = []
+    order = numpy.lexsort((indices2, indices1, distances))
+    for index1, index2 in zip(indices1[order], indices2[order]):
+        if not paired1[index1] and not paired2[index2]:
+            paired1[index1] = paired2[index2] = True
+            pairs.append((index1, index2))
+    pairs.sort()
+    return numpy.array([pair[0] for pair in pairs], dtype=int), numpy.array([pair[1] for pair in pairs], dtype=int)
+
+
+def _match_stop_sets(sets1, sets2, max_difference=None, min_ratio=None):
+    """
+    Find the keys of matching sets (of stops) between two dicts.
+
+    Without max_difference and min_ratio, only equal sets match (found by hashing).
+    Otherwise, two sets match if the size of their symmetric difference is at most max_difference,
+    or the ratio of the sizes of their intersection and union is at least min_ratio.
+    Only sets sharing at least one element are compared (found through an index from elements to sets).
+
+    Returns
+    -------
+    matched1, matched2: set
+        keys of sets1 and sets2 having a match
+    """
+    if max_difference is None and not min_ratio:
+        keys_by_set2 = {}
+        for key, stop_set in sets2.items():
+            keys_by_set2.setdefault(stop_set, []).append(key)
+        matched1 = set()
+        matched2 = set()
+        for key, stop_set in sets1.items():
+            if stop_set in keys_by_set2:
+                matched1.add(key)
+                matched2.update(keys_by_set2[stop_set])
+        return matched1, matched2
+
+    keys_by_element2 = {}
+    for key, stop_set in sets2.items():
+        for element in stop_set:
+            keys_by_element2.setdefault(element, []).append(key)
+    matched1 = set()
+    matched2 = set()
+    for key1, set1 in sets1.items():
+        n_common_by_key2 = {}
+        for element in set1:
+            for key2 in keys_by_element2.get(element, ()):
+                n_common_by_key2[key2] = n_common_by_key2.get(key2, 0) + 1
+        for key2, n_common in n_common_by_key2.items():
+            n_union = len(set1) + len(sets2[key2]) - n_common
+            if (max_difference is not None and n_union - n_common <= max_difference) or \
+                    (min_ratio and n_common / float(n_union) >= min_ratio):
+                matched1.add(key1)
+                matched2.add(key2)
+    return matched1, matched2
+
+
 def main(cmd, args):
     from gtfspy import filter
     # noinspection PyPackageRequirements
@@ -1878,7 +2657,7 @@ def main(cmd, args):
         shapefile_path = args[1] #'/m/cs/project/networks/jweckstr/TESTDATA/helsinki_routes.shp'
         g = GTFS(from_db)
         if cmd == 'export_shapefile_routes':
-            data = g.get_all_route_shapes(use_shapes=True)
+            data = g.generate_route_shapes(use_shapes=True)
 
         elif cmd == 'export_shapefile_segment_counts':
             date = args[2]  # '2016-04-06'
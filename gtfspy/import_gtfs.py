@@ -20,8 +20,10 @@ import sqlite3
 import time
 from six import string_types
 
+from gtfspy import instrumentation
 from gtfspy import stats
 from gtfspy import util
+from gtfspy.columnar_cache import write_columnar_cache
 from gtfspy.gtfs import GTFS
 
 
@@ -46,8 +48,10 @@ postprocessors = [
 ]
 
 
+@instrumentation.instrumented("import_gtfs")
 def import_gtfs(gtfs_sources, output, preserve_connection=False,
-                print_progress=True, location_name=None, **kwargs):
+                print_progress=True, location_name=None, columnar_cache=False, day_trips_date_range=None,
+                **kwargs):
     """Import a GTFS database
 
     gtfs_sources: str, dict, list
@@ -64,6 +68,14 @@ def import_gtfs(gtfs_sources, output, preserve_connection=False,
         Whether to print progress output
     location_name: str, optional
         set the location of this database
+    columnar_cache: bool, optional
+        Whether to also write the columnar on-disk cache of the core tables (see gtfspy.columnar_cache).
+        Only for databases stored on disk.
+    day_trips_date_range: tuple | bool, optional
+        None (default): materialize the day_trips2 table for all dates of the feed.
+        (first_date, last_date): materialize day_trips2 only for the dates in this range ("YYYY-MM-DD", inclusive).
+        False: do not materialize any dates at import time.
+        The dates outside the range are materialized on demand when queried through GTFS.
     """
     if isinstance(output, sqlite3.Connection):
         conn = output
@@ -92,7 +104,9 @@ def import_gtfs(gtfs_sources, output, preserve_connection=False,
     # end python3.6 workaround
 
     # Do the actual importing.
-    loaders = [L(gtfssource=gtfs_sources, print_progress=print_progress, **kwargs) for L in Loaders]
+    loader_kwargs = {DayTripsMaterializer: {"date_range": day_trips_date_range}}
+    loaders = [L(gtfssource=gtfs_sources, print_progress=print_progress, **dict(kwargs, **loader_kwargs.get(L, {})))
+               for L in Loaders]
 
     for loader in loaders:
         loader.assert_exists_if_required()
@@ -104,8 +118,9 @@ def import_gtfs(gtfs_sources, output, preserve_connection=False,
         loader.import_(conn)
 
     # Do any operations that require all tables present.
-    for Loader in loaders:
-        Loader.post_import_round2(conn)
+    with instrumentation.span("import_gtfs.post_import_round2"):
+        for Loader in loaders:
+            Loader.post_import_round2(conn)
 
     # Make any views
     for Loader in loaders:
@@ -157,19 +172,26 @@ def import_gtfs(gtfs_sources, output, preserve_connection=False,
             G.meta['download_date'] = unique_download_dates[0]
 
     G.meta['timezone'] = cur.execute('SELECT timezone FROM agencies LIMIT 1').fetchone()[0]
-    stats.update_stats(G)
+    with instrumentation.span("import_gtfs.update_stats"):
+        stats.update_stats(G)
     del G
 
     if print_progress:
         print("Vacuuming...")
     # Next 3 lines are python 3.6 work-arounds again.
     conn.isolation_level = None  # former default of autocommit mode
-    cur.execute('VACUUM;')
+    with instrumentation.span("import_gtfs.vacuum"):
+        cur.execute('VACUUM;')
     conn.isolation_level = ''    # back to python default
     # end python3.6 workaround
     if print_progress:
         print("Analyzing...")
-    cur.execute('ANALYZE')
+    with instrumentation.span("import_gtfs.analyze"):
+        cur.execute('ANALYZE')
+    if columnar_cache:
+        # written last, as vacuuming may renumber the rowids
+        with instrumentation.span("import_gtfs.write_columnar_cache"):
+            write_columnar_cache(GTFS(conn), print_progress=print_progress)
     if not (preserve_connection is True):
         conn.close()
 
@@ -1,5 +1,13 @@
+from gtfspy import instrumentation
 from gtfspy.import_loaders.table_loader import TableLoader
 
+# Key of the metadata table, where the range of materialized dates is stored
+# if day_trips2 has been materialized only partially (the key is absent, if all dates are materialized)
+DATE_RANGE_META_KEY = "day_trips2_date_range"
+# For read-only databases, the missing dates are materialized into a temporary copy of day_trips2
+# (private to the connection), and the materialized range is then stored in this temporary table
+TEMP_DATE_RANGE_TABLE = "day_trips2_date_range"
+
 
 class DayTripsMaterializer(TableLoader):
     """Make the table day_trips with (date, trip_I, start, end, day_start_ut).
@@ -11,6 +19,9 @@ class DayTripsMaterializer(TableLoader):
     day_trips2: The actual table
     day_trips: Replacement for the old day_trips view.  day_trips2+trips
     day_stop_times: day_trips2+trips+stop_times
+
+    To keep the table small, day_trips2 can be materialized only for a range of dates
+    (see the date_range parameter), and extended later on demand (see materialize_day_trips).
     """
     fname = None
     table = 'day_trips2'
@@ -21,17 +32,29 @@ class DayTripsMaterializer(TableLoader):
                 'day_start_ut INT)')
     copy_where = 'WHERE  {start_ut} < end_time_ut  AND  start_time_ut < {end_ut}'
 
-    @classmethod
-    def post_import_round2(cls, conn):
-        cur = conn.cursor()
-        cur.execute('INSERT INTO day_trips2 '
-                    'SELECT date, trip_I, '
-                    'days.day_start_ut+trips.start_time_ds AS start_time_ut, '
-                    'days.day_start_ut+trips.end_time_ds AS end_time_ut, '
-                    'day_start_ut '
-                    'FROM days '
-                    'JOIN trips USING (trip_I)')
-        conn.commit()
+    def __init__(self, gtfssource=None, print_progress=True, date_range=None):
+        """
+        Parameters
+        ----------
+        gtfssource: see TableLoader
+        print_progress: bool
+        date_range: tuple | bool, optional
+            None (default): materialize day_trips2 for all dates of the feed
+            (first_date, last_date): materialize only the dates in the (inclusive) range, "YYYY-MM-DD"
+            False: do not materialize any dates at import time
+        """
+        super(DayTripsMaterializer, self).__init__(gtfssource=gtfssource, print_progress=print_progress)
+        self.date_range = date_range
+
+    def post_import_round2(self, conn):
+        if self.date_range is None:
+            _insert_day_trips(conn)
+            conn.commit()
+            return
+        _set_materialized_date_range(conn, ())
+        if self.date_range:
+            first_date, last_date = self.date_range
+            materialize_day_trips(conn, first_date, last_date)
 
     def index(cls, cur):
         cur.execute('CREATE INDEX IF NOT EXISTS idx_day_trips2_tid '
@@ -45,22 +68,24 @@ class DayTripsMaterializer(TableLoader):
                     'ON day_trips2 (day_start_ut)')
 
     @classmethod
-    def make_views(cls, conn):
+    def make_views(cls, conn, schema="main"):
         """Create day_trips and day_stop_times views.
 
         day_trips:  day_trips2 x trips  = days x trips
         day_stop_times: day_trips2 x trips x stop_times = days x trips x stop_times
+
+        With schema="temp", the views are created over the temporary copy of day_trips2.
         """
-        conn.execute('DROP VIEW IF EXISTS main.day_trips')
-        conn.execute('CREATE VIEW day_trips AS   '
+        conn.execute('DROP VIEW IF EXISTS ' + schema + '.day_trips')
+        conn.execute('CREATE VIEW ' + schema + '.day_trips AS   '
                      'SELECT day_trips2.*, trips.* '
                      #'days.day_start_ut+trips.start_time_ds AS start_time_ut, '
                      #'days.day_start_ut+trips.end_time_ds AS end_time_ut   '
                      'FROM day_trips2 JOIN trips USING (trip_I);')
         conn.commit()
 
-        conn.execute('DROP VIEW IF EXISTS main.day_stop_times')
-        conn.execute('CREATE VIEW day_stop_times AS   '
+        conn.execute('DROP VIEW IF EXISTS ' + schema + '.day_stop_times')
+        conn.execute('CREATE VIEW ' + schema + '.day_stop_times AS   '
                      'SELECT day_trips2.*, trips.*, stop_times.*, '
                      #'days.day_start_ut+trips.start_time_ds AS start_time_ut, '
                      #'days.day_start_ut+trips.end_time_ds AS end_time_ut, '
@@ -69,4 +94,141 @@ class DayTripsMaterializer(TableLoader):
                      'FROM day_trips2 '
                      'JOIN trips USING (trip_I) '
                      'JOIN stop_times USING (trip_I)')
-        conn.commit()
\ No newline at end of file
+        conn.commit()
+
+
+def get_materialized_date_range(conn):
+    """
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+
+    Returns
+    -------
+    date_range: tuple | None
+        None, if day_trips2 has been materialized for all dates.
+        Otherwise (first_date, last_date) of the materialized dates,
+        or an empty tuple if no dates have been materialized.
+    """
+    if _has_temporary_day_trips(conn):
+        row = conn.execute("SELECT value FROM temp." + TEMP_DATE_RANGE_TABLE).fetchone()
+    else:
+        row = conn.execute("SELECT value FROM metadata WHERE key=?", (DATE_RANGE_META_KEY,)).fetchone()
+    if row is None:
+        return None
+    if not row[0]:
+        return ()
+    first_date, last_date = row[0].split(",")
+    return first_date, last_date
+
+
+def materialize_day_trips(conn, first_date=None, last_date=None, temporary=False):
+    """
+    Make sure that day_trips2 contains the trips of all dates between first_date and last_date (inclusive).
+
+    The materialized dates are always kept as one continuous range,
+    so any dates between the already materialized ones and the requested ones are materialized as well.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+    first_date: str, optional
+        "YYYY-MM-DD", defaults to the first date of the feed
+    last_date: str, optional
+        "YYYY-MM-DD", defaults to the last date of the feed
+    temporary: bool, optional
+        Leave the database unmodified (e.g. a read-only database): the missing dates are instead added
+        to a temporary copy of day_trips2, which (together with temporary day_trips and day_stop_times views)
+        shadows the original table on this connection.
+
+    Returns
+    -------
+    n_inserted: int
+        number of rows added to day_trips2
+    """
+    current_range = get_materialized_date_range(conn)
+    if current_range is None:
+        return 0
+    feed_first_date, feed_last_date = conn.execute("SELECT min(date), max(date) FROM days").fetchone()
+    if feed_first_date is None:
+        return 0
+    first_date = max(first_date or feed_first_date, feed_first_date)
+    last_date = min(last_date or feed_last_date, feed_last_date)
+    if first_date > last_date:
+        return 0
+
+    if current_range and current_range[0] <= first_date and last_date <= current_range[1]:
+        return 0
+
+    schema = "main"
+    if temporary or _has_temporary_day_trips(conn):
+        _create_temporary_day_trips(conn, current_range)
+        schema = "temp"
+
+    n_inserted = 0
+    if not current_range:
+        n_inserted += _insert_day_trips(conn, "? <= date AND date <= ?", (first_date, last_date), schema)
+    else:
+        current_first_date, current_last_date = current_range
+        if first_date < current_first_date:
+            n_inserted += _insert_day_trips(conn, "? <= date AND date < ?", (first_date, current_first_date),
+                                            schema)
+        if current_last_date < last_date:
+            n_inserted += _insert_day_trips(conn, "? < date AND date <= ?", (current_last_date, last_date),
+                                            schema)
+        first_date = min(first_date, current_first_date)
+        last_date = max(last_date, current_last_date)
+
+    if first_date <= feed_first_date and feed_last_date <= last_date:
+        date_range = None
+    else:
+        date_range = (first_date, last_date)
+    _set_materialized_date_range(conn, date_range, schema)
+    conn.commit()
+    return n_inserted
+
+
+def _has_temporary_day_trips(conn):
+    return conn.execute("SELECT count(*) FROM sqlite_temp_master "
+                        "WHERE type='table' AND name='day_trips2'").fetchone()[0] > 0
+
+
+def _create_temporary_day_trips(conn, current_range):
+    if _has_temporary_day_trips(conn):
+        return
+    conn.execute("CREATE TEMP TABLE day_trips2 AS SELECT * FROM main.day_trips2")
+    conn.execute("CREATE TEMP TABLE " + TEMP_DATE_RANGE_TABLE + " (value TEXT)")
+    _set_materialized_date_range(conn, current_range, "temp")
+    conn.execute('CREATE INDEX temp.idx_day_trips2_tid ON day_trips2 (trip_I)')
+    conn.execute('CREATE INDEX temp.idx_day_trips2_stut_etut ON day_trips2 (start_time_ut, end_time_ut)')
+    DayTripsMaterializer.make_views(conn, "temp")
+
+
+def _insert_day_trips(conn, where=None, params=(), schema="main"):
+    query = 'INSERT INTO ' + schema + '.day_trips2 ' \
+            'SELECT date, trip_I, ' \
+            'days.day_start_ut+trips.start_time_ds AS start_time_ut, ' \
+            'days.day_start_ut+trips.end_time_ds AS end_time_ut, ' \
+            'day_start_ut ' \
+            'FROM days ' \
+            'JOIN trips USING (trip_I)'
+    if where:
+        query += ' WHERE ' + where
+    with instrumentation.span("materialize_day_trips"):
+        n_rows = conn.execute(query, params).rowcount
+    instrumentation.count("rows_inserted.day_trips2", n_rows)
+    return n_rows
+
+
+def _set_materialized_date_range(conn, date_range, schema="main"):
+    """date_range None marks all dates materialized"""
+    if schema == "temp":
+        conn.execute("DELETE FROM temp." + TEMP_DATE_RANGE_TABLE)
+        if date_range is not None:
+            conn.execute("INSERT INTO temp." + TEMP_DATE_RANGE_TABLE + " (value) VALUES (?)",
+                         (",".join(date_range),))
+    elif date_range is None:
+        conn.execute("DELETE FROM main.metadata WHERE key=?", (DATE_RANGE_META_KEY,))
+    else:
+        conn.execute("INSERT OR REPLACE INTO main.metadata (key, value) VALUES (?, ?)",
+                     (DATE_RANGE_META_KEY, ",".join(date_range)))
@@ -6,6 +6,7 @@ import zipfile
 
 from six import string_types
 
+from gtfspy import instrumentation
 from gtfspy import util
 
 
@@ -298,6 +299,7 @@ class TableLoader(object):
             rows = chain([row], self.gen_rows([csv_reader], [prefix]))
             cur.executemany(stmt, rows)
             conn.commit()
+            instrumentation.count("rows_inserted." + self.table, cur.rowcount)
 
             # This was used for debugging the missing service_I:
             # if self.__class__.__name__ == 'TripLoader': # and False:
@@ -325,8 +327,9 @@ class TableLoader(object):
         if self.print_progress:
             print('Post-import %s into %s' % (self.fname, self.table))
         cur = conn.cursor()
-        self.post_import(cur)
-        conn.commit()
+        with instrumentation.span("import_gtfs." + self.__class__.__name__ + ".post_import"):
+            self.post_import(cur)
+            conn.commit()
 
     def create_index(self, conn):
         if not hasattr(self, 'index'):
@@ -334,8 +337,9 @@ class TableLoader(object):
         cur = conn.cursor()
         if self.print_progress:
             print('Indexing %s' % (self.table,))
-        self.index(cur)
-        conn.commit()
+        with instrumentation.span("import_gtfs." + self.__class__.__name__ + ".index"):
+            self.index(cur)
+            conn.commit()
 
     def import_(self, conn):
         """Do the actual import. Copy data and store in connection object.
@@ -356,7 +360,8 @@ class TableLoader(object):
         self.create_table(conn)
         # This does insertions
         if self.mode in ('all', 'import') and self.fname and self.exists() and self.table not in ignore_tables:
-            self.insert_data(conn)
+            with instrumentation.span("import_gtfs." + self.__class__.__name__ + ".insert_data", table=self.table):
+                self.insert_data(conn)
         # This makes indexes in the DB.
         if self.mode in ('all', 'index') and hasattr(self, 'index'):
             self.create_index(conn)
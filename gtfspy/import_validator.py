@@ -171,22 +171,25 @@ class ImportValidator(object):
 
     def _validate_table_counts(self):
         """
-        Imports source .txt files, checks row counts and then compares the rowcounts with the gtfsobject
+        Counts the rows of the source .txt files and compares the rowcounts with the gtfsobject.
+        Only the first column (or the trip_id column, when trips are generated from frequencies)
+        of each source table is read.
         :return:
         """
+        database_row_counts = self._get_database_row_counts()
         for table_name_txt, db_table_name, row_warning in zip(SOURCE_TABLE_NAMES, DB_TABLE_NAMES, ROW_WARNINGS):
             source_row_count = 0
 
             for gtfs_source in self.gtfs_sources:
-                frequencies_in_source = source_table_txt_to_pandas(gtfs_source, 'frequencies.txt')
                 try:
-                    if table_name_txt == 'trips' and not frequencies_in_source.empty:
+                    frequencies_in_source = not self._get_frequencies(gtfs_source).empty
+                    if table_name_txt == 'trips' and frequencies_in_source:
                         source_row_count += self._frequency_generated_trips(gtfs_source, table_name_txt)
 
-                    elif table_name_txt == 'stop_times' and not frequencies_in_source.empty:
+                    elif table_name_txt == 'stop_times' and frequencies_in_source:
                         source_row_count += self._frequency_generated_stop_times(gtfs_source, table_name_txt)
                     else:
-                        df = source_table_txt_to_pandas(gtfs_source, table_name_txt)
+                        df = source_table_txt_to_pandas(gtfs_source, table_name_txt, args={"usecols": [0]})
 
                         source_row_count += len(df.index)
                 except (IOError) as e:
@@ -194,7 +197,7 @@ class ImportValidator(object):
                     pass
 
             # Result from GTFSobj:
-            database_row_count = self.gtfs.get_row_count(db_table_name)
+            database_row_count = database_row_counts[db_table_name]
             if source_row_count == database_row_count:
                 print("Row counts match for " + table_name_txt + " between the source and database ("
                       + str(database_row_count) + ")")
@@ -217,24 +220,32 @@ class ImportValidator(object):
                 else:
                     self.warnings_container.add_warning(self.location, row_warning, difference)
 
-
-
-
+    def _get_database_row_counts(self):
+        """
+        :return: dict mapping each of the DB_TABLE_NAMES to its row count, fetched with a single query
+        """
+        query = "SELECT " + ", ".join("(SELECT count(*) FROM " + table + ")" for table in DB_TABLE_NAMES)
+        counts = self.gtfs.execute_custom_query(query).fetchone()
+        return dict(zip(DB_TABLE_NAMES, counts))
 
     def _validate_no_nulls(self):
         """
-        Loads the tables from the gtfs object and counts the number of rows that have null values in
-        fields that should not be null. Stores the number of null rows in warnings_container
+        Counts the number of rows that have null values in fields that should not be null directly
+        in the database (using a single query over all tables).
+        Stores the number of null rows in warnings_container
         """
-        for table, null_warning in zip(DB_TABLE_NAMES, NULL_WARNINGS):
+        subqueries = []
+        for table in DB_TABLE_NAMES:
             # TODO: make this validation source by source
-            df = self.gtfs.get_table(table)
-            df.drop(FIELDS_WHERE_NULL_OK[table], inplace=True, axis=1)
-            # print(df.to_string())
-            len_table = len(df.index)
-            df.dropna(inplace=True, axis=0)
-            len_non_null = len(df.index)
-            nullrows = len_table - len_non_null
+            columns = [row[1] for row in self.gtfs.execute_custom_query("PRAGMA table_info(" + table + ")")]
+            columns = [column for column in columns if column not in FIELDS_WHERE_NULL_OK[table]]
+            if columns:
+                condition = " OR ".join('"' + column + '" IS NULL' for column in columns)
+                subqueries.append("(SELECT count(*) FROM " + table + " WHERE " + condition + ")")
+            else:
+                subqueries.append("0")
+        null_row_counts = self.gtfs.execute_custom_query("SELECT " + ", ".join(subqueries)).fetchone()
+        for nullrows, null_warning in zip(null_row_counts, NULL_WARNINGS):
             if nullrows > 0:
                 # print('Warning: Null values detected in table ' + table)
                 self.warnings_container.add_warning(self.location, null_warning, value=nullrows)
@@ -246,14 +257,57 @@ class ImportValidator(object):
         stops <> stop_times using stop_I
         stop_times <> trips <> days, using trip_I
         trips <> routes, using route_I
+
+        All DANGLER_QUERIES are evaluated with a single query.
         :return:
         """
-        for query, warning in zip(DANGLER_QUERIES, DANGLER_WARNINGS):
-            dangler_count = self.gtfs.execute_custom_query(query).fetchone()[0]
+        query = "SELECT " + ", ".join("(" + dangler_query + ")" for dangler_query in DANGLER_QUERIES)
+        dangler_counts = self.gtfs.execute_custom_query(query).fetchone()
+        for dangler_count, warning in zip(dangler_counts, DANGLER_WARNINGS):
             if dangler_count > 0:
                 print(str(dangler_count) + " " + warning)
                 self.warnings_container.add_warning(self.location, warning, value=dangler_count)
 
+    def _get_frequencies(self, source):
+        """
+        Reads frequencies.txt of a source only once, and computes the number of trips generated by each row.
+        :param source: path to the source file
+        :return: pandas.DataFrame
+        """
+        key = source if not isinstance(source, dict) else id(source)
+        if key not in self.df_freq_dict:
+            try:
+                df_freq = source_table_txt_to_pandas(source, u'frequencies.txt', args={"dtype": {"trip_id": str}})
+            except IOError:
+                df_freq = pd.DataFrame()
+            if not df_freq.empty:
+                df_freq['n_trips'] = [len(range(str_time_to_day_seconds(start_time),
+                                                str_time_to_day_seconds(end_time),
+                                                int(headway_secs)))
+                                      for start_time, end_time, headway_secs in
+                                      zip(df_freq['start_time'], df_freq['end_time'], df_freq['headway_secs'])]
+            self.df_freq_dict[key] = df_freq
+        return self.df_freq_dict[key]
+
+    def _frequency_generated_rows(self, source, txt):
+        """
+        Number of rows in the database generated from a source table having a trip_id column.
+        Each row of a trip listed in frequencies.txt is counted once per generated trip,
+        and each frequencies.txt row with a trip_id not present in the table counts as its generated trips.
+        :param source: path to the source file
+        :param txt: txt file in question
+        :return: int
+        """
+        df_freq = self._get_frequencies(source)
+        trip_ids = source_table_txt_to_pandas(source, txt, args={"usecols": ["trip_id"],
+                                                                 "dtype": {"trip_id": str}})['trip_id']
+        rows_per_trip = trip_ids.value_counts()
+        generated_per_trip = df_freq.groupby('trip_id')['n_trips'].sum()
+        multipliers = generated_per_trip.reindex(rows_per_trip.index).fillna(1)
+        n_rows = (rows_per_trip * multipliers).sum() + trip_ids.isnull().sum()
+        n_rows += generated_per_trip[~generated_per_trip.index.isin(rows_per_trip.index)].sum()
+        return int(n_rows)
+
     def _frequency_generated_trips(self, source, txt):
         """
         This function calculates the equivalent rowcounts for trips when
@@ -262,15 +316,7 @@ class ImportValidator(object):
         :param txt: txt file in question
         :return: sum of all trips
         """
-        df_freq = source_table_txt_to_pandas(source, u'frequencies.txt')
-        df_trips = source_table_txt_to_pandas(source, txt)
-        df_freq['n_trips'] = df_freq.apply(lambda row: len(range(str_time_to_day_seconds(row['start_time']),
-                                                                 str_time_to_day_seconds(row['end_time']),
-                                                                 row['headway_secs'])), axis=1)
-        self.df_freq_dict[source] = df_freq
-        df_trips_freq = pd.merge(df_freq, df_trips, how='outer', on='trip_id')
-
-        return int(df_trips_freq['n_trips'].fillna(1).sum(axis=0))
+        return self._frequency_generated_rows(source, txt)
 
     def _frequency_generated_stop_times(self, source, txt):
         """
@@ -279,11 +325,7 @@ class ImportValidator(object):
         :param txt:
         :return:
         """
-        df_stop_times = source_table_txt_to_pandas(source, txt)
-        df_freq = self.df_freq_dict[source]
-        df_stop_freq = pd.merge(df_freq, df_stop_times, how='outer', on='trip_id')
-
-        return int(df_stop_freq['n_trips'].fillna(1).sum(axis=0))
+        return self._frequency_generated_rows(source, txt)
 
 def main():
     pass
@@ -0,0 +1,319 @@
+"""
+Lightweight instrumentation: named (nested) timing spans, counters and peak memory sampling.
+
+Instrumentation is turned off by default, in which case span() and count() do (almost) nothing.
+Typical usage:
+
+    from gtfspy import instrumentation
+    recorder = instrumentation.enable(trace_memory=True)
+    import_gtfs(...)
+    instrumentation.disable()
+    recorder.write_json("import_profile.json")
+    recorder.write_chrome_trace("import_trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+
+Library code records spans and counters with
+
+    with instrumentation.span("import_gtfs.StopLoader", table="stops"):
+        ...
+    instrumentation.count("rows_inserted.stops", n_rows)
+
+or by decorating functions with @instrumented() (or gtfspy.util.timeit).
+"""
+from __future__ import print_function
+
+import functools
+import json
+import os
+import threading
+import time
+import timeit
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_recorder = None
+
+
+def enable(trace_memory=False):
+    """
+    Start recording spans and counters (replacing any earlier recorder).
+
+    Parameters
+    ----------
+    trace_memory: bool, optional
+        whether to also record the peak memory allocated by Python during each span (using tracemalloc).
+        Note that tracing memory slows down the code considerably.
+
+    Returns
+    -------
+    recorder: Recorder
+    """
+    global _recorder
+    disable()
+    _recorder = Recorder(trace_memory=trace_memory)
+    return _recorder
+
+
+def disable():
+    """
+    Stop recording.
+
+    Returns
+    -------
+    recorder: Recorder | None
+        the recorder that was in use (if any)
+    """
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    if recorder is not None:
+        recorder._stop()
+    return recorder
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def get_recorder():
+    """
+    Returns
+    -------
+    recorder: Recorder | None
+        None, if instrumentation is not enabled
+    """
+    return _recorder
+
+
+def span(name, **args):
+    """
+    Context manager recording the duration of a block of code.
+
+    Parameters
+    ----------
+    name: str
+    **args:
+        extra information stored with the span (should be JSON serializable)
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name, args)
+
+
+def count(name, value=1):
+    """
+    Increment a counter.
+
+    Parameters
+    ----------
+    name: str
+    value: int | float, optional
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def instrumented(name=None):
+    """
+    Decorator recording a span for each call of the decorated function.
+
+    Parameters
+    ----------
+    name: str, optional
+        defaults to the qualified name of the function
+    """
+    def decorator(function):
+        span_name = name if name is not None else _qualified_name(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Recorder(object):
+    """
+    Collects the spans and counters recorded while instrumentation is enabled.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.spans = []
+        self.counters = OrderedDict()
+        self.start_time_ut = time.time()
+        self._start = timeit.default_timer()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary: OrderedDict
+            span name -> dict with the number of calls, and the total and maximum durations (in seconds),
+            ordered by decreasing total duration
+        """
+        totals = {}
+        for record in list(self.spans):
+            calls, total, maximum = totals.get(record["name"], (0, 0, 0))
+            duration = record["duration_us"] / 1e6
+            totals[record["name"]] = (calls + 1, total + duration, max(maximum, duration))
+        summary = OrderedDict()
+        for name, (calls, total, maximum) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            summary[name] = OrderedDict([("calls", calls), ("total_s", total), ("max_s", maximum)])
+        return summary
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+            counters = OrderedDict(self.counters)
+        return OrderedDict([
+            ("start_time_ut", self.start_time_ut),
+            ("trace_memory", self.trace_memory),
+            ("summary", self.summary()),
+            ("counters", counters),
+            ("spans", spans),
+        ])
+
+    def write_json(self, fname):
+        with open(fname, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_chrome_trace(self):
+        """
+        Returns
+        -------
+        trace: dict
+            the spans and counters in the Trace Event Format understood by chrome://tracing and Perfetto
+        """
+        pid = os.getpid()
+        events = []
+        end_us = 0
+        for record in list(self.spans):
+            args = dict(record["args"])
+            if record.get("peak_memory_bytes") is not None:
+                args["peak_memory_bytes"] = record["peak_memory_bytes"]
+            events.append({"name": record["name"], "cat": "gtfspy", "ph": "X",
+                           "ts": record["start_us"], "dur": record["duration_us"],
+                           "pid": pid, "tid": record["thread_id"], "args": args})
+            span_end_us = record["start_us"] + record["duration_us"]
+            if record.get("peak_memory_bytes") is not None:
+                events.append({"name": "peak_memory_bytes", "ph": "C", "ts": span_end_us,
+                               "pid": pid, "args": {"bytes": record["peak_memory_bytes"]}})
+            end_us = max(end_us, span_end_us)
+        for name, value in list(self.counters.items()):
+            events.append({"name": name, "ph": "C", "ts": end_us, "pid": pid, "args": {"value": value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, fname):
+        with open(fname, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def _get_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _now_us(self):
+        return int((timeit.default_timer() - self._start) * 1e6)
+
+    def _update_peak_memory(self, stack):
+        # fold the peak since the last reset into all open spans, so that nested spans can reset the peak
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_span in stack:
+            open_span.peak_memory = max(open_span.peak_memory, peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    def _stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+class _Span(object):
+    __slots__ = ("recorder", "name", "args", "start_us", "peak_memory")
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.start_us = None
+        self.peak_memory = 0
+
+    def annotate(self, **args):
+        """Add extra information to the span."""
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = self.recorder._get_stack()
+        if self.recorder.trace_memory and tracemalloc.is_tracing():
+            self.recorder._update_peak_memory(stack)
+        stack.append(self)
+        self.start_us = self.recorder._now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        recorder = self.recorder
+        end_us = recorder._now_us()
+        stack = recorder._get_stack()
+        peak_memory = None
+        if recorder.trace_memory and tracemalloc.is_tracing():
+            recorder._update_peak_memory(stack)
+            peak_memory = self.peak_memory
+        stack.remove(self)
+        record = OrderedDict([
+            ("name", self.name),
+            ("start_us", self.start_us),
+            ("duration_us", end_us - self.start_us),
+            ("thread_id", threading.current_thread().ident),
+            ("depth", len(stack)),
+            ("args", self.args),
+        ])
+        if peak_memory is not None:
+            record["peak_memory_bytes"] = peak_memory
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with recorder._lock:
+            recorder.spans.append(record)
+        return False
+
+
+class _NullSpan(object):
+
+    def annotate(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _qualified_name(function):
+    return getattr(function, "__qualname__", function.__name__)
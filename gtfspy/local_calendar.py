@@ -0,0 +1,155 @@
+"""
+Conversions between unix times and local (feed time zone) dates.
+
+GTFS defines the start of a day as "noon minus 12 hours" (local time).
+LocalCalendar precomputes these day start times for a range of local dates
+and converts unix times to (date, day seconds) pairs and back in a vectorized manner.
+The time zone is handled by pytz / pandas, so the process-global TZ environment variable is not touched.
+"""
+import numpy
+import pandas as pd
+import pytz
+from six import string_types
+
+SECONDS_IN_HALF_A_DAY = 12 * 3600
+# extra days computed at once when the calendar needs to be extended
+CALENDAR_EXTENSION_MARGIN_DAYS = 366
+
+
+class LocalCalendar(object):
+
+    def __init__(self, timezone, first_date=None, last_date=None):
+        """
+        Parameters
+        ----------
+        timezone: str | pytz.tzinfo.BaseTzInfo
+            e.g. "Europe/Helsinki"
+        first_date: str | datetime.date, optional
+            first local date for which the day start time is precomputed
+        last_date: str | datetime.date, optional
+            last local date for which the day start time is precomputed
+        """
+        if isinstance(timezone, string_types):
+            timezone = pytz.timezone(timezone)
+        self._timezone = timezone
+        # (first day number, day start times of consecutive days), replaced as a whole when extended
+        self._day_starts = (0, numpy.zeros(0, dtype=numpy.int64))
+        if first_date is not None:
+            first_day = to_day_numbers(first_date)
+            last_day = to_day_numbers(last_date) if last_date is not None else first_day
+            self._extend(int(first_day), int(last_day))
+
+    def local_day_numbers(self, uts):
+        """
+        Local dates of unix times, as the number of days since 1970-01-01.
+
+        Parameters
+        ----------
+        uts: int | list-like of ints
+
+        Returns
+        -------
+        day_numbers: numpy.array of ints
+        """
+        uts = numpy.asarray(uts, dtype=numpy.int64)
+        local_times = pd.to_datetime(uts.ravel(), unit='s', utc=True).tz_convert(self._timezone).tz_localize(None)
+        return local_times.values.astype('datetime64[D]').astype(numpy.int64).reshape(uts.shape)
+
+    def day_start_uts_of_days(self, day_numbers):
+        """
+        Parameters
+        ----------
+        day_numbers: int | list-like of ints
+            local dates as the number of days since 1970-01-01 (see to_day_numbers)
+
+        Returns
+        -------
+        day_start_uts: numpy.array of ints
+        """
+        day_numbers = numpy.asarray(day_numbers, dtype=numpy.int64)
+        if day_numbers.size > 0:
+            self._extend(int(day_numbers.min()), int(day_numbers.max()))
+        first_day, day_start_uts = self._day_starts
+        return day_start_uts[day_numbers - first_day]
+
+    def day_start_uts(self, uts):
+        """
+        Day start times of the local dates of unix times.
+
+        Parameters
+        ----------
+        uts: int | list-like of ints
+
+        Returns
+        -------
+        day_start_uts: numpy.array of ints
+        """
+        return self.day_start_uts_of_days(self.local_day_numbers(uts))
+
+    def to_dates_and_ds(self, uts):
+        """
+        Convert unix times to local dates and seconds since the day start.
+
+        Parameters
+        ----------
+        uts: int | list-like of ints
+
+        Returns
+        -------
+        dates: numpy.array of numpy.datetime64[D]
+        ds: numpy.array of ints
+        """
+        uts = numpy.asarray(uts, dtype=numpy.int64)
+        day_numbers = self.local_day_numbers(uts)
+        return day_numbers.astype('datetime64[D]'), uts - self.day_start_uts_of_days(day_numbers)
+
+    def to_uts(self, dates, ds):
+        """
+        Convert local dates and seconds since the day start to unix times.
+
+        Parameters
+        ----------
+        dates: str | datetime.date | list-like of those
+        ds: int | list-like of ints
+
+        Returns
+        -------
+        uts: numpy.array of ints
+        """
+        return self.day_start_uts_of_days(to_day_numbers(dates)) + numpy.asarray(ds, dtype=numpy.int64)
+
+    def _extend(self, first_day, last_day):
+        current_first_day, current_day_starts = self._day_starts
+        current_last_day = current_first_day + len(current_day_starts) - 1
+        if len(current_day_starts) > 0 and current_first_day <= first_day and last_day <= current_last_day:
+            return
+        if len(current_day_starts) > 0:
+            first_day = min(first_day, current_first_day)
+            last_day = max(last_day, current_last_day)
+            if first_day < current_first_day:
+                first_day -= CALENDAR_EXTENSION_MARGIN_DAYS
+            if last_day > current_last_day:
+                last_day += CALENDAR_EXTENSION_MARGIN_DAYS
+        noons = pd.DatetimeIndex(numpy.arange(first_day, last_day + 1).astype('datetime64[D]')) + \
+            pd.Timedelta(hours=12)
+        local_noons = noons.tz_localize(self._timezone,
+                                        ambiguous=numpy.ones(len(noons), dtype=bool),
+                                        nonexistent='shift_forward')
+        day_start_uts = local_noons.tz_convert(None).values.astype('datetime64[s]').astype(numpy.int64) - \
+            SECONDS_IN_HALF_A_DAY
+        self._day_starts = (first_day, day_start_uts)
+
+
+def to_day_numbers(dates):
+    """
+    Parameters
+    ----------
+    dates: str | datetime.date | numpy.datetime64 | list-like of those
+        dates, strings should be formatted as "YYYY-MM-DD"
+
+    Returns
+    -------
+    day_numbers: numpy.array of ints
+        number of days since 1970-01-01
+    """
+    return numpy.asarray(dates, dtype='datetime64[D]').astype(numpy.int64)
@@ -1,8 +1,9 @@
 import networkx
+import numpy
 import pandas as pd
 from math import isnan
 from gtfspy import route_types
-from gtfspy.util import wgs84_distance
+from gtfspy.segments import get_segment_events_from_clause
 from warnings import warn
 
 ALL_STOP_TO_STOP_LINK_ATTRIBUTES = [
@@ -63,7 +64,7 @@ def walk_transfer_stop_to_stop_network(gtfs, max_link_distance=None):
             if stop_distance_tuple.d > max_link_distance:
                 continue
             data = {'d': stop_distance_tuple.d}
-        net.add_edge(from_node, to_node, data)
+        net.add_edge(from_node, to_node, **data)
     return net
 
 
@@ -109,66 +110,106 @@ def stop_to_stop_network_for_route_type(gtfs,
     net = networkx.DiGraph()
     _add_stops_to_net(net, stops_dataframe)
 
-    events_df = gtfs.get_transit_events(start_time_ut=start_time_ut,
-                                        end_time_ut=end_time_ut,
-                                        route_type=route_type)
+    edges = stop_to_stop_network_edges(gtfs,
+                                       link_attributes=link_attributes,
+                                       start_time_ut=start_time_ut,
+                                       end_time_ut=end_time_ut,
+                                       route_type=route_type)
     if len(net.nodes()) < 2:
-        assert events_df.shape[0] == 0
-
-    # group events by links, and loop over them (i.e. each link):
-    link_event_groups = events_df.groupby(['from_stop_I', 'to_stop_I'], sort=False)
-    for key, link_events in link_event_groups:
-        from_stop_I, to_stop_I = key
-        assert isinstance(link_events, pd.DataFrame)
-        # 'dep_time_ut' 'arr_time_ut' 'shape_id' 'route_type' 'trip_I' 'duration' 'from_seq' 'to_seq'
-        if link_attributes is None:
-            net.add_edge(from_stop_I, to_stop_I)
-        else:
-            link_data = {}
-            if "duration_min" in link_attributes:
-                link_data['duration_min'] = float(link_events['duration'].min())
-            if "duration_max" in link_attributes:
-                link_data['duration_max'] = float(link_events['duration'].max())
-            if "duration_median" in link_attributes:
-                link_data['duration_median'] = float(link_events['duration'].median())
-            if "duration_avg" in link_attributes:
-                link_data['duration_avg'] = float(link_events['duration'].mean())
-            # statistics on numbers of vehicles:
-            if "n_vehicles" in link_attributes:
-                link_data['n_vehicles'] = int(link_events.shape[0])
-            if "capacity_estimate" in link_attributes:
-                link_data['capacity_estimate'] = route_types.ROUTE_TYPE_TO_APPROXIMATE_CAPACITY[route_type] \
-                                                 * int(link_events.shape[0])
-            if "d" in link_attributes:
-                from_lat = net.node[from_stop_I]['lat']
-                from_lon = net.node[from_stop_I]['lon']
-                to_lat = net.node[to_stop_I]['lat']
-                to_lon = net.node[to_stop_I]['lon']
-                distance = wgs84_distance(from_lat, from_lon, to_lat, to_lon)
-                link_data['d'] = int(distance)
-            if "distance_shape" in link_attributes:
-                assert "shape_id" in link_events.columns.values
-                found = None
-                for i, shape_id in enumerate(link_events["shape_id"].values):
-                    if shape_id is not None:
-                        found = i
-                        break
-                if found is None:
-                    link_data["distance_shape"] = None
-                else:
-                    link_event = link_events.iloc[found]
-                    distance = gtfs.get_shape_distance_between_stops(
-                        link_event["trip_I"],
-                        int(link_event["from_seq"]),
-                        int(link_event["to_seq"])
-                    )
-                    link_data['distance_shape'] = distance
-            if "route_I_counts" in link_attributes:
-                link_data["route_I_counts"] = link_events.groupby("route_I").size().to_dict()
-            net.add_edge(from_stop_I, to_stop_I, attr_dict=link_data)
+        assert edges.shape[0] == 0
+    _add_edges_to_net(net, edges, link_attributes)
     return net
 
 
+def stop_to_stop_network_edges(gtfs,
+                               link_attributes=None,
+                               start_time_ut=None,
+                               end_time_ut=None,
+                               route_type=None):
+    """
+    Compute the links of the stop-to-stop networks of all route types (or of one route type)
+    in a single grouped pass over the transit events.
+
+    Parameters
+    ----------
+    gtfs : gtfspy.GTFS
+    link_attributes: list[str], optional
+        see stop_to_stop_network_for_route_type, defaults to DEFAULT_STOP_TO_STOP_LINK_ATTRIBUTES
+    start_time_ut: int, optional
+        start time of the time span (in unix time)
+    end_time_ut: int, optional
+        end time of the time span (in unix time)
+    route_type: int, optional
+        If given, only links of this route_type are computed.
+
+    Returns
+    -------
+    edges: pandas.DataFrame
+        with columns route_type, from_stop_I, to_stop_I, and one column for each link attribute.
+        Each row corresponds to one link of the stop-to-stop network of a route type.
+    """
+    if link_attributes is None:
+        link_attributes = DEFAULT_STOP_TO_STOP_LINK_ATTRIBUTES
+    link_keys = ['route_type', 'from_stop_I', 'to_stop_I']
+    from_clause, params = get_segment_events_from_clause(gtfs, start_time_ut, end_time_ut, route_type)
+    events = pd.read_sql_query("SELECT route_type, from_stop_I, to_stop_I, arr_time_ut - dep_time_ut AS duration, "
+                               "distance, route_I, trip_I, seq " + from_clause +
+                               " ORDER BY trip_I, dep_time_ut", gtfs.conn, params=params)
+    link_groups = events.groupby(link_keys, sort=False)
+    edges = link_groups.size().to_frame('n_vehicles')
+    durations = link_groups['duration']
+    if "duration_min" in link_attributes:
+        edges['duration_min'] = durations.min().astype(float)
+    if "duration_max" in link_attributes:
+        edges['duration_max'] = durations.max().astype(float)
+    if "duration_median" in link_attributes:
+        edges['duration_median'] = durations.median().astype(float)
+    if "duration_avg" in link_attributes:
+        edges['duration_avg'] = durations.mean().astype(float)
+    edges = edges.reset_index()
+    if "capacity_estimate" in link_attributes:
+        capacities = [route_types.ROUTE_TYPE_TO_APPROXIMATE_CAPACITY[link_route_type]
+                      for link_route_type in edges['route_type'].tolist()]
+        edges['capacity_estimate'] = numpy.array(capacities, dtype=int) * edges['n_vehicles'].values
+    if "d" in link_attributes:
+        # all segments between the same stops have the same straight line distance
+        edges['d'] = link_groups['distance'].first().values
+    if "distance_shape" in link_attributes:
+        edges['distance_shape'] = pd.Series(_get_link_shape_distances(gtfs, events, edges, link_keys),
+                                            index=edges.index, dtype=object)
+    if "route_I_counts" in link_attributes:
+        route_counts = events.groupby(link_keys + ['route_I']).size()
+        link_to_route_counts = {}
+        for (link_route_type, from_stop_I, to_stop_I, route_I), count in route_counts.items():
+            link = (link_route_type, from_stop_I, to_stop_I)
+            link_to_route_counts.setdefault(link, {})[route_I] = int(count)
+        edges['route_I_counts'] = [link_to_route_counts[link]
+                                   for link in zip(edges['route_type'], edges['from_stop_I'], edges['to_stop_I'])]
+    if "n_vehicles" not in link_attributes:
+        del edges['n_vehicles']
+    return edges
+
+
+def _get_link_shape_distances(gtfs, events, edges, link_keys):
+    """
+    For each link, the distance along the shape of the first trip (in the event order) that has a shape.
+
+    Returns
+    -------
+    distances: list
+        ints (or Nones), aligned with the rows of edges
+    """
+    trips_with_shape = gtfs.execute_custom_query_pandas("SELECT trip_I FROM trips WHERE shape_id IS NOT NULL")
+    shape_events = events[events['trip_I'].isin(trips_with_shape['trip_I'].values)]
+    first_shape_events = shape_events.groupby(link_keys, sort=False)[['trip_I', 'seq']].first()
+    shape_distances = gtfs.get_shape_distances_between_stops(first_shape_events['trip_I'].values,
+                                                             first_shape_events['seq'].values,
+                                                             first_shape_events['seq'].values + 1)
+    link_to_shape_distance = dict(zip(first_shape_events.index, shape_distances))
+    return [link_to_shape_distance.get(link)
+            for link in zip(edges['route_type'], edges['from_stop_I'], edges['to_stop_I'])]
+
+
 def stop_to_stop_networks_by_type(gtfs):
     """
     Compute stop-to-stop networks for all travel modes (route_types).
@@ -183,11 +224,14 @@ def stop_to_stop_networks_by_type(gtfs):
         keys should be one of route_types.ALL_ROUTE_TYPES (i.e. GTFS route_types)
     """
     route_type_to_network = dict()
+    edges = stop_to_stop_network_edges(gtfs)
     for route_type in route_types.ALL_ROUTE_TYPES:
         if route_type == route_types.WALK:
             net = walk_transfer_stop_to_stop_network(gtfs)
         else:
-            net = stop_to_stop_network_for_route_type(gtfs, route_type)
+            net = networkx.DiGraph()
+            _add_stops_to_net(net, gtfs.get_stops_for_route_type(route_type))
+            _add_edges_to_net(net, edges[edges['route_type'] == route_type], DEFAULT_STOP_TO_STOP_LINK_ATTRIBUTES)
         route_type_to_network[route_type] = net
     assert len(route_type_to_network) == len(route_types.ALL_ROUTE_TYPES)
     return route_type_to_network
@@ -209,13 +253,14 @@ def combined_stop_to_stop_transit_network(gtfs, start_time_ut=None, end_time_ut=
         keys should be one of route_types.TRANSIT_ROUTE_TYPES (i.e. GTFS route_types)
     """
     multi_di_graph = networkx.MultiDiGraph()
-    for route_type in route_types.TRANSIT_ROUTE_TYPES:
-        graph = stop_to_stop_network_for_route_type(gtfs, route_type,
-                                                    start_time_ut=start_time_ut, end_time_ut=end_time_ut)
-        for from_node, to_node, data in graph.edges(data=True):
-            data['route_type'] = route_type
-        multi_di_graph.add_edges_from(graph.edges(data=True))
-        multi_di_graph.add_nodes_from(graph.nodes(data=True))
+    edges = stop_to_stop_network_edges(gtfs, start_time_ut=start_time_ut, end_time_ut=end_time_ut)
+    edges = edges[edges['route_type'].isin(route_types.TRANSIT_ROUTE_TYPES)]
+    stops = gtfs.execute_custom_query_pandas(
+        "SELECT DISTINCT stops.stop_I, stops.lat, stops.lon, stops.name FROM stops "
+        "JOIN stop_times USING(stop_I) JOIN trips USING(trip_I) JOIN routes USING(route_I) "
+        "WHERE routes.type IN (" + ",".join(str(rt) for rt in route_types.TRANSIT_ROUTE_TYPES) + ")")
+    _add_stops_to_net(multi_di_graph, stops)
+    _add_edges_to_net(multi_di_graph, edges, DEFAULT_STOP_TO_STOP_LINK_ATTRIBUTES + ["route_type"])
     return multi_di_graph
 
 def _add_stops_to_net(net, stops):
@@ -233,7 +278,24 @@ def _add_stops_to_net(net, stops):
             "lon": stop.lon,
             "name": stop.name
         }
-        net.add_node(stop.stop_I, data)
+        net.add_node(stop.stop_I, **data)
+
+def _add_edges_to_net(net, edges, link_attributes):
+    """
+    Add links to the network from the edge dataframe produced by stop_to_stop_network_edges.
+
+    Parameters
+    ----------
+    net: networkx.DiGraph
+    edges: pandas.DataFrame
+    link_attributes: list[str]
+    """
+    columns = [column for column in link_attributes if column in edges.columns]
+    values = zip(*[edges[column].tolist() for column in columns]) if columns else [()] * len(edges)
+    for from_stop_I, to_stop_I, link_values in zip(edges['from_stop_I'].tolist(),
+                                                   edges['to_stop_I'].tolist(),
+                                                   values):
+        net.add_edge(from_stop_I, to_stop_I, **dict(zip(columns, link_values)))
 
 def temporal_network(gtfs,
                      start_time_ut=None,
@@ -1,18 +1,24 @@
+import argparse
+import json
+import multiprocessing
 import os
+import sqlite3
+from array import array
 
 import networkx
+import numpy
 import pandas
-from osmread import parse_file, Way, Node
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
 
 from gtfspy.gtfs import GTFS
-from gtfspy.util import wgs84_distance
+from gtfspy.util import to_unit_sphere, wgs84_distances, wgs84_height, wgs84_width
 
 from warnings import warn
 
-from geoindex import GeoGridIndex, GeoPoint
 
-
-def add_walk_distances_to_db_python(gtfs, osm_path, cutoff_distance_m=1000):
+def add_walk_distances_to_db_python(gtfs, osm_path, cutoff_distance_m=1000, n_processes=1, batch_size=16):
     """
     Computes the walk paths between stops, and updates these to the gtfs database.
 
@@ -24,6 +30,11 @@ def add_walk_distances_to_db_python(gtfs, osm_path, cutoff_distance_m=1000):
         path to the OpenStreetMap file
     cutoff_distance_m: number
         maximum allowed distance in meters
+    n_processes: int
+        number of processes used for computing the shortest path distances
+    batch_size: int
+        number of source stops handled by one Dijkstra call.
+        Memory usage is proportional to batch_size times the number of nodes in the walk network.
 
     Returns
     -------
@@ -33,90 +44,127 @@ def add_walk_distances_to_db_python(gtfs, osm_path, cutoff_distance_m=1000):
     --------
     gtfspy.calc_transfers
     compute_walk_paths_java
+    create_compact_walk_network_from_osm
     """
     if isinstance(gtfs, str):
         gtfs = GTFS(gtfs)
     assert (isinstance(gtfs, GTFS))
+    stops_df = gtfs.stops()
     print("Reading in walk network")
-    walk_network = create_walk_network_from_osm(osm_path)
+    walk_network = create_compact_walk_network_from_osm(
+        osm_path,
+        bounding_box=get_stops_bounding_box(stops_df, buffer_m=cutoff_distance_m),
+        protected_coordinates=(stops_df['lat'].values, stops_df['lon'].values)
+    )
+    if walk_network.n_nodes() == 0:
+        warn("No walkable OSM ways found around the stops, no walking distances computed")
+        return
     print("Matching stops to the OSM network")
-    stop_I_to_nearest_osm_node, stop_I_to_nearest_osm_node_distance = match_stops_to_nodes(gtfs, walk_network)
+    node_indices, node_distances = walk_network.nearest_nodes(stops_df['lat'].values, stops_df['lon'].values)
+    stop_I_to_node_index = {}
+    stop_I_to_node_distance = {}
+    for stop_I, node_index, node_distance in zip(stops_df['stop_I'].values, node_indices, node_distances):
+        if node_distance > MAX_STOP_TO_OSM_NODE_DISTANCE_M:
+            warn("No OSM node found for stop: " + str(stops_df[stops_df.stop_I == stop_I]))
+            continue
+        stop_I_to_node_index[stop_I] = node_index
+        stop_I_to_node_distance[stop_I] = node_distance
 
     transfers = gtfs.get_straight_line_transfer_distances()
+    print("Computing walking distances")
+    walk_distances = _compute_stop_to_stop_walk_distances(walk_network.to_sparse_matrix(),
+                                                          transfers,
+                                                          stop_I_to_node_index,
+                                                          stop_I_to_node_distance,
+                                                          cutoff_distance_m,
+                                                          n_processes,
+                                                          batch_size)
+    straight_distances = transfers['d'].values
+    assert (straight_distances < walk_distances + 2).all()  # allow for a maximum  of 2 meters in calculations
+    valid = walk_distances <= cutoff_distance_m
+    gtfs.conn.executemany("UPDATE stop_distances SET d_walk=? WHERE from_stop_I=? AND to_stop_I=?",
+                          zip(walk_distances[valid].astype(int).tolist(),
+                              transfers['from_stop_I'].values[valid].tolist(),
+                              transfers['to_stop_I'].values[valid].tolist()))
+    gtfs.conn.commit()
 
-    from_I_to_to_stop_Is = {stop_I: set() for stop_I in stop_I_to_nearest_osm_node}
-    for transfer_tuple in transfers.itertuples():
-        from_I = transfer_tuple.from_stop_I
-        to_I = transfer_tuple.to_stop_I
-        from_I_to_to_stop_Is[from_I].add(to_I)
 
-    print("Computing walking distances")
-    for from_I, to_stop_Is in from_I_to_to_stop_Is.items():
-        from_node = stop_I_to_nearest_osm_node[from_I]
-        from_dist = stop_I_to_nearest_osm_node_distance[from_I]
-        shortest_paths = networkx.single_source_dijkstra_path_length(walk_network,
-                                                                     from_node,
-                                                                     cutoff=cutoff_distance_m - from_dist,
-                                                                     weight="distance")
-        for to_I in to_stop_Is:
-            to_distance = stop_I_to_nearest_osm_node_distance[to_I]
-            to_node = stop_I_to_nearest_osm_node[to_I]
-            osm_distance = shortest_paths.get(to_node, float('inf'))
-            total_distance = from_dist + osm_distance + to_distance
-            from_stop_I_transfers = transfers[transfers['from_stop_I'] == from_I]
-            straigth_distance = from_stop_I_transfers[from_stop_I_transfers["to_stop_I"] == to_I]["d"].values[0]
-            assert (straigth_distance < total_distance + 2)  # allow for a maximum  of 2 meters in calculations
-            if total_distance <= cutoff_distance_m:
-                gtfs.conn.execute("UPDATE stop_distances "
-                                  "SET d_walk = " + str(int(total_distance)) +
-                                  " WHERE from_stop_I=" + str(from_I) + " AND to_stop_I=" + str(to_I))
+# The walk network shared with the worker processes (set by _init_dijkstra_worker).
+_worker_csgraph = None
 
-    gtfs.conn.commit()
+
+def _init_dijkstra_worker(csgraph):
+    global _worker_csgraph
+    _worker_csgraph = csgraph
 
 
-def match_stops_to_nodes(gtfs, walk_network):
+def _bounded_dijkstra(args):
     """
+    Shortest path distances from a batch of source nodes to their target nodes.
+
     Parameters
     ----------
-    gtfs : a GTFS object
-    walk_network : networkx.Graph
+    args: tuple
+        (source_indices, target_indices, cutoff, csgraph), where target_indices is an array of the same length as
+        source_indices, and csgraph is the walk network as a sparse matrix, or None in the worker processes
+        (which use the network set by _init_dijkstra_worker).
 
     Returns
     -------
-    stop_I_to_node: dict
-        maps stop_I to closest walk_network node
-    stop_I_to_dist: dict
-        maps stop_I to the distance to the closest walk_network node
+    distances: numpy.array
+        distance for each (source, target) pair; unreachable pairs (within the cutoff) get the value inf.
     """
-    network_nodes = walk_network.nodes(data="true")
+    source_indices, target_indices, cutoff, csgraph = args
+    if csgraph is None:
+        csgraph = _worker_csgraph
+    unique_sources, source_rows = numpy.unique(source_indices, return_inverse=True)
+    distances = dijkstra(csgraph, directed=False, indices=unique_sources, limit=cutoff)
+    return distances[source_rows, target_indices]
 
-    stop_Is = set(gtfs.get_straight_line_transfer_distances()['from_stop_I'])
-    stops_df = gtfs.stops()
 
-    geo_index = GeoGridIndex(precision=6)
-    for net_node, data in network_nodes:
-        geo_index.add_point(GeoPoint(data['lat'], data['lon'], ref=net_node))
-    stop_I_to_node = {}
-    stop_I_to_dist = {}
-    for stop_I in stop_Is:
-        stop_lat = float(stops_df[stops_df.stop_I == stop_I].lat)
-        stop_lon = float(stops_df[stops_df.stop_I == stop_I].lon)
-        geo_point = GeoPoint(stop_lat, stop_lon)
-        min_dist = float('inf')
-        min_dist_node = None
-        search_distances_m = [0.100, 0.500]
-        for search_distance_m in search_distances_m:
-            for point, distance in geo_index.get_nearest_points(geo_point, search_distance_m, "km"):
-                if distance < min_dist:
-                    min_dist = distance * 1000
-                    min_dist_node = point.ref
-            if min_dist_node is not None:
-                break
-        if min_dist_node is None:
-            warn("No OSM node found for stop: " + str(stops_df[stops_df.stop_I == stop_I]))
-        stop_I_to_node[stop_I] = min_dist_node
-        stop_I_to_dist[stop_I] = min_dist
-    return stop_I_to_node, stop_I_to_dist
+def _compute_stop_to_stop_walk_distances(csgraph, transfers, stop_I_to_node_index, stop_I_to_node_distance,
+                                         cutoff_distance_m, n_processes=1, batch_size=16):
+    """
+    Compute network walking distances for all stop pairs in transfers.
+
+    Returns
+    -------
+    walk_distances: numpy.array
+        distance for each row of transfers (inf if no path within cutoff_distance_m exists)
+    """
+    from_stop_Is = transfers['from_stop_I'].values
+    to_stop_Is = transfers['to_stop_I'].values
+    walk_distances = numpy.full(len(transfers), numpy.inf)
+    matched = numpy.array([from_I in stop_I_to_node_index and to_I in stop_I_to_node_index
+                           for from_I, to_I in zip(from_stop_Is, to_stop_Is)], dtype=bool)
+    if not matched.any():
+        return walk_distances
+    source_nodes = numpy.array([stop_I_to_node_index[stop_I] for stop_I in from_stop_Is[matched]], dtype=numpy.int64)
+    target_nodes = numpy.array([stop_I_to_node_index[stop_I] for stop_I in to_stop_Is[matched]], dtype=numpy.int64)
+    access_distances = numpy.array([stop_I_to_node_distance[from_I] + stop_I_to_node_distance[to_I]
+                                    for from_I, to_I in zip(from_stop_Is[matched], to_stop_Is[matched])])
+
+    # group the pairs by source node, so that each source is handled by exactly one batch
+    order = numpy.argsort(source_nodes, kind="mergesort")
+    unique_sources, first_indices = numpy.unique(source_nodes[order], return_index=True)
+    batch_starts = first_indices[::batch_size]
+    batch_ends = numpy.append(batch_starts[1:], len(order))
+    pass_csgraph = None if n_processes > 1 else csgraph
+    batches = [(source_nodes[order[start:end]], target_nodes[order[start:end]], cutoff_distance_m, pass_csgraph)
+               for start, end in zip(batch_starts, batch_ends)]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes, initializer=_init_dijkstra_worker, initargs=(csgraph,))
+        try:
+            results = pool.map(_bounded_dijkstra, batches)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_bounded_dijkstra(batch) for batch in batches]
+    network_distances = numpy.empty(len(order))
+    network_distances[order] = numpy.concatenate(results)
+    walk_distances[matched] = network_distances + access_distances
+    return walk_distances
 
 
 OSM_HIGHWAY_WALK_TAGS = {"trunk", "trunk_link", "primary", "primary_link", "secondary", "secondary_link", "tertiary",
@@ -125,33 +173,21 @@ OSM_HIGHWAY_WALK_TAGS = {"trunk", "trunk_link", "primary", "primary_link", "seco
 
 
 def create_walk_network_from_osm(osm_file):
-    walk_network = networkx.Graph()
-    assert (os.path.exists(osm_file))
-    ways = []
-    for i, entity in enumerate(parse_file(osm_file)):
-        if isinstance(entity, Node):
-            walk_network.add_node(entity.id, lat=entity.lat, lon=entity.lon)
-        elif isinstance(entity, Way):
-            if "highway" in entity.tags:
-                if entity.tags["highway"] in OSM_HIGHWAY_WALK_TAGS:
-                    ways.append(entity)
-    for way in ways:
-        walk_network.add_path(way.nodes)
-    del ways
-
-    # Remove all singleton nodes (note that taking the giant component does not necessarily provide proper results.
-    for node, degree in walk_network.degree().items():
-        if degree is 0:
-            walk_network.remove_node(node)
-
-    node_lats = networkx.get_node_attributes(walk_network, 'lat')
-    node_lons = networkx.get_node_attributes(walk_network, 'lon')
-    for source, dest, data in walk_network.edges(data=True):
-        data["distance"] = wgs84_distance(node_lats[source],
-                                          node_lons[source],
-                                          node_lats[dest],
-                                          node_lons[dest])
-    return walk_network
+    """
+    Parameters
+    ----------
+    osm_file: str
+
+    Returns
+    -------
+    walk_network: networkx.Graph
+        nodes are OSM ids with attributes "lat" and "lon", edges have the attribute "distance"
+
+    See Also
+    --------
+    create_compact_walk_network_from_osm : the array-based walk network this graph is built from
+    """
+    return create_compact_walk_network_from_osm(osm_file, contract=False).to_networkx()
 
 
 def compute_walk_paths_java(gtfs_db_path, osm_file, cache_db=None):
@@ -165,5 +201,448 @@ def compute_walk_paths_java(gtfs_db_path, osm_file, cache_db=None):
     Returns
     -------
     None
+
+    See Also
+    --------
+    compute_walk_paths : the in-process replacement of the Java tools, to which this call is forwarded
+    """
+    warn("The Java routing tools have been replaced by compute_walk_paths, using it instead.")
+    compute_walk_paths(gtfs_db_path, osm_file, cache_db=cache_db)
+
+
+def compute_walk_paths(gtfs_db_path, osm_file, cache_db=None, n_processes=1, cutoff_distance_m=None, batch_size=16):
+    """
+    Compute walking distances on the OSM street network for all pairs in the stop_distances table,
+    and write them to its d_walk column.
+
+    This is the in-process counterpart of the tools in java_routing (RoutingMain/CacheRouter):
+    pairs that can not be routed get the distance -1, and the cache database uses the same
+    format as SqliteDistanceCache, so caches can be shared between the two.
+
+    Parameters
+    ----------
+    gtfs_db_path: str
+        path to the gtfs database
+    osm_file: str
+        path to the OpenStreetMap file
+    cache_db: str, optional
+        path to a persistent (coordinate-based) distance cache, created if it does not exist.
+        The cache is cleared if osm_file (its name, size or modification time) or cutoff_distance_m changes.
+    n_processes: int
+        number of processes used for computing the shortest path distances
+    cutoff_distance_m: number, optional
+        pairs with longer walking distances than this get the distance -1 (no limit by default)
+    batch_size: int
+        number of source stops handled by one Dijkstra call
+
+    Returns
+    -------
+    None
+    """
+    conn = sqlite3.connect(gtfs_db_path)
+    pairs = pandas.read_sql_query(
+        "SELECT from_stop_I, to_stop_I, S1.lat AS lat1, S1.lon AS lon1, S2.lat AS lat2, S2.lon AS lon2, d "
+        "FROM stop_distances "
+        "LEFT JOIN stops S1 ON (from_stop_I=S1.stop_I) "
+        "LEFT JOIN stops S2 ON (to_stop_I=S2.stop_I)", conn)
+    print("Computing distances for " + str(len(pairs)) + " coordinate pairs")
+    distances = numpy.full(len(pairs), numpy.nan)
+    cache = None
+    if cache_db is not None:
+        cache = WalkDistanceCache(cache_db, _get_walk_distance_cache_parameters(osm_file, cutoff_distance_m))
+        distances = cache.get_cached_distances(pairs)
+        print(str(numpy.isfinite(distances).sum()) + " distances found from cache")
+    missing = numpy.isnan(distances)
+    if missing.any():
+        distances[missing] = _route_stop_pairs(pairs[missing], osm_file, n_processes, cutoff_distance_m, batch_size)
+        if cache is not None:
+            cache.update(pairs[missing], distances[missing])
+    if cache is not None:
+        cache.close()
+    conn.executemany("UPDATE stop_distances SET d_walk=? WHERE from_stop_I=? AND to_stop_I=?",
+                     zip(distances.astype(int).tolist(),
+                         pairs['from_stop_I'].values.tolist(),
+                         pairs['to_stop_I'].values.tolist()))
+    conn.commit()
+    conn.close()
+
+
+def _get_walk_distance_cache_parameters(osm_file, cutoff_distance_m):
+    osm_stat = os.stat(osm_file)
+    return {"osm_file": os.path.basename(osm_file),
+            "osm_file_size": osm_stat.st_size,
+            "osm_file_mtime": int(osm_stat.st_mtime),
+            "cutoff_distance_m": cutoff_distance_m}
+
+
+def _route_stop_pairs(pairs, osm_file, n_processes=1, cutoff_distance_m=None, batch_size=16):
+    """
+    Parameters
+    ----------
+    pairs: pandas.DataFrame
+        with columns from_stop_I, to_stop_I, lat1, lon1, lat2, lon2, d
+
+    Returns
+    -------
+    distances: numpy.array
+        walking distances (-1 for pairs that could not be routed)
+    """
+    stops = pandas.concat([
+        pandas.DataFrame({"stop_I": pairs['from_stop_I'].values, "lat": pairs['lat1'].values,
+                          "lon": pairs['lon1'].values}),
+        pandas.DataFrame({"stop_I": pairs['to_stop_I'].values, "lat": pairs['lat2'].values,
+                          "lon": pairs['lon2'].values})
+    ]).drop_duplicates("stop_I").dropna()
+    # walking paths between two stops seldom leave the bounding box by more than the distance between the stops
+    buffer_m = max(MAX_STOP_TO_OSM_NODE_DISTANCE_M, pairs['d'].max())
+    if cutoff_distance_m is not None:
+        buffer_m = min(buffer_m, cutoff_distance_m)
+    print("Reading in walk network")
+    walk_network = create_compact_walk_network_from_osm(osm_file,
+                                                        bounding_box=get_stops_bounding_box(stops, buffer_m),
+                                                        protected_coordinates=(stops['lat'].values,
+                                                                               stops['lon'].values))
+    distances = numpy.full(len(pairs), -1.)
+    if walk_network.n_nodes() == 0:
+        return distances
+    node_indices, node_distances = walk_network.nearest_nodes(stops['lat'].values, stops['lon'].values)
+    matched = node_distances <= MAX_STOP_TO_OSM_NODE_DISTANCE_M
+    stop_I_to_node_index = dict(zip(stops['stop_I'].values[matched], node_indices[matched]))
+    stop_I_to_node_distance = dict(zip(stops['stop_I'].values[matched], node_distances[matched]))
+    print("Computing walking distances")
+    cutoff = numpy.inf if cutoff_distance_m is None else cutoff_distance_m
+    walk_distances = _compute_stop_to_stop_walk_distances(walk_network.to_sparse_matrix(),
+                                                          pairs,
+                                                          stop_I_to_node_index,
+                                                          stop_I_to_node_distance,
+                                                          cutoff,
+                                                          n_processes,
+                                                          batch_size)
+    routed = walk_distances <= cutoff
+    distances[routed] = walk_distances[routed].astype(int)
+    return distances
+
+
+class WalkDistanceCache(object):
+    """
+    Persistent, coordinate-based cache of walking distances.
+
+    The table layout is the same as in java_routing/SqliteDistanceCache.
+    The parameters the distances were computed with (e.g. the OSM file and the cutoff distance)
+    are stored in an additional table, and the cached distances are discarded when they change.
+    """
+
+    def __init__(self, cache_db_path, parameters=None):
+        """
+        Parameters
+        ----------
+        cache_db_path: str
+        parameters: dict, optional
+            JSON serializable description of how the distances are computed
+        """
+        self.conn = sqlite3.connect(cache_db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stop_distances "
+                          "(lat1 REAL, lon1 REAL, lat2 REAL, lon2 REAL, d_walk INT)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS coordinate_index ON stop_distances "
+                          "(lat1, lon1, lat2, lon2)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_parameters (parameters TEXT)")
+        parameters = json.dumps(parameters, sort_keys=True)
+        row = self.conn.execute("SELECT parameters FROM cache_parameters").fetchone()
+        # caches without recorded parameters (e.g. written by the Java tools) are used as such
+        if row is not None and row[0] != parameters:
+            print("Walk distance cache computed with other parameters, discarding it")
+            self.conn.execute("DELETE FROM stop_distances")
+        if row is None or row[0] != parameters:
+            self.conn.execute("DELETE FROM cache_parameters")
+            self.conn.execute("INSERT INTO cache_parameters (parameters) VALUES (?)", (parameters,))
+        self.conn.commit()
+
+    def get_cached_distances(self, pairs):
+        """
+        Parameters
+        ----------
+        pairs: pandas.DataFrame
+            with columns lat1, lon1, lat2, lon2
+
+        Returns
+        -------
+        distances: numpy.array
+            cached distances, nan for pairs not found in the cache
+        """
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_pairs "
+                          "(i INT, lat1 REAL, lon1 REAL, lat2 REAL, lon2 REAL)")
+        self.conn.execute("DELETE FROM query_pairs")
+        self.conn.executemany("INSERT INTO query_pairs VALUES (?, ?, ?, ?, ?)",
+                              zip(range(len(pairs)),
+                                  pairs['lat1'].values.tolist(), pairs['lon1'].values.tolist(),
+                                  pairs['lat2'].values.tolist(), pairs['lon2'].values.tolist()))
+        distances = numpy.full(len(pairs), numpy.nan)
+        rows = self.conn.execute("SELECT i, d_walk FROM query_pairs "
+                                 "JOIN stop_distances USING (lat1, lon1, lat2, lon2)").fetchall()
+        if rows:
+            indices, cached = zip(*rows)
+            distances[list(indices)] = cached
+        self.conn.execute("DELETE FROM query_pairs")
+        return distances
+
+    def update(self, pairs, distances):
+        """
+        Parameters
+        ----------
+        pairs: pandas.DataFrame
+            with columns lat1, lon1, lat2, lon2
+        distances: list-like
+        """
+        self.conn.executemany("INSERT OR REPLACE INTO stop_distances (lat1, lon1, lat2, lon2, d_walk) "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              zip(pairs['lat1'].values.tolist(), pairs['lon1'].values.tolist(),
+                                  pairs['lat2'].values.tolist(), pairs['lon2'].values.tolist(),
+                                  numpy.asarray(distances).astype(int).tolist()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# Stops farther away than this from any OSM node are not matched to the walk network.
+MAX_STOP_TO_OSM_NODE_DISTANCE_M = 500
+
+
+class WalkNetwork(object):
+    """
+    A compact, array-based representation of an undirected walk network.
+
+    Attributes
+    ----------
+    node_ids: numpy.array
+        OSM ids of the nodes
+    lats, lons: numpy.array
+        coordinates of the nodes
+    sources, targets: numpy.array
+        node indices of the edge end points
+    distances: numpy.array
+        edge lengths in meters
+    """
+
+    def __init__(self, node_ids, lats, lons, sources, targets, distances):
+        self.node_ids = node_ids
+        self.lats = lats
+        self.lons = lons
+        self.sources = sources
+        self.targets = targets
+        self.distances = distances
+        self._kd_tree = None
+
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    def n_edges(self):
+        return len(self.sources)
+
+    def to_sparse_matrix(self):
+        """
+        Returns
+        -------
+        csgraph: scipy.sparse.csr_matrix
+            symmetric adjacency matrix with the edge distances as weights.
+            Of parallel edges, only the shortest is kept.
+        """
+        rows = numpy.concatenate((self.sources, self.targets))
+        cols = numpy.concatenate((self.targets, self.sources))
+        distances = numpy.concatenate((self.distances, self.distances))
+        order = numpy.lexsort((distances, cols, rows))
+        rows, cols, distances = rows[order], cols[order], distances[order]
+        first = numpy.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        n_nodes = self.n_nodes()
+        return csr_matrix((distances[first], (rows[first], cols[first])), shape=(n_nodes, n_nodes))
+
+    def to_networkx(self):
+        """
+        Returns
+        -------
+        walk_network: networkx.Graph
+            nodes are OSM ids with attributes "lat" and "lon", edges have the attribute "distance"
+        """
+        walk_network = networkx.Graph()
+        node_ids = self.node_ids.tolist()
+        for node_id, lat, lon in zip(node_ids, self.lats.tolist(), self.lons.tolist()):
+            walk_network.add_node(node_id, lat=lat, lon=lon)
+        for source, target, distance in zip(self.sources.tolist(), self.targets.tolist(), self.distances.tolist()):
+            source_id = node_ids[source]
+            target_id = node_ids[target]
+            if not walk_network.has_edge(source_id, target_id) or \
+                    walk_network[source_id][target_id]["distance"] > distance:
+                walk_network.add_edge(source_id, target_id, distance=distance)
+        return walk_network
+
+    def nearest_nodes(self, lats, lons):
+        """
+        Parameters
+        ----------
+        lats, lons: numpy.array
+
+        Returns
+        -------
+        node_indices: numpy.array
+            index of the closest node for each coordinate pair
+        distances: numpy.array
+            distances to the closest nodes in meters
+        """
+        if self.n_nodes() == 0:
+            raise ValueError("The walk network is empty")
+        if self._kd_tree is None:
+            self._kd_tree = cKDTree(to_unit_sphere(self.lats, self.lons))
+        _, node_indices = self._kd_tree.query(to_unit_sphere(lats, lons))
+        distances = wgs84_distances(lats, lons, self.lats[node_indices], self.lons[node_indices])
+        return node_indices, distances
+
+
+def get_stops_bounding_box(stops_df, buffer_m=0):
+    """
+    Parameters
+    ----------
+    stops_df: pandas.DataFrame
+        with columns "lat" and "lon"
+    buffer_m: number
+        size of the buffer added around the stops
+
+    Returns
+    -------
+    bounding_box: dict
+        with keys "lat_min", "lat_max", "lon_min", "lon_max"
+    """
+    lat_min, lat_max = stops_df['lat'].min(), stops_df['lat'].max()
+    lon_min, lon_max = stops_df['lon'].min(), stops_df['lon'].max()
+    lat_diff = wgs84_height(buffer_m)
+    # use the latitude farthest away from the equator, so that the buffer is large enough everywhere
+    lon_diff = wgs84_width(buffer_m, max(abs(lat_min), abs(lat_max)))
+    return {"lat_min": lat_min - lat_diff,
+            "lat_max": lat_max + lat_diff,
+            "lon_min": lon_min - lon_diff,
+            "lon_max": lon_max + lon_diff}
+
+
+def create_compact_walk_network_from_osm(osm_file, bounding_box=None, protected_coordinates=None, contract=True):
+    """
+    Stream through an OSM file and build a compact walk network.
+
+    Only nodes inside bounding_box are stored, and only ways with a walkable highway tag are used.
+    Ways are split where they leave the bounding box.
+    As in standard OSM files, all nodes are assumed to precede the ways.
+
+    Parameters
+    ----------
+    osm_file: str
+        path to the OpenStreetMap file (.osm, .osm.bz2 or .osm.pbf)
+    bounding_box: dict, optional
+        with keys "lat_min", "lat_max", "lon_min", "lon_max", see get_stops_bounding_box
+    protected_coordinates: tuple of (lats, lons), optional
+        the closest nodes to these coordinates (typically the stops) are never removed when contracting
+    contract: bool
+        whether to contract chains of degree-2 nodes into single edges
+
+    Returns
+    -------
+    walk_network: WalkNetwork
     """
-    raise NotImplementedError("This has not been pipelined yet. Please see the Python code.")
+    from osmread import parse_file, Way, Node
+    assert (os.path.exists(osm_file))
+    if bounding_box is None:
+        lat_min, lat_max, lon_min, lon_max = -90, 90, -180, 180
+    else:
+        lat_min, lat_max = bounding_box["lat_min"], bounding_box["lat_max"]
+        lon_min, lon_max = bounding_box["lon_min"], bounding_box["lon_max"]
+
+    node_id_to_index = {}
+    node_ids = array('q')
+    lats = array('d')
+    lons = array('d')
+    # walkable parts of ways inside the bounding box, stored as consecutive node indices
+    segment_nodes = array('q')
+    segment_ids = array('q')
+    n_segments = 0
+    for entity in parse_file(osm_file):
+        if isinstance(entity, Node):
+            if lat_min <= entity.lat <= lat_max and lon_min <= entity.lon <= lon_max:
+                node_id_to_index[entity.id] = len(node_ids)
+                node_ids.append(entity.id)
+                lats.append(entity.lat)
+                lons.append(entity.lon)
+        elif isinstance(entity, Way):
+            if entity.tags.get("highway") not in OSM_HIGHWAY_WALK_TAGS:
+                continue
+            current = []
+            for node_id in list(entity.nodes) + [None]:
+                index = node_id_to_index.get(node_id)
+                if index is not None:
+                    current.append(index)
+                    continue
+                if len(current) > 1:
+                    segment_nodes.extend(current)
+                    segment_ids.extend([n_segments] * len(current))
+                    n_segments += 1
+                current = []
+    del node_id_to_index
+
+    node_ids = numpy.frombuffer(node_ids, dtype=numpy.int64)
+    lats = numpy.frombuffer(lats, dtype=float)
+    lons = numpy.frombuffer(lons, dtype=float)
+    segment_nodes = numpy.frombuffer(segment_nodes, dtype=numpy.int64)
+    segment_ids = numpy.frombuffer(segment_ids, dtype=numpy.int64)
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    if len(segment_nodes) == 0:
+        return WalkNetwork(empty, numpy.zeros(0), numpy.zeros(0), empty, empty, numpy.zeros(0))
+
+    same_segment = segment_ids[1:] == segment_ids[:-1]
+    step_distances = numpy.where(same_segment,
+                                 wgs84_distances(lats[segment_nodes[:-1]], lons[segment_nodes[:-1]],
+                                                 lats[segment_nodes[1:]], lons[segment_nodes[1:]]),
+                                 0)
+    cumulative_distances = numpy.concatenate(([0.], numpy.cumsum(step_distances)))
+
+    # decide which positions along the segments are kept as network nodes
+    if contract:
+        is_segment_end = numpy.ones(len(segment_nodes), dtype=bool)
+        is_segment_end[1:-1] = ~same_segment[1:] | ~same_segment[:-1]
+        keep_node = numpy.bincount(segment_nodes, minlength=len(node_ids)) > 1
+        if protected_coordinates is not None:
+            used_nodes = numpy.unique(segment_nodes)
+            tree = cKDTree(to_unit_sphere(lats[used_nodes], lons[used_nodes]))
+            _, nearest = tree.query(to_unit_sphere(*protected_coordinates))
+            keep_node[used_nodes[nearest]] = True
+        kept_positions = numpy.nonzero(is_segment_end | keep_node[segment_nodes])[0]
+    else:
+        kept_positions = numpy.arange(len(segment_nodes))
+
+    edge_starts = kept_positions[:-1]
+    edge_ends = kept_positions[1:]
+    valid = (segment_ids[edge_starts] == segment_ids[edge_ends]) & \
+            (segment_nodes[edge_starts] != segment_nodes[edge_ends])
+    edge_starts = edge_starts[valid]
+    edge_ends = edge_ends[valid]
+    distances = cumulative_distances[edge_ends] - cumulative_distances[edge_starts]
+
+    used_nodes, inverse = numpy.unique(numpy.concatenate((segment_nodes[edge_starts], segment_nodes[edge_ends])),
+                                       return_inverse=True)
+    n_edges = len(edge_starts)
+    return WalkNetwork(node_ids[used_nodes].copy(),
+                       lats[used_nodes].copy(),
+                       lons[used_nodes].copy(),
+                       inverse[:n_edges],
+                       inverse[n_edges:],
+                       distances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute walking distances between stops using OpenStreetMap data.")
+    parser.add_argument("gtfs_db", help="path to the gtfspy database to be updated")
+    parser.add_argument("osm_file", help="path to the *.osm(.pbf) file")
+    parser.add_argument("--cache", "-c", default=None, help="path to the distance cache")
+    parser.add_argument("-n", "--n_processes", type=int, default=1, help="number of processes to use")
+    args = parser.parse_args()
+    compute_walk_paths(args.gtfs_db, args.osm_file, cache_db=args.cache, n_processes=args.n_processes)
+
+
+if __name__ == "__main__":
+    main()
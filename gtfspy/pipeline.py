@@ -0,0 +1,513 @@
+"""
+Declarative runner for processing many GTFS feeds with the same sequence of steps
+(import, filtering, stop distances, stats, exports).
+
+A pipeline is described by a list of feeds and a list of steps, for instance as a JSON file:
+
+    {
+        "output_dir": "processed",
+        "n_processes": 4,
+        "memory_limit_mb": 8000,
+        "time_limit_s": 7200,
+        "feeds": [
+            {"name": "helsinki", "sources": "feeds/helsinki.zip"},
+            {"name": "kuopio", "sources": ["feeds/kuopio.zip"]}
+        ],
+        "steps": [
+            {"step": "import"},
+            {"step": "filter", "weekly_extract": true},
+            {"step": "stop_distances", "threshold_meters": 1000},
+            {"step": "stats"},
+            {"step": "exports", "formats": ["stops_geojson", "sections_geojson"]}
+        ]
+    }
+
+which is run by
+
+    python -m gtfspy.pipeline pipeline.json
+
+Each step is given by the name of a step function in STEPS (key "step"), an optional unique "id"
+(defaulting to the step name), and the keyword arguments of the step function.
+The outputs of a feed are written to <output_dir>/<feed name>/, with the databases named after the step ids.
+
+The feeds are processed in parallel, each in its own process with optional limits on the memory usage
+and the running time.
+Completed steps are recorded in <output_dir>/<feed name>/pipeline_state.json, together with a key computed from
+the content hash of the feed sources, the parameters of the step and the keys of the preceding steps.
+When the pipeline is run again, steps whose key has not changed (and whose outputs still exist) are skipped,
+so that a failed (or extended) pipeline resumes from the first step that needs to be (re)run.
+Note that modifications of the intermediate files made outside the pipeline are not detected.
+The running time of each step is stored in the metadata of the database under 'pipeline_<step id>_seconds'.
+"""
+from __future__ import print_function
+
+import datetime
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sqlite3
+import sys
+import time
+import timeit
+import traceback
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STATE_FNAME = "pipeline_state.json"
+STATE_FORMAT_VERSION = 1
+
+
+class StepContext(object):
+    """
+    Passed to the step functions: tells which feed is processed, and where the current database is.
+    """
+
+    def __init__(self, feed_name, sources, feed_dir, database=None):
+        self.feed_name = feed_name
+        self.sources = sources
+        self.feed_dir = feed_dir
+        self.database = database
+        self.step_id = None
+        self.outputs = []
+
+    def path(self, fname):
+        return os.path.join(self.feed_dir, fname)
+
+    def set_database(self, database):
+        """Make the later steps work on the given (new) database."""
+        self.database = database
+        self.add_output(database)
+
+    def add_output(self, fname):
+        """Record a file written by the current step."""
+        self.outputs.append(os.path.relpath(fname, self.feed_dir))
+
+    def open_gtfs(self):
+        from gtfspy.gtfs import GTFS
+        if self.database is None or not os.path.exists(self.database):
+            raise RuntimeError("No database to work on, the pipeline should start with an import step")
+        return GTFS(self.database)
+
+
+def _step_import(context, **kwargs):
+    from gtfspy.import_gtfs import import_gtfs
+    database = context.path(context.step_id + ".sqlite")
+    _remove_if_exists(database)
+    kwargs.setdefault("location_name", context.feed_name)
+    import_gtfs(context.sources, database, print_progress=False, **kwargs)
+    context.set_database(database)
+
+
+def _step_filter(context, weekly_extract=False, **kwargs):
+    """
+    Parameters
+    ----------
+    weekly_extract: bool, optional
+        filter to the week starting from gtfs.get_weekly_extract_start_date()
+    **kwargs:
+        passed to gtfspy.filter.FilterExtract
+    """
+    from gtfspy.filter import FilterExtract
+    gtfs = context.open_gtfs()
+    if weekly_extract:
+        week_start = gtfs.get_weekly_extract_start_date()
+        kwargs["start_date"] = week_start
+        kwargs["end_date"] = week_start + datetime.timedelta(days=7)
+    database = context.path(context.step_id + ".sqlite")
+    _remove_if_exists(database)
+    FilterExtract(gtfs, database, **kwargs).create_filtered_copy()
+    gtfs.close()
+    context.set_database(database)
+
+
+def _step_stop_distances(context, threshold_meters=1000):
+    from gtfspy.calc_transfers import calc_transfers
+    from gtfspy.import_loaders.stop_distances_loader import apply_transfers
+    conn = sqlite3.connect(context.database)
+    try:
+        # recompute from scratch, so that the step gives the same result when re-run with other parameters
+        conn.execute("DELETE FROM stop_distances")
+        calc_transfers(conn, threshold_meters=threshold_meters)
+        # the transfers.txt rules, as at import time
+        apply_transfers(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _step_stats(context):
+    from gtfspy import stats
+    gtfs = context.open_gtfs()
+    stats.update_stats(gtfs)
+    gtfs.close()
+
+
+# name -> (output file name, name of the function in gtfspy.exports taking a GTFS object and the output file name)
+EXPORTS = OrderedDict([
+    ("stops_geojson", ("stops.geojson", "write_stops_geojson")),
+    ("sections_geojson", ("sections.geojson", "write_sections_geojson")),
+    ("routes_geojson", ("routes.geojson", "write_routes_geojson")),
+    ("temporal_network", ("temporal_network.csv", "write_temporal_network")),
+    ("nodes", ("nodes.csv", "write_nodes")),
+    ("gtfs", ("gtfs.zip", "write_gtfs")),
+])
+
+
+def _step_exports(context, formats=("stops_geojson", "sections_geojson", "routes_geojson")):
+    """
+    Parameters
+    ----------
+    formats: list of str
+        names of the exports in EXPORTS
+    """
+    for name in formats:
+        if name not in EXPORTS:
+            raise ValueError("Unknown export " + str(name))
+    from gtfspy import exports
+    gtfs = context.open_gtfs()
+    export_dir = context.path(context.step_id)
+    if not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+    for name in formats:
+        fname, function_name = EXPORTS[name]
+        fname = os.path.join(export_dir, fname)
+        _remove_if_exists(fname)
+        getattr(exports, function_name)(gtfs, fname)
+        context.add_output(fname)
+    gtfs.close()
+
+
+# name -> function taking a StepContext and the parameters of the step
+# (other steps can be registered here before running the pipeline)
+STEPS = OrderedDict([
+    ("import", _step_import),
+    ("filter", _step_filter),
+    ("stop_distances", _step_stop_distances),
+    ("stats", _step_stats),
+    ("exports", _step_exports),
+])
+
+
+def run_pipeline(feeds, steps, output_dir, n_processes=1, memory_limit_mb=None, time_limit_s=None,
+                 force=False, print_progress=True):
+    """
+    Run the steps for each feed, each feed in a separate process.
+
+    Parameters
+    ----------
+    feeds: list of dict
+        each with a unique "name" and the "sources" (as accepted by gtfspy.import_gtfs.import_gtfs)
+    steps: list of dict
+        each with the name of the step ("step"), an optional unique "id", and the parameters of the step
+    output_dir: str
+    n_processes: int, optional
+        maximum number of feeds processed at the same time
+    memory_limit_mb: int, optional
+        limit for the (virtual) memory of each process, if supported by the platform
+    time_limit_s: float, optional
+        limit for the wall clock time spent on each feed, after which its process is terminated
+    force: bool, optional
+        re-run all steps, even if they are up to date
+    print_progress: bool, optional
+
+    Returns
+    -------
+    results: OrderedDict
+        feed name -> the state of the feed, a dict with keys "status" ("done" or "failed"), "error"
+        (set if the process of the feed was terminated between steps) and "steps", the latter listing for each step its id, key, status, duration, outputs and error (if any)
+    """
+    feeds = _validate_feeds(feeds)
+    steps = _validate_steps(steps)
+    if n_processes < 1:
+        raise ValueError("n_processes should be at least 1")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    pending = list(feeds)
+    running = OrderedDict()  # feed name -> (process, start time)
+    while pending or running:
+        while pending and len(running) < n_processes:
+            feed = pending.pop(0)
+            if print_progress:
+                print("Processing feed " + feed["name"])
+            process = multiprocessing.Process(target=_run_feed_in_process,
+                                              args=(feed, steps, output_dir, memory_limit_mb, force, print_progress))
+            process.start()
+            running[feed["name"]] = (process, timeit.default_timer())
+
+        timeout = None
+        if time_limit_s is not None:
+            first_deadline = min(start + time_limit_s for _, start in running.values())
+            timeout = max(first_deadline - timeit.default_timer(), 0)
+        multiprocessing.connection.wait([process.sentinel for process, _ in running.values()], timeout)
+
+        for name, (process, start) in list(running.items()):
+            error = None
+            if not process.is_alive():
+                if process.exitcode != 0:
+                    error = "process exited with code " + str(process.exitcode)
+            elif time_limit_s is not None and timeit.default_timer() - start >= time_limit_s:
+                process.terminate()
+                error = "time limit of %s s exceeded" % time_limit_s
+            else:
+                continue
+            process.join()
+            del running[name]
+            if error is not None:
+                _mark_interrupted(os.path.join(output_dir, name), error)
+            if print_progress:
+                print("Finished feed " + name + (": " + error if error else ""))
+
+    results = OrderedDict()
+    for feed in feeds:
+        state = _load_state(os.path.join(output_dir, feed["name"]))
+        failed = len(state["steps"]) < len(steps) or any(step["status"] != "done" for step in state["steps"])
+        results[feed["name"]] = OrderedDict([("status", "failed" if failed else "done"),
+                                             ("error", state.get("error")),
+                                             ("steps", state["steps"])])
+    return results
+
+
+def run_feed(feed, steps, output_dir, force=False, print_progress=True):
+    """
+    Run the steps for a single feed in the current process.
+
+    Parameters
+    ----------
+    feed: dict
+    steps: list of dict
+    output_dir: str
+    force: bool, optional
+    print_progress: bool, optional
+
+    Returns
+    -------
+    state: dict
+        see run_pipeline
+    """
+    steps = _validate_steps(steps)
+    feed_dir = os.path.join(output_dir, feed["name"])
+    if not os.path.exists(feed_dir):
+        os.makedirs(feed_dir)
+    old_steps = [] if force else _load_state(feed_dir)["steps"]
+    state = OrderedDict([("format_version", STATE_FORMAT_VERSION), ("feed", feed["name"]), ("steps", [])])
+    context = StepContext(feed["name"], feed["sources"], feed_dir)
+
+    key = hash_sources(feed["sources"])
+    up_to_date = True
+    for index, step in enumerate(steps):
+        params = OrderedDict((k, v) for k, v in step.items() if k not in ("step", "id"))
+        key = _hash_json([key, step["step"], params])
+        old = old_steps[index] if index < len(old_steps) else None
+        up_to_date = up_to_date and old is not None and old["key"] == key and old["status"] == "done" and \
+            all(os.path.exists(os.path.join(feed_dir, fname)) for fname in old["outputs"])
+        if up_to_date:
+            if old["database"] is not None:
+                context.database = os.path.join(feed_dir, old["database"])
+            state["steps"].append(old)
+            if print_progress:
+                print(feed["name"] + ": " + step["id"] + " is up to date")
+            continue
+
+        record = OrderedDict([("id", step["id"]), ("step", step["step"]), ("key", key), ("status", "running"),
+                              ("started_ut", time.time()), ("duration_s", None), ("database", None),
+                              ("outputs", []), ("error", None)])
+        state["steps"].append(record)
+        _write_state(feed_dir, state)
+        if print_progress:
+            print(feed["name"] + ": running " + step["id"])
+
+        context.step_id = step["id"]
+        context.outputs = []
+        time_start = timeit.default_timer()
+        try:
+            STEPS[step["step"]](context, **params)
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = traceback.format_exc()
+            record["duration_s"] = timeit.default_timer() - time_start
+            _write_state(feed_dir, state)
+            if print_progress:
+                print(feed["name"] + ": " + step["id"] + " failed: " + repr(e))
+            break
+        record["duration_s"] = timeit.default_timer() - time_start
+        record["status"] = "done"
+        record["outputs"] = context.outputs
+        if context.database is not None:
+            record["database"] = os.path.relpath(context.database, feed_dir)
+            _store_step_timing(context.database, step["id"], record["duration_s"])
+        _write_state(feed_dir, state)
+    return state
+
+
+def hash_sources(sources):
+    """
+    Content hash of GTFS sources.
+
+    Parameters
+    ----------
+    sources: str | dict | list
+        path(s) to zip files or directories, or dicts mapping gtfs filenames to their contents
+
+    Returns
+    -------
+    hash: str
+    """
+    sha = hashlib.sha1()
+    if not isinstance(sources, list):
+        sources = [sources]
+    for source in sources:
+        if isinstance(source, dict):
+            sha.update(_hash_json(source).encode("utf-8"))
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for fname in sorted(files):
+                    path = os.path.join(root, fname)
+                    sha.update(os.path.relpath(path, source).encode("utf-8"))
+                    _update_hash_with_file(sha, path)
+        else:
+            _update_hash_with_file(sha, source)
+    return sha.hexdigest()
+
+
+def load_pipeline_config(fname):
+    """
+    Parameters
+    ----------
+    fname: str
+        path to a JSON file, with keys "feeds", "steps", "output_dir" and optionally the other
+        arguments of run_pipeline
+
+    Returns
+    -------
+    config: dict
+        keyword arguments of run_pipeline, relative paths interpreted relative to the directory of the file
+    """
+    with open(fname) as f:
+        config = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(fname))
+    config["output_dir"] = os.path.join(base_dir, config["output_dir"])
+    for feed in config["feeds"]:
+        sources = feed["sources"]
+        if isinstance(sources, list):
+            feed["sources"] = [os.path.join(base_dir, source) for source in sources]
+        else:
+            feed["sources"] = os.path.join(base_dir, sources)
+    return config
+
+
+def _run_feed_in_process(feed, steps, output_dir, memory_limit_mb, force, print_progress):
+    if memory_limit_mb is not None and resource is not None:
+        limit = int(memory_limit_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    run_feed(feed, steps, output_dir, force=force, print_progress=print_progress)
+
+
+def _validate_feeds(feeds):
+    names = [feed["name"] for feed in feeds]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the feeds should be unique")
+    for name in names:
+        if not name or os.sep in name:
+            raise ValueError("Invalid feed name: " + repr(name))
+    return feeds
+
+
+def _validate_steps(steps):
+    validated = []
+    for step in steps:
+        if step.get("step") not in STEPS:
+            raise ValueError("Unknown step " + repr(step.get("step")))
+        step = OrderedDict(step)
+        step.setdefault("id", step["step"])
+        validated.append(step)
+    ids = [step["id"] for step in validated]
+    if len(set(ids)) != len(ids):
+        raise ValueError("The ids of the steps should be unique (give an explicit 'id' for repeated steps)")
+    return validated
+
+
+def _store_step_timing(database, step_id, duration_s):
+    from gtfspy.gtfs import GTFS
+    gtfs = GTFS(database)
+    gtfs.meta["pipeline_" + step_id + "_seconds"] = duration_s
+    gtfs.meta["pipeline_" + step_id + "_finished_ut"] = time.time()
+    gtfs.close()
+
+
+def _mark_interrupted(feed_dir, error):
+    # the process was killed while running a step (or before it got to start any)
+    if not os.path.exists(feed_dir):
+        os.makedirs(feed_dir)
+    state = _load_state(feed_dir)
+    for record in state["steps"]:
+        if record["status"] == "running":
+            record["status"] = "failed"
+            record["error"] = error
+    if not state["steps"] or state["steps"][-1]["status"] == "done":
+        state["error"] = error
+    _write_state(feed_dir, state)
+
+
+def _load_state(feed_dir):
+    fname = os.path.join(feed_dir, STATE_FNAME)
+    if not os.path.exists(fname):
+        return {"steps": []}
+    with open(fname) as f:
+        state = json.load(f, object_pairs_hook=OrderedDict)
+    if state.get("format_version") != STATE_FORMAT_VERSION:
+        return {"steps": []}
+    return state
+
+
+def _write_state(feed_dir, state):
+    # write to a temporary file first, so that an interrupted write does not corrupt the state
+    fname = os.path.join(feed_dir, STATE_FNAME)
+    with open(fname + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(fname + ".tmp", fname)
+
+
+def _hash_json(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _update_hash_with_file(sha, fname):
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+
+def _remove_if_exists(fname):
+    if os.path.exists(fname):
+        os.remove(fname)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Process multiple GTFS feeds with a declarative pipeline.")
+    parser.add_argument("config", help="JSON file describing the feeds and the steps")
+    parser.add_argument("--n_processes", type=int, default=None, help="overrides the value in the config file")
+    parser.add_argument("--force", action="store_true", help="re-run all steps")
+    args = parser.parse_args()
+
+    config = load_pipeline_config(args.config)
+    if args.n_processes is not None:
+        config["n_processes"] = args.n_processes
+    results = run_pipeline(force=args.force, **config)
+    for name, result in results.items():
+        print(name + ": " + result["status"])
+    if any(result["status"] != "done" for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Opt-in caching of GTFS query results.
+
+Methods of GTFS decorated with cached_query store their results in the QueryCache of the GTFS object
+(if the cache has been enabled with GTFS.enable_query_cache).
+The cache keys consist of the method name, the arguments, and the data version of the database,
+so that any change to the database invalidates the earlier results.
+"""
+import copy
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy
+import pandas as pd
+
+DEFAULT_QUERY_CACHE_SIZE = 1024
+
+_MISSING = object()
+
+
+class QueryCache(object):
+    """
+    A size-bounded, thread-safe least-recently-used cache.
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUERY_CACHE_SIZE):
+        """
+        Parameters
+        ----------
+        maxsize: int
+            maximum number of cached results
+        """
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._results.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # move to the most recently used end
+            self._results[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = value
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Returns
+        -------
+        info: dict
+            with keys hits, misses, size, and maxsize
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._results), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._results)
+
+    def __getstate__(self):
+        # cached results are not shipped along, e.g. to worker processes
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+
+def cached_query(method):
+    """
+    Decorator for GTFS methods, whose results depend only on their arguments and the contents of the database.
+
+    Calls with unhashable arguments are not cached.
+    Mutable results are copied when returned, so that the cached results stay intact.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self._query_cache
+        if cache is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())), self._get_data_version())
+        try:
+            value = cache.get(key, _MISSING)
+        except TypeError:
+            # unhashable arguments
+            return method(self, *args, **kwargs)
+        if value is _MISSING:
+            value = method(self, *args, **kwargs)
+            cache.put(key, value)
+        return _copy_result(value)
+    return wrapper
+
+
+def _copy_result(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, numpy.ndarray)):
+        return value.copy()
+    if isinstance(value, (list, dict, set)):
+        return copy.deepcopy(value)
+    return value
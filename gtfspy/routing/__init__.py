@@ -1,2 +1,7 @@
-import pyximport
-pyximport.install()
\ No newline at end of file
+# Use the compiled extensions when they have been built (see setup.py),
+# as loading them through pyximport imports the (slow to import) Cython compiler.
+try:
+    from gtfspy.routing import label
+except ImportError:
+    import pyximport
+    pyximport.install()
@@ -4,6 +4,7 @@ An abstract class defining some requirements for the algorithms inherited by thi
 from abc import ABCMeta, abstractmethod
 
 import time
+from gtfspy import instrumentation
 from gtfspy.routing.util import timeit
 
 
@@ -23,7 +24,8 @@ class AbstractRoutingAlgorithm:
         if self._has_run:
             raise RuntimeError("Algorithm has already run, please initialize a new algorithm")
         start_time = time.time()
-        self._run()
+        with instrumentation.span("routing." + self.__class__.__name__ + ".run"):
+            self._run()
         end_time = time.time()
         self._run_time = end_time - start_time
         self._has_run = True
@@ -4,8 +4,7 @@ Author: rmkujala
 
 from collections import defaultdict
 
-import networkx
-
+from gtfspy import instrumentation
 from gtfspy.routing.abstract_routing_algorithm import AbstractRoutingAlgorithm
 
 
@@ -64,10 +63,12 @@ class ConnectionScan(AbstractRoutingAlgorithm):
 
     def _run(self):
         self._scan_footpaths(self._seed, self._start_time)
+        n_connections_scanned = 0
         for connection in self._connections:
             departure_time = connection.departure_time
             if departure_time > self._end_time:
-                return
+                break
+            n_connections_scanned += 1
             from_stop = connection.departure_stop
             to_stop = connection.arrival_stop
             arrival_time = connection.arrival_time
@@ -83,6 +84,7 @@ class ConnectionScan(AbstractRoutingAlgorithm):
             if reachable:
                 self._update_stop_label(to_stop, arrival_time)
                 self._scan_footpaths(to_stop, arrival_time)
+        instrumentation.count("routing.connections_scanned", n_connections_scanned)
 
     def _update_stop_label(self, stop, arrival_time):
         current_stop_label = self.__stop_labels[stop]
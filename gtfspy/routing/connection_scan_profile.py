@@ -28,11 +28,10 @@ Implements
 """
 from collections import defaultdict
 
-import networkx
-
 from gtfspy.routing.connection import Connection
 from gtfspy.routing.label import LabelTimeSimple
 from gtfspy.routing.node_profile_simple import NodeProfileSimple
+from gtfspy import instrumentation
 from gtfspy.routing.abstract_routing_algorithm import AbstractRoutingAlgorithm
 
 
@@ -84,6 +83,7 @@ class ConnectionScanProfiler(AbstractRoutingAlgorithm):
         self._end_time = end_time
         self._transfer_margin = transfer_margin
         if walk_network is None:
+            import networkx
             walk_network = networkx.Graph()
         self._walk_network = walk_network
         self._walk_speed = float(walk_speed)
@@ -153,6 +153,7 @@ class ConnectionScanProfiler(AbstractRoutingAlgorithm):
                 self._scan_footpaths_to_departure_stop(connection.departure_stop,
                                                        connection.departure_time,
                                                        min_arrival_time)
+        instrumentation.count("routing.connections_scanned", n_connections)
 
     def _scan_footpaths_to_departure_stop(self, connection_dep_stop, connection_dep_time, arrival_time_target):
         """ A helper method for scanning the footpaths. Updates self._stop_profiles accordingly"""
@@ -1,9 +1,12 @@
 from gtfspy.routing.connection import Connection
 from gtfspy.networks import temporal_network, walk_transfer_stop_to_stop_network
 from gtfspy.gtfs import GTFS
+import numpy
 import pandas
 from warnings import warn
 
+from gtfspy.binary_temporal_network import read_binary_temporal_network
+
 
 def get_transit_connections(gtfs, start_time_ut, end_time_ut):
     """
@@ -29,6 +32,35 @@ def get_transit_connections(gtfs, start_time_ut, end_time_ut):
                 )
 
 
+def get_transit_connections_from_binary(filename, start_time_ut=None, end_time_ut=None):
+    """
+    Read the transit connections from a binary temporal network file
+    (see gtfspy.binary_temporal_network.write_binary_temporal_network).
+
+    Parameters
+    ----------
+    filename: str
+    start_time_ut: int, optional
+        connections arriving before this are left out
+    end_time_ut: int, optional
+        connections departing after this are left out
+
+    Returns
+    -------
+    list[Connection]
+        sorted by departure time
+    """
+    events = read_binary_temporal_network(filename)
+    mask = numpy.ones(len(events["dep_time_ut"]), dtype=bool)
+    if start_time_ut is not None:
+        mask &= events["arr_time_ut"] >= start_time_ut
+    if end_time_ut is not None:
+        mask &= events["dep_time_ut"] <= end_time_ut
+    columns = [events[name][mask].tolist() for name in
+               ["from_stop_I", "to_stop_I", "dep_time_ut", "arr_time_ut", "trip_I", "seq"]]
+    return [Connection(*values) for values in zip(*columns)]
+
+
 def get_walk_network(gtfs, max_link_distance_m=1000):
     """
     Parameters
@@ -2,6 +2,7 @@ import os
 import sqlite3
 import pandas as pd
 
+from gtfspy import instrumentation
 from gtfspy.routing.connection import Connection
 from gtfspy.gtfs import GTFS
 from gtfspy.routing.label import LabelTimeAndRoute, LabelTimeWithBoardingsCount, LabelTimeBoardingsAndRoute, \
@@ -150,6 +151,7 @@ class JourneyDataManager:
 
         self._execute_function(insert_journeys_stmt, journey_list)
         self.conn.commit()
+        instrumentation.count("journeys_inserted", len(journey_list))
 
     @timeit
     def _execute_function(self, statement, rows):
@@ -240,6 +242,8 @@ class JourneyDataManager:
             self.conn.executemany(insert_legs_stmt, connection_list)
             self.routing_parameters["target_list"] += (str(target_stop) + ",")
             self.conn.commit()
+            instrumentation.count("journeys_inserted", len(journey_list))
+            instrumentation.count("legs_inserted", len(connection_list))
 
 
     def create_index_for_journeys_table(self):
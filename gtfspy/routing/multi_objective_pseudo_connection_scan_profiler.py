@@ -1,6 +1,5 @@
 from collections import defaultdict
 
-import networkx
 import numpy
 
 from gtfspy.routing.connection import Connection
@@ -8,6 +7,7 @@ from gtfspy.routing.abstract_routing_algorithm import AbstractRoutingAlgorithm
 from gtfspy.routing.node_profile_multiobjective import NodeProfileMultiObjective
 from gtfspy.routing.label import merge_pareto_frontiers, LabelTimeWithBoardingsCount, LabelTime, compute_pareto_front, \
     LabelVehLegCount, LabelTimeBoardingsAndRoute, LabelTimeAndRoute
+from gtfspy import instrumentation
 from gtfspy.util import timeit
 
 
@@ -65,6 +65,7 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
         self._end_time = end_time_ut
         self._transfer_margin = transfer_margin
         if walk_network is None:
+            import networkx
             walk_network = networkx.Graph()
         self._walk_network = walk_network
         self._walk_speed = walk_speed
@@ -164,7 +165,9 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
 
     @timeit
     def __compute_pseudo_connections(self):
-        print("Started computing pseudoconnections")
+        if self._verbose:
+            print("Started computing pseudoconnections")
+        import networkx
         pseudo_connections = []
         # DiGraph makes things iterate both ways (!)
         for u, v, data in networkx.DiGraph(self._walk_network).edges(data=True):
@@ -197,7 +200,9 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
                                         is_walk=True)
                     pseudo_connections.append(pseudo)
                     i += 1
-        print("Computed pseudoconnections")
+        if self._verbose:
+            print("Computed pseudoconnections")
+        instrumentation.count("routing.pseudo_connections", len(pseudo_connections))
         return pseudo_connections
 
     @timeit
@@ -257,6 +262,9 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
     def _run(self):
         previous_departure_time = float("inf")
         n_connections_tot = len(self._all_connections)
+        count_labels = instrumentation.is_enabled()
+        n_labels_created = 0
+        n_labels_pruned = 0
         for i, connection in enumerate(self._all_connections):
             # basic checking + printing progress:
             if self._verbose and i % 1000 == 0:
@@ -272,6 +280,10 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
 
             # Then, compute Pareto-frontier of these alternatives:
             all_pareto_optimal_labels = merge_pareto_frontiers(arrival_node_labels, trip_labels)
+            if count_labels:
+                n_candidate_labels = len(arrival_node_labels) + len(trip_labels)
+                n_labels_created += n_candidate_labels
+                n_labels_pruned += n_candidate_labels - len(all_pareto_optimal_labels)
 
             # Update labels for this trip
             if not connection.is_walk:
@@ -281,14 +293,19 @@ class MultiObjectivePseudoCSAProfiler(AbstractRoutingAlgorithm):
             self._stop_profiles[connection.departure_stop].update(all_pareto_optimal_labels,
                                                                   connection.departure_time)
 
+        instrumentation.count("routing.connections_scanned", n_connections_tot)
+        instrumentation.count("routing.labels_created", n_labels_created)
+        instrumentation.count("routing.labels_pruned", n_labels_pruned)
 
-        print("finalizing profiles!")
+        if self._verbose:
+            print("finalizing profiles!")
         self._finalize_profiles()
 
     def _finalize_profiles(self):
         """
         Deal with the first walks by joining profiles to other stops within walking distance.
         """
+        import networkx
         for stop, stop_profile in self._stop_profiles.items():
             assert (isinstance(stop_profile, NodeProfileMultiObjective))
             neighbor_label_bags = []
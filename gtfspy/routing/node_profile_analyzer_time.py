@@ -4,9 +4,6 @@ import warnings
 import numpy
 import pytz
 
-from matplotlib import dates as md, rcParams
-import matplotlib.pyplot as plt
-
 from gtfspy.routing.profile_block_analyzer import ProfileBlockAnalyzer
 from gtfspy.routing.profile_block import ProfileBlock
 from gtfspy.routing.node_profile_simple import NodeProfileSimple
@@ -250,6 +247,7 @@ class NodeProfileAnalyzerTime:
         -------
         fig: matplotlib.Figure
         """
+        from matplotlib import pyplot as plt
         xvalues, cdf = self.profile_block_analyzer._temporal_distance_cdf()
         fig = plt.figure()
         ax = fig.add_subplot(111)
@@ -437,6 +435,8 @@ class NodeProfileAnalyzerTime:
         plot_journeys: bool, optional
             if True, small dots are plotted at the departure times
         """
+        from matplotlib import dates as md, rcParams
+        from matplotlib import pyplot as plt
         if ax is None:
             fig = plt.figure()
             ax = fig.add_subplot(111)
@@ -4,14 +4,8 @@ import warnings
 from collections import defaultdict
 
 import datetime
-import matplotlib
 import numpy
-import matplotlib.pyplot as plt
 import pytz
-from matplotlib import lines
-
-from matplotlib import dates as md
-from matplotlib.colors import ListedColormap, LinearSegmentedColormap
 
 from gtfspy.routing.fastest_path_analyzer import FastestPathAnalyzer
 from gtfspy.routing.node_profile_multiobjective import NodeProfileMultiObjective
@@ -49,6 +43,7 @@ def _truncate_colormap(cmap, minval=0.0, maxval=1.0, n=100):
     Truncates a colormap to use.
     Code originall from http://stackoverflow.com/questions/18926031/how-to-extract-a-subset-of-a-colormap-as-a-new-colormap-in-matplotlib
     """
+    from matplotlib.colors import LinearSegmentedColormap
     new_cmap = LinearSegmentedColormap.from_list(
         'trunc({n},{a:.2f},{b:.2f})'.format(n=cmap.name, a=minval, b=maxval),
         cmap(numpy.linspace(minval, maxval, n))
@@ -287,17 +282,20 @@ class NodeProfileAnalyzerTimeAndVehLegs:
 
     @classmethod
     def _multiply_color_saturation(cls, color, multiplier):
+        import matplotlib.colors
         hsv = matplotlib.colors.rgb_to_hsv(color[:3])
         rgb = matplotlib.colors.hsv_to_rgb((hsv[0], hsv[1] * multiplier, hsv[2]))
         return list(iter(rgb)) + [1]
 
     @classmethod
     def _multiply_color_brightness(cls, color, multiplier):
+        import matplotlib.colors
         hsv = matplotlib.colors.rgb_to_hsv(color[:3])
         rgb = matplotlib.colors.hsv_to_rgb((hsv[0], hsv[1], max(0, min(1, hsv[2] * multiplier))))
         return list(iter(rgb)) + [1]
 
     def _get_fill_and_line_colors(self, min_n, max_n):
+        import matplotlib.colors
         colors = self._get_colors_for_boardings(min_n, max_n)
         n_boardings_range = range(min_n, max_n + 1)
         nboardings_to_color = {n: colors[i] for i, n in enumerate(n_boardings_range)}
@@ -349,6 +347,9 @@ class NodeProfileAnalyzerTimeAndVehLegs:
             min_n = 0
         if max_n is None:
             return None
+        import matplotlib.axes
+        from matplotlib import dates as md, lines
+        from matplotlib import pyplot as plt
         if ax is None:
             fig = plt.figure()
             ax = fig.add_subplot(111)
@@ -485,6 +486,7 @@ class NodeProfileAnalyzerTimeAndVehLegs:
 
     def plot_temporal_distance_pdf_horizontal(self, use_minutes=True, ax=None, duration_divider=60.0,
                                               legend_font_size=None, legend_loc=None):
+        from matplotlib import pyplot as plt
         if ax is None:
             fig = plt.figure()
             ax = fig.add_subplot(111)
@@ -578,6 +580,7 @@ class NodeProfileAnalyzerTimeAndVehLegs:
         return ax
 
     def plot_fastest_temporal_distance_profile(self, timezone=None, **kwargs):
+        from matplotlib import pyplot as plt
         max_n = self.max_trip_n_boardings()
         if "ax" not in kwargs:
             fig = plt.figure(figsize=(10, 6))
@@ -28,11 +28,10 @@ Implements
 """
 from collections import defaultdict
 
-import networkx
-
 from gtfspy.routing.connection import Connection
 from gtfspy.routing.label import LabelTime
 from gtfspy.routing.node_profile_simple import NodeProfileSimple
+from gtfspy import instrumentation
 from gtfspy.routing.abstract_routing_algorithm import AbstractRoutingAlgorithm
 from gtfspy.routing.pseudo_connections import compute_pseudo_connections
 from gtfspy.routing.node_profile_c import NodeProfileC
@@ -86,6 +85,7 @@ class PseudoConnectionScanProfiler(AbstractRoutingAlgorithm):
         self._end_time = end_time
         self._transfer_margin = transfer_margin
         if walk_network is None:
+            import networkx
             walk_network = networkx.Graph()
         self._walk_network = walk_network
         self._walk_speed = float(walk_speed)
@@ -155,6 +155,7 @@ class PseudoConnectionScanProfiler(AbstractRoutingAlgorithm):
 
             # update departure stop profile (later: with the sets of pareto-optimal labels)
             self._stop_profiles[connection.departure_stop].update_pareto_optimal_tuples(pareto_tuple)
+        instrumentation.count("routing.connections_scanned", n_connections_tot)
 
     @property
     def stop_profiles(self):
@@ -1,13 +1,21 @@
 import time
 
+from gtfspy import instrumentation
+
 def timeit(method):
     """
     A Python decorator for printing out the execution time for a function.
+    When instrumentation is enabled (see gtfspy.instrumentation), the execution time is recorded as a span instead.
 
     Adapted from:
     www.andreas-jung.com/contents/a-python-decorator-for-measuring-the-execution-time-of-methods
     """
+    span_name = getattr(method, "__qualname__", method.__name__)
+
     def timed(*args, **kw):
+        if instrumentation.is_enabled():
+            with instrumentation.span(span_name):
+                return method(*args, **kw)
         time_start = time.time()
         result = method(*args, **kw)
         time_end = time.time()
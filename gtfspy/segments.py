@@ -1,3 +1,225 @@
+import numpy
+import pandas as pd
+
+from gtfspy.route_types import ALL_ROUTE_TYPES
+from gtfspy.util import wgs84_distances
+
+# Name of the table, where the consecutive stop segments are cached.
+SEGMENTS_TABLE = "stop_time_segments"
+SEGMENTS_TABLE_COLUMNS = ["trip_I", "from_stop_I", "to_stop_I", "from_seq", "dep_time_ds", "arr_time_ds",
+                          "duration", "distance", "route_I", "type"]
+# Tables from which the segments are computed. Triggers on these tables delete the fingerprint of the cached
+# segments table on any modification, so that the table is recomputed when next needed.
+SEGMENTS_SOURCE_TABLES = ["stop_times", "trips", "routes", "stops"]
+
+
+def ensure_segments_table(gtfs, recompute=False, chunksize=1000000):
+    """
+    Make sure that the table of consecutive stop segments exists and is up to date.
+
+    Each row of the table corresponds to two stop_times rows of the same trip with consecutive seq values:
+        trip_I, from_stop_I, to_stop_I, from_seq,
+        dep_time_ds: departure time from the first stop,
+        arr_time_ds: arrival time to the second stop,
+        duration: difference of the arrival times at the two stops (seconds),
+        distance: straight line distance between the stops (meters, truncated to int),
+        route_I, type: route and route type of the trip
+
+    The table is computed only once and then cached in the database.
+    It is recomputed after any insert, update or delete on the stop_times, trips, routes or stops tables:
+    triggers on these tables, created together with the cached table, delete its fingerprint from
+    the metadata table. The fingerprint also covers the sizes of the tables and the stop coordinates.
+    For a read-only GTFS, an outdated or missing table is instead computed into a temporary table
+    of the current connection (i.e. separately for each thread using the GTFS).
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    recompute: bool
+        force recomputation of the table
+    chunksize: int
+        number of stop_times rows processed at a time
+
+    Returns
+    -------
+    table_name: str
+    """
+    fingerprint = _get_segments_fingerprint(gtfs)
+    table_exists = gtfs.conn.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?",
+                                     (SEGMENTS_TABLE,)).fetchone()[0] > 0
+    if table_exists and not recompute and gtfs.meta.get("segments_fingerprint") == fingerprint \
+            and _has_invalidation_triggers(gtfs):
+        return SEGMENTS_TABLE
+
+    if getattr(gtfs, "read_only", False):
+        temp_table_exists = gtfs.conn.execute("SELECT count(*) FROM sqlite_temp_master "
+                                              "WHERE type='table' AND name=?", (SEGMENTS_TABLE,)).fetchone()[0] > 0
+        if not temp_table_exists or recompute:
+            _create_segments_table(gtfs, "temp", chunksize)
+        return "temp." + SEGMENTS_TABLE
+
+    _create_segments_table(gtfs, "main", chunksize)
+    _create_invalidation_triggers(gtfs)
+    gtfs.meta["segments_fingerprint"] = fingerprint
+    return SEGMENTS_TABLE
+
+
+def _create_segments_table(gtfs, schema, chunksize):
+    table = schema + "." + SEGMENTS_TABLE
+    gtfs.conn.execute("DROP TABLE IF EXISTS " + table)
+    gtfs.conn.execute("CREATE TABLE " + table + " (trip_I INT, from_stop_I INT, to_stop_I INT, "
+                      "from_seq INT, dep_time_ds INT, arr_time_ds INT, duration INT, distance INT, "
+                      "route_I INT, type INT)")
+    for segments in _compute_segments(gtfs, chunksize):
+        gtfs.conn.executemany("INSERT INTO " + table + " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              segments.itertuples(index=False, name=None))
+    gtfs.conn.execute("CREATE INDEX " + schema + ".idx_" + SEGMENTS_TABLE + "_tid ON " + SEGMENTS_TABLE +
+                      " (trip_I)")
+    gtfs.conn.execute("CREATE INDEX " + schema + ".idx_" + SEGMENTS_TABLE + "_fsid_tsid ON " + SEGMENTS_TABLE +
+                      " (from_stop_I, to_stop_I)")
+    gtfs.conn.commit()
+
+
+def _get_invalidation_triggers():
+    # (trigger name, table, operation) of each trigger deleting the fingerprint of the segments table
+    return [("invalidate_" + SEGMENTS_TABLE + "_after_" + operation.lower() + "_on_" + table, table, operation)
+            for table in SEGMENTS_SOURCE_TABLES for operation in ["INSERT", "UPDATE", "DELETE"]]
+
+
+def _has_invalidation_triggers(gtfs):
+    trigger_names = [trigger_name for trigger_name, _, _ in _get_invalidation_triggers()]
+    n_triggers = gtfs.conn.execute("SELECT count(*) FROM sqlite_master WHERE type='trigger' AND name IN (" +
+                                   ",".join("?" * len(trigger_names)) + ")", trigger_names).fetchone()[0]
+    return n_triggers == len(trigger_names)
+
+
+def _create_invalidation_triggers(gtfs):
+    for trigger_name, table, operation in _get_invalidation_triggers():
+        gtfs.conn.execute("CREATE TRIGGER IF NOT EXISTS main." + trigger_name + " AFTER " + operation + " ON " +
+                          table + " BEGIN DELETE FROM metadata WHERE key='segments_fingerprint'; END")
+    gtfs.conn.commit()
+
+
+def get_segment_events_from_clause(gtfs, start_time_ut=None, end_time_ut=None, route_type=None):
+    """
+    FROM (and WHERE) clause of a query over the transit events, i.e. the segments of all trips on all days.
+
+    The events have the columns dep_time_ut, arr_time_ut, from_stop_I, to_stop_I, trip_I, seq, route_type,
+    route_I, distance (straight line distance between the stops), and start_time_ut and end_time_ut
+    (the latter two of the whole trip).
+    An event is included if it overlaps with the given time span.
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    start_time_ut: int, optional
+    end_time_ut: int, optional
+    route_type: int, optional
+
+    Returns
+    -------
+    from_clause: str
+    params: list
+        parameters for the placeholders in from_clause
+    """
+    gtfs._materialize_day_trips_for_time_span(start_time_ut, end_time_ut)
+    day_trips_table = gtfs._get_day_trips_table_name()
+    segments_table = ensure_segments_table(gtfs)
+    from_clause = "FROM (SELECT day_start_ut + dep_time_ds AS dep_time_ut, day_start_ut + arr_time_ds AS arr_time_ut, " \
+                  "from_stop_I, to_stop_I, trip_I, from_seq AS seq, type AS route_type, route_I, distance, " \
+                  "start_time_ut, end_time_ut " \
+                  "FROM " + day_trips_table + " JOIN " + segments_table + " USING(trip_I))"
+    where_clauses = []
+    params = []
+    if end_time_ut is not None:
+        where_clauses.append("start_time_ut < ? AND dep_time_ut <= ?")
+        params += [end_time_ut, end_time_ut]
+    if start_time_ut is not None:
+        where_clauses.append("end_time_ut > ? AND arr_time_ut >= ?")
+        params += [start_time_ut, start_time_ut]
+    if route_type is not None:
+        assert route_type in ALL_ROUTE_TYPES
+        where_clauses.append("route_type = ?")
+        params.append(route_type)
+    if where_clauses:
+        from_clause += " WHERE " + " AND ".join(where_clauses)
+    return from_clause, params
+
+
+def get_segments(gtfs):
+    """
+    Returns
+    -------
+    segments: pandas.DataFrame
+        with the columns described in ensure_segments_table
+    """
+    table_name = ensure_segments_table(gtfs)
+    return pd.read_sql_query("SELECT * FROM " + table_name, gtfs.conn)
+
+
+def drop_segments_table(gtfs, schema="main"):
+    """
+    Remove the cached segments table, so that it is recomputed when next needed.
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    schema: str, optional
+        name of the (attached) database
+    """
+    gtfs.conn.execute("DROP TABLE IF EXISTS " + schema + "." + SEGMENTS_TABLE)
+    for trigger_name, _, _ in _get_invalidation_triggers():
+        gtfs.conn.execute("DROP TRIGGER IF EXISTS " + schema + "." + trigger_name)
+    gtfs.conn.execute("DELETE FROM " + schema + ".metadata WHERE key='segments_fingerprint'")
+    gtfs.conn.commit()
+
+
+def _get_segments_fingerprint(gtfs):
+    # the stops table is small, so a checksum of its coordinates is cheap to compute each time
+    counts = gtfs.conn.execute("SELECT (SELECT count(*) FROM stop_times), (SELECT max(rowid) FROM stop_times), "
+                               "(SELECT count(*) FROM trips), count(*), total(stop_I), total(lat), total(lon), "
+                               "total(stop_I * lat), total(stop_I * lon) FROM stops").fetchone()
+    return ",".join(repr(count) for count in counts)
+
+
+def _compute_segments(gtfs, chunksize=1000000):
+    """
+    Compute the consecutive stop segments with numpy, reading stop_times in chunks.
+
+    Yields
+    ------
+    segments: pandas.DataFrame
+    """
+    query = ("SELECT trip_I, seq, stop_I, arr_time_ds, dep_time_ds, lat, lon, route_I, type "
+             "FROM stop_times "
+             "JOIN stops USING (stop_I) "
+             "JOIN trips USING (trip_I) "
+             "JOIN routes USING (route_I) "
+             "ORDER BY trip_I, seq")
+    previous_last_row = None
+    for chunk in pd.read_sql_query(query, gtfs.conn, chunksize=chunksize):
+        if previous_last_row is not None:
+            chunk = pd.concat([previous_last_row, chunk], ignore_index=True)
+        previous_last_row = chunk.iloc[-1:]
+        trip_Is = chunk['trip_I'].values
+        seqs = chunk['seq'].values
+        consecutive = numpy.nonzero((trip_Is[:-1] == trip_Is[1:]) & (seqs[:-1] + 1 == seqs[1:]))[0]
+        first = chunk.iloc[consecutive]
+        second = chunk.iloc[consecutive + 1]
+        distances = wgs84_distances(first['lat'].values, first['lon'].values,
+                                    second['lat'].values, second['lon'].values).astype(int)
+        yield pd.DataFrame({
+            "trip_I": first['trip_I'].values,
+            "from_stop_I": first['stop_I'].values,
+            "to_stop_I": second['stop_I'].values,
+            "from_seq": first['seq'].values,
+            "dep_time_ds": first['dep_time_ds'].values,
+            "arr_time_ds": second['arr_time_ds'].values,
+            "duration": second['arr_time_ds'].values - first['arr_time_ds'].values,
+            "distance": distances,
+            "route_I": first['route_I'].values,
+            "type": first['type'].values
+        }, columns=SEGMENTS_TABLE_COLUMNS)
 
 
 class Segments(object):
@@ -31,7 +31,11 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import numpy as np
-from .util import wgs84_distance
+from .util import wgs84_distances, wgs84_distances_from_point
+
+# number of shape points for which find_segments first computes distances
+# to a stop (the scan continues at least 100 points past the best match)
+FIND_SEGMENTS_WINDOW = 256
 
 
 def print_coords(rows, prefix=''):
@@ -78,16 +82,32 @@ def find_segments(stops, shape):
     d_last_stop = float('inf')
     lstlat, lstlon = None, None
     break_shape_points = []
+    shape_lats = np.array([point['lat'] for point in shape], dtype=float)
+    shape_lons = np.array([point['lon'] for point in shape], dtype=float)
     for stop in stops:
         stlat, stlon = stop['lat'], stop['lon']
         best_d = float('inf')
         # print stop
         if badness > 500 and badness > 30 * len(break_points):
             return [], badness
+        # distances to the following shape points, computed in windows that
+        # grow only when the scan below runs past them
+        ds = []
+        ds_last_stop = []
+        window = FIND_SEGMENTS_WINDOW
         for i in range(last_i, len(shape)):
-            d = wgs84_distance(stlat, stlon, shape[i]['lat'], shape[i]['lon'])
+            if i - last_i == len(ds):
+                window_start, window_end = i, min(i + window, len(shape))
+                ds.extend(wgs84_distances_from_point(stlat, stlon, shape_lats[window_start:window_end],
+                                                     shape_lons[window_start:window_end]).tolist())
+                if lstlat:
+                    ds_last_stop.extend(wgs84_distances_from_point(
+                        lstlat, lstlon, shape_lats[window_start:window_end],
+                        shape_lons[window_start:window_end]).tolist())
+                window *= 2
+            d = ds[i - last_i]
             if lstlat:
-                d_last_stop = wgs84_distance(lstlat, lstlon, shape[i]['lat'], shape[i]['lon'])
+                d_last_stop = ds_last_stop[i - last_i]
             # If we are getting closer to next stop, record this as
             # the best stop so far.continue
             if d < best_d:
@@ -228,14 +248,12 @@ def gen_cumulative_distances(stops):
         and the function adds the 'd' key ('d' stands for distance)
         to the dictionaries
     """
-    stops[0]['d'] = 0.0
-    for i in range(1, len(stops)):
-        stops[i]['d'] = stops[i-1]['d'] + wgs84_distance(
-            stops[i-1]['lat'], stops[i-1]['lon'],
-            stops[i]['lat'], stops[i]['lon'],
-            )
-    for stop in stops:
-        stop['d'] = int(stop['d'])
+    lats = np.array([stop['lat'] for stop in stops], dtype=float)
+    lons = np.array([stop['lon'] for stop in stops], dtype=float)
+    cumulative_distances = np.concatenate(
+        ([0.0], np.cumsum(wgs84_distances(lats[:-1], lons[:-1], lats[1:], lons[1:]))))
+    for stop, d in zip(stops, cumulative_distances.tolist()):
+        stop['d'] = int(d)
         # stop['d'] = round(stop['d'], 1)
 
 
@@ -461,3 +479,65 @@ def interpolate_shape_times(shape_distances, shape_breaks, stop_times):
     # deal final ones separately:
     shape_times[shape_breaks[-1]:] = stop_times[-1]
     return list(shape_times)
+
+
+def interpolate_shape_times_in_batch(shape_distances, shape_starts, shape_breaks, stop_times, stop_counts):
+    """
+    Interpolate passage times for the shape points of many trajectories at once.
+
+    Equivalent to calling interpolate_shape_times for each trajectory, and keeping
+    only the shape points between the first and the last shape break.
+
+    Parameters
+    ----------
+    shape_distances: numpy.array
+        cumulative distances along the shapes, the shapes of all trajectories concatenated
+    shape_starts: numpy.array
+        for each trajectory, the index in shape_distances where its shape starts
+    shape_breaks: numpy.array
+        shape breaks (relative to the start of the shape) of the stops of all trajectories, concatenated.
+        The shape breaks of each trajectory should be non-decreasing.
+    stop_times: numpy.array
+        stop times of the stops of all trajectories, concatenated
+    stop_counts: numpy.array
+        for each trajectory, the number of stops (at least one)
+
+    Returns
+    -------
+    shape_indices: numpy.array
+        indices (to shape_distances) of the shape points of all trajectories, concatenated
+    shape_times: numpy.array
+        interpolated passage times for the shape points
+    point_counts: numpy.array
+        for each trajectory, the number of shape points
+    """
+    shape_breaks = np.asarray(shape_breaks, dtype=np.int64)
+    stop_times = np.asarray(stop_times, dtype=float)
+    stop_counts = np.asarray(stop_counts, dtype=np.int64)
+    n_trajectories = len(stop_counts)
+    last_stops = np.cumsum(stop_counts) - 1
+    first_stops = last_stops - stop_counts + 1
+    first_breaks = shape_breaks[first_stops]
+    point_counts = shape_breaks[last_stops] - first_breaks + 1
+    point_trajectories = np.repeat(np.arange(n_trajectories), point_counts)
+    point_offsets = np.cumsum(point_counts) - point_counts
+    local_indices = (np.arange(point_counts.sum()) - np.repeat(point_offsets, point_counts) +
+                     np.repeat(first_breaks, point_counts))
+
+    # the stop preceding each shape point: the last stop whose shape break is at or before the point
+    stride = (shape_breaks.max() + 1) if len(shape_breaks) > 0 else 1
+    stop_keys = np.repeat(np.arange(n_trajectories), stop_counts) * stride + shape_breaks
+    stops = np.searchsorted(stop_keys, point_trajectories * stride + local_indices, side="right") - 1
+    is_last = stops == last_stops[point_trajectories]
+    next_stops = np.where(is_last, stops, stops + 1)
+
+    starts = shape_starts[point_trajectories]
+    shape_indices = starts + local_indices
+    distances = np.asarray(shape_distances, dtype=float)
+    from_distances = distances[starts + shape_breaks[stops]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm_distances = ((distances[shape_indices] - from_distances) /
+                          (distances[starts + shape_breaks[next_stops]] - from_distances))
+    shape_times = (1. - norm_distances) * stop_times[stops] + norm_distances * stop_times[next_stops]
+    shape_times[is_last] = stop_times[stops[is_last]]
+    return shape_indices, shape_times, point_counts
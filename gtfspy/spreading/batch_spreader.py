@@ -0,0 +1,231 @@
+from __future__ import absolute_import, print_function
+
+import multiprocessing
+from heapq import heappush, heappop
+
+import numpy
+
+from gtfspy.util import wgs84_distances
+
+# Data shared with the worker processes (set by _init_worker).
+_worker_data = None
+
+
+class BatchSpreader(object):
+    """
+    Compute first-arrival times of many spreading processes ("seeds") over the same time window.
+
+    The transit events and the walking transfers are fetched from the database only once.
+    Each scan over the time-ordered events then handles a whole group of seeds at the same time
+    by storing the seeds that have reached a stop (or are aboard a trip) as the bits of an integer.
+    Groups of seeds can further be distributed over multiple processes.
+    """
+
+    def __init__(self, gtfs, start_time_ut, end_time_ut, min_transfer_time=30, walk_speed=0.5, events=None):
+        """
+        Parameters
+        ----------
+        gtfs: GTFS
+            the underlying GTFS (database) connection for getting data
+        start_time_ut: int
+            earliest possible start time of the seeds
+        end_time_ut: int
+            no events after this time are taken into account
+        min_transfer_time : int
+            minimum transfer time in seconds
+        walk_speed : float
+            walking speed in meters per second
+        events : dict, optional
+            columns of transit events (e.g. from gtfspy.binary_temporal_network.read_binary_temporal_network)
+            to use instead of fetching them from the database.
+            Should contain at least dep_time_ut, arr_time_ut, from_stop_I, to_stop_I, and trip_I
+        """
+        self.start_time_ut = start_time_ut
+        self.end_time_ut = end_time_ut
+        self.min_transfer_time = min_transfer_time
+        self.walk_speed = walk_speed
+
+        stops = gtfs.stops()
+        order = numpy.argsort(stops['stop_I'].values)
+        self.stop_Is = stops['stop_I'].values[order]
+        self._stop_lats = stops['lat'].values[order]
+        self._stop_lons = stops['lon'].values[order]
+
+        if events is None:
+            events = gtfs.get_transit_events(start_time_ut, end_time_ut)
+            events = {name: events[name].values for name in events.columns}
+        dep_times = numpy.asarray(events['dep_time_ut'], dtype=numpy.int64)
+        arr_times = numpy.asarray(events['arr_time_ut'], dtype=numpy.int64)
+        mask = (dep_times <= end_time_ut) & (arr_times >= start_time_ut)
+        order = numpy.lexsort((arr_times[mask], dep_times[mask]))
+        self._dep_times = dep_times[mask][order]
+        self._arr_times = arr_times[mask][order]
+        self._from_indices = self._stop_I_to_index(numpy.asarray(events['from_stop_I'])[mask][order])
+        self._to_indices = self._stop_I_to_index(numpy.asarray(events['to_stop_I'])[mask][order])
+        self._trip_Is = numpy.asarray(events['trip_I'], dtype=numpy.int64)[mask][order]
+
+        transfers = gtfs.get_straight_line_transfer_distances()
+        from_indices = self._stop_I_to_index(transfers['from_stop_I'].values)
+        to_indices = self._stop_I_to_index(transfers['to_stop_I'].values)
+        walk_durations = (transfers['d'].values / float(walk_speed)).astype(numpy.int64)
+        self._walk_neighbors = [[] for _ in range(len(self.stop_Is))]
+        for from_index, to_index, duration in zip(from_indices, to_indices, walk_durations):
+            self._walk_neighbors[from_index].append((int(to_index), int(duration)))
+
+    def _stop_I_to_index(self, stop_Is):
+        return numpy.searchsorted(self.stop_Is, stop_Is)
+
+    def get_closest_stop_Is(self, lats, lons):
+        """
+        Vectorized closest stop lookup for the seed locations.
+
+        Parameters
+        ----------
+        lats: list-like of floats
+        lons: list-like of floats
+
+        Returns
+        -------
+        stop_Is: numpy.array
+        """
+        lats = numpy.asarray(lats, dtype=float)
+        lons = numpy.asarray(lons, dtype=float)
+        distances = wgs84_distances(lats[:, None], lons[:, None],
+                                    self._stop_lats[None, :], self._stop_lons[None, :])
+        return self.stop_Is[numpy.argmin(distances, axis=1)]
+
+    def spread(self, seed_stop_Is, seed_start_times_ut, max_duration_ut=None,
+               seeds_per_scan=64, n_processes=1):
+        """
+        Run the spreading for all seeds.
+
+        Parameters
+        ----------
+        seed_stop_Is: list-like of ints
+            the stop where each seed starts
+        seed_start_times_ut: list-like of ints or int
+            the start time of each seed (or one start time shared by all seeds)
+        max_duration_ut: int, optional
+            maximum duration of each spreading process (in seconds)
+        seeds_per_scan: int
+            how many seeds are handled during one scan over the events
+        n_processes: int
+            number of worker processes used for the scans
+
+        Returns
+        -------
+        first_arrival_times: numpy.array
+            array of shape (n_stops, n_seeds) containing the first arrival time of each seed at each stop,
+            numpy.inf for stops that were not reached.
+            The rows are ordered as BatchSpreader.stop_Is.
+        """
+        seed_indices = self._stop_I_to_index(numpy.asarray(seed_stop_Is))
+        seed_start_times_ut = numpy.broadcast_to(numpy.asarray(seed_start_times_ut, dtype=numpy.int64),
+                                                 seed_indices.shape)
+        assert (self.stop_Is[seed_indices] == numpy.asarray(seed_stop_Is)).all(), "unknown seed stop"
+        assert (seed_start_times_ut >= self.start_time_ut).all()
+
+        groups = []
+        for offset in range(0, len(seed_indices), seeds_per_scan):
+            groups.append((seed_indices[offset:offset + seeds_per_scan],
+                           seed_start_times_ut[offset:offset + seeds_per_scan]))
+
+        data = self._get_scan_data()
+        if n_processes > 1 and len(groups) > 1:
+            pool = multiprocessing.Pool(n_processes, initializer=_init_worker, initargs=(data,))
+            try:
+                results = pool.map(_scan_in_worker, groups)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_scan(data, indices, start_times) for indices, start_times in groups]
+
+        if results:
+            first_arrival_times = numpy.concatenate(results, axis=1)
+        else:
+            first_arrival_times = numpy.zeros((len(self.stop_Is), 0))
+        if max_duration_ut is not None:
+            first_arrival_times[first_arrival_times > seed_start_times_ut[None, :] + max_duration_ut] = numpy.inf
+        return first_arrival_times
+
+    def _get_scan_data(self):
+        return {
+            "n_stops": len(self.stop_Is),
+            "dep_times": self._dep_times,
+            "arr_times": self._arr_times,
+            "from_indices": self._from_indices,
+            "to_indices": self._to_indices,
+            "trip_Is": self._trip_Is,
+            "walk_neighbors": self._walk_neighbors,
+            "min_transfer_time": self.min_transfer_time,
+            "end_time_ut": self.end_time_ut
+        }
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _scan_in_worker(group):
+    seed_indices, seed_start_times_ut = group
+    return _scan(_worker_data, seed_indices, seed_start_times_ut)
+
+
+def _scan(data, seed_indices, seed_start_times_ut):
+    """
+    One bit-parallel scan over the time-ordered events.
+
+    Arrivals are kept in a heap ordered by the time from which the arrived seeds can board
+    other vehicles (arrival time + minimum transfer time). Before handling an event, all arrivals
+    that allow boarding it are applied to the stops, which also triggers the walking transfers.
+
+    Returns
+    -------
+    first_arrival_times: numpy.array
+        of shape (n_stops, len(seed_indices))
+    """
+    n_stops = data["n_stops"]
+    min_transfer_time = data["min_transfer_time"]
+    walk_neighbors = data["walk_neighbors"]
+    first_arrival_times = numpy.full((n_stops, len(seed_indices)), numpy.inf)
+    reached = [0] * n_stops
+    trip_riders = {}
+    # heap of (boarding_possible_from, arrival_time, stop_index, seed_bits)
+    arrivals = []
+    for bit, (stop_index, start_time_ut) in enumerate(zip(seed_indices, seed_start_times_ut)):
+        heappush(arrivals, (int(start_time_ut), int(start_time_ut), int(stop_index), 1 << bit))
+
+    def apply_arrivals(until):
+        while arrivals and arrivals[0][0] <= until:
+            _, arr_time, stop_index, bits = heappop(arrivals)
+            new_bits = bits & ~reached[stop_index]
+            if not new_bits:
+                continue
+            reached[stop_index] |= new_bits
+            bits_left = new_bits
+            while bits_left:
+                lowest = bits_left & -bits_left
+                first_arrival_times[stop_index, lowest.bit_length() - 1] = arr_time
+                bits_left ^= lowest
+            for neighbor_index, duration in walk_neighbors[stop_index]:
+                walk_arr_time = arr_time + duration
+                heappush(arrivals, (walk_arr_time + min_transfer_time, walk_arr_time, neighbor_index, new_bits))
+
+    for dep_time, arr_time, from_index, to_index, trip_I in zip(data["dep_times"].tolist(),
+                                                                data["arr_times"].tolist(),
+                                                                data["from_indices"].tolist(),
+                                                                data["to_indices"].tolist(),
+                                                                data["trip_Is"].tolist()):
+        apply_arrivals(dep_time)
+        riders = trip_riders.get(trip_I, 0) | reached[from_index]
+        if not riders:
+            continue
+        trip_riders[trip_I] = riders
+        arriving = riders & ~reached[to_index]
+        if arriving:
+            heappush(arrivals, (arr_time + min_transfer_time, arr_time, to_index, arriving))
+    apply_arrivals(float('inf'))
+    first_arrival_times[first_arrival_times > data["end_time_ut"]] = numpy.inf
+    return first_arrival_times
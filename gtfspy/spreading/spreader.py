@@ -159,11 +159,16 @@ class Spreader(object):
 
         combined = inf_time_data.merge(stop_data, how='inner', on='stop_I', suffixes=('_infs', '_stops'), copy=True)
 
+        inf_events = [(stop_I, dest_stop_obj.get_min_event())
+                      for stop_I, dest_stop_obj in self._stop_I_to_spreading_stop.items()]
+        inf_events = [(stop_I, inf_event) for stop_I, inf_event in inf_events if inf_event is not None]
+        transit_trip_Is = list(set(inf_event.trip_I for _, inf_event in inf_events if inf_event.trip_I != -1))
+        names_and_types = self.gtfs.get_route_names_and_types_of_tripIs(transit_trip_Is)
+        trip_I_to_name_and_type = dict(zip(names_and_types['trip_I'].tolist(),
+                                           zip(names_and_types['name'].tolist(), names_and_types['type'].tolist())))
+
         trips = []
-        for stop_I, dest_stop_obj in self._stop_I_to_spreading_stop.items():
-            inf_event = dest_stop_obj.get_min_event()
-            if inf_event is None:
-                continue
+        for stop_I, inf_event in inf_events:
             dep_stop_I = inf_event.from_stop_I
             dep_lat = float(combined[combined['stop_I'] == dep_stop_I]['lat'].values)
             dep_lon = float(combined[combined['stop_I'] == dep_stop_I]['lon'].values)
@@ -175,7 +180,7 @@ class Spreader(object):
                 name = "walk"
                 rtype = -1
             else:
-                name, rtype = self.gtfs.get_route_name_and_type_of_tripI(inf_event.trip_I)
+                name, rtype = trip_I_to_name_and_type[inf_event.trip_I]
 
             trip = {
                 "lats"      : [dep_lat, dest_lat],
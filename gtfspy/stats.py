@@ -8,6 +8,7 @@ import sys
 import os
 
 from gtfspy.gtfs import GTFS
+from gtfspy.segments import ensure_segments_table
 from gtfspy.util import wgs84_distance
 
 
@@ -146,10 +147,13 @@ def get_stats(gtfs):
         (but not a list)
     """
     stats = {}
-    # Basic table counts
-    for table in ['agencies', 'routes', 'stops', 'stop_times', 'trips', 'calendar', 'shapes', 'calendar_dates',
-                  'days', 'stop_distances', 'frequencies', 'feed_info', 'transfers']:
-        stats["n_" + table] = gtfs.get_row_count(table)
+    # Basic table counts (all in one query)
+    tables = ['agencies', 'routes', 'stops', 'stop_times', 'trips', 'calendar', 'shapes', 'calendar_dates',
+              'days', 'stop_distances', 'frequencies', 'feed_info', 'transfers']
+    counts = gtfs.execute_custom_query(
+        "SELECT " + ", ".join("(SELECT count(*) FROM " + table + ")" for table in tables)).fetchone()
+    for table, count in zip(tables, counts):
+        stats["n_" + table] = count
 
     # Agency names
     agencies = gtfs.get_table("agencies")
@@ -190,7 +194,19 @@ def get_stats(gtfs):
         stats["height_km"] = None
         stats["width_km"] = None
 
-    first_day_start_ut, last_day_start_ut = gtfs.get_day_start_ut_span()
+    # Dates, day start times and the maximum activity day from one pass over the days table
+    date_rows = gtfs.execute_custom_query(
+        'SELECT date, min(day_start_ut), max(day_start_ut), count(*) '
+        'FROM days '
+        'GROUP BY date '
+        'ORDER BY date').fetchall()
+    if date_rows:
+        dates, day_start_uts_min, day_start_uts_max, counts_per_date = zip(*date_rows)
+        first_day_start_ut = min(day_start_uts_min)
+        last_day_start_ut = max(day_start_uts_max)
+    else:
+        dates = []
+        first_day_start_ut, last_day_start_ut = None, None
     stats["start_time_ut"] = first_day_start_ut
     if last_day_start_ut is None:
         stats["end_time_ut"] = None
@@ -198,20 +214,16 @@ def get_stats(gtfs):
         # 28 (instead of 24) comes from the GTFS stANDard
         stats["end_time_ut"] = last_day_start_ut + 28 * 3600
 
-    stats["start_date"] = gtfs.get_min_date()
-    stats["end_date"] = gtfs.get_max_date()
+    stats["start_date"] = dates[0] if date_rows else None
+    stats["end_date"] = dates[-1] if date_rows else None
 
-    # Maximum activity day
-    max_activity_date = gtfs.execute_custom_query(
-        'SELECT count(*), date '
-        'FROM days '
-        'GROUP BY date '
-        'ORDER BY count(*) DESC, date '
-        'LIMIT 1;').fetchone()
-    if max_activity_date:
-        stats["max_activity_date"] = max_activity_date[1]
+    # Maximum activity day (in case of ties, the earliest date)
+    max_activity_date = None
+    if date_rows:
+        max_activity_date = dates[int(numpy.argmax(counts_per_date))]
+        stats["max_activity_date"] = max_activity_date
         max_activity_hour = gtfs.get_cursor().execute(
-            'SELECT count(*), arr_time_hour FROM day_stop_times '
+            'SELECT count(*), arr_time_hour FROM days JOIN stop_times USING(trip_I) '
             'WHERE date=? GROUP BY arr_time_hour '
             'ORDER BY count(*) DESC;', (stats["max_activity_date"],)).fetchone()
         if max_activity_hour:
@@ -227,33 +239,36 @@ def get_stats(gtfs):
     # Compute simple distributions of various columns that have a finite range of values.
     # Commented lines refer to values that are not imported yet, ?
 
-    stats['routes__type__dist'] = _distribution(gtfs, 'routes', 'type')
-    # stats['stop_times__pickup_type__dist'] = _distribution(gtfs, 'stop_times', 'pickup_type')
-    # stats['stop_times__drop_off_type__dist'] = _distribution(gtfs, 'stop_times', 'drop_off_type')
-    # stats['stop_times__timepoint__dist'] = _distribution(gtfs, 'stop_times', 'timepoint')
-    stats['calendar_dates__exception_type__dist'] = _distribution(gtfs, 'calendar_dates', 'exception_type')
-    stats['frequencies__exact_times__dist'] = _distribution(gtfs, 'frequencies', 'exact_times')
-    stats['transfers__transfer_type__dist'] = _distribution(gtfs, 'transfers', 'transfer_type')
-    stats['agencies__lang__dist'] = _distribution(gtfs, 'agencies', 'lang')
-    stats['stops__location_type__dist'] = _distribution(gtfs, 'stops', 'location_type')
-    # stats['stops__wheelchair_boarding__dist'] = _distribution(gtfs, 'stops', 'wheelchair_boarding')
-    # stats['trips__wheelchair_accessible__dist'] = _distribution(gtfs, 'trips', 'wheelchair_accessible')
-    # stats['trips__bikes_allowed__dist'] = _distribution(gtfs, 'trips', 'bikes_allowed')
-    # stats[''] = _distribution(gtfs, '', '')
+    stats.update(_distributions(gtfs, [
+        ('routes', 'type'),
+        # ('stop_times', 'pickup_type'),
+        # ('stop_times', 'drop_off_type'),
+        # ('stop_times', 'timepoint'),
+        ('calendar_dates', 'exception_type'),
+        ('frequencies', 'exact_times'),
+        ('transfers', 'transfer_type'),
+        ('agencies', 'lang'),
+        ('stops', 'location_type'),
+        # ('stops', 'wheelchair_boarding'),
+        # ('trips', 'wheelchair_accessible'),
+        # ('trips', 'bikes_allowed'),
+    ]))
     stats = _feed_calendar_span(gtfs, stats)
 
     return stats
 
 
-def _distribution(gtfs, table, column):
-    """Count occurrences of values AND return it as a string.
+def _distributions(gtfs, table_columns):
+    """Count occurrences of values of several columns AND return them as strings, all in one query.
 
-    Example return value:   '1:5 2:15'"""
-    cur = gtfs.conn.cursor()
-    cur.execute('SELECT {column}, count(*) '
-                'FROM {table} GROUP BY {column} '
-                'ORDER BY {column}'.format(column=column, table=table))
-    return ' '.join('%s:%s' % (t, c) for t, c in cur)
+    Example return value:   {'routes__type__dist': '1:5 2:15'}"""
+    query = " UNION ALL ".join(
+        "SELECT '{table}__{column}__dist' AS key, {column} AS value, count(*) AS n "
+        "FROM {table} GROUP BY {column}".format(table=table, column=column) for table, column in table_columns)
+    distributions = {table + '__' + column + '__dist': [] for table, column in table_columns}
+    for key, value, count in gtfs.conn.execute(query + " ORDER BY key, value"):
+        distributions[key].append('%s:%s' % (value, count))
+    return {key: ' '.join(values) for key, values in distributions.items()}
 
 
 def _fleet_size_estimate(gtfs, hour, date):
@@ -321,31 +336,68 @@ def _fleet_size_estimate(gtfs, hour, date):
     results['fleet_size_route_based'] = " ".join(fleet_size_list)
 
     # Fleet size estimate: maximum number of vehicles in movement
-    fleet_size_list = []
-    fleet_size_dict = {}
-    if hour:
-        for minute in range(hour * 3600, (hour + 1) * 3600, 60):
-            rows = gtfs.conn.cursor().execute(
-                'SELECT type, count(*) '
-                'FROM trips, routes, days '
-                'WHERE trips.route_I = routes.route_I '
-                'AND trips.trip_I=days.trip_I '
-                'AND start_time_ds <= ? '
-                'AND end_time_ds > ? + 60 '
-                'AND date = ? '
-                'GROUP BY type;',
-                (minute, minute, date))
-
-            for row in rows:
-                if fleet_size_dict.get(row[0], 0) < row[1]:
-                    fleet_size_dict[row[0]] = row[1]
-
-    for key in fleet_size_dict.keys():
-        fleet_size_list.append(str(key) + ':' + str(fleet_size_dict[key]))
-    results["fleet_size_max_movement"] = ' '.join(fleet_size_list)
+    results["fleet_size_max_movement"] = _fleet_size_max_movement(gtfs, hour, date)
     return results
 
 
+def _fleet_size_max_movement(gtfs, hour, date):
+    """
+    Maximum number of vehicles in movement (by route type) during the given hour of a date.
+
+    A vehicle is considered to be in movement during minute m, if its trip starts at latest at m and ends after m+60.
+    Instead of querying each minute separately, the counts are obtained with a sweep over the sorted trip start
+    and (shifted) end times, see _n_vehicles_in_movement.
+
+    Parameters
+    ----------
+    gtfs: GTFS
+    hour: int
+    date: str
+
+    Returns
+    -------
+    fleet_size_max_movement: str
+        e.g. "3:10 1:4" (route_type:max_vehicles), route types ordered by their first appearance
+    """
+    if not hour:
+        return ""
+    trips = pd.read_sql_query(
+        'SELECT type, start_time_ds, end_time_ds '
+        'FROM trips, routes, days '
+        'WHERE trips.route_I = routes.route_I '
+        'AND trips.trip_I=days.trip_I '
+        'AND date = ? ', gtfs.conn, params=(date,)).dropna()
+    minutes = numpy.arange(hour * 3600, (hour + 1) * 3600, 60)
+    first_minute_and_type_to_max = []
+    for route_type, type_trips in trips.groupby('type'):
+        n_moving = _n_vehicles_in_movement(type_trips['start_time_ds'].values, type_trips['end_time_ds'].values,
+                                           minutes)
+        if (n_moving > 0).any():
+            first_minute_and_type_to_max.append((numpy.nonzero(n_moving > 0)[0][0], route_type, n_moving.max()))
+    return ' '.join(str(route_type) + ':' + str(max_n_moving)
+                    for _, route_type, max_n_moving in sorted(first_minute_and_type_to_max))
+
+
+def _n_vehicles_in_movement(start_times, end_times, minutes):
+    """
+    Number of trips with start_time <= m < end_time - 60, for each minute m.
+
+    A trip is in movement during the minutes of [start_time, end_time - 60), so the count at minute m is
+    the number of trips started by m minus the number of trips with end_time - 60 <= m.
+    Trips with end_time - 60 <= start_time are never in movement, and are left out,
+    as they would otherwise be subtracted already before their start.
+
+    Returns
+    -------
+    n_moving: numpy.array
+    """
+    shifted_ends = numpy.asarray(end_times) - 60
+    in_movement_at_some_point = shifted_ends > start_times
+    starts = numpy.sort(numpy.asarray(start_times)[in_movement_at_some_point])
+    shifted_ends = numpy.sort(shifted_ends[in_movement_at_some_point])
+    return numpy.searchsorted(starts, minutes, side='right') - numpy.searchsorted(shifted_ends, minutes, side='right')
+
+
 def _n_gtfs_sources(gtfs):
     n_gtfs_sources = gtfs.execute_custom_query(
         "SELECT value FROM metadata WHERE key = 'n_gtfs_sources';").fetchone()
@@ -424,28 +476,15 @@ def trip_stats(gtfs, results_by_mode=False):
 
     """
     conn = gtfs.conn
-
-    conn.create_function("find_distance", 4, wgs84_distance)
-    cur = conn.cursor()
+    segments_table = ensure_segments_table(gtfs)
     # this query calculates the distance and travel time for each complete trip
-    # stop_data_df = pd.read_sql_query(query, self.conn, params=params)
-
     query = 'SELECT ' \
-            'startstop.trip_I AS trip_I, ' \
+            'trip_I, ' \
             'type, ' \
-            'sum(CAST(find_distance(startstop.lat, startstop.lon, endstop.lat, endstop.lon) AS INT)) as total_distance, ' \
-            'sum(endstop.arr_time_ds - startstop.arr_time_ds) as total_traveltime ' \
-            'FROM ' \
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) startstop, ' \
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) endstop, ' \
-            'trips, ' \
-            'routes ' \
-            'WHERE ' \
-            'startstop.trip_I = endstop.trip_I ' \
-            'AND startstop.seq + 1 = endstop.seq ' \
-            'AND startstop.trip_I = trips.trip_I ' \
-            'AND trips.route_I = routes.route_I ' \
-            'GROUP BY startstop.trip_I'
+            'sum(distance) as total_distance, ' \
+            'sum(duration) as total_traveltime ' \
+            'FROM ' + segments_table + ' ' \
+            'GROUP BY trip_I'
 
     q_result = pd.read_sql_query(query, conn)
     q_result['avg_speed_kmh'] = 3.6 * q_result['total_distance'] / q_result['total_traveltime']
@@ -475,27 +514,11 @@ def stop_headways(gtfs, results_by_mode=False):
 
 def get_section_stats(gtfs, results_by_mode=False):
     conn = gtfs.conn
-
-    conn.create_function("find_distance", 4, wgs84_distance)
-    cur = conn.cursor()
+    segments_table = ensure_segments_table(gtfs)
     # this query calculates the distance and travel time for each stop to stop section for each trip
-    # stop_data_df = pd.read_sql_query(query, self.conn, params=params)
-
-    query = 'SELECT type, from_stop_I, to_stop_I, distance, min(travel_time) AS min_time, max(travel_time) AS max_time, avg(travel_time) AS mean_time ' \
-            'FROM ' \
-            '(SELECT q1.trip_I, type, q1.stop_I as from_stop_I, q2.stop_I as to_stop_I,  ' \
-            'CAST(find_distance(q1.lat, q1.lon, q2.lat, q2.lon) AS INT) as distance, ' \
-            'q2.arr_time_ds - q1.arr_time_ds as travel_time, ' \
-            'q1.lat AS from_lat, q1.lon AS from_lon, q2.lat AS to_lat, q2.lon AS to_lon ' \
-            'FROM ' \
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) q1, ' \
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) q2, ' \
-            'trips, ' \
-            'routes ' \
-            'WHERE q1.trip_I = q2.trip_I ' \
-            'AND q1.seq + 1 = q2.seq ' \
-            'AND q1.trip_I = trips.trip_I ' \
-            'AND trips.route_I = routes.route_I) sq1 ' \
+    query = 'SELECT type, from_stop_I, to_stop_I, distance, min(duration) AS min_time, max(duration) AS max_time, ' \
+            'avg(duration) AS mean_time ' \
+            'FROM ' + segments_table + ' ' \
             'GROUP BY to_stop_I, from_stop_I, type '
 
     q_result = pd.read_sql_query(query, conn)
@@ -529,7 +552,7 @@ def route_frequencies(gtfs, results_by_mode=False):
         " (SELECT route_I, COUNT(route_I) as frequency"
         " FROM"
         " (SELECT date, route_I, trip_I"
-        " FROM day_stop_times"
+        " FROM days JOIN trips USING(trip_I) JOIN stop_times USING(trip_I)"
         " WHERE date = '{day}'"
         " GROUP by route_I, trip_I)"
         " GROUP BY route_I) as f"
@@ -619,7 +642,7 @@ def get_vehicle_hours_by_type(gtfs, route_type):
     day = gtfs.get_suitable_date_for_daily_extract()
     query = (" SELECT * , SUM(end_time_ds - start_time_ds)/3600 as vehicle_hours_type"
              " FROM"
-             " (SELECT * FROM day_trips as q1"
+             " (SELECT * FROM (SELECT * FROM days JOIN trips USING(trip_I)) as q1"
              " INNER JOIN"
              " (SELECT route_I, type FROM routes) as q2"
              " ON q1.route_I = q2.route_I"
@@ -633,11 +656,10 @@ def trips_frequencies(gtfs):
     """
         Get the frequency of trip_I in a particular day
     """
+    segments_table = ensure_segments_table(gtfs)
     query = (
-        " SELECT q1.stop_I as from_stop_I, q2.stop_I as to_stop_I, q1.trip_I as trip_I, COUNT(*) as freq FROM"
-        " (SELECT * FROM stop_times) q1,"
-        " (SELECT * FROM stop_times) q2"
-        " WHERE q1.seq+1=q2.seq AND q1.trip_I=q2.trip_I"
+        " SELECT from_stop_I, to_stop_I, trip_I, COUNT(*) as freq"
+        " FROM " + segments_table +
         " GROUP BY from_stop_I, to_stop_I")
     return(gtfs.execute_custom_query_pandas(query))
 
@@ -0,0 +1,225 @@
+"""
+Deterministic generator of synthetic GTFS feeds, for benchmarking and testing at arbitrary scales.
+
+The generated feed consists of
+    - stops scattered uniformly around a center point,
+    - routes running back and forth through a subset of the stops (ordered along a random direction),
+    - trips evenly spread over the service hours, all running on every day of the feed,
+    - (optionally) shapes following the stops of the routes,
+    - (optionally) routes whose trips are defined through frequencies.txt.
+
+The same parameters (including the seed) always produce exactly the same feed.
+"""
+from __future__ import print_function
+
+import csv
+import datetime
+import io
+import os
+import zipfile
+
+import numpy
+
+from gtfspy.util import wgs84_distances, wgs84_height, wgs84_width
+
+SERVICE_START_DS = 5 * 3600
+SERVICE_END_DS = 23 * 3600
+STOP_SPACING_M = 400
+VEHICLE_SPEED_M_PER_S = 8.
+DWELL_TIME_S = 20
+SHAPE_POINTS_PER_SEGMENT = 3
+
+
+def generate_synthetic_feed(n_stops=100,
+                            n_routes=10,
+                            trips_per_day=500,
+                            n_days=7,
+                            n_shaped_routes=None,
+                            n_frequency_routes=0,
+                            stops_per_route=None,
+                            start_date="2017-01-02",
+                            center_lat=60.17,
+                            center_lon=24.94,
+                            timezone="Europe/Helsinki",
+                            seed=0):
+    """
+    Generate a synthetic GTFS feed.
+
+    Parameters
+    ----------
+    n_stops: int
+    n_routes: int
+    trips_per_day: int
+        the (approximate) total number of trips per day, split evenly among the routes and both directions
+    n_days: int
+        the number of service days, starting from start_date
+    n_shaped_routes: int, optional
+        the number of routes that have shapes, defaults to all routes
+    n_frequency_routes: int, optional
+        the number of routes whose trips are defined through frequencies.txt instead of stop_times.txt
+    stops_per_route: int, optional
+        defaults to min(n_stops, 20)
+    start_date: str
+        first service day as "YYYY-MM-DD"
+    center_lat: float
+    center_lon: float
+    timezone: str
+    seed: int
+        seed of the random number generator
+
+    Returns
+    -------
+    feed: dict
+        maps the gtfs filenames (like 'stops.txt') to their string presentations,
+        which can be given as such to gtfspy.import_gtfs.import_gtfs
+    """
+    if n_stops < 2:
+        raise ValueError("A feed needs at least two stops")
+    if n_routes < 1:
+        raise ValueError("A feed needs at least one route")
+    if stops_per_route is None:
+        stops_per_route = min(n_stops, 20)
+    if not 2 <= stops_per_route <= n_stops:
+        raise ValueError("stops_per_route should be between 2 and n_stops")
+    if n_shaped_routes is None:
+        n_shaped_routes = n_routes
+    if n_frequency_routes > n_routes:
+        raise ValueError("n_frequency_routes can not be larger than n_routes")
+
+    random_state = numpy.random.RandomState(seed)
+
+    # stops
+    half_side_m = STOP_SPACING_M * numpy.sqrt(n_stops) / 2.
+    stop_lats = center_lat + wgs84_height(random_state.uniform(-half_side_m, half_side_m, n_stops))
+    stop_lons = center_lon + wgs84_width(1, center_lat) * random_state.uniform(-half_side_m, half_side_m, n_stops)
+    stop_ids = ["S%d" % i for i in range(n_stops)]
+    stops = [[stop_id, "Stop " + str(i), "%.6f" % lat, "%.6f" % lon]
+             for i, (stop_id, lat, lon) in enumerate(zip(stop_ids, stop_lats, stop_lons))]
+
+    routes = []
+    trips = []
+    stop_times = []
+    shapes = []
+    frequencies = []
+    trips_per_route = _split_evenly(trips_per_day, n_routes)
+    for route_index in range(n_routes):
+        route_id = "R%d" % route_index
+        routes.append([route_id, "SYN", str(route_index + 1), "Synthetic route " + str(route_index + 1), "3"])
+
+        # a random subset of the stops, ordered along a random direction
+        route_stops = random_state.choice(n_stops, stops_per_route, replace=False)
+        angle = random_state.uniform(0, 2 * numpy.pi)
+        route_stops = route_stops[numpy.argsort(numpy.cos(angle) * stop_lons[route_stops] / wgs84_width(1, center_lat) +
+                                                numpy.sin(angle) * stop_lats[route_stops] / wgs84_height(1))]
+        is_frequency_route = route_index >= n_routes - n_frequency_routes
+        has_shape = route_index < n_shaped_routes
+
+        for direction, n_trips in enumerate(_split_evenly(trips_per_route[route_index], 2)):
+            if n_trips == 0:
+                continue
+            direction_stops = route_stops if direction == 0 else route_stops[::-1]
+            lats, lons = stop_lats[direction_stops], stop_lons[direction_stops]
+            segment_lengths = wgs84_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+            travel_times = numpy.round(segment_lengths / VEHICLE_SPEED_M_PER_S).astype(int) + DWELL_TIME_S
+            offsets = numpy.concatenate([[0], numpy.cumsum(travel_times)])
+
+            shape_id = ""
+            if has_shape:
+                shape_id = "%s_%d_shape" % (route_id, direction)
+                shapes.extend(_shape_rows(shape_id, lats, lons))
+
+            headway = (SERVICE_END_DS - SERVICE_START_DS) // n_trips
+            if is_frequency_route:
+                trip_starts = [SERVICE_START_DS]
+                frequencies.append(["%s_%d_freq" % (route_id, direction),
+                                    _to_gtfs_time(SERVICE_START_DS),
+                                    _to_gtfs_time(SERVICE_START_DS + n_trips * headway),
+                                    str(headway)])
+            else:
+                # shift the directions (and routes) a bit with respect to each other
+                first_start = SERVICE_START_DS + random_state.randint(0, max(headway, 1))
+                trip_starts = first_start + headway * numpy.arange(n_trips)
+            for trip_index, trip_start in enumerate(trip_starts):
+                if is_frequency_route:
+                    trip_id = "%s_%d_freq" % (route_id, direction)
+                else:
+                    trip_id = "%s_%d_%d" % (route_id, direction, trip_index)
+                trips.append([route_id, "ALL", trip_id, str(direction), shape_id])
+                for seq, (stop_index, offset) in enumerate(zip(direction_stops, offsets)):
+                    time_str = _to_gtfs_time(trip_start + offset)
+                    stop_times.append([trip_id, time_str, time_str, stop_ids[stop_index], str(seq + 1)])
+
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end = start + datetime.timedelta(days=n_days - 1)
+    feed = {
+        "agency.txt": _to_csv(["agency_id", "agency_name", "agency_url", "agency_timezone"],
+                              [["SYN", "Synthetic Transit", "http://example.com", timezone]]),
+        "stops.txt": _to_csv(["stop_id", "stop_name", "stop_lat", "stop_lon"], stops),
+        "routes.txt": _to_csv(["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"], routes),
+        "trips.txt": _to_csv(["route_id", "service_id", "trip_id", "direction_id", "shape_id"], trips),
+        "stop_times.txt": _to_csv(["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+                                  stop_times),
+        "calendar.txt": _to_csv(["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday",
+                                 "sunday", "start_date", "end_date"],
+                                [["ALL"] + ["1"] * 7 + [start.strftime("%Y%m%d"), end.strftime("%Y%m%d")]]),
+    }
+    if shapes:
+        feed["shapes.txt"] = _to_csv(["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"], shapes)
+    if frequencies:
+        feed["frequencies.txt"] = _to_csv(["trip_id", "start_time", "end_time", "headway_secs"], frequencies)
+    return feed
+
+
+def write_synthetic_feed(output, **kwargs):
+    """
+    Generate a synthetic GTFS feed and write it to disk.
+
+    Parameters
+    ----------
+    output: str
+        path to a directory, or to a zip file (if the path ends with .zip)
+    **kwargs:
+        passed to generate_synthetic_feed
+
+    Returns
+    -------
+    output: str
+    """
+    feed = generate_synthetic_feed(**kwargs)
+    if output.endswith(".zip"):
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for fname in sorted(feed):
+                zip_file.writestr(fname, feed[fname])
+    else:
+        if not os.path.exists(output):
+            os.makedirs(output)
+        for fname in sorted(feed):
+            with io.open(os.path.join(output, fname), "w", encoding="utf-8", newline="") as f:
+                f.write(feed[fname])
+    return output
+
+
+def _split_evenly(total, n_parts):
+    return [total // n_parts + (1 if i < total % n_parts else 0) for i in range(n_parts)]
+
+
+def _shape_rows(shape_id, lats, lons):
+    # the shape runs through the stops, with some extra points in between
+    fractions = numpy.arange(SHAPE_POINTS_PER_SEGMENT) / float(SHAPE_POINTS_PER_SEGMENT)
+    shape_lats = numpy.append((lats[:-1, None] + fractions * (lats[1:] - lats[:-1])[:, None]).ravel(), lats[-1])
+    shape_lons = numpy.append((lons[:-1, None] + fractions * (lons[1:] - lons[:-1])[:, None]).ravel(), lons[-1])
+    return [[shape_id, "%.6f" % lat, "%.6f" % lon, str(seq)]
+            for seq, (lat, lon) in enumerate(zip(shape_lats, shape_lons))]
+
+
+def _to_gtfs_time(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+def _to_csv(header, rows):
+    f = io.StringIO()
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+    return f.getvalue()
@@ -0,0 +1,33 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtfspy import benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_run_benchmarks(self):
+        output_fname = os.path.join(self.output_dir, "results.json")
+        scales = {"tiny": dict(n_stops=20, n_routes=2, trips_per_day=20, n_days=2)}
+        results = benchmark.run_benchmarks(scales=scales, benchmarks=["import_gtfs", "get_stats"], repeat=2,
+                                           output_fname=output_fname, print_progress=False)
+        with open(output_fname) as f:
+            self.assertEqual(json.load(f), json.loads(json.dumps(results)))
+        self.assertEqual([(result["scale"], result["benchmark"]) for result in results["results"]],
+                         [("tiny", "import_gtfs"), ("tiny", "get_stats")])
+        for result in results["results"]:
+            self.assertIsNone(result["error"])
+            self.assertEqual(len(result["times_s"]), 2)
+            self.assertEqual(result["min_s"], min(result["times_s"]))
+            self.assertGreater(result["peak_memory_bytes"], 0)
+        with self.assertRaises(ValueError):
+            benchmark.run_benchmarks(scales=scales, benchmarks=["unknown"], print_progress=False)
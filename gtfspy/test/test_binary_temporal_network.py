@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy
+
+from gtfspy.gtfs import GTFS
+from gtfspy import binary_temporal_network
+from gtfspy.routing.helpers import get_transit_connections_from_binary
+from gtfspy.spreading.batch_spreader import BatchSpreader
+
+
+class BinaryTemporalNetworkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        self.gtfs = GTFS.from_directory_as_inmemory_db(self.gtfs_source_dir)
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_write_and_read(self):
+        path = os.path.join(self.output_dir, "network.tnetb")
+        compressed_path = os.path.join(self.output_dir, "network.zip")
+        n_events = binary_temporal_network.write_binary_temporal_network(self.gtfs, path, chunksize=10)
+        binary_temporal_network.write_binary_temporal_network(self.gtfs, compressed_path, compress=True)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["network.tnetb", "network.zip"])
+        events_df = self.gtfs.get_transit_events()
+        self.assertEqual(n_events, len(events_df))
+
+        events = binary_temporal_network.read_binary_temporal_network(path)
+        self.assertIsInstance(events["dep_time_ut"], numpy.memmap)
+        self.assertTrue((numpy.diff(events["dep_time_ut"]) >= 0).all())
+        for column in ["dep_time_ut", "arr_time_ut", "from_stop_I", "to_stop_I", "trip_I", "route_type"]:
+            self.assertTrue((numpy.sort(events[column]) == numpy.sort(events_df[column].values)).all())
+
+        compressed_events = binary_temporal_network.read_binary_temporal_network(compressed_path)
+        for name, _ in binary_temporal_network.TEMPORAL_NETWORK_COLUMNS:
+            self.assertTrue((compressed_events[name] == events[name]).all())
+        header = binary_temporal_network.read_binary_temporal_network_header(compressed_path)
+        self.assertEqual(header["n_events"], n_events)
+
+    def test_zip_signature_in_column_data(self):
+        path = os.path.join(self.output_dir, "network.tnetb")
+        binary_temporal_network.write_binary_temporal_network(self.gtfs, path)
+        header = binary_temporal_network.read_binary_temporal_network_header(path)
+        # an (empty) zip end of central directory record as the last bytes of the file
+        with open(path, "r+b") as f:
+            f.seek(-22, os.SEEK_END)
+            f.write(b"PK\x05\x06" + b"\0" * 18)
+        self.assertTrue(zipfile.is_zipfile(path))
+        self.assertEqual(binary_temporal_network.read_binary_temporal_network_header(path), header)
+        events = binary_temporal_network.read_binary_temporal_network(path)
+        self.assertIsInstance(events["dep_time_ut"], numpy.memmap)
+        self.assertEqual(len(events["dep_time_ut"]), header["n_events"])
+
+    def test_feed_routing_and_spreading(self):
+        path = os.path.join(self.output_dir, "network.tnetb")
+        binary_temporal_network.write_binary_temporal_network(self.gtfs, path)
+        day_start_ut = self.gtfs.get_day_start_ut_span()[0]
+        start_time_ut = day_start_ut + 7 * 3600
+        end_time_ut = day_start_ut + 12 * 3600
+
+        connections = get_transit_connections_from_binary(path, start_time_ut, end_time_ut)
+        self.assertGreater(len(connections), 0)
+        departure_times = [connection.departure_time for connection in connections]
+        self.assertEqual(departure_times, sorted(departure_times))
+
+        events = binary_temporal_network.read_binary_temporal_network(path)
+        spreader = BatchSpreader(self.gtfs, start_time_ut, end_time_ut)
+        file_spreader = BatchSpreader(self.gtfs, start_time_ut, end_time_ut, events=events)
+        seeds = spreader.stop_Is[:3]
+        self.assertTrue((spreader.spread(seeds, start_time_ut) == file_spreader.spread(seeds, start_time_ut)).all())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import pandas as pd
+
+from gtfspy.gtfs import GTFS
+from gtfspy.import_gtfs import import_gtfs
+from gtfspy import columnar_cache
+
+
+class ColumnarCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output_dir = tempfile.mkdtemp()
+        cls.imported_fname = os.path.join(cls.output_dir, "imported.sqlite")
+        gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        import_gtfs(gtfs_source_dir, cls.imported_fname, print_progress=False, columnar_cache=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.output_dir)
+
+    def setUp(self):
+        self.fname = os.path.join(self.output_dir, "test_gtfs.sqlite")
+        shutil.copy(self.imported_fname, self.fname)
+        self.gtfs = GTFS(self.fname)
+        columnar_cache.write_columnar_cache(self.gtfs)
+
+    def test_written_at_import(self):
+        cache = columnar_cache.ColumnarCache(self.imported_fname + columnar_cache.COLUMNAR_CACHE_SUFFIX)
+        self.assertTrue(cache.is_valid(GTFS(self.imported_fname), "stop_times"))
+
+    def test_tables_match_database(self):
+        cache = self.gtfs.get_columnar_cache()
+        self.assertIsNotNone(cache)
+        self.assertEqual(sorted(cache.tables), sorted(columnar_cache.CACHED_TABLES))
+        for table in columnar_cache.CACHED_TABLES:
+            self.assertTrue(cache.is_valid(self.gtfs, table))
+            pd.testing.assert_frame_equal(self.gtfs.get_table(table),
+                                          pd.read_sql("SELECT * FROM " + table, self.gtfs.conn))
+        columns = cache.load_columns("stop_times", ["trip_I", "seq"])
+        self.assertIsInstance(columns["trip_I"], numpy.memmap)
+
+    def test_transit_events_match_database(self):
+        start_ut, end_ut = self.gtfs.get_approximate_schedule_time_span_in_ut()
+        for args in [(None, None, None), (start_ut + 8 * 3600, start_ut + 10 * 3600, None), (None, None, 3)]:
+            from_cache = self.gtfs.get_transit_events(*args)
+            columnar_cache.invalidate_columnar_cache(self.gtfs)
+            from_database = self.gtfs.get_transit_events(*args)
+            columnar_cache.write_columnar_cache(self.gtfs)
+            pd.testing.assert_frame_equal(from_cache, from_database)
+
+    def test_invalidation(self):
+        cache = self.gtfs.get_columnar_cache()
+        self.gtfs.conn.execute("DELETE FROM stops WHERE stop_I = 1")
+        self.gtfs.conn.commit()
+        self.assertFalse(cache.is_valid(self.gtfs, "stops"))
+        self.assertTrue(cache.is_valid(self.gtfs, "trips"))
+        self.assertEqual(len(self.gtfs.stops()), self.gtfs.get_row_count("stops"))
+        columnar_cache.invalidate_columnar_cache(self.gtfs)
+        self.assertFalse(cache.is_valid(self.gtfs, "trips"))
+
+    def test_edited_tables_are_read_back(self):
+        stops = self.gtfs.stops()
+        stops["lat"] = 10.0
+        self.gtfs.update_stop_coordinates(stops[["stop_id", "lat", "lon"]])
+        self.assertTrue((self.gtfs.stops()["lat"] == 10.0).all())
+        self.assertTrue((self.gtfs.get_table("stops")["lat"] == 10.0).all())
+
+        columnar_cache.write_columnar_cache(self.gtfs)
+        # coordinate edits made directly with SQL are detected, too
+        self.gtfs.conn.execute("UPDATE stops SET lon = 20.0")
+        self.gtfs.conn.commit()
+        self.assertTrue((self.gtfs.get_table("stops")["lon"] == 20.0).all())
+
+        columnar_cache.write_columnar_cache(self.gtfs)
+        self.gtfs.conn.execute("UPDATE stop_times SET stop_I = 1")
+        self.gtfs.invalidate_caches()
+        self.assertTrue((self.gtfs.get_table("stop_times")["stop_I"] == 1).all())
+
+    def test_in_memory_database_has_no_cache(self):
+        G = GTFS.from_directory_as_inmemory_db(os.path.join(os.path.dirname(__file__), "test_data"))
+        self.assertIsNone(G.get_columnar_cache())
+        with self.assertRaises(ValueError):
+            columnar_cache.write_columnar_cache(G)
@@ -2,6 +2,7 @@ import io
 import os
 import unittest
 import shutil
+import zipfile
 
 import networkx
 import numpy
@@ -100,6 +101,26 @@ class ExportsTest(unittest.TestCase):
 
         self.assertTrue(at_least_one_shape_distance, "at least one shape distance should exist")
 
+    def test_stop_to_stop_network_edges(self):
+        edges = networks.stop_to_stop_network_edges(self.gtfs, link_attributes=ALL_STOP_TO_STOP_LINK_ATTRIBUTES)
+        self.assertIsInstance(edges, pandas.DataFrame)
+        self.assertGreater(len(edges), 0)
+        self.assertFalse(edges.duplicated(['route_type', 'from_stop_I', 'to_stop_I']).any())
+        n_events = len(self.gtfs.get_transit_events())
+        self.assertEqual(edges['n_vehicles'].sum(), n_events)
+        for route_I_counts, n_vehicles in zip(edges['route_I_counts'], edges['n_vehicles']):
+            self.assertEqual(sum(route_I_counts.values()), n_vehicles)
+
+        bus_net = networks.stop_to_stop_network_for_route_type(self.gtfs, BUS,
+                                                               link_attributes=ALL_STOP_TO_STOP_LINK_ATTRIBUTES)
+        bus_edges = edges[edges['route_type'] == BUS]
+        self.assertEqual(len(bus_edges), len(bus_net.edges()))
+        for edge in bus_edges.to_dict("records"):
+            link_data = bus_net.get_edge_data(edge['from_stop_I'], edge['to_stop_I'])
+            for attribute in ALL_STOP_TO_STOP_LINK_ATTRIBUTES:
+                if attribute in link_data:
+                    self.assertEqual(link_data[attribute], edge[attribute])
+
     def test_combined_stop_to_stop_transit_network(self):
         multi_di_graph = networks.combined_stop_to_stop_transit_network(self.gtfs)
         self.assertIsInstance(multi_di_graph, networkx.MultiDiGraph)
@@ -236,6 +257,51 @@ class ExportsTest(unittest.TestCase):
                 else:
                     os.remove(test_output_dir + ending)
 
+    def test_write_gtfs_in_chunks(self):
+        zip_path = os.path.join(self.extract_output_dir, "chunked_gtfs.zip")
+        files_before = set(os.listdir(self.extract_output_dir))
+        exports.write_gtfs(self.gtfs, zip_path, chunksize=2)
+        # no temporary files are left behind
+        self.assertEqual(set(os.listdir(self.extract_output_dir)) - files_before, {"chunked_gtfs.zip"})
+        with zipfile.ZipFile(zip_path) as zip_file:
+            self.assertIn("stop_times.txt", zip_file.namelist())
+            stop_times = pandas.read_csv(zip_file.open("stop_times.txt"))
+        self.assertEqual(len(stop_times), self.gtfs.get_row_count("stop_times"))
+        self.assertFalse(stop_times['trip_id'].isnull().any())
+        self.assertFalse(stop_times['stop_id'].isnull().any())
+        in_memory_file = io.StringIO()
+        exports._write_gtfs_stop_times(self.gtfs, in_memory_file)
+        in_memory_file.seek(0)
+        self.assertEqual(len(pandas.read_csv(in_memory_file)), len(stop_times))
+
+    def test_write_query_in_chunks_keeps_integers(self):
+        # an integer column with NULLs in some of the chunks only
+        from_clause = "FROM (SELECT 1 AS i, 3 AS x UNION ALL SELECT 2, NULL UNION ALL SELECT 3, 4) ORDER BY i"
+        outputs = []
+        for chunksize in [1, 2, 3]:
+            in_memory_file = io.StringIO()
+            exports._write_query_in_chunks(self.gtfs, in_memory_file, ["i", "x AS min_transfer_time"], from_clause,
+                                           chunksize)
+            outputs.append(in_memory_file.getvalue())
+        self.assertEqual(outputs[0], "i,min_transfer_time\n1,3\n2,\n3,4\n")
+        self.assertEqual(len(set(outputs)), 1)
+        stop_times_outputs = []
+        for chunksize in [1, exports.WRITE_GTFS_CHUNKSIZE]:
+            in_memory_file = io.StringIO()
+            exports._write_gtfs_stop_times(self.gtfs, in_memory_file, chunksize=chunksize)
+            stop_times_outputs.append(in_memory_file.getvalue())
+        self.assertEqual(stop_times_outputs[0], stop_times_outputs[1])
+
+    def test_write_gtfs_directory_in_parallel(self):
+        from gtfspy.import_gtfs import import_gtfs
+        sqlite_fname = os.path.join(self.extract_output_dir, "parallel_write.sqlite")
+        import_gtfs(self.gtfs_source_dir, sqlite_fname)
+        output_dir = os.path.join(self.extract_output_dir, "parallel_write_gtfs")
+        exports.write_gtfs(GTFS(sqlite_fname), output_dir, n_threads=3)
+        self.assertIn("trips.txt", os.listdir(output_dir))
+        trips = pandas.read_csv(os.path.join(output_dir, "trips.txt"))
+        self.assertEqual(len(trips), self.gtfs.get_row_count("trips"))
+
     def test_write_stops_geojson(self):
         in_memory_file = io.StringIO()
         exports.write_stops_geojson(self.gtfs, in_memory_file)
@@ -247,6 +313,41 @@ class ExportsTest(unittest.TestCase):
         self.assertIn("name", gjson_properties.keys())
         self.assertIn("stop_I", gjson_properties.keys())
 
+    def test_stops_geojson_fields(self):
+        features = exports.create_stops_geojson_dict(self.gtfs)['features']
+        self.assertEqual(len(features), self.gtfs.get_row_count("stops"))
+        self.assertEqual(set(features[0]['properties'].keys()), {"stop_I", "name"})
+        fields = {'stop_I': 'id', 'stop_id': 'stop_id', 'name': 'stop_name', 'lat': 'lat', 'lon': 'lon'}
+        features = exports.create_stops_geojson_dict(self.gtfs, fields=fields)['features']
+        stops = self.gtfs.stops()
+        self.assertEqual(features[0]['properties'], {"id": str(stops['stop_I'][0]),
+                                                     "stop_id": stops['stop_id'][0],
+                                                     "stop_name": stops['name'][0]})
+        self.assertEqual(features[0]['geometry']['coordinates'], [stops['lon'][0], stops['lat'][0]])
+        with self.assertRaises(ValueError):
+            exports.create_stops_geojson_dict(self.gtfs, fields={'no_such_column': 'x'})
+
+    def test_write_routes_geojson_with_reduced_precision(self):
+        in_memory_file = io.StringIO()
+        exports.write_routes_geojson(self.gtfs, in_memory_file, precision=3, simplify_tolerance=100)
+        in_memory_file.seek(0)
+        gjson = geojson.loads(in_memory_file.read(-1))
+        self.assertEqual(len(gjson['features']), len(self.gtfs.get_all_route_shapes(use_shapes=False)))
+        for feature in gjson['features']:
+            coordinates = feature['geometry']['coordinates']
+            self.assertGreaterEqual(len(coordinates), 2)
+            for lon, lat in coordinates:
+                self.assertEqual(round(lon, 3), lon)
+                self.assertEqual(round(lat, 3), lat)
+
+    def test_stream_stops_geojson_to_file(self):
+        path = os.path.join(self.extract_output_dir, "stops.geojson")
+        exports.write_stops_geojson(self.gtfs, path, precision=4)
+        with open(path) as f:
+            gjson = geojson.loads(f.read())
+        self.assertEqual(len(gjson['features']), self.gtfs.get_row_count("stops"))
+        self.assertEqual(gjson['features'][-1]['id'], str(self.gtfs.get_row_count("stops") - 1))
+
     def test_write_sections_geojson(self):
         in_memory_file = io.StringIO()
         exports.write_sections_geojson(self.gtfs, in_memory_file)
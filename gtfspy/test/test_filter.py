@@ -110,6 +110,41 @@ class TestGTFSfilter(unittest.TestCase):
         self.assertLess(start_date_not_included, min_date_calendar)
         os.remove(self.fname_copy)
 
+    def test_filter_keeps_only_referenced_rows(self):
+        FilterExtract(self.G, self.fname_copy, agency_ids_to_preserve=['DTA'], buffer_lat=36.914893,
+                      buffer_lon=-116.76821, buffer_distance=50, update_metadata=False).create_filtered_copy()
+        conn_copy = sqlite3.connect(self.fname_copy)
+        queries = ["SELECT count(*) FROM shapes WHERE shape_id NOT IN "
+                   "(SELECT shape_id FROM trips WHERE shape_id IS NOT NULL)",
+                   "SELECT count(*) FROM stop_times WHERE trip_I NOT IN (SELECT trip_I FROM trips)",
+                   "SELECT count(*) FROM stop_times WHERE stop_I NOT IN (SELECT stop_I FROM stops)",
+                   "SELECT count(*) FROM trips WHERE route_I NOT IN (SELECT route_I FROM routes)",
+                   "SELECT count(*) FROM stop_distances WHERE from_stop_I NOT IN (SELECT stop_I FROM stops)"]
+        for query in queries:
+            self.assertEqual(conn_copy.execute(query).fetchone()[0], 0, query)
+        self.assertGreater(conn_copy.execute("SELECT count(*) FROM trips").fetchone()[0], 0)
+        views = [row[0] for row in conn_copy.execute("SELECT name FROM sqlite_master WHERE type='view'")]
+        self.assertIn("day_stop_times", views)
+
+    def test_filter_does_not_copy_segments_table(self):
+        from gtfspy.segments import SEGMENTS_TABLE, ensure_segments_table
+        ensure_segments_table(self.G)
+        FilterExtract(self.G, self.fname_copy, buffer_lat=36.914893, buffer_lon=-116.76821, buffer_distance=50,
+                      update_metadata=False).create_filtered_copy()
+        G_copy = GTFS(self.fname_copy)
+        self.assertNotIn(SEGMENTS_TABLE, G_copy.get_table_names())
+        segments = G_copy.execute_custom_query_pandas("SELECT * FROM " + ensure_segments_table(G_copy))
+        self.assertEqual(len(segments), G_copy.get_row_count("stop_times") - G_copy.get_row_count("trips"))
+
+    def test_filter_no_data_left(self):
+        filters = [dict(agency_ids_to_preserve=['NO_SUCH_AGENCY']),
+                   dict(buffer_lat=0, buffer_lon=0, buffer_distance=1),
+                   dict(start_date="2001-01-01", end_date="2001-01-02")]
+        for filter_kwargs in filters:
+            with self.assertRaises(ValueError):
+                FilterExtract(self.G, self.fname_copy, update_metadata=False, **filter_kwargs).create_filtered_copy()
+            self.assertFalse(os.path.exists(self.fname_copy))
+
     def test_filter_spatially(self):
         # test that the db is split by a given spatial boundary
         FilterExtract(self.G, self.fname_copy, buffer_lat=36.914893, buffer_lon=-116.76821, buffer_distance=50).create_filtered_copy()
@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
 import datetime
+import io
 import os
+import shutil
 import sqlite3
+import tempfile
 import unittest
 
 import numpy
@@ -99,6 +102,18 @@ class TestGTFS(unittest.TestCase):
         # tested as a part of test_to_directed_graph, although this could be made a separate test as well
         pass
 
+    def test_get_shape_distances_between_stops(self):
+        stop_times = self.gtfs.execute_custom_query_pandas("SELECT trip_I, seq FROM stop_times")
+        trip_Is = list(stop_times['trip_I'].values) + [-1]
+        from_seqs = list(stop_times['seq'].values) + [0]
+        to_seqs = list(stop_times['seq'].values + 1) + [1]
+        distances = self.gtfs.get_shape_distances_between_stops(trip_Is, from_seqs, to_seqs)
+        self.assertEqual(len(distances), len(trip_Is))
+        self.assertIsNone(distances[-1])
+        self.assertTrue(any(distance is not None for distance in distances))
+        for trip_I, from_seq, to_seq, distance in zip(trip_Is, from_seqs, to_seqs, distances):
+            self.assertEqual(distance, self.gtfs.get_shape_distance_between_stops(trip_I, from_seq, to_seq))
+
     def test_stops(self):
         self.assertIsInstance(self.gtfs.stops(), pandas.DataFrame)
 
@@ -138,6 +153,20 @@ class TestGTFS(unittest.TestCase):
         self.assertTrue(isinstance(res, dict))
         # TODO! Not properly tested yet.
 
+    def test_generate_trip_trajectories(self):
+        s, e = self.gtfs.get_approximate_schedule_time_span_in_ut()
+        trips = self.gtfs.get_trip_trajectories_within_timespan(s, s + 3600 * 24)['trips']
+        self.assertGreater(len(trips), 0)
+        for trip in trips:
+            self.assertEqual(len(trip['times']), len(trip['lats']))
+            self.assertEqual(len(trip['times']), len(trip['lons']))
+            self.assertEqual(trip['times'], sorted(trip['times']))
+        slices = list(self.gtfs.generate_trip_trajectories(s, s + 3600 * 24, time_slice_length=3600))
+        self.assertEqual(len(slices), 24)
+        sliced_trips = [trip for trips_in_slice in slices for trip in trips_in_slice]
+        key = lambda trip: (trip['times'][0], trip['name'])
+        self.assertEqual(sorted(sliced_trips, key=key), sorted(trips, key=key))
+
     def test_get_stop_count_data(self):
         dt_start_query = datetime.datetime(2007, 1, 1, 7, 59, 59)
         dt_end_query = datetime.datetime(2007, 1, 1, 10, 2, 1)
@@ -167,6 +196,20 @@ class TestGTFS(unittest.TestCase):
         self.assertGreater(len(res), 0)
         self.assertIsNotNone(res, "this is a 'it compiles' test")
 
+    def test_get_count_data_in_time_bins(self):
+        dt_start_query = datetime.datetime(2007, 1, 1, 7, 0, 0)
+        start_query = self.gtfs.unlocalized_datetime_to_ut_seconds(dt_start_query)
+        edges = [start_query + 1800 * i for i in range(9)]
+        stop_data_by_bin = self.gtfs.get_stop_count_data_in_time_bins(edges)
+        seg_data_by_bin = self.gtfs.get_segment_count_data_in_time_bins(edges)
+        self.assertEqual(len(stop_data_by_bin), len(edges) - 1)
+        self.assertEqual(len(seg_data_by_bin), len(edges) - 1)
+        for bin_start, bin_end, stop_data, seg_data in zip(edges[:-1], edges[1:], stop_data_by_bin, seg_data_by_bin):
+            self.assertTrue(stop_data.equals(self.gtfs.get_stop_count_data(bin_start, bin_end)))
+            self.assertEqual(seg_data, self.gtfs.get_segment_count_data(bin_start, bin_end))
+        self.assertGreater(sum(stop_data['count'].sum() for stop_data in stop_data_by_bin), 0)
+        self.assertGreater(sum(len(seg_data) for seg_data in seg_data_by_bin), 0)
+
     def test_get_tripIs_active_in_range(self):
         dt_start_query = datetime.datetime(2007, 1, 1, 7, 59, 59)
         dt_end_query = datetime.datetime(2007, 1, 1, 8, 2, 1)
@@ -232,6 +275,48 @@ class TestGTFS(unittest.TestCase):
         self.assertTrue(isinstance(name, string_types))
         self.assertTrue(isinstance(type_, int))
 
+    def test_get_route_names_and_types_of_tripIs(self):
+        trip_Is = self.gtfs.execute_custom_query_pandas("SELECT trip_I FROM trips")['trip_I'].tolist()[::-1]
+        names_and_types = self.gtfs.get_route_names_and_types_of_tripIs(trip_Is)
+        self.assertEqual(names_and_types['trip_I'].tolist(), trip_Is)
+        for trip_I, name, type_ in names_and_types[['trip_I', 'name', 'type']].itertuples(index=False):
+            self.assertEqual((name, type_), self.gtfs.get_route_name_and_type_of_tripI(trip_I))
+        with self.assertRaises(ValueError):
+            self.gtfs.get_route_names_and_types_of_tripIs([-1])
+
+    def test_get_coordinates_of_stops(self):
+        stop_Is = self.gtfs.stops()['stop_I'].tolist()
+        lats, lons = self.gtfs.get_coordinates_of_stops(stop_Is)
+        for stop_I, lat, lon in zip(stop_Is, lats, lons):
+            self.assertEqual((lat, lon), self.gtfs.get_stop_coordinates(stop_I))
+
+    def test_get_stop_distances(self):
+        stop_distances = self.gtfs.execute_custom_query_pandas("SELECT from_stop_I, to_stop_I FROM stop_distances")
+        from_stop_Is = stop_distances['from_stop_I'].tolist() + [-1]
+        to_stop_Is = stop_distances['to_stop_I'].tolist() + [-1]
+        d_walks = self.gtfs.get_stop_distances(from_stop_Is, to_stop_Is)
+        self.assertIsNone(d_walks[-1])
+        for from_stop_I, to_stop_I, d_walk in zip(from_stop_Is, to_stop_Is, d_walks):
+            self.assertEqual(d_walk, self.gtfs.get_stop_distance(from_stop_I, to_stop_I))
+
+    def test_query_cache(self):
+        G = GTFS.from_directory_as_inmemory_db(self.gtfs_source_dir)
+        self.assertIsNone(G.get_query_cache_info())
+        G.enable_query_cache(maxsize=2)
+        stops = G.stops()
+        stops['lat'] = 0
+        self.assertTrue((G.stops()['lat'] != 0).all())
+        self.assertEqual(G.get_query_cache_info()['hits'], 1)
+        G.stop(1)
+        G.stop(2)
+        self.assertEqual(G.get_query_cache_info()['size'], 2)
+        # modifications of the database invalidate the cached results
+        n_stops = len(G.stops())
+        G.conn.execute("DELETE FROM stops WHERE stop_I = 1")
+        self.assertEqual(len(G.stops()), n_stops - 1)
+        G.disable_query_cache()
+        self.assertIsNone(G.get_query_cache_info())
+
     def test_get_trip_stop_time_data(self):
         start_ut, end_ut = self.gtfs.get_approximate_schedule_time_span_in_ut()
         dsut_dict = self.gtfs.get_tripIs_within_range_by_dsut(start_ut, end_ut)
@@ -286,5 +371,67 @@ class TestGTFS(unittest.TestCase):
             self.assertIn(r_type, modes)
 
     def test_homogenize_stops_table_with_other_db(self):
-        # TODO: testing this would require creating temp databases or something, joining inmemory databases might be impossible?
-        pass
+        from gtfspy.import_gtfs import import_gtfs
+        from gtfspy.synthetic_feed import generate_synthetic_feed
+        feed = generate_synthetic_feed(n_stops=30, n_routes=3, trips_per_day=30, n_days=1)
+        other_feed = dict(feed)
+        stops = pandas.read_csv(io.StringIO(feed["stops.txt"]), dtype={"stop_id": str})
+        stops.loc[stops["stop_id"] == "S0", "stop_lat"] += 0.05  # moved by about 5.5 km
+        # moved by about 33 m to the east, which is within the 50 m limit; before matching stops with the
+        # coordinates in the right order (lat, lon), this was measured as about 67 m and the stops were not paired
+        stops.loc[stops["stop_id"] == "S2", "stop_lon"] += 0.0006
+        stops = pandas.concat([stops, pandas.DataFrame([["S_extra", "Extra", 61.0, 25.0]], columns=stops.columns)])
+        other_feed["stops.txt"] = stops.to_csv(index=False)
+        other_feed["stop_times.txt"] = feed["stop_times.txt"].replace(",S1,", ",X1,")
+        other_feed["stops.txt"] = other_feed["stops.txt"].replace("S1,", "X1,", 1)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for match_stop_ids, n_common in [(True, 28), (False, 29)]:
+                fnames = [os.path.join(tmp_dir, name + str(match_stop_ids) + ".sqlite") for name in ["this", "other"]]
+                import_gtfs(feed, fnames[0], print_progress=False)
+                import_gtfs(other_feed, fnames[1], print_progress=False)
+                G = GTFS(fnames[0])
+                G.homogenize_stops_table_with_other_db(fnames[1], match_stop_ids=match_stop_ids)
+                this_pairs = G.execute_custom_query_pandas("SELECT stop_id, stop_pair_I FROM stops")
+                other_pairs = G.execute_custom_query_pandas("SELECT stop_id, stop_pair_I FROM other.stops")
+                # 30 + 31 stops in the two databases
+                self.assertEqual(len(this_pairs), 61 - n_common)
+                self.assertEqual(len(other_pairs), 61 - n_common)
+                self.assertEqual(set(this_pairs["stop_pair_I"]), set(range(61 - n_common)))
+                self.assertEqual(set(other_pairs["stop_pair_I"]), set(range(61 - n_common)))
+                this_pair_Is = dict(zip(this_pairs["stop_id"], this_pairs["stop_pair_I"]))
+                other_pair_Is = dict(zip(other_pairs["stop_id"], other_pairs["stop_pair_I"]))
+                self.assertEqual(this_pair_Is["S5"], other_pair_Is["S5"])
+                self.assertEqual(this_pair_Is["S2"], other_pair_Is["S2"])
+                self.assertNotEqual(this_pair_Is["S0"], other_pair_Is["S0"])
+                self.assertEqual(this_pair_Is["S1"] == other_pair_Is["X1"], not match_stop_ids)
+                G.conn.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_get_route_difference_with_other_db(self):
+        from gtfspy.synthetic_feed import generate_synthetic_feed
+        feed = generate_synthetic_feed(n_stops=30, n_routes=4, trips_per_day=80, n_days=1, stops_per_route=10)
+        other_feed = dict(feed)
+        # drop the last stop of the first trip of route R0
+        stop_times = feed["stop_times.txt"].splitlines()
+        r0_rows = [i for i, row in enumerate(stop_times) if row.startswith("R0_0_0,")]
+        other_feed["stop_times.txt"] = "\n".join(stop_times[:r0_rows[-1]] + stop_times[r0_rows[-1] + 1:]) + "\n"
+        G = GTFS.from_directory_as_inmemory_db(feed)
+        other_G = GTFS.from_directory_as_inmemory_db(other_feed)
+        start_time, end_time = 0, 24 * 3600
+
+        this_unique, other_unique = G.get_route_difference_with_other_db(G, start_time, end_time)
+        self.assertEqual((len(this_unique), len(other_unique)), (0, 0))
+        this_unique, other_unique = G.get_route_difference_with_other_db(other_G, start_time, end_time)
+        self.assertEqual((len(this_unique), len(other_unique)), (0, 1))
+        this_unique, other_unique = G.get_route_difference_with_other_db(other_G, start_time, end_time,
+                                                                         uniqueness_threshold=1)
+        self.assertEqual((len(this_unique), len(other_unique)), (0, 0))
+        this_unique, other_unique = G.get_route_difference_with_other_db(other_G, start_time, end_time,
+                                                                         uniqueness_ratio=0.95)
+        self.assertEqual((len(this_unique), len(other_unique)), (0, 1))
+        this_unique, other_unique = G.get_route_difference_with_other_db(other_G, start_time, end_time,
+                                                                         uniqueness_ratio=0.85)
+        self.assertEqual((len(this_unique), len(other_unique)), (0, 0))
@@ -0,0 +1,115 @@
+import gc
+import multiprocessing
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from gtfspy.gtfs import GTFS
+from gtfspy.import_gtfs import import_gtfs
+from gtfspy import segments
+
+
+def _count_stops(gtfs):
+    return gtfs.get_row_count("stops")
+
+
+class ReadOnlyGTFSTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output_dir = tempfile.mkdtemp()
+        cls.fname = os.path.join(cls.output_dir, "test_gtfs.sqlite")
+        gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        import_gtfs(gtfs_source_dir, cls.fname, print_progress=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.output_dir)
+
+    def test_queries_from_many_threads(self):
+        G = GTFS(self.fname, read_only=True)
+        reference = GTFS(self.fname).get_stop_count_data(*G.get_approximate_schedule_time_span_in_ut())
+        results = []
+        errors = []
+
+        def query():
+            try:
+                start_ut, end_ut = G.get_approximate_schedule_time_span_in_ut()
+                results.append((G.get_stop_count_data(start_ut, end_ut), id(G.conn)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 8)
+        for stop_count_data, _ in results:
+            self.assertTrue(stop_count_data.equals(reference))
+        G.close()
+
+    def test_connections_are_closed_when_threads_exit(self):
+        G = GTFS(self.fname, read_only=True)
+        n_connections = len(G._connections)
+        thread_connections = []
+
+        def query():
+            G.get_row_count("stops")
+            thread_connections.append(G.conn)
+
+        for _ in range(3):
+            threads = [threading.Thread(target=query) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            gc.collect()
+            self.assertEqual(len(G._connections), n_connections)
+        self.assertEqual(len(thread_connections), 12)
+        for conn in thread_connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+        self.assertGreater(G.get_row_count("stops"), 0)
+        G.close()
+
+    def test_writes_are_refused(self):
+        for G in [GTFS(self.fname, read_only=True), GTFS(self.fname, immutable=True)]:
+            self.assertTrue(G.read_only)
+            with self.assertRaises(sqlite3.OperationalError):
+                G.conn.execute("DELETE FROM stops")
+            with self.assertRaises(sqlite3.OperationalError):
+                G.meta["some_key"] = "some_value"
+            self.assertGreater(G.get_row_count("stops"), 0)
+        with self.assertRaises(ValueError):
+            GTFS(sqlite3.connect(self.fname), read_only=True)
+
+    def test_segments_table_of_read_only_gtfs(self):
+        G = GTFS(self.fname, read_only=True)
+        table_name = segments.ensure_segments_table(G)
+        self.assertEqual(table_name, "temp." + segments.SEGMENTS_TABLE)
+        self.assertEqual(len(segments.get_segments(G)), len(segments.get_segments(GTFS(self.fname))))
+
+    def test_pickling(self):
+        G = GTFS(self.fname, read_only=True)
+        n_stops = G.get_row_count("stops")
+        G_copy = pickle.loads(pickle.dumps(G))
+        self.assertEqual(G_copy.get_row_count("stops"), n_stops)
+        self.assertIsNot(G_copy.conn, G.conn)
+        with self.assertRaises(TypeError):
+            pickle.dumps(GTFS(self.fname))
+
+    def test_worker_processes(self):
+        G = GTFS(self.fname, read_only=True)
+        n_stops = G.get_row_count("stops")
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(pool.map(_count_stops, [G] * 4), [n_stops] * 4)
+        finally:
+            pool.close()
+            pool.join()
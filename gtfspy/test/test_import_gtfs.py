@@ -1,7 +1,9 @@
 from __future__ import print_function
 
 import os
+import shutil
 import sqlite3
+import tempfile
 import unittest
 
 
@@ -522,6 +524,59 @@ class TestImport(unittest.TestCase):
         self.assertEqual(rows[2][0], 1)
         self.assertEqual(rows[3][0], 2)
 
+    def test_partial_day_trips_materialization(self):
+        gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        import_gtfs(gtfs_source_dir, self.conn, preserve_connection=True, print_progress=False,
+                    day_trips_date_range=("2007-01-01", "2007-01-07"))
+        G = GTFS(self.conn)
+        G_full = GTFS.from_directory_as_inmemory_db(gtfs_source_dir)
+        self.assertIsNone(G_full.get_materialized_day_trips_date_range())
+        self.assertEqual(G.get_materialized_day_trips_date_range(), ("2007-01-01", "2007-01-07"))
+        self.assertLess(G.get_row_count("day_trips2"), G_full.get_row_count("day_trips2"))
+
+        # queries outside of the materialized dates extend the materialization
+        start_ut = G.get_day_start_ut("2007-02-01") + 8 * 3600
+        end_ut = start_ut + 2 * 3600
+        events = G.get_transit_events(start_ut, end_ut)
+        self.assertGreater(len(events), 0)
+        self.assertTrue(events.equals(G_full.get_transit_events(start_ut, end_ut)))
+        first_date, last_date = G.get_materialized_day_trips_date_range()
+        self.assertEqual(first_date, "2007-01-01")
+        self.assertGreaterEqual(last_date, "2007-02-01")
+        self.assertTrue(G.get_trip_counts_per_day().equals(G_full.get_trip_counts_per_day()))
+
+        G.materialize_day_trips()
+        self.assertIsNone(G.get_materialized_day_trips_date_range())
+        self.assertEqual(G.get_row_count("day_trips2"), G_full.get_row_count("day_trips2"))
+
+    def test_partial_day_trips_materialization_read_only(self):
+        gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp_dir, "partial.sqlite")
+            import_gtfs(gtfs_source_dir, fname, print_progress=False,
+                        day_trips_date_range=("2007-01-01", "2007-01-07"))
+            n_rows_on_disk = GTFS(fname).get_row_count("day_trips2")
+            G_full = GTFS.from_directory_as_inmemory_db(gtfs_source_dir)
+            G = GTFS(fname, read_only=True)
+            start_ut = G.get_day_start_ut("2007-02-01") + 8 * 3600
+            end_ut = start_ut + 2 * 3600
+            self.assertEqual(sorted(G.get_tripIs_active_in_range(start_ut, end_ut)["trip_I"]),
+                             sorted(G_full.get_tripIs_active_in_range(start_ut, end_ut)["trip_I"]))
+            self.assertTrue(G.get_transit_events(start_ut, end_ut).equals(
+                G_full.get_transit_events(start_ut, end_ut)))
+            self.assertGreaterEqual(G.get_materialized_day_trips_date_range()[1], "2007-02-01")
+            G.materialize_day_trips()
+            self.assertIsNone(G.get_materialized_day_trips_date_range())
+            self.assertTrue(G.get_trip_counts_per_day().equals(G_full.get_trip_counts_per_day()))
+            G.close()
+            # the database itself is left unmodified
+            G = GTFS(fname)
+            self.assertEqual(G.get_materialized_day_trips_date_range(), ("2007-01-01", "2007-01-07"))
+            self.assertEqual(G.get_row_count("day_trips2"), n_rows_on_disk)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_metaData(self):
         # TODO! untested
         pass
@@ -24,3 +24,12 @@ class TestImportValidator(unittest.TestCase):
     def test_null_counts_in_gtfsobj(self):
         self.validator_object_txt._validate_no_nulls()
         self.validator_object_txt.get_warnings()
+
+    def test_dangler_and_null_counts(self):
+        self.G_txt.conn.execute("DELETE FROM trips WHERE trip_I IN (SELECT trip_I FROM trips LIMIT 1)")
+        self.G_txt.conn.execute("UPDATE routes SET name=NULL")
+        warnings = self.validator_object_txt.get_warnings()
+        counts = warnings.get_warning_counts()
+        self.assertGreater(counts[iv.WARNING_DANGLING_STOP_TIMES_VS_TRIPS], 0)
+        self.assertEqual(counts[iv.WARNING_TRIPS_ROWS_MISSING], -1)
+        self.assertEqual(counts[iv.WARNING_ROUTES_NULL], self.G_txt.get_row_count("routes"))
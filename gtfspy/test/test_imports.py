@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+import unittest
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the optional (and slow to import) dependencies should be imported only when needed
+CODE = """
+import sys
+for module in ["matplotlib", "networkx", "shapefile", "shapely", "smopy", "osmread", "geojson"]:
+    sys.modules[module] = None  # makes importing the module fail
+
+from gtfspy.gtfs import GTFS
+from gtfspy import stats
+import gtfspy.routing.multi_objective_pseudo_connection_scan_profiler
+import gtfspy.routing.journey_data
+
+G = GTFS.from_directory_as_inmemory_db({test_data!r})
+assert len(G.stops()) > 0
+stats.get_stats(G)
+"""
+
+
+class LazyImportsTest(unittest.TestCase):
+
+    def test_core_works_without_optional_dependencies(self):
+        test_data = os.path.join(os.path.dirname(__file__), "test_data")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_PARENT, env.get("PYTHONPATH")]))
+        process = subprocess.Popen([sys.executable, "-c", CODE.format(test_data=test_data)], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr.decode("utf-8", "replace"))
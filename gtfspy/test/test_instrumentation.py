@@ -0,0 +1,115 @@
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtfspy import instrumentation
+from gtfspy.gtfs import GTFS
+from gtfspy.util import timeit
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        instrumentation.disable()
+        shutil.rmtree(self.output_dir)
+
+    def test_disabled_by_default(self):
+        self.assertFalse(instrumentation.is_enabled())
+        with instrumentation.span("nothing") as span:
+            span.annotate(value=1)
+        instrumentation.count("nothing")
+        self.assertIsNone(instrumentation.get_recorder())
+
+    def test_spans_and_counters(self):
+        recorder = instrumentation.enable()
+        with instrumentation.span("outer", source="test"):
+            for _ in range(3):
+                with instrumentation.span("inner") as span:
+                    span.annotate(extra=True)
+                    instrumentation.count("rows", 2)
+        with self.assertRaises(ValueError):
+            with instrumentation.span("failing"):
+                raise ValueError()
+        self.assertIs(instrumentation.disable(), recorder)
+        instrumentation.count("rows")
+
+        self.assertEqual(recorder.counters, {"rows": 6})
+        names = [record["name"] for record in recorder.spans]
+        self.assertEqual(names, ["inner", "inner", "inner", "outer", "failing"])
+        outer = recorder.spans[3]
+        self.assertEqual(outer["depth"], 0)
+        self.assertEqual(outer["args"], {"source": "test"})
+        for inner in recorder.spans[:3]:
+            self.assertEqual(inner["depth"], 1)
+            self.assertEqual(inner["args"], {"extra": True})
+            self.assertGreaterEqual(inner["start_us"], outer["start_us"])
+            self.assertLessEqual(inner["start_us"] + inner["duration_us"], outer["start_us"] + outer["duration_us"])
+        self.assertEqual(recorder.spans[4]["error"], "ValueError")
+        self.assertEqual(recorder.summary()["inner"]["calls"], 3)
+
+        json_fname = os.path.join(self.output_dir, "profile.json")
+        recorder.write_json(json_fname)
+        with open(json_fname) as f:
+            self.assertEqual(json.load(f)["counters"], {"rows": 6})
+        trace_fname = os.path.join(self.output_dir, "trace.json")
+        recorder.write_chrome_trace(trace_fname)
+        with open(trace_fname) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len([event for event in events if event["ph"] == "X"]), 5)
+        self.assertIn({"value": 6}, [event["args"] for event in events if event["ph"] == "C"])
+
+    def test_peak_memory(self):
+        recorder = instrumentation.enable(trace_memory=True)
+        with instrumentation.span("outer"):
+            with instrumentation.span("allocate"):
+                data = [0] * 1000000
+            del data
+            with instrumentation.span("small"):
+                pass
+        instrumentation.disable()
+        peaks = {record["name"]: record["peak_memory_bytes"] for record in recorder.spans}
+        self.assertGreaterEqual(peaks["allocate"], 8000000)
+        self.assertGreaterEqual(peaks["outer"], peaks["allocate"])
+        self.assertLess(peaks["small"], peaks["allocate"])
+
+    def test_timeit_records_spans(self):
+        @timeit
+        def function():
+            return 1
+
+        recorder = instrumentation.enable()
+        self.assertEqual(function(), 1)
+        instrumentation.disable()
+        self.assertEqual(len(recorder.spans), 1)
+        self.assertTrue(recorder.spans[0]["name"].endswith("function"))
+
+    def test_instrumented_keeps_function_attributes(self):
+        def function(a, b=2):
+            """Docstring."""
+            return a + b
+
+        wrapped = instrumentation.instrumented()(function)
+        self.assertIs(wrapped.__wrapped__, function)
+        for attribute in ["__name__", "__qualname__", "__module__", "__doc__"]:
+            self.assertEqual(getattr(wrapped, attribute), getattr(function, attribute))
+        self.assertEqual(inspect.signature(wrapped), inspect.signature(function))
+        recorder = instrumentation.enable()
+        self.assertEqual(wrapped(1), 3)
+        instrumentation.disable()
+        self.assertEqual(recorder.spans[0]["name"], function.__qualname__)
+
+    def test_import_gtfs(self):
+        recorder = instrumentation.enable()
+        G = GTFS.from_directory_as_inmemory_db(os.path.join(os.path.dirname(__file__), "test_data"))
+        instrumentation.disable()
+        for table in ["stops", "routes", "day_trips2"]:
+            self.assertEqual(recorder.counters["rows_inserted." + table], G.get_row_count(table))
+        summary = recorder.summary()
+        self.assertEqual(summary["import_gtfs"]["calls"], 1)
+        self.assertIn("import_gtfs.StopLoader.insert_data", summary)
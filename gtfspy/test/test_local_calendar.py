@@ -0,0 +1,65 @@
+import os
+import unittest
+
+import numpy
+
+from gtfspy.gtfs import GTFS
+from gtfspy.local_calendar import LocalCalendar, to_day_numbers
+
+
+class LocalCalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = LocalCalendar("Europe/Helsinki", "2017-03-20", "2017-03-30")
+
+    def test_day_start_uts(self):
+        # 2017-03-25 is a normal day: the day starts at local midnight (22:00 UTC)
+        self.assertEqual(self.calendar.to_uts("2017-03-25", 0), 1490392800)
+        # clocks are moved forward on 2017-03-26: the day starts at 23:00 local time on the previous day
+        self.assertEqual(self.calendar.to_uts("2017-03-26", 0), 1490475600)
+        day_start_uts = self.calendar.day_start_uts([1490392800, 1490392800 + 3600, 1490475600 + 7200])
+        numpy.testing.assert_array_equal(day_start_uts, [1490392800, 1490392800, 1490475600])
+
+    def test_conversions_are_inverse(self):
+        uts = numpy.arange(1400000000, 1600000000, 9999)
+        dates, ds = self.calendar.to_dates_and_ds(uts)
+        numpy.testing.assert_array_equal(self.calendar.to_uts(dates, ds), uts)
+        # (on days when clocks are moved backwards, the day starts at 01:00 local time)
+        self.assertTrue(((ds >= -3600) & (ds < 25 * 3600)).all())
+        self.assertEqual(str(dates[0]), "2014-05-13")
+
+    def test_to_day_numbers(self):
+        numpy.testing.assert_array_equal(to_day_numbers(["1970-01-01", "1970-01-11"]), [0, 10])
+
+
+class GTFSCalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        self.gtfs = GTFS.from_directory_as_inmemory_db(self.gtfs_source_dir)
+
+    def test_day_start_ut_does_not_touch_process_time_zone(self):
+        tz_before = os.environ.get("TZ")
+        os.environ["TZ"] = "Asia/Tokyo"
+        try:
+            start_ut, end_ut = self.gtfs.get_approximate_schedule_time_span_in_ut()
+            day_start_ut = self.gtfs.day_start_ut(start_ut + 3600)
+            self.assertEqual(os.environ["TZ"], "Asia/Tokyo")
+        finally:
+            if tz_before is None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = tz_before
+        self.assertIn(day_start_ut, self.gtfs.execute_custom_query_pandas(
+            "SELECT DISTINCT day_start_ut FROM days")["day_start_ut"].values)
+        self.assertEqual(self.gtfs.increment_day_start_ut(day_start_ut, 2) - day_start_ut, 2 * 24 * 3600)
+        numpy.testing.assert_array_equal(self.gtfs.day_start_ut([start_ut + 3600, start_ut + 3601]),
+                                         [day_start_ut, day_start_ut])
+
+    def test_get_tripIs_within_range_by_dsut(self):
+        start_ut, end_ut = self.gtfs.get_approximate_schedule_time_span_in_ut()
+        trip_I_dict = self.gtfs.get_tripIs_within_range_by_dsut(start_ut, end_ut)
+        self.assertGreater(len(trip_I_dict), 0)
+        for day_start_ut, trip_Is in trip_I_dict.items():
+            self.assertEqual(self.gtfs.day_start_ut(day_start_ut + 3600), day_start_ut)
+            self.assertEqual(len(trip_Is), len(set(trip_Is)))
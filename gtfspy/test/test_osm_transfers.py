@@ -0,0 +1,280 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import networkx
+import numpy
+import pandas
+
+from gtfspy.gtfs import GTFS
+from gtfspy.import_gtfs import import_gtfs
+from gtfspy.osm_transfers import WalkNetwork, WalkDistanceCache, _compute_stop_to_stop_walk_distances, \
+    _get_walk_distance_cache_parameters, add_walk_distances_to_db_python, compute_walk_paths, \
+    create_compact_walk_network_from_osm, create_walk_network_from_osm
+from gtfspy.synthetic_feed import generate_synthetic_feed
+from gtfspy.util import wgs84_distance
+
+# nodes 1-6 on a line from west to east, node 7 far to the north and node 8 not part of any way
+OSM_NODES = [(1, 60.170, 24.940), (2, 60.170, 24.941), (3, 60.170, 24.942), (4, 60.170, 24.943),
+             (5, 60.170, 24.944), (6, 60.170, 24.945), (7, 61.000, 24.945), (8, 60.171, 24.940)]
+OSM_WAYS = [(100, [1, 2, 3, 4], "highway", "footway"),
+            (101, [4, 5, 6, 7], "highway", "residential"),
+            (102, [1, 6], "highway", "motorway"),
+            (103, [2, 5], "building", "yes")]
+BOUNDING_BOX = {"lat_min": 60.0, "lat_max": 60.5, "lon_min": 24.0, "lon_max": 25.0}
+
+
+def _write_osm_file(fname, nodes, ways):
+    meta = 'version="1" changeset="1" timestamp="2017-01-01T00:00:00Z" uid="1" user="test"'
+    with open(fname, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for node_id, lat, lon in nodes:
+            f.write('<node id="%d" lat="%f" lon="%f" %s/>\n' % (node_id, lat, lon, meta))
+        for way_id, node_ids, key, value in ways:
+            f.write('<way id="%d" %s>\n' % (way_id, meta))
+            for node_id in node_ids:
+                f.write('<nd ref="%d"/>\n' % node_id)
+            f.write('<tag k="%s" v="%s"/>\n</way>\n' % (key, value))
+        f.write('</osm>\n')
+
+
+def _path_length(node_ids):
+    coordinates = {node_id: (lat, lon) for node_id, lat, lon in OSM_NODES}
+    return sum(wgs84_distance(*(coordinates[a] + coordinates[b])) for a, b in zip(node_ids[:-1], node_ids[1:]))
+
+
+class OsmTransfersTest(unittest.TestCase):
+
+    def setUp(self):
+        # a 6 x 6 grid of nodes (about 100 meters apart) with some edges removed,
+        # a parallel edge, and a separate component of two nodes
+        rng = numpy.random.RandomState(0)
+        n = 6
+        lats = numpy.repeat(60.17 + 0.0009 * numpy.arange(n), n) + rng.uniform(-0.0002, 0.0002, n * n)
+        lons = numpy.tile(24.94 + 0.0018 * numpy.arange(n), n) + rng.uniform(-0.0004, 0.0004, n * n)
+        lats = numpy.append(lats, [60.20, 60.201])
+        lons = numpy.append(lons, [24.90, 24.90])
+        sources, targets = [], []
+        for i in range(n):
+            for j in range(n):
+                node = i * n + j
+                if j + 1 < n:
+                    sources.append(node)
+                    targets.append(node + 1)
+                if i + 1 < n:
+                    sources.append(node)
+                    targets.append(node + n)
+        keep = rng.uniform(size=len(sources)) > 0.2
+        sources = numpy.array(sources)[keep].tolist() + [0, n * n]
+        targets = numpy.array(targets)[keep].tolist() + [1, n * n + 1]
+        sources = numpy.array(sources, dtype=numpy.int64)
+        targets = numpy.array(targets, dtype=numpy.int64)
+        distances = rng.uniform(80, 200, len(sources))
+        distances[-2] = 500  # a longer parallel edge between nodes 0 and 1
+        self.walk_network = WalkNetwork(numpy.arange(len(lats), dtype=numpy.int64) + 1000, lats, lons,
+                                        sources, targets, distances)
+
+    def test_to_sparse_matrix(self):
+        csgraph = self.walk_network.to_sparse_matrix()
+        self.assertEqual(csgraph.shape, (self.walk_network.n_nodes(), self.walk_network.n_nodes()))
+        self.assertEqual((csgraph != csgraph.T).nnz, 0)
+        # of the parallel edges, the shorter one is kept
+        self.assertLess(csgraph[0, 1], 500)
+        graph = self.walk_network.to_networkx()
+        self.assertEqual(csgraph.nnz, 2 * graph.number_of_edges())
+        self.assertAlmostEqual(graph[1000][1001]["distance"], csgraph[0, 1])
+
+    def test_nearest_nodes(self):
+        node_indices, distances = self.walk_network.nearest_nodes(self.walk_network.lats[[3, 10]] + 0.0001,
+                                                                  self.walk_network.lons[[3, 10]])
+        self.assertEqual(node_indices.tolist(), [3, 10])
+        numpy.testing.assert_allclose(distances, 11.1, atol=0.2)
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        empty_network = WalkNetwork(empty, numpy.zeros(0), numpy.zeros(0), empty, empty, numpy.zeros(0))
+        with self.assertRaises(ValueError):
+            empty_network.nearest_nodes(numpy.array([60.17]), numpy.array([24.94]))
+
+    def _networkx_distances(self, transfers, cutoff):
+        graph = self.walk_network.to_networkx()
+        distances = []
+        for from_stop_I, to_stop_I in zip(transfers['from_stop_I'], transfers['to_stop_I']):
+            lengths = networkx.single_source_dijkstra_path_length(graph, from_stop_I + 1000, cutoff=cutoff,
+                                                                  weight="distance")
+            distances.append(lengths.get(to_stop_I + 1000, numpy.inf))
+        return numpy.array(distances)
+
+    def test_sparse_dijkstra_matches_networkx(self):
+        n_nodes = self.walk_network.n_nodes()
+        pairs = [(from_I, to_I) for from_I in range(n_nodes) for to_I in range(n_nodes) if from_I != to_I]
+        transfers = pandas.DataFrame(pairs, columns=["from_stop_I", "to_stop_I"])
+        # stops are located exactly at the nodes
+        stop_I_to_node_index = {i: i for i in range(n_nodes)}
+        stop_I_to_node_distance = {i: 0 for i in range(n_nodes)}
+        csgraph = self.walk_network.to_sparse_matrix()
+        for cutoff in [numpy.inf, 400]:
+            expected = self._networkx_distances(transfers, None if cutoff == numpy.inf else cutoff)
+            for n_processes, batch_size in [(1, 1), (1, 5), (2, 3)]:
+                distances = _compute_stop_to_stop_walk_distances(csgraph, transfers, stop_I_to_node_index,
+                                                                 stop_I_to_node_distance, cutoff,
+                                                                 n_processes=n_processes, batch_size=batch_size)
+                numpy.testing.assert_allclose(distances, expected)
+        # the other component can not be reached
+        self.assertTrue(numpy.isinf(expected[(transfers['from_stop_I'] == 0).values &
+                                             (transfers['to_stop_I'] == n_nodes - 1).values]).all())
+
+    def test_access_distances_are_added(self):
+        transfers = pandas.DataFrame({"from_stop_I": [10, 10, 11], "to_stop_I": [11, 12, 10]})
+        stop_I_to_node_index = {10: 0, 11: 7}
+        stop_I_to_node_distance = {10: 5.0, 11: 20.0}
+        distances = _compute_stop_to_stop_walk_distances(self.walk_network.to_sparse_matrix(), transfers,
+                                                         stop_I_to_node_index, stop_I_to_node_distance, numpy.inf)
+        network_distance = self._networkx_distances(pandas.DataFrame({"from_stop_I": [0], "to_stop_I": [7]}),
+                                                    None)[0]
+        self.assertAlmostEqual(distances[0], network_distance + 25)
+        self.assertAlmostEqual(distances[2], network_distance + 25)
+        # stop 12 is not matched to the network
+        self.assertTrue(numpy.isinf(distances[1]))
+
+
+class CompactWalkNetworkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.osm_file = os.path.join(self.work_dir, "test.osm")
+        _write_osm_file(self.osm_file, OSM_NODES, OSM_WAYS)
+        self.coordinates = {node_id: (lat, lon) for node_id, lat, lon in OSM_NODES}
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _edges(self, walk_network):
+        node_ids = walk_network.node_ids.tolist()
+        return {tuple(sorted((node_ids[source], node_ids[target]))): distance for source, target, distance
+                in zip(walk_network.sources.tolist(), walk_network.targets.tolist(), walk_network.distances.tolist())}
+
+    def test_uncontracted(self):
+        walk_network = create_compact_walk_network_from_osm(self.osm_file, bounding_box=BOUNDING_BOX, contract=False)
+        # only the walkable ways are used, and they are cut at the bounding box
+        self.assertEqual(sorted(walk_network.node_ids.tolist()), [1, 2, 3, 4, 5, 6])
+        edges = self._edges(walk_network)
+        self.assertEqual(sorted(edges), [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6)])
+        self.assertAlmostEqual(edges[(1, 2)], _path_length([1, 2]))
+        for node_id, lat, lon in zip(walk_network.node_ids.tolist(), walk_network.lats, walk_network.lons):
+            self.assertEqual((lat, lon), self.coordinates[node_id])
+
+        graph = create_walk_network_from_osm(self.osm_file)
+        # without a bounding box, also node 7 is included
+        self.assertEqual(sorted(graph.nodes()), [1, 2, 3, 4, 5, 6, 7])
+        self.assertAlmostEqual(graph[6][7]["distance"], _path_length([6, 7]))
+
+    def test_contracted(self):
+        walk_network = create_compact_walk_network_from_osm(self.osm_file, bounding_box=BOUNDING_BOX)
+        # the end points of the ways and the junction node 4 are kept
+        self.assertEqual(sorted(walk_network.node_ids.tolist()), [1, 4, 6])
+        edges = self._edges(walk_network)
+        self.assertAlmostEqual(edges[(1, 4)], _path_length([1, 2, 3, 4]))
+        self.assertAlmostEqual(edges[(4, 6)], _path_length([4, 5, 6]))
+
+        lat, lon = self.coordinates[2]
+        walk_network = create_compact_walk_network_from_osm(self.osm_file, bounding_box=BOUNDING_BOX,
+                                                            protected_coordinates=([lat + 0.0001], [lon]))
+        self.assertEqual(sorted(walk_network.node_ids.tolist()), [1, 2, 4, 6])
+        self.assertEqual(sorted(self._edges(walk_network)), [(1, 2), (2, 4), (4, 6)])
+
+    def test_no_walkable_ways(self):
+        osm_file = os.path.join(self.work_dir, "empty.osm")
+        _write_osm_file(osm_file, OSM_NODES, OSM_WAYS[2:])
+        walk_network = create_compact_walk_network_from_osm(osm_file)
+        self.assertEqual(walk_network.n_nodes(), 0)
+        self.assertEqual(walk_network.n_edges(), 0)
+
+        gtfs = GTFS.from_directory_as_inmemory_db(os.path.join(os.path.dirname(__file__), "test_data"))
+        with self.assertWarns(UserWarning):
+            add_walk_distances_to_db_python(gtfs, osm_file)
+        self.assertEqual(gtfs.execute_custom_query("SELECT count(d_walk) FROM stop_distances").fetchone()[0], 0)
+
+
+class WalkDistanceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_db = os.path.join(self.work_dir, "cache.sqlite")
+        self.osm_file = os.path.join(self.work_dir, "test.osm")
+        _write_osm_file(self.osm_file, OSM_NODES, OSM_WAYS)
+        # a small feed with its stops at the OSM nodes 1, 4 and 6
+        feed = generate_synthetic_feed(n_stops=3, n_routes=1, trips_per_day=2, n_days=1)
+        feed["stops.txt"] = "stop_id,stop_name,stop_lat,stop_lon\n" + "".join(
+            "S%d,Stop %d,%f,%f\n" % (i, i, lat, lon)
+            for i, (_, lat, lon) in enumerate(node for node in OSM_NODES if node[0] in (1, 4, 6)))
+        self.gtfs_db = os.path.join(self.work_dir, "gtfs.sqlite")
+        import_gtfs(feed, self.gtfs_db, print_progress=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _pairs(self):
+        return GTFS(self.gtfs_db).execute_custom_query_pandas(
+            "SELECT from_stop_I, to_stop_I, S1.lat AS lat1, S1.lon AS lon1, S2.lat AS lat2, S2.lon AS lon2, d "
+            "FROM stop_distances "
+            "LEFT JOIN stops S1 ON (from_stop_I=S1.stop_I) "
+            "LEFT JOIN stops S2 ON (to_stop_I=S2.stop_I) "
+            "ORDER BY from_stop_I, to_stop_I")
+
+    def _d_walks(self):
+        return GTFS(self.gtfs_db).execute_custom_query_pandas(
+            "SELECT d_walk FROM stop_distances ORDER BY from_stop_I, to_stop_I")['d_walk'].values
+
+    def test_cache_hit_and_miss(self):
+        pairs = self._pairs()
+        self.assertEqual(len(pairs), 6)
+        cache = WalkDistanceCache(self.cache_db, {"cutoff_distance_m": None})
+        self.assertTrue(numpy.isnan(cache.get_cached_distances(pairs)).all())
+        cache.update(pairs[:4], [100, 200, -1, 300])
+        cache.close()
+
+        cache = WalkDistanceCache(self.cache_db, {"cutoff_distance_m": None})
+        distances = cache.get_cached_distances(pairs)
+        cache.close()
+        numpy.testing.assert_array_equal(distances[:4], [100, 200, -1, 300])
+        self.assertTrue(numpy.isnan(distances[4:]).all())
+
+    def test_cache_is_invalidated_when_parameters_change(self):
+        pairs = self._pairs()
+        cache = WalkDistanceCache(self.cache_db, {"cutoff_distance_m": None})
+        cache.update(pairs, numpy.arange(len(pairs)))
+        cache.close()
+        cache = WalkDistanceCache(self.cache_db, {"cutoff_distance_m": 100})
+        self.assertTrue(numpy.isnan(cache.get_cached_distances(pairs)).all())
+        cache.close()
+        # the cache now belongs to the new parameters
+        cache = WalkDistanceCache(self.cache_db, {"cutoff_distance_m": None})
+        self.assertTrue(numpy.isnan(cache.get_cached_distances(pairs)).all())
+        cache.close()
+
+    def test_compute_walk_paths_uses_cached_distances(self):
+        pairs = self._pairs()
+        # all distances are found from the cache, so the (here empty) OSM file is not even read
+        open(self.osm_file, "w").close()
+        cache = WalkDistanceCache(self.cache_db, _get_walk_distance_cache_parameters(self.osm_file, None))
+        cache.update(pairs, numpy.arange(len(pairs)) + 10)
+        cache.close()
+        compute_walk_paths(self.gtfs_db, self.osm_file, cache_db=self.cache_db)
+        numpy.testing.assert_array_equal(self._d_walks(), numpy.arange(len(pairs)) + 10)
+
+    def test_compute_walk_paths(self):
+        compute_walk_paths(self.gtfs_db, self.osm_file, cache_db=self.cache_db)
+        pairs = self._pairs()
+        d_walks = self._d_walks()
+        walk_distances = {frozenset([1, 4]): _path_length([1, 2, 3, 4]),
+                          frozenset([4, 6]): _path_length([4, 5, 6]),
+                          frozenset([1, 6]): _path_length([1, 2, 3, 4, 5, 6])}
+        node_by_stop_I = dict(zip(GTFS(self.gtfs_db).stops()['stop_I'], [1, 4, 6]))
+        for from_stop_I, to_stop_I, d_walk in zip(pairs['from_stop_I'], pairs['to_stop_I'], d_walks):
+            expected = walk_distances[frozenset([node_by_stop_I[from_stop_I], node_by_stop_I[to_stop_I]])]
+            self.assertEqual(d_walk, int(expected))
+
+        # a shorter cutoff invalidates the cached distances
+        compute_walk_paths(self.gtfs_db, self.osm_file, cache_db=self.cache_db, cutoff_distance_m=150)
+        for d_walk_before, d_walk in zip(d_walks, self._d_walks()):
+            self.assertEqual(d_walk, d_walk_before if d_walk_before <= 150 else -1)
@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtfspy.gtfs import GTFS
+from gtfspy.pipeline import run_pipeline, hash_sources, load_pipeline_config, STATE_FNAME
+from gtfspy.synthetic_feed import write_synthetic_feed
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.work_dir, "output")
+        feed_kwargs = dict(n_stops=30, n_routes=3, trips_per_day=60, n_days=14)
+        self.feeds = [
+            {"name": "city_a", "sources": write_synthetic_feed(os.path.join(self.work_dir, "a"), **feed_kwargs)},
+            {"name": "city_b", "sources": write_synthetic_feed(os.path.join(self.work_dir, "b.zip"), seed=1,
+                                                               **feed_kwargs)},
+        ]
+        self.steps = [
+            {"step": "import"},
+            {"step": "filter", "start_date": "2017-01-02", "end_date": "2017-01-09"},
+            {"step": "stop_distances", "threshold_meters": 500},
+            {"step": "stats"},
+            {"step": "exports", "formats": ["stops_geojson"]},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _run(self, steps=None, **kwargs):
+        return run_pipeline(self.feeds, steps or self.steps, self.output_dir, n_processes=2,
+                            print_progress=False, **kwargs)
+
+    def test_run_pipeline(self):
+        results = self._run()
+        self.assertEqual(list(results.keys()), ["city_a", "city_b"])
+        for name, result in results.items():
+            self.assertEqual(result["status"], "done")
+            self.assertEqual([step["id"] for step in result["steps"]],
+                             ["import", "filter", "stop_distances", "stats", "exports"])
+            feed_dir = os.path.join(self.output_dir, name)
+            self.assertTrue(os.path.exists(os.path.join(feed_dir, "exports", "stops.geojson")))
+            self.assertTrue(os.path.exists(os.path.join(feed_dir, STATE_FNAME)))
+            G = GTFS(os.path.join(feed_dir, "filter.sqlite"))
+            self.assertEqual(G.meta["location_name"], name)
+            for step_id in ["filter", "stop_distances", "stats", "exports"]:
+                self.assertGreaterEqual(G.meta["pipeline_" + step_id + "_seconds"], 0)
+            self.assertEqual(G.get_day_start_ut_span()[1] - G.get_day_start_ut_span()[0], 6 * 24 * 3600)
+            self.assertLessEqual(G.execute_custom_query("SELECT max(d) FROM stop_distances").fetchone()[0], 500)
+
+    def test_up_to_date_steps_are_skipped(self):
+        first = self._run()
+        second = self._run()
+        self.assertEqual(first, second)
+
+        # changing the parameters of a step re-runs it and the steps after it
+        steps = [dict(step) for step in self.steps]
+        steps[2]["threshold_meters"] = 300
+        third = self._run(steps)
+        for name in third:
+            first_starts = [step["started_ut"] for step in first[name]["steps"]]
+            third_starts = [step["started_ut"] for step in third[name]["steps"]]
+            self.assertEqual(first_starts[:2], third_starts[:2])
+            for first_start, third_start in zip(first_starts[2:], third_starts[2:]):
+                self.assertGreater(third_start, first_start)
+
+        forced = self._run(steps, force=True)
+        self.assertGreater(forced["city_a"]["steps"][0]["started_ut"], third["city_a"]["steps"][0]["started_ut"])
+
+    def test_resume_after_failure(self):
+        steps = self.steps[:-1] + [{"step": "exports", "formats": ["unknown_format"]}]
+        failed = self._run(steps)
+        self.assertEqual(failed["city_a"]["status"], "failed")
+        self.assertEqual(failed["city_a"]["steps"][-1]["status"], "failed")
+        self.assertIn("unknown_format", failed["city_a"]["steps"][-1]["error"])
+
+        resumed = self._run()
+        self.assertEqual(resumed["city_a"]["status"], "done")
+        self.assertEqual([step["started_ut"] for step in resumed["city_a"]["steps"][:-1]],
+                         [step["started_ut"] for step in failed["city_a"]["steps"][:-1]])
+
+    def test_time_limit(self):
+        results = self._run(time_limit_s=0.001)
+        for result in results.values():
+            self.assertEqual(result["status"], "failed")
+        results = self._run()
+        for result in results.values():
+            self.assertEqual(result["status"], "done")
+
+    def test_stop_distances_keep_transfers(self):
+        feed_dir = self.feeds[0]["sources"]
+        with open(os.path.join(feed_dir, "transfers.txt"), "w") as f:
+            f.write("from_stop_id,to_stop_id,transfer_type,min_transfer_time\n"
+                    "S0,S1,2,300\n"
+                    "S1,S2,1,\n"
+                    "S0,S2,3,\n")
+        steps = [{"step": "import"}, {"step": "stop_distances", "threshold_meters": 1000}]
+        results = run_pipeline(self.feeds[:1], steps, self.output_dir, print_progress=False)
+        self.assertEqual(results["city_a"]["status"], "done")
+
+        query = "SELECT from_stop_I, to_stop_I, d, min_transfer_time, timed_transfer FROM stop_distances " \
+                "ORDER BY from_stop_I, to_stop_I"
+        G = GTFS(os.path.join(self.output_dir, "city_a", "import.sqlite"))
+        G_imported = GTFS.from_directory_as_inmemory_db(feed_dir)
+        rows = G.execute_custom_query(query).fetchall()
+        self.assertEqual(rows, G_imported.execute_custom_query(query).fetchall())
+        stop_Is = dict(G.execute_custom_query("SELECT stop_id, stop_I FROM stops").fetchall())
+        pairs = {(row[0], row[1]): row for row in rows}
+        self.assertEqual(pairs[(stop_Is["S0"], stop_Is["S1"])][3], 300)
+        self.assertEqual(pairs[(stop_Is["S1"], stop_Is["S2"])][4], 1)
+        self.assertNotIn((stop_Is["S0"], stop_Is["S2"]), pairs)
+
+    def test_invalid_steps(self):
+        with self.assertRaises(ValueError):
+            self._run([{"step": "no_such_step"}])
+        with self.assertRaises(ValueError):
+            self._run([{"step": "import"}, {"step": "import"}])
+
+    def test_hash_sources(self):
+        zip_fname = self.feeds[1]["sources"]
+        self.assertEqual(hash_sources(zip_fname), hash_sources([zip_fname]))
+        self.assertNotEqual(hash_sources(self.feeds[0]["sources"]), hash_sources(zip_fname))
+        self.assertEqual(hash_sources({"stops.txt": "a"}), hash_sources({"stops.txt": "a"}))
+        self.assertNotEqual(hash_sources({"stops.txt": "a"}), hash_sources({"stops.txt": "b"}))
+
+    def test_load_pipeline_config(self):
+        config_fname = os.path.join(self.work_dir, "pipeline.json")
+        with open(config_fname, "w") as f:
+            json.dump({"output_dir": "output", "feeds": [{"name": "city_a", "sources": "a"}], "steps": self.steps}, f)
+        config = load_pipeline_config(config_fname)
+        self.assertEqual(config["output_dir"], self.output_dir)
+        self.assertEqual(config["feeds"][0]["sources"], self.feeds[0]["sources"])
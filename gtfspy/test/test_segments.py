@@ -0,0 +1,102 @@
+import os
+import unittest
+
+from gtfspy.gtfs import GTFS
+from gtfspy import segments
+
+
+class SegmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        self.gtfs = GTFS.from_directory_as_inmemory_db(self.gtfs_source_dir)
+
+    def test_segments_match_stop_times_self_join(self):
+        segments_df = segments.get_segments(self.gtfs)
+        reference = self.gtfs.execute_custom_query_pandas(
+            'SELECT q1.trip_I, q1.stop_I AS from_stop_I, q2.stop_I AS to_stop_I, '
+            'CAST(find_distance(s1.lat, s1.lon, s2.lat, s2.lon) AS INT) AS distance, '
+            'q2.arr_time_ds - q1.arr_time_ds AS duration '
+            'FROM stop_times q1, stop_times q2, stops s1, stops s2 '
+            'WHERE q1.trip_I = q2.trip_I AND q1.seq + 1 = q2.seq '
+            'AND q1.stop_I = s1.stop_I AND q2.stop_I = s2.stop_I')
+        self.assertEqual(len(segments_df), len(reference))
+        columns = ["trip_I", "from_stop_I", "to_stop_I", "duration", "distance"]
+        segments_df = segments_df[columns].sort_values(columns).reset_index(drop=True)
+        reference = reference[columns].sort_values(columns).reset_index(drop=True)
+        self.assertTrue((segments_df[columns[:-1]].values == reference[columns[:-1]].values).all())
+        # find_distance may be the single precision cython version of wgs84_distance
+        self.assertTrue((abs(segments_df["distance"] - reference["distance"]) <= 1).all())
+
+    def test_segments_table_is_cached_and_updated(self):
+        table_name = segments.ensure_segments_table(self.gtfs)
+        n_segments = self.gtfs.get_row_count(table_name)
+        self.assertGreater(n_segments, 0)
+        # cached version is not recomputed
+        self.gtfs.conn.execute("DELETE FROM " + table_name)
+        segments.ensure_segments_table(self.gtfs)
+        self.assertEqual(self.gtfs.get_row_count(table_name), 0)
+        # changes in stop_times are detected
+        self.gtfs.conn.execute("DELETE FROM stop_times WHERE trip_I = (SELECT min(trip_I) FROM stop_times)")
+        segments.ensure_segments_table(self.gtfs)
+        self.assertGreater(self.gtfs.get_row_count(table_name), 0)
+        self.assertLess(self.gtfs.get_row_count(table_name), n_segments)
+
+    def test_segments_table_is_updated_after_edits(self):
+        table_name = segments.ensure_segments_table(self.gtfs)
+
+        def total_distance():
+            return self.gtfs.execute_custom_query("SELECT sum(distance) FROM " +
+                                                  segments.ensure_segments_table(self.gtfs)).fetchone()[0]
+
+        def recomputed_total_distance():
+            return int(sum(chunk["distance"].sum() for chunk in segments._compute_segments(self.gtfs)))
+
+        original_distance = total_distance()
+        stops = self.gtfs.stops()
+        stops["lat"] += 0.01
+        self.gtfs.update_stop_coordinates(stops[["stop_id", "lat", "lon"]])
+        self.assertNotEqual(total_distance(), original_distance)
+        self.assertEqual(total_distance(), recomputed_total_distance())
+
+        # the coordinates of the stops are part of the fingerprint of the table
+        self.gtfs.conn.execute("UPDATE stops SET lon = lon + 0.01 WHERE stop_I = (SELECT min(stop_I) FROM stops)")
+        self.assertEqual(total_distance(), recomputed_total_distance())
+
+        # other edits keeping the row counts unchanged require invalidating the caches
+        self.gtfs.conn.execute("UPDATE stop_times SET stop_I = (SELECT max(stop_I) FROM stops) "
+                               "WHERE rowid = (SELECT min(rowid) FROM stop_times)")
+        self.gtfs.invalidate_caches()
+        self.assertEqual(total_distance(), recomputed_total_distance())
+        self.assertEqual(table_name, segments.SEGMENTS_TABLE)
+
+    def test_segments_table_is_rebuilt_after_updates(self):
+        table_name = segments.ensure_segments_table(self.gtfs)
+
+        def segments_of_first_trip():
+            return self.gtfs.execute_custom_query_pandas(
+                "SELECT from_seq, dep_time_ds, arr_time_ds, route_I FROM " + segments.ensure_segments_table(self.gtfs) +
+                " WHERE trip_I = (SELECT min(trip_I) FROM stop_times) ORDER BY from_seq")
+
+        original = segments_of_first_trip()
+        # in-place updates keep all row counts unchanged
+        self.gtfs.conn.execute("UPDATE stop_times SET dep_time_ds = dep_time_ds + 60, arr_time_ds = arr_time_ds + 60 "
+                               "WHERE trip_I = (SELECT min(trip_I) FROM stop_times)")
+        self.gtfs.conn.commit()
+        self.assertNotIn("segments_fingerprint", self.gtfs.meta)
+        updated = segments_of_first_trip()
+        self.assertTrue((updated["dep_time_ds"] == original["dep_time_ds"] + 60).all())
+        self.assertTrue((updated["arr_time_ds"] == original["arr_time_ds"] + 60).all())
+
+        self.gtfs.conn.execute("UPDATE trips SET route_I = (SELECT max(route_I) FROM routes) "
+                               "WHERE trip_I = (SELECT min(trip_I) FROM stop_times)")
+        self.gtfs.conn.commit()
+        max_route_I = self.gtfs.execute_custom_query("SELECT max(route_I) FROM routes").fetchone()[0]
+        self.assertTrue((segments_of_first_trip()["route_I"] == max_route_I).all())
+        self.assertIn("segments_fingerprint", self.gtfs.meta)
+        self.assertEqual(table_name, segments.SEGMENTS_TABLE)
+
+        # dropping the table also removes the triggers
+        segments.drop_segments_table(self.gtfs)
+        self.assertEqual(self.gtfs.execute_custom_query(
+            "SELECT count(*) FROM sqlite_master WHERE type='trigger'").fetchone()[0], 0)
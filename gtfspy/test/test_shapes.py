@@ -78,3 +78,53 @@ class ShapesTest(unittest.TestCase):
         result = shapes.interpolate_shape_times(shape_distances, shape_breaks, stop_times)
         assert len(result) == len(result_should_be)
         np.testing.assert_array_equal(result, result_should_be)
+
+    def test_interpolate_shape_times_in_batch(self):
+        trajectories = [
+            ([0, 2, 5, 10, 20, 100], [0, 2, 5], [0, 1, 20]),
+            ([0, 1, 10], [0, 1, 2], [0, 10, 18]),
+            ([0, 3, 4, 8, 9], [1, 1, 3], [5, 6, 9]),
+            ([0, 7], [1], [4])
+        ]
+        shape_distances = np.concatenate([distances for distances, _, _ in trajectories])
+        shape_starts = np.cumsum([0] + [len(distances) for distances, _, _ in trajectories[:-1]])
+        shape_breaks = np.concatenate([breaks for _, breaks, _ in trajectories])
+        stop_times = np.concatenate([times for _, _, times in trajectories])
+        stop_counts = [len(breaks) for _, breaks, _ in trajectories]
+        shape_indices, shape_times, point_counts = shapes.interpolate_shape_times_in_batch(
+            shape_distances, shape_starts, shape_breaks, stop_times, stop_counts)
+        offset = 0
+        for (distances, breaks, times), shape_start, point_count in zip(trajectories, shape_starts, point_counts):
+            expected = shapes.interpolate_shape_times(distances, breaks, times)[breaks[0]:breaks[-1] + 1]
+            self.assertEqual(point_count, len(expected))
+            np.testing.assert_array_equal(shape_times[offset:offset + point_count], expected)
+            np.testing.assert_array_equal(shape_indices[offset:offset + point_count],
+                                          shape_start + np.arange(breaks[0], breaks[-1] + 1))
+            offset += point_count
+        self.assertEqual(offset, len(shape_times))
+
+    def test_find_segments_long_shape(self):
+        n_points = 20000
+        t = np.linspace(0, 1, n_points)
+        lats = 60.1 + 0.2 * t + 0.002 * np.sin(40 * t)
+        lons = 24.8 + 0.3 * t
+        shape_points = [dict(seq=i, lat=lat, lon=lon) for i, (lat, lon) in enumerate(zip(lats, lons))]
+        stop_indices = np.linspace(0, n_points - 1, 200).astype(int).tolist()
+        stop_points = [dict(lat=lats[i], lon=lons[i]) for i in stop_indices]
+
+        n_distances = []
+        distances_from_point = shapes.wgs84_distances_from_point
+
+        def counting_distances_from_point(lat, lon, lats, lons):
+            n_distances.append(len(lats))
+            return distances_from_point(lat, lon, lats, lons)
+
+        shapes.wgs84_distances_from_point = counting_distances_from_point
+        try:
+            breakpoints, badness = shapes.find_segments(stop_points, shape_points)
+        finally:
+            shapes.wgs84_distances_from_point = distances_from_point
+        self.assertEqual(breakpoints, stop_indices)
+        self.assertAlmostEqual(badness, 0)
+        # distances are only computed near each stop, not for the whole rest of the shape
+        self.assertLess(sum(n_distances), 2 * n_points + 2 * len(stop_points) * shapes.FIND_SEGMENTS_WINDOW)
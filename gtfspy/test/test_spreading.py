@@ -1,6 +1,9 @@
 import os
 import unittest
 
+import numpy
+
+from gtfspy.spreading.batch_spreader import BatchSpreader
 from gtfspy.spreading.event import Event
 from gtfspy.spreading.spreader import Spreader
 from gtfspy.spreading.spreading_stop import SpreadingStop
@@ -76,3 +79,41 @@ class SpreadingTest(unittest.TestCase):
             assert key in el, el
 
 
+
+class BatchSpreaderTest(unittest.TestCase):
+
+    def setUp(self):
+        gtfs_source_dir = os.path.join(os.path.dirname(__file__), "test_data")
+        self.gtfs = GTFS.from_directory_as_inmemory_db(gtfs_source_dir)
+        first_day_start_ut, _ = self.gtfs.get_day_start_ut_span()
+        self.start_time_ut = first_day_start_ut + 7 * 3600
+        self.end_time_ut = first_day_start_ut + 24 * 3600
+        self.spreader = BatchSpreader(self.gtfs, self.start_time_ut, self.end_time_ut, 30, 0.5)
+
+    def test_spread(self):
+        seed_stop_Is = list(self.spreader.stop_Is)
+        first_arrival_times = self.spreader.spread(seed_stop_Is, self.start_time_ut + 3600)
+        self.assertEqual(first_arrival_times.shape, (len(seed_stop_Is), len(seed_stop_Is)))
+        for i in range(len(seed_stop_Is)):
+            self.assertEqual(first_arrival_times[i, i], self.start_time_ut + 3600)
+        self.assertTrue((first_arrival_times >= self.start_time_ut + 3600).all())
+        self.assertTrue(numpy.isfinite(first_arrival_times).sum() > len(seed_stop_Is))
+
+    def test_bit_parallel_equals_single_seeds(self):
+        seed_stop_Is = list(self.spreader.stop_Is) * 2
+        start_times = [self.start_time_ut + 600 * i for i in range(len(seed_stop_Is))]
+        batch = self.spreader.spread(seed_stop_Is, start_times, seeds_per_scan=64)
+        single = self.spreader.spread(seed_stop_Is, start_times, seeds_per_scan=1)
+        numpy.testing.assert_array_equal(batch, single)
+        parallel = self.spreader.spread(seed_stop_Is, start_times, seeds_per_scan=4, n_processes=2)
+        numpy.testing.assert_array_equal(batch, parallel)
+
+    def test_max_duration_and_closest_stops(self):
+        stop_Is = self.spreader.stop_Is
+        stops = self.gtfs.stops().set_index("stop_I")
+        closest = self.spreader.get_closest_stop_Is(stops.loc[stop_Is, 'lat'].values,
+                                                    stops.loc[stop_Is, 'lon'].values)
+        numpy.testing.assert_array_equal(closest, stop_Is)
+        first_arrival_times = self.spreader.spread(stop_Is, self.start_time_ut, max_duration_ut=1800)
+        finite = numpy.isfinite(first_arrival_times)
+        self.assertTrue((first_arrival_times[finite] <= self.start_time_ut + 1800).all())
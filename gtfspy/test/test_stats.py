@@ -2,6 +2,7 @@ import os
 import unittest
 import tempfile as temp
 
+import numpy
 import pandas as pd
 
 from gtfspy.gtfs import GTFS
@@ -37,6 +38,47 @@ class StatsTest(unittest.TestCase):
         d = stats.get_stats(self.gtfs)
         self.assertTrue(isinstance(d, dict))
 
+    def test_get_stats_dates_and_fleet_size(self):
+        d = stats.get_stats(self.gtfs)
+        self.assertEqual(d["start_date"], self.gtfs.get_min_date())
+        self.assertEqual(d["end_date"], self.gtfs.get_max_date())
+        self.assertEqual(d["start_time_ut"], self.gtfs.get_day_start_ut_span()[0])
+        self.assertEqual(d["n_stops"], self.gtfs.get_row_count("stops"))
+        date = d["max_activity_date"]
+        for hour in range(5, 12):
+            # per-minute reference computation
+            type_to_max = {}
+            for minute in range(hour * 3600, (hour + 1) * 3600, 60):
+                rows = self.gtfs.conn.execute(
+                    'SELECT type, count(*) FROM trips, routes, days '
+                    'WHERE trips.route_I = routes.route_I AND trips.trip_I=days.trip_I '
+                    'AND start_time_ds <= ? AND end_time_ds > ? + 60 AND date = ? '
+                    'GROUP BY type;', (minute, minute, date))
+                for route_type, count in rows:
+                    type_to_max[route_type] = max(type_to_max.get(route_type, 0), count)
+            fleet_size = stats._fleet_size_max_movement(self.gtfs, hour, date)
+            parsed = dict(tuple(int(x) for x in el.split(":")) for el in fleet_size.split())
+            self.assertEqual(parsed, type_to_max)
+
+    def test_n_vehicles_in_movement(self):
+        # trips shorter than a minute are never in movement
+        n_moving = stats._n_vehicles_in_movement(numpy.array([180, 180, 180, 185]),
+                                                 numpy.array([250, 250, 250, 185]), numpy.array([120, 180, 190]))
+        self.assertEqual(list(n_moving), [0, 3, 0])
+        rng = numpy.random.RandomState(0)
+        starts = rng.randint(0, 3600, 200)
+        ends = starts + rng.randint(0, 600, 200)
+        minutes = numpy.arange(0, 3600, 60)
+        reference = [((starts <= minute) & (ends > minute + 60)).sum() for minute in minutes]
+        self.assertEqual(list(stats._n_vehicles_in_movement(starts, ends, minutes)), reference)
+
+    def test_distributions(self):
+        d = stats.get_stats(self.gtfs)
+        for table, column in [('routes', 'type'), ('stops', 'location_type'), ('transfers', 'transfer_type')]:
+            rows = self.gtfs.conn.execute('SELECT {column}, count(*) FROM {table} GROUP BY {column} '
+                                          'ORDER BY {column}'.format(table=table, column=column))
+            self.assertEqual(d[table + '__' + column + '__dist'], ' '.join('%s:%s' % row for row in rows))
+
     def test_calc_and_store_stats(self):
         self.gtfs.meta['stats_calc_at_ut'] = None
         stats.update_stats(self.gtfs)
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtfspy.gtfs import GTFS
+from gtfspy.synthetic_feed import generate_synthetic_feed, write_synthetic_feed
+
+
+class SyntheticFeedTest(unittest.TestCase):
+
+    parameters = dict(n_stops=50, n_routes=5, trips_per_day=101, n_days=3, n_shaped_routes=3, n_frequency_routes=1,
+                      stops_per_route=8)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_deterministic(self):
+        feed = generate_synthetic_feed(**self.parameters)
+        self.assertEqual(feed, generate_synthetic_feed(**self.parameters))
+        self.assertNotEqual(feed["stops.txt"], generate_synthetic_feed(seed=1, **self.parameters)["stops.txt"])
+
+    def test_import(self):
+        G = GTFS.from_directory_as_inmemory_db(generate_synthetic_feed(**self.parameters))
+        self.assertEqual(G.get_row_count("stops"), 50)
+        self.assertEqual(G.get_row_count("routes"), 5)
+        trip_counts = G.get_trip_counts_per_day()
+        self.assertEqual(list(trip_counts["date_str"]), ["2017-01-02", "2017-01-03", "2017-01-04"])
+        self.assertEqual(list(trip_counts["trip_counts"]), [101] * 3)
+        # both directions of the shaped routes
+        self.assertEqual(G.execute_custom_query("SELECT count(DISTINCT shape_id) FROM shapes").fetchone()[0], 6)
+        self.assertEqual(G.get_row_count("frequencies"), 2)
+        stop_counts = G.execute_custom_query("SELECT count(*) FROM stop_times GROUP BY trip_I").fetchall()
+        self.assertEqual(set(stop_counts), {(8,)})
+
+    def test_write(self):
+        for output in [os.path.join(self.output_dir, "feed"), os.path.join(self.output_dir, "feed.zip")]:
+            write_synthetic_feed(output, **self.parameters)
+            G = GTFS.from_directory_as_inmemory_db(output)
+            self.assertEqual(G.get_row_count("stops"), 50)
@@ -2,7 +2,7 @@ import os
 import unittest
 
 from gtfspy.gtfs import GTFS
-from gtfspy.timetable_validator import TimetableValidator
+from gtfspy.timetable_validator import TimetableValidator, WARNING_STOP_SEQUENCE_ERROR
 
 class TestGTFSValidator(unittest.TestCase):
 
@@ -17,3 +17,24 @@ class TestGTFSValidator(unittest.TestCase):
         assert len(warning_counts) > 0
 
 
+    def test_threaded_validation_gives_same_warnings(self):
+        validator = TimetableValidator(self.G, buffer_params={'lat': 60.2, 'lon': 24.9, 'buffer_distance': 0.5})
+        warnings = validator.get_warnings()
+        counts = dict(warnings.get_warning_counts())
+        rows = {repr(row): errors for row, errors in warnings.get_warnings_by_query_rows().items()}
+        threaded_warnings = validator.get_warnings(n_threads=4)
+        self.assertEqual(counts, dict(threaded_warnings.get_warning_counts()))
+        self.assertEqual(rows, {repr(row): errors for row, errors in
+                                threaded_warnings.get_warnings_by_query_rows().items()})
+        self.assertEqual(sum(counts.values()),
+                         sum(len(errors) for errors in threaded_warnings.get_warnings_by_query_rows().values()))
+
+    def test_stop_sequence_errors(self):
+        self.G.conn.execute("UPDATE stop_times SET seq=seq+10 WHERE trip_I=1 AND seq>1")
+        warnings = TimetableValidator(self.G).get_warnings()
+        counts = warnings.get_warning_counts()
+        self.assertEqual(counts[WARNING_STOP_SEQUENCE_ERROR], 1)
+        rows = [row for row, errors in warnings.get_warnings_by_query_rows().items()
+                if WARNING_STOP_SEQUENCE_ERROR in errors]
+        self.assertEqual(rows[0][0], 1)
+        self.assertEqual(rows[0][2], 12)
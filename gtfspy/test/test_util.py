@@ -1,10 +1,44 @@
+import math
 import unittest
 import os
+
+import numpy
 import pandas as pd
 
 from gtfspy import util
 
 
+def math_wgs84_distance(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 6378137. * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def recursive_douglas_peucker(lats, lons, tolerance):
+    ys = numpy.radians(lats) * util.EARTH_RADIUS
+    xs = numpy.radians(lons) * util.EARTH_RADIUS * numpy.cos(numpy.radians(numpy.mean(lats)))
+    kept = {0, len(lats) - 1}
+
+    def simplify(start, end):
+        dx, dy = xs[end] - xs[start], ys[end] - ys[start]
+        max_deviation, farthest = -1, None
+        for i in range(start + 1, end):
+            px, py = xs[i] - xs[start], ys[i] - ys[start]
+            length = math.hypot(dx, dy)
+            deviation = abs(px * dy - py * dx) / length if length > 0 else math.hypot(px, py)
+            if deviation > max_deviation:
+                max_deviation, farthest = deviation, i
+        if farthest is not None and max_deviation > tolerance:
+            kept.add(farthest)
+            simplify(start, farthest)
+            simplify(farthest, end)
+
+    simplify(0, len(lats) - 1)
+    return sorted(kept)
+
+
 class TestUtil(unittest.TestCase):
 
     @staticmethod
@@ -29,6 +63,37 @@ class TestUtil(unittest.TestCase):
         d = util.wgs84_distance(lat, lon, lat2, lon)
         self.assertTrue(self._approximately_equal(d, 100))
 
+    def test_distance_functions(self):
+        rng = numpy.random.RandomState(0)
+        lats1, lons1 = rng.uniform(-80, 80, 100), rng.uniform(-180, 180, 100)
+        lats2, lons2 = lats1 + rng.normal(0, 0.05, 100), lons1 + rng.normal(0, 0.05, 100)
+        # e.g. arrays backed by pandas can be read-only
+        for array in (lats2, lons2):
+            array.setflags(write=False)
+        reference = numpy.array([math_wgs84_distance(*coordinates)
+                                 for coordinates in zip(lats1, lons1, lats2, lons2)])
+        compiled = util._cutil
+        try:
+            # the compiled versions (if available) and the numpy fallbacks
+            for cutil in {compiled, None}:
+                util._cutil = cutil
+                distances = util.wgs84_distances(lats1, lons1, lats2, lons2)
+                numpy.testing.assert_allclose(distances, reference, rtol=1e-9)
+                numpy.testing.assert_allclose(util.wgs84_distances_from_point(lats1[0], lons1[0], lats2, lons2),
+                                              util.wgs84_distances(lats1[0], lons1[0], lats2, lons2), rtol=1e-9)
+                equirectangular = util.equirectangular_distances(lats1, lons1, lats2, lons2)
+                numpy.testing.assert_allclose(equirectangular, reference, rtol=1e-3)
+                numpy.testing.assert_allclose(
+                    util.equirectangular_distances_from_point(lats1[0], lons1[0], lats2, lons2),
+                    [util.equirectangular_distance(lats1[0], lons1[0], lat, lon) for lat, lon in zip(lats2, lons2)],
+                    rtol=1e-9)
+                # broadcasting
+                self.assertEqual(util.wgs84_distances(lats1[:, None], lons1[:, None], lats2, lons2).shape, (100, 100))
+        finally:
+            util._cutil = compiled
+        for coordinates in zip(lats1, lons1, lats2, lons2):
+            self.assertAlmostEqual(util.wgs84_distance(*coordinates), math_wgs84_distance(*coordinates), places=6)
+
     def test_day_seconds_to_str_time(self):
         str_time = util.day_seconds_to_str_time(25 * 3600 + 59 * 60 + 10)
         self.assertTrue(str_time == "25:59:10", "the times can also go over 24 hours")
@@ -50,4 +115,48 @@ class TestUtil(unittest.TestCase):
         df1 = pd.DataFrame(dict1)
         df2 = pd.DataFrame(dict2)
         df = util.difference_of_pandas_dfs(df1, df2, ["lat", "lon"])
-        self.assertEqual(len(df.index), 2)
\ No newline at end of file
+        self.assertEqual(len(df.index), 2)
+
+    def test_simplify_polyline(self):
+        # a straight line with a bump of about half a meter
+        lats = [60.0, 60.001, 60.002, 60.003, 60.004]
+        lons = [24.0, 24.0, 24.00001, 24.0, 24.0]
+        simple_lats, simple_lons = util.simplify_polyline(lats, lons, tolerance=10)
+        self.assertEqual(list(simple_lats), [60.0, 60.004])
+        self.assertEqual(list(simple_lons), [24.0, 24.0])
+        simple_lats, _ = util.simplify_polyline(lats, lons, tolerance=0.4)
+        self.assertEqual(list(simple_lats), [60.0, 60.002, 60.004])
+        # a detour of about 1 km
+        simple_lats, _ = util.simplify_polyline([60.0, 60.002, 60.004], [24.0, 24.02, 24.0], tolerance=10)
+        self.assertEqual(len(simple_lats), 3)
+        simple_lats, _ = util.simplify_polyline([60.0, 60.002, 60.004], [24.0, 24.02, 24.0], tolerance=2000)
+        self.assertEqual(len(simple_lats), 2)
+        same_lats, same_lons = util.simplify_polyline(lats, lons)
+        self.assertEqual(list(same_lons), lons)
+        _, rounded_lons = util.simplify_polyline(lats, lons, precision=3)
+        self.assertEqual(list(rounded_lons), [24.0, 24.0, 24.0, 24.0, 24.0])
+
+    def test_simplify_polyline_matches_recursive_douglas_peucker(self):
+        rng = numpy.random.RandomState(0)
+        for n_points in [3, 10, 500]:
+            lats = 60 + numpy.cumsum(rng.normal(0, 0.0005, n_points))
+            lons = 24 + numpy.cumsum(rng.normal(0, 0.001, n_points))
+            # a closed loop: the first and last points are the same
+            lats[-1], lons[-1] = lats[0], lons[0]
+            for tolerance in [1, 20, 200]:
+                simple_lats, simple_lons = util.simplify_polyline(lats, lons, tolerance=tolerance)
+                kept = recursive_douglas_peucker(lats, lons, tolerance)
+                self.assertEqual(list(simple_lats), list(lats[kept]))
+                self.assertEqual(list(simple_lons), list(lons[kept]))
+
+    def test_find_points_within_distance(self):
+        rng = numpy.random.RandomState(0)
+        lats1, lons1 = 60 + rng.uniform(0, 0.05, 200), 24 + rng.uniform(0, 0.1, 200)
+        lats2, lons2 = 60 + rng.uniform(0, 0.05, 300), 24 + rng.uniform(0, 0.1, 300)
+        indices1, indices2, distances = util.find_points_within_distance(lats1, lons1, lats2, lons2, 300)
+        all_distances = util.wgs84_distances(lats1[:, None], lons1[:, None], lats2, lons2)
+        expected = set(zip(*numpy.nonzero(all_distances <= 300)))
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(set(zip(indices1, indices2)), expected)
+        numpy.testing.assert_allclose(distances, all_distances[indices1, indices2])
+        self.assertEqual(len(util.find_points_within_distance([], [], lats2, lons2, 300)[0]), 0)
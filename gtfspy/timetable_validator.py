@@ -1,6 +1,10 @@
 from collections import defaultdict, Counter
+from multiprocessing.pool import ThreadPool
 import sys
 
+import numpy
+import pandas as pd
+
 # the following is required when using this module as a script
 # (i.e. using the if __name__ == "__main__": part at the end of this file)
 if __name__ == '__main__' and __package__ is None:
@@ -10,7 +14,8 @@ if __name__ == '__main__' and __package__ is None:
 
 from gtfspy import route_types
 from gtfspy.gtfs import GTFS
-from gtfspy.util import wgs84_distance
+from gtfspy.segments import get_segments
+from gtfspy.util import wgs84_distances
 
 WARNING_LONG_STOP_SPACING = "Long Stop Spacing"
 WARNING_5_OR_MORE_CONSECUTIVE_STOPS_WITH_SAME_TIME = "Trips that have Five or More Consecutive Same Stop Times"
@@ -46,81 +51,106 @@ class TimetableValidator(object):
         self.buffer_params = buffer_params
         self.warnings_container = WarningsContainer()
 
-    def get_warnings(self):
+    def get_warnings(self, n_threads=1):
         """
         Validates/checks a given GTFS feed with respect to a number of different issues.
 
         The set of warnings that are checked for, can be found in the gtfs_validator.ALL_WARNINGS
 
+        The needed columns are read from the database only once, after which each
+        validation rule is evaluated as a vectorized mask over the loaded arrays.
+
+        Parameters
+        ----------
+        n_threads: int
+            number of threads used for evaluating the rules
+
         Returns
         -------
         warnings: WarningsContainer
         """
         self.warnings_container.clear()
-        self._validate_stops_with_same_stop_time()
-        self._validate_speeds_and_trip_times()
-        self._validate_stop_spacings()
-        self._validate_stop_sequence()
-        self._validate_misplaced_stops()
+        data = self._load_validation_data()
+        rules = [
+            self._validate_stops_with_same_stop_time,
+            self._validate_speeds_and_trip_times,
+            self._validate_stop_spacings,
+            self._validate_stop_sequence,
+            self._validate_misplaced_stops
+        ]
+        if n_threads > 1:
+            pool = ThreadPool(n_threads)
+            try:
+                results = pool.map(lambda rule: rule(data), rules)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [rule(data) for rule in rules]
+        for result in results:
+            for rows, warning in result:
+                self.warnings_container.add_warnings(rows, warning)
         self.warnings_container.print_summary()
         return self.warnings_container
 
-    def _validate_misplaced_stops(self):
+    def _load_validation_data(self):
+        """
+        Returns
+        -------
+        data: dict
+            "stop_times": pandas.DataFrame with columns trip_I, seq, arr_time, dep_time_ds
+            "segments": pandas.DataFrame of consecutive stop segments (see gtfspy.segments)
+            "stops": pandas.DataFrame or None (only loaded when buffer_params are given)
+        """
+        stop_times = self.gtfs.execute_custom_query_pandas("SELECT trip_I, seq, arr_time, dep_time_ds "
+                                                           "FROM stop_times")
+        data = {
+            "stop_times": stop_times,
+            "segments": get_segments(self.gtfs),
+            "stops": None
+        }
         if self.buffer_params:
-            p = self.buffer_params
-            center_lat = p['lat']
-            center_lon = p['lon']
-            distance = p['buffer_distance'] * 2 * 1000
-            count = 0
-            for stop_row in self.gtfs.stops().itertuples():
-                if distance < wgs84_distance(center_lat, center_lon, stop_row.lat, stop_row.lon):
-                    self.warnings_container.add_warning(stop_row, WARNING_STOP_FAR_AWAY_FROM_FILTER_BOUNDARY)
-                    print(WARNING_STOP_FAR_AWAY_FROM_FILTER_BOUNDARY, stop_row)
-
-    def _validate_stops_with_same_stop_time(self):
+            data["stops"] = self.gtfs.stops()
+        return data
+
+    def _validate_misplaced_stops(self, data):
+        if not self.buffer_params:
+            return []
+        p = self.buffer_params
+        distance = p['buffer_distance'] * 2 * 1000
+        stops = data["stops"]
+        distances = wgs84_distances(p['lat'], p['lon'], stops['lat'].values, stops['lon'].values)
+        rows = list(stops[distance < distances].itertuples())
+        for stop_row in rows:
+            print(WARNING_STOP_FAR_AWAY_FROM_FILTER_BOUNDARY, stop_row)
+        return [(rows, WARNING_STOP_FAR_AWAY_FROM_FILTER_BOUNDARY)]
+
+    def _validate_stops_with_same_stop_time(self, data):
         n_stops_with_same_time = 5
-        # this query returns the trips where there are N or more stops with the same stop time
-        rows = self.gtfs.get_cursor().execute(
-            'SELECT '
-            'trip_I, '
-            'arr_time, '
-            'N '
-            'FROM '
-            '(SELECT trip_I, arr_time, count(*) as N FROM stop_times GROUP BY trip_I, arr_time) q1 '
-            'WHERE N >= ?', (n_stops_with_same_time,)
-        )
-        for row in rows:
-            self.warnings_container.add_warning(row, WARNING_5_OR_MORE_CONSECUTIVE_STOPS_WITH_SAME_TIME)
-
-    def _validate_stop_spacings(self):
-        self.gtfs.conn.create_function("find_distance", 4, wgs84_distance)
+        # find the trips where there are N or more stops with the same stop time
+        stop_times = data["stop_times"]
+        # missing arrival times (code -1) form a group of their own, as in SQL's GROUP BY
+        time_codes, times = pd.factorize(stop_times['arr_time'])
+        keys = numpy.column_stack((stop_times['trip_I'].values, time_codes))
+        unique_keys, counts = numpy.unique(keys, axis=0, return_counts=True)
+        mask = counts >= n_stops_with_same_time
+        rows = [(trip_I, times[code] if code >= 0 else None, count) for trip_I, code, count in
+                zip(unique_keys[mask, 0].tolist(), unique_keys[mask, 1].tolist(), counts[mask].tolist())]
+        return [(rows, WARNING_5_OR_MORE_CONSECUTIVE_STOPS_WITH_SAME_TIME)]
+
+    def _validate_stop_spacings(self, data):
         max_stop_spacing = 20000  # meters
         max_time_between_stops = 1800  # seconds
-        # this query calculates distance and travel time between consecutive stops
-        rows = self.gtfs.execute_custom_query(
-            'SELECT '
-            'q1.trip_I, '
-            'type, '
-            'q1.stop_I as stop_1, '
-            'q2.stop_I as stop_2, '
-            'CAST(find_distance(q1.lat, q1.lon, q2.lat, q2.lon) AS INT) as distance, '
-            'q2.arr_time_ds - q1.arr_time_ds as traveltime '
-            'FROM '
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) q1, '
-            '(SELECT * FROM stop_times, stops WHERE stop_times.stop_I = stops.stop_I) q2, '
-            'trips, '
-            'routes '
-            'WHERE q1.trip_I = q2.trip_I '
-            'AND q1.seq + 1 = q2.seq '
-            'AND q1.trip_I = trips.trip_I '
-            'AND trips.route_I = routes.route_I ').fetchall()
-        for row in rows:
-            if row[4] > max_stop_spacing:
-                self.warnings_container.add_warning(row, WARNING_LONG_STOP_SPACING)
-            if row[5] > max_time_between_stops:
-                self.warnings_container.add_warning(row, WARNING_LONG_TRAVEL_TIME_BETWEEN_STOPS)
-
-    def _validate_speeds_and_trip_times(self):
+        # distance and travel time between consecutive stops
+        segments = data["segments"]
+        columns = [segments[column].values for column in
+                   ['trip_I', 'type', 'from_stop_I', 'to_stop_I', 'distance', 'duration']]
+        long_spacing = columns[4] > max_stop_spacing
+        long_travel_time = columns[5] > max_time_between_stops
+        return [(_to_rows(columns, long_spacing), WARNING_LONG_STOP_SPACING),
+                (_to_rows(columns, long_travel_time), WARNING_LONG_TRAVEL_TIME_BETWEEN_STOPS)]
+
+    def _validate_speeds_and_trip_times(self, data):
         # These are the mode - feasible speed combinations used here:
         # https://support.google.com/transitpartners/answer/1095482?hl=en
         gtfs_type_to_max_speed = {
@@ -135,46 +165,44 @@ class TimetableValidator(object):
             route_types.AIRCRAFT : 1000
         }
         max_trip_time = 7200  # seconds
-        self.gtfs.conn.create_function("find_distance", 4, wgs84_distance)
-
-        # this query returns the total distance and travel time for each trip calculated for each stop spacing separately
-        rows = self.gtfs.execute_custom_query(
-            'SELECT '
-            ' q1.trip_I, '
-            ' type, '
-            ' sum(CAST(find_distance(q1.lat, q1.lon, q2.lat, q2.lon) AS INT)) AS total_distance, '
-            ' sum(q2.arr_time_ds - q1.arr_time_ds) AS total_traveltime '
-            ' FROM '
-            '(SELECT * FROM stop_times, '
-            'stops WHERE stop_times.stop_I = stops.stop_I) q1, '
-            '(SELECT * FROM stop_times, '
-            'stops WHERE stop_times.stop_I = stops.stop_I) q2, trips, routes WHERE q1.trip_I = q2.trip_I '
-            'AND q1.seq + 1 = q2.seq AND q1.trip_I = trips.trip_I '
-            '  AND trips.route_I = routes.route_I GROUP BY q1.trip_I').fetchall()
-
-        for row in rows:
-            avg_velocity = row[2] / max(row[3], 1) * 3.6
-            if avg_velocity > gtfs_type_to_max_speed[row[1]]:
-                self.warnings_container.add_warning(row, WARNING_UNREALISTIC_AVERAGE_SPEED)
-
-            if row[3] > max_trip_time:
-                self.warnings_container.add_warning(row, WARNING_LONG_TRIP_TIME)
 
-    def _validate_stop_sequence(self):
+        # total distance and travel time for each trip calculated for each stop spacing separately
+        segments = data["segments"]
+        trip_codes, trip_Is = pd.factorize(segments['trip_I'])
+        n_trips = len(trip_Is)
+        total_distances = numpy.bincount(trip_codes, weights=segments['distance'].values,
+                                         minlength=n_trips).astype(numpy.int64)
+        total_traveltimes = numpy.bincount(trip_codes, weights=numpy.nan_to_num(segments['duration'].values),
+                                           minlength=n_trips).astype(numpy.int64)
+        types = numpy.zeros(n_trips, dtype=numpy.int64)
+        types[trip_codes] = segments['type'].values
+        columns = [numpy.asarray(trip_Is), types, total_distances, total_traveltimes]
+
+        max_speeds = pd.Series(types).map(gtfs_type_to_max_speed).values
+        avg_velocities = total_distances / numpy.maximum(total_traveltimes, 1) * 3.6
+        return [(_to_rows(columns, avg_velocities > max_speeds), WARNING_UNREALISTIC_AVERAGE_SPEED),
+                (_to_rows(columns, total_traveltimes > max_trip_time), WARNING_LONG_TRIP_TIME)]
+
+    def _validate_stop_sequence(self, data):
         # this function checks if the stop sequence value is changing with +1 for each stop. This is not (yet) enforced
-        rows = self.gtfs.execute_custom_query('SELECT trip_I, dep_time_ds, seq '
-                                              'FROM stop_times '
-                                              'ORDER BY trip_I, dep_time_ds, seq').fetchall()
-
-        old_trip_id = None
-        for row in rows:
-            new_trip_id = row[0]
-            new_seq = row[2]
-            if old_trip_id == new_trip_id:
-                if old_seq + 1 != new_seq:
-                    self.warnings_container.add_warning(row, WARNING_STOP_SEQUENCE_ERROR)
-            old_trip_id = row[0]
-            old_seq = row[2]
+        stop_times = data["stop_times"]
+        trip_Is = stop_times['trip_I'].values
+        seqs = stop_times['seq'].values
+        dep_times = stop_times['dep_time_ds'].values.astype(float)
+        # order by trip_I, dep_time_ds, seq (missing departure times first, as in SQL)
+        order = numpy.lexsort((seqs, numpy.where(numpy.isnan(dep_times), -numpy.inf, dep_times), trip_Is))
+        trip_Is, seqs, dep_times = trip_Is[order], seqs[order], dep_times[order]
+        errors = numpy.nonzero((trip_Is[:-1] == trip_Is[1:]) & (seqs[:-1] + 1 != seqs[1:]))[0] + 1
+        rows = [(trip_I, None if numpy.isnan(dep_time) else int(dep_time), seq) for trip_I, dep_time, seq in
+                zip(trip_Is[errors].tolist(), dep_times[errors].tolist(), seqs[errors].tolist())]
+        return [(rows, WARNING_STOP_SEQUENCE_ERROR)]
+
+
+def _to_rows(columns, mask):
+    """
+    Convert the masked elements of the columns into row tuples of Python values.
+    """
+    return list(zip(*[column[mask].tolist() for column in columns]))
 
 
 class WarningsContainer(object):
@@ -192,6 +220,21 @@ class WarningsContainer(object):
             self._warnings_counter[error] += 1
         self._warnings_records[row].append(error)
 
+    def add_warnings(self, rows, error):
+        """
+        Add the same warning for a number of rows at once.
+
+        Parameters
+        ----------
+        rows: list of tuples
+        error: str
+        """
+        if not rows:
+            return
+        self._warnings_counter[error] += len(rows)
+        for row in rows:
+            self._warnings_records[row].append(error)
+
     def print_summary(self):
         print('The feed produced the following warnings: ')
         for key in self._warnings_counter.keys():
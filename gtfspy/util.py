@@ -4,6 +4,7 @@ from __future__ import print_function
 import contextlib
 import datetime
 import io
+import itertools
 import math
 import os
 import shutil
@@ -12,10 +13,10 @@ import tempfile
 import time
 from math import cos
 
-import networkx
 import numpy
 import pandas as pd
-import shapefile as shp
+
+from gtfspy import instrumentation
 
 """
 Various unrelated utility functions.
@@ -42,6 +43,209 @@ def wgs84_distance(lat1, lon1, lat2, lon2):
     return d
 
 
+def wgs84_distances(lats1, lons1, lats2, lons2):
+    """
+    Vectorized version of wgs84_distance.
+
+    Parameters
+    ----------
+    lats1, lons1, lats2, lons2: numpy.array or float
+        Coordinates in WGS84, broadcast against each other as usual with numpy.
+
+    Returns
+    -------
+    distances: numpy.array
+        distances in meters
+    """
+    lats1, lons1, lats2, lons2 = (numpy.asarray(x, dtype=float) for x in (lats1, lons1, lats2, lons2))
+    if _cutil is not None and _same_1d_shape(lats1, lons1, lats2, lons2):
+        return _cutil.wgs84_distances(*_contiguous(lats1, lons1, lats2, lons2))
+    # same operations as in wgs84_distance, so that the results agree as closely as possible
+    sin_dlat_half = numpy.sin(numpy.radians(lats2 - lats1) / 2)
+    sin_dlon_half = numpy.sin(numpy.radians(lons2 - lons1) / 2)
+    a = (sin_dlat_half * sin_dlat_half +
+         numpy.cos(numpy.radians(lats1)) * numpy.cos(numpy.radians(lats2)) *
+         sin_dlon_half * sin_dlon_half)
+    c = 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+
+def wgs84_distances_from_point(lat, lon, lats, lons):
+    """
+    Distances from one point to many points.
+
+    Parameters
+    ----------
+    lat, lon: float
+    lats, lons: list-like of floats
+
+    Returns
+    -------
+    distances: numpy.array
+        distances in meters
+    """
+    lats, lons = numpy.asarray(lats, dtype=float), numpy.asarray(lons, dtype=float)
+    if _cutil is not None and _same_1d_shape(lats, lons):
+        return _cutil.wgs84_distances_from_point(float(lat), float(lon), *_contiguous(lats, lons))
+    return wgs84_distances(lat, lon, lats, lons)
+
+
+def equirectangular_distance(lat1, lon1, lat2, lon2):
+    """
+    Equirectangular approximation of the distance (in meters) between two points in WGS84 coord system.
+    Faster, and for short distances (up to some tens of kilometers) practically as accurate as wgs84_distance.
+    """
+    x = math.radians(lon2 - lon1) * math.cos(math.radians(lat1 + lat2) / 2)
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS * math.sqrt(x * x + y * y)
+
+
+def equirectangular_distances(lats1, lons1, lats2, lons2):
+    """
+    Vectorized version of equirectangular_distance, see wgs84_distances.
+    """
+    lats1, lons1, lats2, lons2 = (numpy.asarray(x, dtype=float) for x in (lats1, lons1, lats2, lons2))
+    if _cutil is not None and _same_1d_shape(lats1, lons1, lats2, lons2):
+        return _cutil.equirectangular_distances(*_contiguous(lats1, lons1, lats2, lons2))
+    x = numpy.radians(lons2 - lons1) * numpy.cos(numpy.radians(lats1 + lats2) / 2)
+    y = numpy.radians(lats2 - lats1)
+    return EARTH_RADIUS * numpy.sqrt(x * x + y * y)
+
+
+def equirectangular_distances_from_point(lat, lon, lats, lons):
+    """
+    Equirectangular approximations of the distances from one point to many points, see wgs84_distances_from_point.
+    """
+    lats, lons = numpy.asarray(lats, dtype=float), numpy.asarray(lons, dtype=float)
+    if _cutil is not None and _same_1d_shape(lats, lons):
+        return _cutil.equirectangular_distances_from_point(float(lat), float(lon), *_contiguous(lats, lons))
+    return equirectangular_distances(lat, lon, lats, lons)
+
+
+def _same_1d_shape(*arrays):
+    return all(array.ndim == 1 and array.shape == arrays[0].shape for array in arrays)
+
+
+def _contiguous(*arrays):
+    return [numpy.ascontiguousarray(array) for array in arrays]
+
+
+def to_unit_sphere(lats, lons):
+    """
+    Cartesian coordinates of WGS84 points on the unit sphere, e.g. for building a scipy.spatial.cKDTree.
+
+    Returns
+    -------
+    xyz: numpy.array
+        of shape (n, 3)
+    """
+    lats = numpy.radians(numpy.asarray(lats, dtype=float))
+    lons = numpy.radians(numpy.asarray(lons, dtype=float))
+    return numpy.column_stack((numpy.cos(lats) * numpy.cos(lons), numpy.cos(lats) * numpy.sin(lons), numpy.sin(lats)))
+
+
+def find_points_within_distance(lats1, lons1, lats2, lons2, max_distance):
+    """
+    Find all pairs of points (one from each set) within a given distance, using a spatial (k-d tree) join.
+    The running time grows near-linearly with the number of points (and the number of pairs found).
+
+    Parameters
+    ----------
+    lats1, lons1: list-like of floats
+    lats2, lons2: list-like of floats
+    max_distance: float
+        in meters
+
+    Returns
+    -------
+    indices1: numpy.array
+    indices2: numpy.array
+        indices of the points in the first and second sets
+    distances: numpy.array
+        distances between the paired points in meters
+    """
+    from scipy.spatial import cKDTree
+    lats1, lons1, lats2, lons2 = (numpy.asarray(x, dtype=float) for x in (lats1, lons1, lats2, lons2))
+    if len(lats1) == 0 or len(lats2) == 0:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)
+    # chord length on the unit sphere corresponding to max_distance (with some slack for rounding errors)
+    radius = 2 * math.sin(min(max_distance / (2. * EARTH_RADIUS), math.pi / 2)) * (1 + 1e-9) + 1e-12
+    tree1 = cKDTree(to_unit_sphere(lats1, lons1))
+    tree2 = cKDTree(to_unit_sphere(lats2, lons2))
+    neighbours = tree1.query_ball_tree(tree2, radius)
+    n_pairs = sum(len(points) for points in neighbours)
+    indices1 = numpy.repeat(numpy.arange(len(neighbours)), [len(points) for points in neighbours])
+    indices2 = numpy.fromiter(itertools.chain.from_iterable(neighbours), dtype=int, count=n_pairs)
+    distances = wgs84_distances(lats1[indices1], lons1[indices1], lats2[indices2], lons2[indices2])
+    within = distances <= max_distance
+    return indices1[within], indices2[within], distances[within]
+
+
+def simplify_polyline(lats, lons, tolerance=None, precision=None):
+    """
+    Simplify a polyline using the Douglas-Peucker algorithm, and/or reduce the precision of its coordinates.
+
+    Parameters
+    ----------
+    lats, lons: list-like of floats
+        coordinates of the polyline in WGS84
+    tolerance: float, optional
+        maximum allowed deviation (in meters) of the simplified line from the original points.
+        By default, the line is not simplified.
+    precision: int, optional
+        number of decimals the coordinates are rounded to. By default, the coordinates are not rounded.
+
+    Returns
+    -------
+    lats, lons: numpy.array
+    """
+    lats = numpy.asarray(lats, dtype=float)
+    lons = numpy.asarray(lons, dtype=float)
+    if tolerance and len(lats) > 2:
+        # project to a local plane (in meters), where the distances to the lines are computed
+        ys = numpy.radians(lats) * EARTH_RADIUS
+        xs = numpy.radians(lons) * EARTH_RADIUS * numpy.cos(numpy.radians(numpy.mean(lats)))
+        keep = numpy.zeros(len(lats), dtype=bool)
+        keep[0] = keep[-1] = True
+        # All ranges of the same recursion level are handled at once:
+        # the deviations of the interior points of all ranges are computed in one go.
+        starts = numpy.array([0])
+        ends = numpy.array([len(lats) - 1])
+        while len(starts) > 0:
+            n_interior = ends - starts - 1
+            has_interior = n_interior > 0
+            starts, ends, n_interior = starts[has_interior], ends[has_interior], n_interior[has_interior]
+            if len(starts) == 0:
+                break
+            first_positions = numpy.cumsum(n_interior) - n_interior
+            range_indices = numpy.repeat(numpy.arange(len(starts)), n_interior)
+            positions = numpy.arange(n_interior.sum())
+            points = starts[range_indices] + 1 + positions - first_positions[range_indices]
+            dx = (xs[ends] - xs[starts])[range_indices]
+            dy = (ys[ends] - ys[starts])[range_indices]
+            px = xs[points] - xs[starts][range_indices]
+            py = ys[points] - ys[starts][range_indices]
+            lengths = numpy.sqrt(dx * dx + dy * dy)
+            deviations = numpy.where(lengths > 0,
+                                     numpy.abs(px * dy - py * dx) / numpy.where(lengths > 0, lengths, 1),
+                                     numpy.sqrt(px * px + py * py))
+            max_deviations = numpy.maximum.reduceat(deviations, first_positions)
+            # the first point with the largest deviation in each range
+            farthest = numpy.minimum.reduceat(numpy.where(deviations == max_deviations[range_indices],
+                                                          positions, len(positions)),
+                                              first_positions)
+            split = max_deviations > tolerance
+            splits = points[farthest[split]]
+            keep[splits] = True
+            starts, ends = numpy.concatenate((starts[split], splits)), numpy.concatenate((splits, ends[split]))
+        lats = lats[keep]
+        lons = lons[keep]
+    if precision is not None:
+        lats = numpy.round(lats, precision)
+        lons = numpy.round(lons, precision)
+    return lats, lons
+
+
 def wgs84_height(meters):
     return meters / (EARTH_RADIUS * TORADIANS)
 
@@ -51,11 +255,14 @@ def wgs84_width(meters, lat):
     return meters / (R2 * TORADIANS)
 
 
-# cython implementation of this.  It is called _often_.
+# Compiled (cython) implementations of the distance functions, see cutil.pyx.
+# wgs84_distance is called _often_, e.g. as the find_distance function in SQL queries.
 try:
-    from gtfspy.cutil import wgs84_distance
+    from gtfspy import cutil as _cutil
 except ImportError:
-    pass
+    _cutil = None
+if _cutil is not None:
+    from gtfspy.cutil import wgs84_distance, equirectangular_distance
 
 possible_tmpdirs = [
     '/tmp',
@@ -221,12 +428,17 @@ def makedirs(path):
 def timeit(method):
     """
     A Python decorator for printing out the execution time for a function.
+    When instrumentation is enabled (see gtfspy.instrumentation), the execution time is recorded as a span instead.
 
     Adapted from:
     www.andreas-jung.com/contents/a-python-decorator-for-measuring-the-execution-time-of-methods
     """
+    span_name = getattr(method, "__qualname__", method.__name__)
 
     def timed(*args, **kw):
+        if instrumentation.is_enabled():
+            with instrumentation.span(span_name):
+                return method(*args, **kw)
         time_start = time.time()
         result = method(*args, **kw)
         time_end = time.time()
@@ -253,7 +465,7 @@ def source_table_txt_to_pandas(path, table, args=None):
     """
     :param path: path to directory or zipfile
     :param table: name of table
-    :param args: string arguments passed to the read_csv function
+    :param args: dict of keyword arguments passed to the read_csv function
     :return: pandas dataframe
     """
 
@@ -293,69 +505,62 @@ def source_table_txt_to_pandas(path, table, args=None):
                 return pandas.DataFrame()
 
     if args:
-        df = read_csv(**args)
+        df = read_csv(f, **args)
     else:
         df = read_csv(f)
     return df
 
 
-def write_shapefile(data, shapefile_path):
-    from numpy import int64
+def write_shapefile(data, shapefile_path, precision=None, simplify_tolerance=None):
     """
-    :param data: list of dicts where dictionary contains the keys lons and lats
+    Write polylines into a shapefile.
+
+    With pyshp 2 or newer, the features are streamed into the output files one at a time,
+    so that data can also be a generator (e.g. GTFS.generate_route_shapes).
+
+    :param data: iterable of dicts where dictionary contains the keys lons and lats
     :param shapefile_path: path where shapefile is saved
+    :param precision: int, optional. number of decimals the coordinates are rounded to
+    :param simplify_tolerance: float, optional. tolerance (in meters) for simplifying the lines
     :return:
     """
+    import shapefile as shp
 
-    w = shp.Writer(shp.POLYLINE)  # shapeType=3)
+    data = iter(data)
+    first_item = next(data, None)
+    if first_item is None:
+        raise ValueError("No data to write to " + str(shapefile_path))
 
-    fields = []
-    encode_strings = []
+    streaming = int(shp.__version__.split(".")[0]) >= 2
+    if streaming:
+        w = shp.Writer(shapefile_path, shapeType=shp.POLYLINE)
+    else:
+        w = shp.Writer(shp.POLYLINE)  # shapeType=3)
 
     # This makes sure every geom has all the attributes
     w.autoBalance = 1
     # Create all attribute fields except for lats and lons. In addition the field names are saved for the
-    # datastoring phase. Encode_strings stores .encode methods as strings for all fields that are strings
-    if not fields:
-        for key, value in data[0].items():
-            if key != u'lats' and key != u'lons':
-                fields.append(key)
-
-                if type(value) == float:
-                    w.field(key.encode('ascii'), fieldType='N', size=11, decimal=3)
-                    print("float", type(value))
-                elif type(value) == int or type(value) == int64:
-                    print("int", type(value))
-
-                    # encode_strings.append(".encode('ascii')")
-                    w.field(key.encode('ascii'), fieldType='N', size=6, decimal=0)
-                else:
-                    print("other type", type(value))
-
-                    w.field(key.encode('ascii'))
-
-    for dict_item in data:
-        line = []
-        lineparts = []
-        records = []
-        records_string = ''
-        for lat, lon in zip(dict_item[u'lats'], dict_item[u'lons']):
-            line.append([float(lon), float(lat)])
-        lineparts.append(line)
-        w.line(parts=lineparts)
-
-        # The shapefile records command is built up as strings to allow a differing number of columns
-        for field in fields:
-            if records_string:
-                records_string += ", dict_item['" + field + "']"
+    # datastoring phase.
+    fields = []
+    for key, value in first_item.items():
+        if key != u'lats' and key != u'lons':
+            fields.append(key)
+            if isinstance(value, float):
+                w.field(str(key), 'N', 11, 3)
+            elif isinstance(value, (int, numpy.integer)):
+                w.field(str(key), 'N', 6, 0)
             else:
-                records_string += "dict_item['" + field + "']"
-        method_string = "w.record(" + records_string + ")"
-
-        # w.record(dict_item['name'], dict_item['agency'], dict_item['agency_name'], dict_item['type'], dict_item['lons'])
-        print(method_string)
-        eval(method_string)
-    w.save(shapefile_path)
+                w.field(str(key))
+
+    for dict_item in itertools.chain([first_item], data):
+        lats, lons = simplify_polyline(dict_item[u'lats'], dict_item[u'lons'],
+                                       tolerance=simplify_tolerance, precision=precision)
+        w.line([numpy.column_stack((lons, lats)).tolist()])
+        w.record(*[dict_item[field] for field in fields])
+    if streaming:
+        w.close()
+    else:
+        w.save(shapefile_path)
 
 
 # Opening files with Universal newlines is done differently in py3
@@ -378,6 +583,7 @@ def draw_net_using_node_coords(net):
         the figure object where the network is plotted
     """
     import matplotlib.pyplot as plt
+    import networkx
     fig = plt.figure()
     node_coords = {}
     for node, data in net.nodes(data=True):
@@ -34,6 +34,7 @@ setup(
     install_requires = [
         "setuptools>=18.0",
         "pandas",
+        "scipy",
         "networkx==1.11",
         "pyshp",
         "smopy",
@@ -52,6 +53,10 @@ setup(
             'gtfspy.routing.label',
             sources=["gtfspy/routing/label.pyx"],
         ),
+        Extension(
+            'gtfspy.cutil',
+            sources=["gtfspy/cutil.pyx"],
+        ),
     ],
     keywords = ['transit', 'routing' 'gtfs', 'public transport', 'analysis', 'visualization'], # arbitrary keywords
 )